@@ -0,0 +1,288 @@
+"""
+asyncio controller runtime: many intersections in one process.
+
+Each intersection is three tasks on a shared event loop:
+
+    feed    delivers per-approach counts (camera + YOLO in a worker thread,
+            or a simulated feed)
+    timer   sleeps until the current green's deadline and switches the
+            lights exactly then, instead of polling every frame
+    link    drains the intersection's command queue to its serial port
+            (pyserial-asyncio when installed) or to a simulated ESP32
+
+The cycle itself is the same CycleController used by detect_cars.py and the
+GUI: counts may extend the running green (which moves the deadline), and
+the timer feeds the latest counts in at the deadline to make the switch.
+Nothing blocks the loop: no time.sleep, no blocking serial writes.
+
+Benchmark scheduling jitter with simulated intersections:
+
+    python async_controller.py --intersections 50 --seconds 60
+
+Run the real intersection (camera 0, ESP32 on COM3) on the async core:
+
+    python async_controller.py --camera 0 --port COM3
+"""
+import argparse
+import asyncio
+import random
+import time
+
+import numpy as np
+
+from traffic_control import CycleController
+
+BAUD_RATE = 115200
+
+
+class SimulatedLink:
+    """Stand-in for an ESP32: applies commands after a small transfer delay."""
+
+    def __init__(self, delay=0.002):
+        self.delay = delay
+        self.heads = {"S1": "RED", "S2": "RED", "S3": "RED", "S4": "RED"}
+        self.sent = 0
+
+    async def open(self):
+        pass
+
+    async def write(self, command):
+        await asyncio.sleep(self.delay)
+        *lanes, color = command.strip().split(":")
+        for lane in lanes:
+            self.heads[lane] = color
+        self.sent += 1
+
+    async def close(self):
+        pass
+
+
+class SerialLink:
+    """Async serial transport to a real ESP32."""
+
+    def __init__(self, port, baud_rate=BAUD_RATE):
+        self.port = port
+        self.baud_rate = baud_rate
+        self.writer = None
+        self.ser = None
+        self.sent = 0
+
+    async def open(self):
+        try:
+            import serial_asyncio
+            _, self.writer = await serial_asyncio.open_serial_connection(url=self.port,
+                                                                          baudrate=self.baud_rate)
+        except ImportError:
+            # Without pyserial-asyncio, keep the blocking port off the loop
+            import serial
+            loop = asyncio.get_running_loop()
+            self.ser = await loop.run_in_executor(None, lambda: serial.Serial(self.port, self.baud_rate,
+                                                                              timeout=1))
+        await asyncio.sleep(2)  # Wait for ESP32 to initialize
+
+    async def write(self, command):
+        data = command.encode()
+        if self.writer is not None:
+            self.writer.write(data)
+            await self.writer.drain()
+        else:
+            await asyncio.get_running_loop().run_in_executor(None, self.ser.write, data)
+        self.sent += 1
+
+    async def close(self):
+        if self.writer is not None:
+            self.writer.close()
+        elif self.ser is not None:
+            self.ser.close()
+
+
+class SimulatedFeed:
+    """Random-walk approach counts at a fixed frame rate."""
+
+    def __init__(self, rate_hz=10.0, seed=None):
+        self.period = 1.0 / rate_hz
+        self.rng = random.Random(seed)
+        self.counts = [0, 0, 0, 0]
+
+    async def frames(self):
+        loop = asyncio.get_running_loop()
+        next_frame = loop.time()
+        while True:
+            next_frame += self.period
+            await asyncio.sleep(max(0.0, next_frame - loop.time()))
+            self.counts = [max(0, min(6, c + self.rng.choice((-1, 0, 0, 1)))) for c in self.counts]
+            yield tuple(self.counts)
+
+
+class CameraFeed:
+    """Webcam + YOLO; capture and inference run in a worker thread."""
+
+    def __init__(self, camera=0, imgsz=416):
+        self.camera = camera
+        self.imgsz = imgsz
+
+    def _open(self):
+        from ultralytics import YOLO
+
+        from camera import Camera
+        from preprocess import FramePool, LocalDetector
+        from zones import load_zone_config
+
+        self.cap = Camera(self.camera, pool=FramePool(count=2))
+        self.detector = LocalDetector(YOLO('model/weights/best.pt'), imgsz=self.imgsz)
+        self.zones = load_zone_config()
+
+    def _next_counts(self):
+        from zones import box_centers, classify_directions, count_directions
+
+        ret, frame = self.cap.read()
+        if not ret:
+            return None
+        height, width = frame.shape[:2]
+        detections = self.detector.infer(frame)
+        center_x, center_y = box_centers(detections[:, :4])
+        directions = classify_directions(center_x, center_y, width, height, self.zones)
+        return tuple(int(c) for c in count_directions(directions))
+
+    async def frames(self):
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, self._open)
+        try:
+            while True:
+                counts = await loop.run_in_executor(None, self._next_counts)
+                if counts is None:
+                    return
+                yield counts
+        finally:
+            self.cap.release()
+
+
+class Intersection:
+    """One intersection: feed, phase timer and serial link as asyncio tasks."""
+
+    def __init__(self, name, feed, link, log=None):
+        self.name = name
+        self.feed = feed
+        self.link = link
+        self.commands = asyncio.Queue()
+        self.counts = (0, 0, 0, 0)
+        self.jitter = []  # timer firing lateness (s)
+        self.switches = 0
+        self._deadline_changed = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        self.cycle = CycleController(self._send_paired, log=log, now=loop.time())
+
+    def _send_paired(self, lane1, lane2, color):
+        self.commands.put_nowait(f"{lane1}:{lane2}:{color}\n")
+        return True
+
+    def deadline(self):
+        """Loop time at which the current green expires."""
+        if self.cycle.current_cycle_direction == "EW":
+            return self.cycle.tl1_green_start + self.cycle.current_tl1_duration
+        return self.cycle.tl2_green_start + self.cycle.current_tl2_duration
+
+    def _update(self, now):
+        before = self.deadline()
+        if self.cycle.update(*self.counts, now) is not None:
+            self.switches += 1
+        if self.deadline() != before:
+            self._deadline_changed.set()
+
+    async def _feed_task(self):
+        loop = asyncio.get_running_loop()
+        async for counts in self.feed.frames():
+            north, south, east, west = counts
+            self.counts = (north, south, east, west)
+            self._update(loop.time())
+
+    async def _timer_task(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            deadline = self.deadline()
+            self._deadline_changed.clear()
+            try:
+                await asyncio.wait_for(self._deadline_changed.wait(), max(0.0, deadline - loop.time()))
+                continue  # green was extended (or switched by a feed update): re-arm
+            except asyncio.TimeoutError:
+                pass
+            fired = loop.time()
+            self.jitter.append(fired - deadline)
+            # The loop may wake a hair early; never let that skip the switch
+            self._update(max(fired, deadline))
+
+    async def _link_task(self):
+        await self.link.open()
+        while True:
+            command = await self.commands.get()
+            await self.link.write(command)
+
+    async def run(self):
+        # Put the lights in the cycle's starting state
+        self.commands.put_nowait("S1:S4:GREEN\n")
+        self.commands.put_nowait("S2:S3:RED\n")
+        tasks = [asyncio.create_task(self._link_task()),
+                 asyncio.create_task(self._timer_task()),
+                 asyncio.create_task(self._feed_task())]
+        try:
+            await asyncio.gather(*tasks)
+        finally:
+            for task in tasks:
+                task.cancel()
+            await self.link.close()
+
+
+async def run_simulated(count, seconds, feed_hz, fast_cycle):
+    """Run `count` simulated intersections and report timer jitter."""
+    green_time = (lambda n, s, e, w, d: 1 + max(n, s, e, w) % 3) if fast_cycle else None
+    intersections = []
+    for i in range(count):
+        intersection = Intersection(f"sim-{i}", SimulatedFeed(feed_hz, seed=i), SimulatedLink())
+        if green_time:
+            intersection.cycle.green_time = green_time
+        intersections.append(intersection)
+
+    cpu_start = time.process_time()
+    tasks = [asyncio.create_task(i.run()) for i in intersections]
+    await asyncio.sleep(seconds)
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    cpu = time.process_time() - cpu_start
+
+    jitter = np.array([j for i in intersections for j in i.jitter]) * 1000
+    switches = sum(i.switches for i in intersections)
+    commands = sum(i.link.sent for i in intersections)
+    print(f"{count} intersections, {seconds:.0f}s, feed {feed_hz:g} Hz: "
+          f"{switches} phase switches, {commands} commands, CPU {cpu / seconds * 100:.1f}% of one core")
+    if len(jitter):
+        print(f"Timer lateness (ms): p50 {np.percentile(jitter, 50):.3f}  "
+              f"p99 {np.percentile(jitter, 99):.3f}  max {jitter.max():.3f}  "
+              f"(n={len(jitter)})")
+
+
+async def run_camera(camera, port):
+    """Run the real intersection on the async core until the feed ends."""
+    intersection = Intersection("A4", CameraFeed(camera), SerialLink(port), log=print)
+    await intersection.run()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="asyncio traffic controller runtime")
+    parser.add_argument("--intersections", type=int, default=20, help="simulated intersections")
+    parser.add_argument("--seconds", type=float, default=30.0, help="simulation length")
+    parser.add_argument("--feed-hz", type=float, default=10.0, help="simulated frames per second")
+    parser.add_argument("--fast-cycle", action="store_true",
+                        help="use 1-3 s greens so short runs see many phase switches")
+    parser.add_argument("--camera", type=int, help="run the real intersection from this camera")
+    parser.add_argument("--port", default="COM3", help="ESP32 serial port for --camera")
+    args = parser.parse_args()
+
+    if args.camera is not None:
+        asyncio.run(run_camera(args.camera, args.port))
+    else:
+        asyncio.run(run_simulated(args.intersections, args.seconds, args.feed_hz, args.fast_cycle))
+
+
+if __name__ == "__main__":
+    main()
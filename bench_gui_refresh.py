@@ -0,0 +1,257 @@
+"""
+GUI-thread CPU of the old per-frame refresh vs the coalesced, change-only one.
+
+A worker thread stands in for VideoThread: it produces 640x480 frames and
+stats at --fps and logs --events-per-second lines. The same panel (video
+label, counts, four lamps with countdowns, log) is then refreshed two ways:
+
+    old   one queued signal per frame; every frame restyles all four lamps
+          with setStyleSheet and resets every label, and every log line is
+          its own signal that rebuilds the word-wrapped QLabel log (newest
+          line on top, last 5 kept) with setText, as the GUI used to
+    new   the worker only publishes its latest frame/stats; a 33 ms timer
+          redraws the frame if it changed, touches only the widgets whose
+          value changed (lamps are precomputed pixmaps) and appends to the
+          virtualized log model
+
+GUI-thread CPU is time.thread_time() on the Qt main thread over wall time.
+Runs without a display (QT_QPA_PLATFORM=offscreen is set if unset):
+
+    python bench_gui_refresh.py --seconds 10 --fps 30 --events-per-second 20
+"""
+import argparse
+import os
+import threading
+import time
+
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+
+import cv2
+import numpy as np
+from PyQt5.QtCore import QObject, Qt, QTimer, pyqtSignal
+from PyQt5.QtGui import QFont, QImage, QPixmap
+from PyQt5.QtWidgets import QApplication, QFrame, QGridLayout, QLabel, QListView
+
+from traffic_light_gui import LAMP_COLORS, EventListModel, lamp_pixmap
+
+
+class Producer(QObject):
+    """Synthetic VideoThread: frames, stats and log lines at a fixed rate."""
+
+    frame_signal = pyqtSignal(np.ndarray)
+    stats_signal = pyqtSignal(dict)
+    log_signal = pyqtSignal(str)
+
+    def __init__(self, fps, events_per_second, emit):
+        super().__init__()
+        self.period = 1.0 / fps
+        self.event_every = max(1, round(fps / events_per_second)) if events_per_second else 0
+        self.emit = emit
+        rng = np.random.default_rng(0)
+        self.frames = [rng.integers(0, 255, (480, 640, 3), np.uint8) for _ in range(6)]
+        self.latest_frame = None
+        self.frame_seq = 0
+        self.latest_stats = None
+        self.lines = []
+        self.lock = threading.Lock()
+        self.running = True
+
+    def run(self):
+        next_frame = time.perf_counter()
+        while self.running:
+            seq = self.frame_seq + 1
+            # Lamps switch every 10 s, counts and countdowns change about once a second
+            second = int(seq * self.period)
+            green_ew = (second // 10) % 2 == 0
+            stats = {"ns_total": second % 7, "we_total": second % 5}
+            for light in (1, 2, 3, 4):
+                green = green_ew == (light in (1, 4))
+                stats[f"tl{light}_state"] = "GREEN" if green else "RED"
+                stats[f"tl{light}_remaining"] = 10 - second % 10 if green else 0
+            frame = self.frames[seq % len(self.frames)]
+            if self.event_every and seq % self.event_every == 0:
+                line = f"[{time.strftime('%H:%M:%S')}] [CYCLE] frame {seq}"
+                if self.emit:
+                    self.log_signal.emit(line)
+                else:
+                    with self.lock:
+                        self.lines.append(line)
+            if self.emit:
+                self.frame_signal.emit(frame)
+                self.stats_signal.emit(stats)
+            self.latest_frame = frame
+            self.latest_stats = stats
+            self.frame_seq = seq
+            next_frame += self.period
+            time.sleep(max(0.0, next_frame - time.perf_counter()))
+
+    def take_lines(self):
+        with self.lock:
+            lines, self.lines = self.lines, []
+        return lines
+
+
+class Panel(QFrame):
+    """Video label, counts, lamps and log laid out like the GUI's right panel."""
+
+    def __init__(self, new):
+        super().__init__()
+        self.setStyleSheet("QFrame{border:2px solid #333; padding:10px} QLabel{color:#fff}")
+        layout = QGridLayout(self)
+        self.video = QLabel()
+        self.video.setFixedSize(640, 480)
+        layout.addWidget(self.video, 0, 0, 1, 4)
+        self.ns_count, self.we_count = QLabel(), QLabel()
+        layout.addWidget(self.ns_count, 1, 0)
+        layout.addWidget(self.we_count, 1, 1)
+        self.lamps = {state: lamp_pixmap(color) for state, color in LAMP_COLORS.items()}
+        self.status, self.countdown = [], []
+        for light in range(4):
+            status, countdown = QLabel(), QLabel()
+            status.setFixedSize(22, 22)
+            if new:
+                status.setStyleSheet("border: none; padding: 0; background: transparent;")
+            layout.addWidget(status, 2, light)
+            layout.addWidget(countdown, 3, light)
+            self.status.append(status)
+            self.countdown.append(countdown)
+        if new:
+            self.log_model = EventListModel()
+            self.log = QListView()
+            self.log.setModel(self.log_model)
+            self.log.setUniformItemSizes(True)
+        else:
+            self.log = QLabel()
+            self.log.setFont(QFont("Courier New", 8))
+            self.log.setStyleSheet("color: #00ff00; background-color: #000; padding: 5px;")
+            self.log.setAlignment(Qt.AlignTop | Qt.AlignLeft)
+            self.log.setWordWrap(True)
+        layout.addWidget(self.log, 4, 0, 1, 4)
+        self.rgb = None
+
+    def show_frame(self, frame):
+        if self.rgb is None:
+            self.rgb = np.empty_like(frame)
+        cv2.cvtColor(frame, cv2.COLOR_BGR2RGB, dst=self.rgb)
+        h, w, ch = self.rgb.shape
+        image = QImage(self.rgb.data, w, h, ch * w, QImage.Format_RGB888)
+        self.video.setPixmap(QPixmap.fromImage(image).scaled(640, 480, Qt.KeepAspectRatio))
+
+
+class OldRefresh:
+    def __init__(self, panel, producer):
+        self.panel = panel
+        self.producer = producer
+        producer.frame_signal.connect(panel.show_frame)
+        producer.stats_signal.connect(self.update_stats)
+        producer.log_signal.connect(self.update_log)
+
+    def update_stats(self, stats):
+        panel = self.panel
+        panel.ns_count.setText(str(stats["ns_total"]))
+        panel.we_count.setText(str(stats["we_total"]))
+        for light in range(4):
+            state = stats[f"tl{light + 1}_state"]
+            panel.status[light].setStyleSheet(f"border-radius:11px; background-color: {LAMP_COLORS[state]};")
+            panel.countdown[light].setText(f"{stats[f'tl{light + 1}_remaining']}s")
+
+    def update_log(self, message):
+        current_text = self.panel.log.text()
+        lines = current_text.split('\n')
+        lines.insert(0, message)
+        # Keep only last 5 messages
+        if len(lines) > 5:
+            lines = lines[:5]
+        self.panel.log.setText('\n'.join(lines))
+
+
+class NewRefresh:
+    def __init__(self, panel, producer):
+        self.panel = panel
+        self.producer = producer
+        self.shown_seq = 0
+        self.shown = {}
+        self.refresh_timer = QTimer()
+        self.refresh_timer.timeout.connect(self.refresh)
+        self.refresh_timer.start(33)
+        self.log_timer = QTimer()
+        self.log_timer.timeout.connect(self.update_log)
+        self.log_timer.start(250)
+
+    def _set(self, widget, value, apply):
+        if self.shown.get(widget) != value:
+            self.shown[widget] = value
+            apply(value)
+
+    def refresh(self):
+        producer, panel = self.producer, self.panel
+        if producer.frame_seq != self.shown_seq and producer.latest_frame is not None:
+            self.shown_seq = producer.frame_seq
+            panel.show_frame(producer.latest_frame)
+        stats = producer.latest_stats
+        if stats is None:
+            return
+        self._set(panel.ns_count, str(stats["ns_total"]), panel.ns_count.setText)
+        self._set(panel.we_count, str(stats["we_total"]), panel.we_count.setText)
+        for light in range(4):
+            status = panel.status[light]
+            self._set(status, stats[f"tl{light + 1}_state"],
+                      lambda state: status.setPixmap(panel.lamps[state]))
+            self._set(panel.countdown[light], f"{stats[f'tl{light + 1}_remaining']}s",
+                      panel.countdown[light].setText)
+
+    def update_log(self):
+        lines = self.producer.take_lines()
+        if not lines:
+            return
+        scrollbar = self.panel.log.verticalScrollBar()
+        at_bottom = scrollbar.value() == scrollbar.maximum()
+        self.panel.log_model.append(lines)
+        if at_bottom:
+            self.panel.log.scrollToBottom()
+
+
+def run(app, new, seconds, fps, events_per_second):
+    """Run one refresh strategy; return (GUI-thread CPU %, frames produced)."""
+    producer = Producer(fps, events_per_second, emit=not new)
+    panel = Panel(new)
+    panel.show()
+    refresh = (NewRefresh if new else OldRefresh)(panel, producer)
+    worker = threading.Thread(target=producer.run, daemon=True)
+    worker.start()
+    # Let the first layout/polish pass settle before measuring
+    warmup = time.perf_counter() + 1.0
+    while time.perf_counter() < warmup:
+        app.processEvents()
+        time.sleep(0.001)
+    cpu, wall = time.thread_time(), time.perf_counter()
+    end = wall + seconds
+    while time.perf_counter() < end:
+        app.processEvents()
+        time.sleep(0.001)
+    cpu, wall = time.thread_time() - cpu, time.perf_counter() - wall
+    producer.running = False
+    worker.join()
+    app.processEvents()  # drain signals still queued
+    panel.close()
+    del refresh
+    return cpu / wall * 100, producer.frame_seq
+
+
+def main():
+    parser = argparse.ArgumentParser(description="GUI-thread CPU: per-frame vs coalesced refresh")
+    parser.add_argument("--seconds", type=float, default=10)
+    parser.add_argument("--fps", type=float, default=30)
+    parser.add_argument("--events-per-second", type=float, default=20)
+    args = parser.parse_args()
+
+    app = QApplication([])
+    print(f"{args.fps:.0f} FPS, {args.events_per_second:.0f} log lines/s, {args.seconds:.0f} s per run "
+          f"({os.environ['QT_QPA_PLATFORM']} platform)")
+    for name, new in (("old (per-frame signals)", False), ("new (coalesced, change-only)", True)):
+        cpu, frames = run(app, new, args.seconds, args.fps, args.events_per_second)
+        print(f"  {name:30s} GUI thread CPU {cpu:5.1f}% ({frames} frames produced)")
+
+
+if __name__ == "__main__":
+    main()
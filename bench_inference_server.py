@@ -0,0 +1,164 @@
+"""
+Load test for inference_server.py.
+
+For each client count (default 1, 2, 4, 8) this runs two setups for a fixed
+time and compares them:
+
+    standalone  every controller process loads its own YOLO model (today)
+    shared      one inference_server.py process, clients send frames via
+                shared memory
+
+and prints total frames per second, per-frame latency and the resident
+memory of all processes involved.
+
+Usage:
+    python bench_inference_server.py
+    python bench_inference_server.py --clients 1,4,8 --seconds 20 --image image.png
+"""
+import argparse
+import multiprocessing as mp
+import os
+import subprocess
+import sys
+import time
+
+import numpy as np
+
+from inference_server import MODEL_PATH, InferenceClient
+
+
+def rss_mb(pid=None):
+    """Resident memory of a process in MB (psutil if available, else /proc)."""
+    pid = pid or os.getpid()
+    try:
+        import psutil
+        return psutil.Process(pid).memory_info().rss / 2 ** 20
+    except ImportError:
+        pass
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return float("nan")
+
+
+def load_frame(path, width=640, height=480):
+    """Bundled sample image resized to webcam resolution."""
+    import cv2
+
+    image = cv2.imread(path)
+    if image is None:
+        raise SystemExit(f"Could not load image: {path}")
+    return cv2.resize(image, (width, height))
+
+
+def _client_worker(mode, address, image, seconds, imgsz, start, out):
+    frame = load_frame(image)
+    if mode == "shared":
+        client = InferenceClient(address, max_height=frame.shape[0], max_width=frame.shape[1])
+        infer = client.infer
+    else:
+        from ultralytics import YOLO
+        model = YOLO(MODEL_PATH)
+        model(frame, imgsz=imgsz, verbose=False)  # warm up
+        infer = lambda f: model(f, conf=0.55, iou=0.3, imgsz=imgsz, verbose=False)
+    start.wait()
+    latencies = []
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        t0 = time.perf_counter()
+        infer(frame)
+        latencies.append(time.perf_counter() - t0)
+    out.put((latencies, rss_mb()))
+    if mode == "shared":
+        client.close()
+
+
+def _wait_for_server(address, timeout=120.0):
+    from multiprocessing.connection import Client
+    from inference_server import AUTHKEY
+
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            Client(address, authkey=AUTHKEY).close()
+            return
+        except OSError:
+            time.sleep(0.5)
+    raise SystemExit("Inference server did not start")
+
+
+def run(mode, clients, args):
+    """Run one configuration; returns a result dict."""
+    ctx = mp.get_context("spawn")
+    server = None
+    address = ("127.0.0.1", args.port)
+    if mode == "shared":
+        server = subprocess.Popen([sys.executable, "inference_server.py",
+                                   "--address", f"127.0.0.1:{args.port}",
+                                   "--imgsz", str(args.imgsz),
+                                   "--max-batch", str(args.max_batch),
+                                   "--max-wait-ms", str(args.max_wait_ms)],
+                                  stdout=subprocess.DEVNULL)
+        _wait_for_server(address)
+
+    start = ctx.Event()
+    out = ctx.Queue()
+    procs = [ctx.Process(target=_client_worker,
+                         args=(mode, address, args.image, args.seconds, args.imgsz, start, out))
+             for _ in range(clients)]
+    for p in procs:
+        p.start()
+    time.sleep(args.settle)  # let every client load / connect before timing
+    start.set()
+    reports = [out.get() for _ in procs]
+    server_rss = rss_mb(server.pid) if server else 0.0
+    for p in procs:
+        p.join()
+    if server:
+        server.terminate()
+        server.wait()
+
+    latencies = np.concatenate([np.array(r[0]) for r in reports])
+    return {
+        "mode": mode,
+        "clients": clients,
+        "fps": len(latencies) / args.seconds,
+        "p50_ms": float(np.percentile(latencies, 50) * 1000),
+        "p95_ms": float(np.percentile(latencies, 95) * 1000),
+        "client_rss_mb": sum(r[1] for r in reports),
+        "server_rss_mb": server_rss,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test the shared inference server")
+    parser.add_argument("--clients", default="1,2,4,8", help="comma-separated client counts")
+    parser.add_argument("--seconds", type=float, default=10.0, help="measurement time per run")
+    parser.add_argument("--image", default="image.png", help="frame sent by every client")
+    parser.add_argument("--imgsz", type=int, default=416)
+    parser.add_argument("--max-batch", type=int, default=8)
+    parser.add_argument("--max-wait-ms", type=float, default=5.0)
+    parser.add_argument("--port", type=int, default=6001)
+    parser.add_argument("--settle", type=float, default=20.0,
+                        help="seconds to wait for clients to load models before timing")
+    parser.add_argument("--mode", action="append", choices=("standalone", "shared"),
+                        help="setups to run (default: both)")
+    args = parser.parse_args()
+
+    modes = args.mode or ["standalone", "shared"]
+    print(f"{'mode':>10} {'clients':>7} {'fps':>8} {'p50 ms':>8} {'p95 ms':>8} "
+          f"{'clients MB':>10} {'server MB':>9} {'total MB':>9}")
+    for clients in (int(c) for c in args.clients.split(",")):
+        for mode in modes:
+            r = run(mode, clients, args)
+            total = r["client_rss_mb"] + r["server_rss_mb"]
+            print(f"{r['mode']:>10} {r['clients']:>7} {r['fps']:>8.1f} {r['p50_ms']:>8.1f} "
+                  f"{r['p95_ms']:>8.1f} {r['client_rss_mb']:>10.0f} {r['server_rss_mb']:>9.0f} {total:>9.0f}")
+
+
+if __name__ == "__main__":
+    main()
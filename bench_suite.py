@@ -0,0 +1,374 @@
+"""
+Performance benchmark suite with stored baselines and regression checks.
+
+Runs without a camera or an ESP32:
+
+    yolo        LocalDetector.infer (letterbox + model) at --imgsz on the
+                bundled sample images, resized to webcam resolution
+    classify    box_centers + classify_directions + count_directions for
+                a frame of detections
+    cycle       CycleController.update over a replayed count trace (an
+                incident's detections.jsonl with --trace, otherwise a
+                seeded synthetic day of traffic)
+    gui_frame   TrafficLightGUI.update_frame (BGR->RGB, QImage, QPixmap),
+                offscreen
+    serial      FramedPort sends (text and framed) and reply parsing
+                against an in-memory port
+
+A benchmark whose dependencies are missing (ultralytics, OpenCV, PyQt5) is
+recorded as skipped. Results are written as JSON, together with a machine
+fingerprint (CPU model, core count, OS, Python and library versions), to
+bench_results/<time>_<fingerprint>.json. compare flags every case whose
+median is worse than the baseline by more than the tolerance and exits with
+status 1 if there is one. It warns when the two runs come from different
+machines.
+
+    python bench_suite.py run
+    python bench_suite.py run --only cycle,serial --compare bench_results/baseline.json
+    python bench_suite.py compare bench_results/a.json bench_results/b.json --tolerance 10
+"""
+import argparse
+import hashlib
+import json
+import os
+import platform
+import sys
+import time
+
+import numpy as np
+
+RESULTS_DIR = "bench_results"
+SAMPLE_IMAGES = ("image.png", "output/inferenced_image.jpg")
+BENCHMARKS = {}
+
+
+class Skipped(Exception):
+    """Raised by a benchmark whose dependencies are not available."""
+
+
+def benchmark(name):
+    def register(fn):
+        BENCHMARKS[name] = fn
+        return fn
+    return register
+
+
+def timings(fn, repeat, warmup=10):
+    """Call fn repeat times after warmup; returns per-call stats in milliseconds."""
+    for _ in range(warmup):
+        fn()
+    samples = np.empty(repeat)
+    for i in range(repeat):
+        start = time.perf_counter_ns()
+        fn()
+        samples[i] = time.perf_counter_ns() - start
+    ms = samples / 1e6
+    return {"p50_ms": float(np.percentile(ms, 50)), "p95_ms": float(np.percentile(ms, 95)),
+            "mean_ms": float(ms.mean()), "samples": repeat}
+
+
+def fingerprint():
+    """
+    Machine description and a short hash of the parts that affect timings.
+    The hash uses the OS name only, not platform.platform(), so a kernel
+    or distribution update does not make every baseline look foreign.
+    """
+    cpu = platform.processor()
+    try:
+        with open("/proc/cpuinfo") as f:
+            cpu = next((line.split(":", 1)[1].strip() for line in f if line.startswith("model name")), cpu)
+    except OSError:
+        pass
+    machine = {"cpu": cpu, "cores": os.cpu_count(), "machine": platform.machine(),
+               "system": platform.system(), "os": platform.platform(), "python": platform.python_version(), "numpy": np.__version__}
+    for module in ("torch", "ultralytics", "cv2", "PyQt5.QtCore"):
+        try:
+            imported = __import__(module, fromlist=["_"])
+            machine[module.split(".")[0]] = getattr(imported, "__version__", None) or getattr(
+                imported, "PYQT_VERSION_STR", "?")
+        except ImportError:
+            pass
+    key = json.dumps([machine[k] for k in ("cpu", "cores", "machine", "system")])
+    machine["id"] = hashlib.sha1(key.encode()).hexdigest()[:10]
+    return machine
+
+
+def _require(module):
+    try:
+        return __import__(module, fromlist=["_"])
+    except ImportError as e:
+        raise Skipped(f"{module} not installed ({e})")
+
+
+def _sample_frames():
+    """(name, 640x480 frame) for each sample image that could be read."""
+    cv2 = _require("cv2")
+    frames = []
+    for path in SAMPLE_IMAGES:
+        image = cv2.imread(path)
+        if image is not None:
+            frames.append((os.path.basename(path), cv2.resize(image, (640, 480))))
+    if not frames:
+        raise Skipped(f"no sample images ({', '.join(SAMPLE_IMAGES)})")
+    return frames
+
+
+@benchmark("yolo")
+def bench_yolo(args):
+    ultralytics = _require("ultralytics")
+    from inference_server import MODEL_PATH
+    from preprocess import LocalDetector
+
+    if not os.path.exists(MODEL_PATH):
+        raise Skipped(f"{MODEL_PATH} not found")
+    frames = _sample_frames()
+    detector = LocalDetector(ultralytics.YOLO(MODEL_PATH), imgsz=args.imgsz)
+    results = {}
+    for name, frame in frames:
+        results[name] = timings(lambda: detector.infer(frame), args.repeat)
+        results[name]["detections"] = len(detector.infer(frame))
+    return results
+
+
+@benchmark("classify")
+def bench_classify(args):
+    from zones import box_centers, classify_directions, count_directions, load_zone_config
+
+    zones = load_zone_config()
+    rng = np.random.default_rng(0)
+    results = {}
+    for count in (10, 50):
+        xy = rng.uniform(0, 1, (count, 2)) * (600, 440)
+        boxes = np.hstack([xy, xy + rng.uniform(20, 40, (count, 2))]).astype(np.float32)
+
+        def step():
+            center_x, center_y = box_centers(boxes)
+            count_directions(classify_directions(center_x, center_y, 640, 480, zones))
+
+        results[f"{count}_boxes"] = timings(step, args.repeat * 10)
+    return results
+
+
+def _synthetic_trace(seconds=86400, fps=30, step=1.0, seed=0):
+    """A day of per-second counts with a morning and evening peak (frame timestamps every `step` s)."""
+    rng = np.random.default_rng(seed)
+    ts = np.arange(0, seconds, step)
+    peak = 1 + 2 * (np.exp(-((ts / 3600 - 8) ** 2) / 2) + np.exp(-((ts / 3600 - 17) ** 2) / 2))
+    counts = rng.poisson(np.outer(peak, (1.2, 1.0, 0.8, 0.8)))
+    return ts, np.minimum(counts, 8)
+
+
+def _load_trace(path):
+    if os.path.isdir(path):
+        from incident_recorder import load_incident
+
+        _, records = load_incident(path)
+        return (np.array([r["ts"] for r in records], float),
+                np.array([r["counts"] for r in records], int))
+    data = np.loadtxt(path, delimiter=",", skiprows=1)
+    return data[:, 0], data[:, 1:5].astype(int)
+
+
+@benchmark("cycle")
+def bench_cycle(args):
+    from traffic_control import CycleController
+
+    ts, counts = _load_trace(args.trace) if args.trace else _synthetic_trace()
+    rows = [tuple(int(c) for c in row) for row in counts]
+    start_ts = float(ts[0])
+
+    def replay():
+        cycle = CycleController(lambda *command: None, log=lambda message: None, now=start_ts)
+        for now, row in zip(ts.tolist(), rows):
+            cycle.update(*row, now)
+
+    result = timings(replay, max(3, args.repeat // 10), warmup=1)
+    result["updates"] = len(rows)
+    result["per_update_us"] = result["p50_ms"] * 1000 / len(rows)
+    return {"replay": result}
+
+
+@benchmark("gui_frame")
+def bench_gui_frame(args):
+    frames = _sample_frames()
+    os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+    _require("PyQt5")
+    from PyQt5.QtWidgets import QApplication, QLabel
+
+    try:
+        import traffic_light_gui
+    except ImportError as e:
+        raise Skipped(f"traffic_light_gui dependencies missing ({e})")
+
+    app = QApplication.instance() or QApplication([])
+
+    class Window:
+        # The attributes update_frame uses, without the camera and serial setup
+        _rgb = None
+        video_label = QLabel()
+
+    window = Window()
+    _, frame = frames[0]
+    result = {"640x480": timings(lambda: traffic_light_gui.TrafficLightGUI.update_frame(window, frame),
+                                 args.repeat * 5)}
+    app.processEvents()
+    return result
+
+
+class _MemoryPort:
+    """In-memory stand-in for a pyserial port: writes are counted, reads come from `replies`."""
+    is_open = True
+    in_waiting = 0
+
+    def __init__(self, replies=b""):
+        self.written = 0
+        self.replies = replies
+        self.offset = 0
+
+    def write(self, data):
+        self.written += len(data)
+
+    def read(self, size=1):
+        chunk = self.replies[self.offset:self.offset + max(size, 4096)]
+        self.offset += len(chunk)
+        return chunk
+
+    def close(self):
+        pass
+
+
+@benchmark("serial")
+def bench_serial(args):
+    from serial_protocol import FramedPort, encode_reply
+
+    switch = [(("S2", "S3"), "GREEN"), (("S1", "S4"), "RED")]
+    results = {}
+    for name, binary in (("text", False), ("framed", True)):
+        port = FramedPort("memory", mode="text")
+        port.ser, port.binary = _MemoryPort(), binary
+
+        def send_switches(n=1000):
+            for _ in range(n):
+                with port.batch():
+                    port.send(switch[:1])
+                    port.send(switch[1:])
+
+        port.ser.written = 0
+        send_switches(1)
+        bytes_per_switch = port.ser.written
+        result = timings(send_switches, max(5, args.repeat // 5))
+        result["switches_per_s"] = 1000 / (result["p50_ms"] / 1000)
+        result["bytes_per_switch"] = bytes_per_switch
+        results[f"send_{name}"] = result
+
+    replies = {"text": b"< Received: S2:S3:GREEN\nOK: S2 & S3 GREEN\n" * 1000,
+               "framed": b"".join(encode_reply(seq, 0, 0x96) for seq in range(1, 1001))}
+    for name, data in replies.items():
+        def parse():
+            port = FramedPort("memory", mode="text")
+            port.ser = _MemoryPort(data)
+            port.binary = name == "framed"
+            for seq in range(1, 1001):
+                port.pending[seq] = (0.0, ["S2:S3:GREEN"])
+            while port.readline():
+                pass
+
+        result = timings(parse, max(5, args.repeat // 5))
+        result["replies_per_s"] = 1000 / (result["p50_ms"] / 1000)
+        results[f"parse_{name}"] = result
+    return results
+
+
+def run(args):
+    names = args.only.split(",") if args.only else list(BENCHMARKS)
+    report = {"time": time.strftime("%Y-%m-%dT%H:%M:%S"), "machine": fingerprint(),
+              "settings": {"imgsz": args.imgsz, "repeat": args.repeat, "trace": args.trace},
+              "results": {}}
+    for name in names:
+        print(f"{name}...", end=" ", flush=True)
+        try:
+            report["results"][name] = BENCHMARKS[name](args)
+            print("done")
+        except Skipped as e:
+            report["results"][name] = {"skipped": str(e)}
+            print(f"skipped: {e}")
+    path = args.out or os.path.join(RESULTS_DIR, f"{time.strftime('%Y%m%d-%H%M%S')}_"
+                                                 f"{report['machine']['id']}.json")
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(path, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"Results written to {path}")
+    _print(report)
+    return path
+
+
+def _print(report):
+    for name, cases in report["results"].items():
+        if "skipped" in cases:
+            continue
+        for case, metrics in cases.items():
+            extra = "".join(f", {key} {value:,.1f}" for key, value in metrics.items()
+                            if key.endswith(("_per_s", "_per_switch", "_us")))
+            print(f"  {name}/{case:16s} p50 {metrics['p50_ms']:9.3f} ms, p95 {metrics['p95_ms']:9.3f} ms"
+                  f"{extra}")
+
+
+def compare(baseline_path, current_path, tolerance):
+    """Print metric changes; returns the list of regressions beyond tolerance (percent)."""
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+    with open(current_path) as f:
+        current = json.load(f)
+    if baseline["machine"]["id"] != current["machine"]["id"]:
+        print(f"warning: different machines ({baseline['machine']['cpu']} vs {current['machine']['cpu']});"
+              f" timings are not directly comparable")
+    if baseline.get("settings") != current.get("settings"):
+        print(f"warning: different settings ({baseline.get('settings')} vs {current.get('settings')})")
+    regressions = []
+    for name, cases in current["results"].items():
+        base_cases = baseline["results"].get(name, {})
+        if "skipped" in cases or "skipped" in base_cases:
+            continue
+        for case, metrics in cases.items():
+            if case not in base_cases:
+                continue
+            # The gate is on the median; p95 is shown but too noisy on short runs to fail on
+            old, new = base_cases[case]["p50_ms"], metrics["p50_ms"]
+            change = (new - old) / old * 100 if old else 0.0
+            flag = change > tolerance
+            print(f"  {name}/{case:16s} p50 {old:9.3f} -> {new:9.3f} ms ({change:+6.1f}%), "
+                  f"p95 {base_cases[case]['p95_ms']:9.3f} -> {metrics['p95_ms']:9.3f} ms"
+                  f"{'  REGRESSION' if flag else ''}")
+            if flag:
+                regressions.append((name, case, change))
+    print(f"{len(regressions)} regression(s) beyond {tolerance:.0f}%")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Controller performance benchmarks")
+    sub = parser.add_subparsers(dest="command", required=True)
+    run_parser = sub.add_parser("run", help="run the benchmarks and store the results")
+    run_parser.add_argument("--only", help=f"comma-separated subset of {', '.join(BENCHMARKS)}")
+    run_parser.add_argument("--imgsz", type=int, default=416, help="model input size")
+    run_parser.add_argument("--repeat", type=int, default=50, help="timed iterations per case")
+    run_parser.add_argument("--trace", help="incident directory or CSV (ts,north,south,east,west)")
+    run_parser.add_argument("--out", help="results file (default bench_results/<time>_<machine>.json)")
+    run_parser.add_argument("--compare", metavar="BASELINE", help="compare with a stored run afterwards")
+    run_parser.add_argument("--tolerance", type=float, default=10.0, help="allowed slowdown, percent")
+    compare_parser = sub.add_parser("compare", help="compare two stored runs")
+    compare_parser.add_argument("baseline")
+    compare_parser.add_argument("current")
+    compare_parser.add_argument("--tolerance", type=float, default=10.0, help="allowed slowdown, percent")
+    args = parser.parse_args()
+
+    if args.command == "run":
+        path = run(args)
+        if args.compare:
+            sys.exit(1 if compare(args.compare, path, args.tolerance) else 0)
+    else:
+        sys.exit(1 if compare(args.baseline, args.current, args.tolerance) else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,132 @@
+"""
+Load test for web_dashboard.py.
+
+Runs the detection loop (YOLO on the sample image, plus the same annotation
+and publish calls as the GUI) for a fixed time with 0 viewers, then with
+each requested number of MJPEG + WebSocket viewers, and prints inference
+FPS next to what the viewers actually received. Viewers run in separate
+processes, like real browsers would; --slow makes half of them read at a
+trickle to show that they drop frames instead of slowing the pipeline.
+
+Usage:
+    python bench_web_dashboard.py
+    python bench_web_dashboard.py --viewers 1,10,50 --seconds 20 --slow
+"""
+import argparse
+import base64
+import multiprocessing as mp
+import os
+import socket
+import time
+
+import numpy as np
+
+from bench_inference_server import load_frame
+from traffic_control import CycleController
+from web_dashboard import WebDashboard, frame_stats
+from zones import box_centers, classify_directions, count_directions, load_zone_config
+
+
+def _viewer(port, seconds, slow, out):
+    """Read /stream.mjpg (and /ws on a second socket); report frames and bytes."""
+    stream = socket.create_connection(("127.0.0.1", port))
+    stream.sendall(b"GET /stream.mjpg HTTP/1.1\r\nHost: localhost\r\n\r\n")
+    ws = socket.create_connection(("127.0.0.1", port))
+    key = base64.b64encode(os.urandom(16)).decode()
+    ws.sendall(f"GET /ws HTTP/1.1\r\nHost: localhost\r\nUpgrade: websocket\r\n"
+               f"Connection: Upgrade\r\nSec-WebSocket-Key: {key}\r\n"
+               f"Sec-WebSocket-Version: 13\r\n\r\n".encode())
+    stream.settimeout(1.0)
+    ws.setblocking(False)
+    frames = stats_bytes = received = 0
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        try:
+            chunk = stream.recv(4096 if slow else 262144)
+        except socket.timeout:
+            continue
+        received += len(chunk)
+        frames += chunk.count(b"--frame\r\n")
+        try:
+            stats_bytes += len(ws.recv(65536))
+        except BlockingIOError:
+            pass
+        if slow:
+            time.sleep(0.05)
+    stream.close()
+    ws.close()
+    out.put((frames, received, stats_bytes))
+
+
+def run(viewers, args, model, frame, zones):
+    """One timed run of the detection loop; returns a result dict."""
+    dashboard = WebDashboard(args.port, host="127.0.0.1", max_fps=args.max_fps)
+    ctx = mp.get_context("spawn")
+    out = ctx.Queue()
+    procs = [ctx.Process(target=_viewer, args=(dashboard.port, args.seconds + 2,
+                                               args.slow and i % 2 == 1, out))
+             for i in range(viewers)]
+    for p in procs:
+        p.start()
+    time.sleep(1.0 if viewers else 0)  # let viewers connect before timing
+
+    height, width = frame.shape[:2]
+    cycle = CycleController(lambda *a: True, log=None)
+    inferred = 0
+    start = time.perf_counter()
+    while time.perf_counter() - start < args.seconds:
+        results = model(frame, conf=0.55, iou=0.3, imgsz=args.imgsz, verbose=False)
+        center_x, center_y = box_centers(results[0].boxes.xyxy.cpu().numpy())
+        directions = classify_directions(center_x, center_y, width, height, zones)
+        north, south, east, west = (int(c) for c in count_directions(directions))
+        now = time.time()
+        cycle.update(north, south, east, west, now)
+        dashboard.publish_frame(results[0].plot())
+        dashboard.publish_stats(frame_stats(north, south, east, west, cycle, now))
+        inferred += 1
+    elapsed = time.perf_counter() - start
+    encoded = dashboard.frames_encoded
+
+    reports = [out.get() for _ in procs]
+    for p in procs:
+        p.join()
+    dashboard.close()
+    return {
+        "viewers": viewers,
+        "fps": inferred / elapsed,
+        "encoded_fps": encoded / elapsed,
+        "viewer_fps": np.mean([r[0] for r in reports]) / elapsed if reports else 0.0,
+        "viewer_mb": sum(r[1] for r in reports) / 2 ** 20,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test the web dashboard")
+    parser.add_argument("--viewers", default="1,5,20", help="comma-separated viewer counts")
+    parser.add_argument("--seconds", type=float, default=10.0, help="measurement time per run")
+    parser.add_argument("--image", default="image.png", help="frame fed to the model")
+    parser.add_argument("--imgsz", type=int, default=416)
+    parser.add_argument("--max-fps", type=float, default=10.0, help="dashboard encode rate cap")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--slow", action="store_true", help="make every other viewer a slow reader")
+    args = parser.parse_args()
+
+    from ultralytics import YOLO
+    model = YOLO('model/weights/best.pt')
+    frame = load_frame(args.image)
+    model(frame, imgsz=args.imgsz, verbose=False)  # warm up
+    zones = load_zone_config()
+
+    print(f"{'viewers':>7} {'infer fps':>9} {'change':>7} {'encoded fps':>11} "
+          f"{'viewer fps':>10} {'sent MB':>8}")
+    baseline = None
+    for viewers in [0] + [int(v) for v in args.viewers.split(",")]:
+        r = run(viewers, args, model, frame, zones)
+        baseline = baseline or r["fps"]
+        change = (r["fps"] / baseline - 1) * 100
+        print(f"{r['viewers']:>7} {r['fps']:>9.1f} {change:>+6.1f}% {r['encoded_fps']:>11.1f} "
+              f"{r['viewer_fps']:>10.1f} {r['viewer_mb']:>8.1f}")
+
+
+if __name__ == "__main__":
+    main()
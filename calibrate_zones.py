@@ -0,0 +1,204 @@
+"""
+Calibrate the direction threshold lines from labeled images.
+
+Usage:
+    python calibrate_zones.py labels.csv
+    python calibrate_zones.py labels.csv --north 0:400:20 --south 0:400:20 --workers 4
+
+labels.csv has one row per image with the ground-truth approach counts:
+
+    image,north,south,east,west
+    Dataset/test/IMG_5083.jpg,2,1,0,3
+
+YOLO runs once per image and the boxes are cached (calibration_cache.npz), so
+re-running the sweep with different ranges does not touch the model. Every
+threshold combination is scored with the vectorized classifier from zones.py,
+the grid is split across worker processes, and the best configuration is
+written to zones.yaml, which detect_cars.py, traffic_light_gui.py and
+infer_image.py load at startup. The full per-config accuracy table is written
+to a CSV file.
+"""
+import argparse
+import csv
+import itertools
+import os
+import time
+from multiprocessing import Pool, cpu_count
+
+import numpy as np
+
+from zones import (DIRECTIONS, ZONES_FILE, ZoneConfig, box_centers,
+                   classify_directions, count_directions, save_zone_config)
+
+CACHE_FILE = "calibration_cache.npz"
+TABLE_FILE = "zones_calibration.csv"
+MODEL_PATH = "model/weights/best.pt"
+
+
+def load_labels(path):
+    """Read labels.csv into (image paths, (N, 4) ground-truth counts)."""
+    images, counts = [], []
+    with open(path, newline="") as f:
+        for row in csv.DictReader(f):
+            images.append(row["image"])
+            counts.append([int(row[d.lower()]) for d in DIRECTIONS])
+    return images, np.array(counts, dtype=np.int32).reshape(-1, len(DIRECTIONS))
+
+
+def detect_all(images, conf, iou, imgsz):
+    """Run YOLO once per image and return (sizes, boxes, offsets)."""
+    import cv2
+    from ultralytics import YOLO
+
+    model = YOLO(MODEL_PATH)
+    sizes, boxes, offsets = [], [], [0]
+    for path in images:
+        image = cv2.imread(path)
+        if image is None:
+            raise SystemExit(f"Could not load image: {path}")
+        height, width = image.shape[:2]
+        results = model(image, conf=conf, iou=iou, imgsz=imgsz, verbose=False)
+        xyxy = results[0].boxes.xyxy.cpu().numpy().reshape(-1, 4)
+        sizes.append((width, height))
+        boxes.append(xyxy)
+        offsets.append(offsets[-1] + len(xyxy))
+        print(f"  {path}: {len(xyxy)} cars")
+    boxes = np.concatenate(boxes) if boxes else np.zeros((0, 4), np.float32)
+    return np.array(sizes, dtype=np.int32), boxes.astype(np.float32), np.array(offsets, dtype=np.int64)
+
+
+def load_detections(images, args):
+    """Return cached detections, running the model only when the cache is stale."""
+    params = np.array([args.conf, args.iou, args.imgsz], dtype=np.float64)
+    if os.path.exists(args.cache) and not args.refresh:
+        cache = np.load(args.cache)
+        if list(cache["images"]) == images and np.array_equal(cache["params"], params):
+            print(f"✓ Using cached detections from {args.cache}")
+            return cache["sizes"], cache["boxes"], cache["offsets"]
+    print(f"Running detection on {len(images)} images...")
+    sizes, boxes, offsets = detect_all(images, args.conf, args.iou, args.imgsz)
+    np.savez_compressed(args.cache, images=np.array(images), params=params,
+                        sizes=sizes, boxes=boxes, offsets=offsets)
+    return sizes, boxes, offsets
+
+
+def parse_range(text):
+    """Parse 'start:stop:step' (stop inclusive) or a single value."""
+    parts = [int(p) for p in text.split(":")]
+    if len(parts) == 1:
+        return [parts[0]]
+    start, stop = parts[0], parts[1]
+    step = parts[2] if len(parts) > 2 else 10
+    return list(range(start, stop + 1, step))
+
+
+# Detections shared with the worker processes (set once by _init_worker)
+_detections = None
+
+
+def _init_worker(sizes, boxes, offsets, truth):
+    global _detections
+    _detections = (sizes, boxes, offsets, truth)
+
+
+def score_configs(grid):
+    """
+    Score a (K, 4) block of [north, south, west, east] offsets.
+
+    Returns a (K, 6) array: exact-match accuracy, per-direction accuracy
+    (north, south, east, west) and mean absolute count error.
+    """
+    sizes, boxes, offsets, truth = _detections
+    # Column vectors so the thresholds broadcast against the box centers
+    zones = ZoneConfig(*(grid[:, i:i + 1] for i in range(4)))
+    exact = np.zeros(len(grid))
+    per_direction = np.zeros((len(grid), len(DIRECTIONS)))
+    abs_error = np.zeros(len(grid))
+    for i, (width, height) in enumerate(sizes):
+        center_x, center_y = box_centers(boxes[offsets[i]:offsets[i + 1]])
+        counts = count_directions(classify_directions(center_x, center_y, width, height, zones))
+        counts = np.broadcast_to(counts, (len(grid), len(DIRECTIONS)))
+        match = counts == truth[i]
+        exact += match.all(axis=1)
+        per_direction += match
+        abs_error += np.abs(counts - truth[i]).sum(axis=1)
+    n = max(len(sizes), 1)
+    return np.column_stack([exact / n, per_direction / n, abs_error / (n * len(DIRECTIONS))])
+
+
+def sweep(grid, detections, workers, chunk_size):
+    """Score every row of the grid, in parallel when workers > 1."""
+    chunks = [grid[i:i + chunk_size] for i in range(0, len(grid), chunk_size)]
+    if workers <= 1:
+        _init_worker(*detections)
+        return np.concatenate([score_configs(chunk) for chunk in chunks])
+    with Pool(workers, initializer=_init_worker, initargs=detections) as pool:
+        return np.concatenate(pool.map(score_configs, chunks))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Calibrate direction thresholds from labeled images")
+    parser.add_argument("labels", help="CSV with image,north,south,east,west columns")
+    parser.add_argument("--north", default="0:300:20", help="north offset range start:stop:step")
+    parser.add_argument("--south", default="0:300:20", help="south offset range start:stop:step")
+    parser.add_argument("--west", default="0:300:20", help="west offset range start:stop:step")
+    parser.add_argument("--east", default="0:300:20", help="east offset range start:stop:step")
+    parser.add_argument("--conf", type=float, default=0.55)
+    parser.add_argument("--iou", type=float, default=0.3)
+    parser.add_argument("--imgsz", type=int, default=416)
+    parser.add_argument("--cache", default=CACHE_FILE, help="detection cache file")
+    parser.add_argument("--refresh", action="store_true", help="ignore the detection cache")
+    parser.add_argument("--workers", type=int, default=cpu_count(), help="worker processes")
+    parser.add_argument("--chunk-size", type=int, default=2048, help="configs per work item")
+    parser.add_argument("--out", default=ZONES_FILE, help="output zones config")
+    parser.add_argument("--table", default=TABLE_FILE, help="output per-config accuracy CSV")
+    parser.add_argument("--top", type=int, default=10, help="rows of the table to print")
+    args = parser.parse_args()
+
+    images, truth = load_labels(args.labels)
+    if not images:
+        raise SystemExit(f"No labeled images in {args.labels}")
+    sizes, boxes, offsets = load_detections(images, args)
+
+    grid = np.array(list(itertools.product(parse_range(args.north), parse_range(args.south),
+                                           parse_range(args.west), parse_range(args.east))),
+                    dtype=np.int32)
+    print(f"Sweeping {len(grid)} configurations over {len(images)} images "
+          f"with {args.workers} workers...")
+    start = time.perf_counter()
+    scores = sweep(grid, (sizes, boxes, offsets, truth), args.workers, args.chunk_size)
+    print(f"✓ Sweep finished in {time.perf_counter() - start:.2f}s")
+
+    # Best = highest exact-match accuracy, then lowest mean absolute error
+    order = np.lexsort((scores[:, 5], -scores[:, 0]))
+    header = ["north", "south", "west", "east", "exact_acc",
+              *(f"{d.lower()}_acc" for d in DIRECTIONS), "mae"]
+    with open(args.table, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(header)
+        for i in order:
+            writer.writerow([*grid[i].tolist(), *(f"{s:.4f}" for s in scores[i])])
+    print(f"✓ Accuracy table saved to: {args.table}")
+
+    print("  ".join(f"{h:>9}" for h in header))
+    for i in order[:args.top]:
+        print("  ".join([*(f"{v:>9d}" for v in grid[i]), *(f"{s:>9.3f}" for s in scores[i])]))
+
+    best = order[0]
+    zones = ZoneConfig(*(int(v) for v in grid[best]))
+    save_zone_config(zones, args.out, extra={
+        "calibration": {
+            "labels": args.labels,
+            "images": len(images),
+            "exact_accuracy": round(float(scores[best, 0]), 4),
+            "mae": round(float(scores[best, 5]), 4),
+            "conf": args.conf,
+            "iou": args.iou,
+            "imgsz": args.imgsz,
+        }
+    })
+    print(f"✓ Best configuration {zones} saved to: {args.out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,238 @@
+"""
+Camera capture with negotiated format, a shallow driver queue and stale-frame draining.
+
+cv2.VideoCapture(0) with default properties usually gets YUYV at the
+sensor's full resolution and a 4-frame driver queue. That means
+converting a large uncompressed frame on every read. When inference is
+slower than the camera, it also means processing a frame that is several
+periods old. Camera asks the driver for:
+
+    FOURCC       MJPG (compressed on the camera, much less USB bandwidth and copying)
+    resolution   640x480 by default, close to the 416 px model input and the
+                 640 px GUI view, so neither needs a large resize
+    FPS          30
+    BUFFERSIZE   1 (where the backend supports it)
+
+and reads with grab()/retrieve(). grab() only dequeues a buffer. A grab
+that returns much faster than a frame period came out of the queue, so it
+is stale and is dropped without being decoded. Draining stops after
+max_drain frames or one frame period, whichever comes first, so a read
+never waits more than about two periods. Only the newest frame is
+retrieve()d (decoded). Drivers may ignore any of the requests. The values
+actually negotiated are read back and reported, with the capture timing:
+
+    wait    time blocked in grab() for a fresh frame
+    decode  retrieve() time
+    age     frame age when retrieved (V4L2 buffer timestamps, where available)
+    drops   stale frames skipped
+
+Configure with TRAFFIC_CAMERA (index or file/URL), TRAFFIC_CAMERA_SIZE
+(e.g. 1280x720), TRAFFIC_CAMERA_FPS and TRAFFIC_CAMERA_FOURCC.
+Compare with the default capture while a slow consumer runs:
+
+    python camera.py --seconds 10 --work-ms 80
+"""
+import argparse
+import os
+import sys
+import time
+from collections import deque
+
+import numpy as np
+
+
+class Camera:
+    """
+    Drop-in for the cv2.VideoCapture calls the controllers use
+    (isOpened, read, release).
+
+    source: camera index, or a file/stream path (files are never drained)
+    width/height/fps/fourcc/buffer_size: requested capture format; None leaves the driver default
+    max_drain: most stale frames dropped per read
+    drain_budget: most seconds spent draining per read (default: one frame period)
+    pool: optional preprocess.FramePool; frames are decoded into its buffers
+    """
+
+    def __init__(self, source=0, width=640, height=480, fps=30, fourcc="MJPG", buffer_size=1,
+                 max_drain=4, pool=None, drain_budget=None):
+        import cv2
+
+        self.source = source
+        self.pool = pool
+        backend = cv2.CAP_V4L2 if isinstance(source, int) and sys.platform.startswith("linux") else cv2.CAP_ANY
+        self.cap = cv2.VideoCapture(source, backend)
+        if not self.cap.isOpened() and backend != cv2.CAP_ANY:
+            self.cap = cv2.VideoCapture(source)
+        self.live = isinstance(source, int)
+        self.max_drain = max_drain if self.live else 0
+        self.requested = {"fourcc": fourcc, "width": width, "height": height, "fps": fps,
+                          "buffer_size": buffer_size}
+        if self.cap.isOpened():
+            # FOURCC first: some drivers only offer the larger sizes/rates in MJPG
+            if fourcc:
+                self.cap.set(cv2.CAP_PROP_FOURCC, cv2.VideoWriter_fourcc(*fourcc))
+            if width and height:
+                self.cap.set(cv2.CAP_PROP_FRAME_WIDTH, width)
+                self.cap.set(cv2.CAP_PROP_FRAME_HEIGHT, height)
+            if fps:
+                self.cap.set(cv2.CAP_PROP_FPS, fps)
+            if buffer_size:
+                self.cap.set(cv2.CAP_PROP_BUFFERSIZE, buffer_size)
+        self.negotiated = self._read_back()
+        period = 1.0 / self.negotiated["fps"] if self.negotiated.get("fps") else 1.0 / 30
+        self.stale_threshold = period / 2
+        self.drain_budget = period if drain_budget is None else drain_budget
+        self.wait = deque(maxlen=300)
+        self.decode = deque(maxlen=300)
+        self.age = deque(maxlen=300)
+        self.frames = 0
+        self.drops = 0
+
+    def _read_back(self):
+        import cv2
+
+        if not self.cap.isOpened():
+            return {}
+        code = int(self.cap.get(cv2.CAP_PROP_FOURCC))
+        fourcc = "".join(chr((code >> 8 * i) & 0xFF) for i in range(4)) if code else "?"
+        return {
+            "backend": self.cap.getBackendName(),
+            "fourcc": fourcc,
+            "width": int(self.cap.get(cv2.CAP_PROP_FRAME_WIDTH)),
+            "height": int(self.cap.get(cv2.CAP_PROP_FRAME_HEIGHT)),
+            "fps": self.cap.get(cv2.CAP_PROP_FPS),
+            "buffer_size": int(self.cap.get(cv2.CAP_PROP_BUFFERSIZE)),
+        }
+
+    def isOpened(self):
+        return self.cap.isOpened()
+
+    def read(self):
+        """(ok, frame) with the newest frame the driver has; stale queued frames are skipped."""
+        import cv2
+
+        start = time.perf_counter()
+        if not self.cap.grab():
+            return False, None
+        grabbed = time.perf_counter()
+        drain_end = grabbed + self.drain_budget
+        drained = 0
+        # A grab that returned this quickly was already queued; fetch the next one instead.
+        # Each grab can block for up to a frame period, so the whole drain is bounded in time too.
+        while (self.live and grabbed - start < self.stale_threshold and drained < self.max_drain
+               and grabbed < drain_end):
+            start = grabbed
+            if not self.cap.grab():
+                break
+            grabbed = time.perf_counter()
+            drained += 1
+        if self.pool is not None and self.negotiated:
+            shape = (self.negotiated["height"], self.negotiated["width"], 3)
+            ok, frame = self.cap.retrieve(self.pool.acquire(shape))
+        else:
+            ok, frame = self.cap.retrieve()
+        done = time.perf_counter()
+        if not ok:
+            return False, None
+        self.frames += 1
+        self.drops += drained
+        self.wait.append(grabbed - start)
+        self.decode.append(done - grabbed)
+        if self.live and hasattr(time, "clock_gettime"):
+            # V4L2 stamps buffers in CLOCK_MONOTONIC milliseconds; other backends give 0 or a position
+            age = time.clock_gettime(time.CLOCK_MONOTONIC) - self.cap.get(cv2.CAP_PROP_POS_MSEC) / 1000
+            if 0 <= age < 5:
+                self.age.append(age)
+        return True, frame
+
+    def release(self):
+        self.cap.release()
+
+    def describe(self):
+        """One line with requested vs negotiated format."""
+        got = self.negotiated
+        if not got:
+            return f"Camera {self.source}: not opened"
+        req = self.requested
+        return (f"Camera {self.source} ({got['backend']}): {got['fourcc']} {got['width']}x{got['height']} "
+                f"@ {got['fps']:.0f} fps, buffer {got['buffer_size']} "
+                f"(requested {req['fourcc']} {req['width']}x{req['height']} @ {req['fps']}, "
+                f"buffer {req['buffer_size']})")
+
+    def summary(self):
+        """Capture timing so far: p50/p95 of wait, decode and (if known) frame age."""
+        parts = [f"{self.frames} frames, {self.drops} stale dropped"]
+        for name, values in (("wait", self.wait), ("decode", self.decode), ("age", self.age)):
+            if values:
+                ms = np.array(values) * 1000
+                parts.append(f"{name} p50 {np.percentile(ms, 50):.1f} / p95 {np.percentile(ms, 95):.1f} ms")
+        return ", ".join(parts)
+
+
+def camera_settings_from_env(default=0):
+    """Camera arguments (source, width, height, fps, fourcc) from TRAFFIC_CAMERA, _SIZE, _FPS and _FOURCC."""
+    source = os.environ.get("TRAFFIC_CAMERA", str(default))
+    source = int(source) if source.isdigit() else source
+    width, height = (int(v) for v in os.environ.get("TRAFFIC_CAMERA_SIZE", "640x480").lower().split("x"))
+    fps = float(os.environ.get("TRAFFIC_CAMERA_FPS", "30"))
+    fourcc = os.environ.get("TRAFFIC_CAMERA_FOURCC", "MJPG")
+    return {"source": source, "width": width, "height": height, "fps": fps, "fourcc": fourcc}
+
+
+def camera_from_env(default=0, pool=None):
+    """Camera configured from TRAFFIC_CAMERA, TRAFFIC_CAMERA_SIZE, _FPS and _FOURCC."""
+    settings = camera_settings_from_env(default)
+    return Camera(settings["source"], settings["width"], settings["height"], settings["fps"],
+                  settings["fourcc"] or None, pool=pool)
+
+
+def _measure(read, seconds, work):
+    """Read frames for `seconds` while a consumer spends `work` seconds per frame."""
+    reads = []
+    end = time.perf_counter() + seconds
+    while time.perf_counter() < end:
+        t0 = time.perf_counter()
+        ok, frame = read()
+        reads.append(time.perf_counter() - t0)
+        if not ok:
+            break
+        if work:
+            time.sleep(work)  # stand-in for inference
+    ms = np.array(reads) * 1000
+    return frame, ms
+
+
+def main():
+    import cv2
+
+    parser = argparse.ArgumentParser(description="Compare default and configured camera capture")
+    parser.add_argument("--source", default="0")
+    parser.add_argument("--size", default="640x480")
+    parser.add_argument("--fps", type=float, default=30)
+    parser.add_argument("--fourcc", default="MJPG")
+    parser.add_argument("--seconds", type=float, default=10)
+    parser.add_argument("--work-ms", type=float, default=80,
+                        help="simulated inference time per frame (slower than the camera)")
+    args = parser.parse_args()
+    source = int(args.source) if args.source.isdigit() else args.source
+    work = args.work_ms / 1000
+
+    default = cv2.VideoCapture(source)
+    frame, ms = _measure(default.read, args.seconds, work)
+    default.release()
+    if frame is not None:
+        print(f"Default capture: {frame.shape[1]}x{frame.shape[0]}, read() p50 {np.median(ms):.1f} ms, "
+              f"p95 {np.percentile(ms, 95):.1f} ms over {len(ms)} frames")
+
+    width, height = (int(v) for v in args.size.lower().split("x"))
+    camera = Camera(source, width, height, args.fps, args.fourcc or None)
+    print(camera.describe())
+    frame, ms = _measure(camera.read, args.seconds, work)
+    camera.release()
+    print(f"Configured capture: read() p50 {np.median(ms):.1f} ms, p95 {np.percentile(ms, 95):.1f} ms "
+          f"over {len(ms)} frames")
+    print(f"  {camera.summary()}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,353 @@
+"""
+Traffic count history: a bounded, memory-mapped columnar time-series store.
+
+Every processed frame's north/south/east/west counts and phase are folded
+into per-second buckets; closed seconds roll up into minutes and minutes
+into hours as they happen, so no batch job is ever needed. Each resolution
+is a tier on disk:
+
+    history/<tier>/<column>.bin   one fixed-size memory-mapped file per column
+    history/<tier>/head.bin       number of rows ever written to the tier
+
+Tiers are ring buffers: once full, the oldest row is overwritten, so the
+store never grows past its preallocated size (about 60 MB with the default
+retention of 7 days of seconds, 1 year of minutes and 10 years of hours).
+
+Columns per bucket: ts (bucket start, epoch seconds), samples (frames),
+north/south/east/west (count sums), ns_green/ew_green (seconds of green),
+switches, extensions, planned (sum of green durations chosen at switches).
+Averages are sums divided by samples (or by switches for planned).
+
+Queries select the tier by time range, binary-search the sorted ts column
+and reduce only the rows in range:
+
+    python count_history.py demand --days 30 --weekdays --hours 7-9 --approach ns
+    python count_history.py info
+    python count_history.py bench --days 30
+"""
+import argparse
+import os
+import threading
+import time
+
+import numpy as np
+
+HISTORY_DIR = "history"
+APPROACHES = ("north", "south", "east", "west")
+COLUMNS = {
+    "ts": np.int64,
+    "samples": np.int32,
+    "north": np.float32,
+    "south": np.float32,
+    "east": np.float32,
+    "west": np.float32,
+    "ns_green": np.float32,
+    "ew_green": np.float32,
+    "switches": np.int32,
+    "extensions": np.int32,
+    "planned": np.float32,
+}
+# (name, bucket seconds, rows kept)
+TIERS = (
+    ("second", 1, 7 * 86400),
+    ("minute", 60, 366 * 1440),
+    ("hour", 3600, 10 * 366 * 24),
+)
+
+
+class Tier:
+    """One resolution: fixed-capacity ring of rows stored column by column."""
+
+    def __init__(self, path, step, capacity):
+        self.path = path
+        self.step = step
+        self.capacity = capacity
+        os.makedirs(path, exist_ok=True)
+        self.head = self._map("head", np.int64, 1)
+        self.columns = {name: self._map(name, dtype, capacity) for name, dtype in COLUMNS.items()}
+
+    def _map(self, name, dtype, length):
+        filename = os.path.join(self.path, f"{name}.bin")
+        size = np.dtype(dtype).itemsize * length
+        if not os.path.exists(filename) or os.path.getsize(filename) != size:
+            with open(filename, "wb") as f:
+                f.truncate(size)  # sparse: disk is only used as rows are written
+        return np.memmap(filename, dtype=dtype, mode="r+", shape=(length,))
+
+    @property
+    def rows(self):
+        return int(min(self.head[0], self.capacity))
+
+    def last_ts(self):
+        if self.head[0] == 0:
+            return None
+        return int(self.columns["ts"][(self.head[0] - 1) % self.capacity])
+
+    def append(self, bucket):
+        """
+        Write one closed bucket (dict of column values). A bucket with the
+        same ts as the last row is added into it: close() writes partly
+        filled minutes and hours, and a restart within them continues them.
+        """
+        last = self.last_ts()
+        if last is not None and bucket["ts"] < last:
+            return  # clock stepped backwards; keep ts sorted
+        if last is not None and bucket["ts"] == last:
+            i = int((self.head[0] - 1) % self.capacity)
+            for name, column in self.columns.items():
+                if name != "ts":
+                    column[i] += bucket[name]
+            return
+        i = int(self.head[0] % self.capacity)
+        for name, column in self.columns.items():
+            column[i] = bucket[name]
+        self.head[0] += 1
+
+    def segments(self):
+        """Index ranges (lo, hi) of the ring in time order."""
+        head = int(self.head[0])
+        if head <= self.capacity:
+            return [(0, head)]
+        split = head % self.capacity
+        return [(split, self.capacity), (0, split)]
+
+    def first_ts(self):
+        lo, hi = self.segments()[0]
+        return int(self.columns["ts"][lo]) if hi > lo else None
+
+    def select(self, start, end, columns=None):
+        """Columns for rows with start <= ts < end, as arrays in time order."""
+        names = columns or list(COLUMNS)
+        parts = {name: [] for name in names}
+        ts = self.columns["ts"]
+        for lo, hi in self.segments():
+            a = lo + int(np.searchsorted(ts[lo:hi], start, "left"))
+            b = lo + int(np.searchsorted(ts[lo:hi], end, "left"))
+            for name in names:
+                parts[name].append(self.columns[name][a:b])
+        return {name: np.concatenate(chunks) if chunks else np.empty(0, COLUMNS[name])
+                for name, chunks in parts.items()}
+
+    def flush(self):
+        self.head.flush()
+        for column in self.columns.values():
+            column.flush()
+
+
+def _empty_bucket(ts):
+    bucket = dict.fromkeys(COLUMNS, 0)
+    bucket["ts"] = ts
+    return bucket
+
+
+class CountHistory:
+    """
+    Feed it one add() per frame (and phase/extend events via watch()); it
+    keeps the second/minute/hour tiers up to date incrementally. add() runs
+    on the frame loop and the event hooks on whichever thread logs, so the
+    open buckets are only touched under a lock.
+    """
+
+    def __init__(self, path=HISTORY_DIR, tiers=TIERS):
+        self.path = path
+        self.tiers = [Tier(os.path.join(path, name), step, capacity)
+                      for name, step, capacity in tiers]
+        self.names = [name for name, _, _ in tiers]
+        self._open = [None] * len(self.tiers)  # bucket being filled per tier
+        self._last_time = None
+        self._lock = threading.Lock()
+
+    def add(self, now, north, south, east, west, direction):
+        """Fold one frame's counts and current phase into the open second."""
+        with self._lock:
+            bucket = self._bucket(now)
+            bucket["samples"] += 1
+            bucket["north"] += north
+            bucket["south"] += south
+            bucket["east"] += east
+            bucket["west"] += west
+            if self._last_time is not None:
+                # Green time since the previous frame (gaps over a second are not counted)
+                dt = min(max(now - self._last_time, 0.0), 1.0)
+                bucket["ns_green" if direction == "NS" else "ew_green"] += dt
+            self._last_time = now
+
+    def on_event(self, event):
+        """EventLog hook: count phase switches and green extensions."""
+        with self._lock:
+            bucket = self._bucket(event["ts"])
+            if event["kind"] == "phase":
+                bucket["switches"] += 1
+                bucket["planned"] += event.get("duration", 0)
+            elif event["kind"] == "extend":
+                bucket["extensions"] += 1
+
+    def watch(self, event_log):
+        event_log.on("phase", self.on_event)
+        event_log.on("extend", self.on_event)
+
+    def _bucket(self, now):
+        """The open second for `now` (caller holds the lock)."""
+        second = int(now)
+        bucket = self._open[0]
+        if bucket is None or bucket["ts"] != second:
+            if bucket is not None:
+                self._close(0, bucket)
+            bucket = self._open[0] = _empty_bucket(second)
+        return bucket
+
+    def _close(self, level, bucket):
+        """Append a finished bucket to its tier and fold it into the next tier up."""
+        self.tiers[level].append(bucket)
+        if level + 1 == len(self.tiers):
+            return
+        step = self.tiers[level + 1].step
+        parent_ts = bucket["ts"] - bucket["ts"] % step
+        parent = self._open[level + 1]
+        if parent is not None and parent["ts"] != parent_ts:
+            self._close(level + 1, parent)
+            parent = None
+        if parent is None:
+            parent = self._open[level + 1] = _empty_bucket(parent_ts)
+        for name in COLUMNS:
+            if name != "ts":
+                parent[name] += bucket[name]
+
+    def tier_for(self, start, end, max_rows=200_000):
+        """Finest tier that still holds `start` and needs at most max_rows rows."""
+        for tier in self.tiers[:-1]:
+            first = tier.first_ts()
+            if first is not None and first <= start and (end - start) / tier.step <= max_rows:
+                return tier
+        return self.tiers[-1]
+
+    def query(self, start, end, columns=None, tier=None):
+        """Rows with start <= ts < end from the named (or automatically chosen) tier."""
+        tier = self.tiers[self.names.index(tier)] if tier else self.tier_for(start, end)
+        return tier.select(start, end, columns)
+
+    def demand(self, start, end, approaches=("north", "south"), weekdays=None, hours=None,
+               tier=None):
+        """
+        Average vehicles per frame summed over `approaches` between start and
+        end, optionally only on the given weekdays (0 = Monday) and within
+        the local-time hour window hours=(from, to). Returns (average, frames).
+        """
+        rows = self.query(start, end, ["ts", "samples", *approaches], tier)
+        mask = np.ones(len(rows["ts"]), bool)
+        if weekdays is not None or hours is not None:
+            local = rows["ts"] + _utc_offset()
+            if weekdays is not None:
+                # 1970-01-01 was a Thursday
+                mask &= np.isin((local // 86400 + 3) % 7, list(weekdays))
+            if hours is not None:
+                hour = (local % 86400) / 3600.0
+                mask &= (hour >= hours[0]) & (hour < hours[1])
+        frames = int(rows["samples"][mask].sum())
+        if frames == 0:
+            return 0.0, 0
+        total = sum(float(rows[name][mask].sum()) for name in approaches)
+        return total / frames, frames
+
+    def flush(self):
+        for tier in self.tiers:
+            tier.flush()
+
+    def close(self):
+        """
+        Write out every open bucket, partly filled or not (the current second,
+        minute and hour), and sync the files. A restart within the same
+        minute or hour adds to those rows instead of losing them.
+        """
+        with self._lock:
+            for level in range(len(self.tiers)):
+                if self._open[level] is not None:
+                    self._close(level, self._open[level])  # folds into level + 1, closed next
+                    self._open[level] = None
+            self._last_time = None
+        self.flush()
+
+
+def _utc_offset():
+    """Local time offset from UTC in seconds (current, so DST edges are approximate)."""
+    return -time.altzone if time.localtime().tm_isdst > 0 else -time.timezone
+
+
+def _parse_hours(text):
+    start, end = text.split("-")
+    return float(start), float(end)
+
+
+def bench(days, path):
+    """Fill a store with `days` of synthetic 1 Hz data, then time typical queries."""
+    history = CountHistory(path)
+    rng = np.random.default_rng(0)
+    end = int(time.time()) // 3600 * 3600
+    start = end - days * 86400
+    t0 = time.perf_counter()
+    direction = "EW"
+    for now in range(start, end):
+        hour = (now + _utc_offset()) % 86400 / 3600
+        rush = 3.0 if 7 <= hour < 9 or 16 <= hour < 18 else 1.0
+        counts = rng.poisson(rush, 4)
+        if now % 30 == 0:
+            direction = "NS" if direction == "EW" else "EW"
+            history.on_event({"ts": now, "kind": "phase", "duration": 30})
+        history.add(now, *counts, direction)
+    history.close()
+    fill = time.perf_counter() - t0
+    print(f"Wrote {days} days at 1 Hz in {fill:.1f}s ({(end - start) / fill:,.0f} frames/s)")
+
+    for label, kwargs in (
+        ("last hour, N-S", dict(start=end - 3600, end=end)),
+        ("last day, N-S", dict(start=end - 86400, end=end)),
+        ("weekdays 7-9am, last month", dict(start=end - 30 * 86400, end=end,
+                                            weekdays=range(5), hours=(7, 9))),
+        ("all, last year (hour tier)", dict(start=end - 366 * 86400, end=end, tier="hour")),
+    ):
+        runs = []
+        for _ in range(20):
+            t0 = time.perf_counter()
+            value, frames = history.demand(**kwargs)
+            runs.append(time.perf_counter() - t0)
+        print(f"  {label:<28} {value:6.2f} cars/frame over {frames:>9,} frames  "
+              f"median {np.median(runs) * 1000:.2f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Query the traffic count history")
+    parser.add_argument("--path", default=HISTORY_DIR)
+    sub = parser.add_subparsers(dest="command", required=True)
+    query = sub.add_parser("demand", help="average demand over a time window")
+    query.add_argument("--days", type=float, default=7, help="look back this many days")
+    query.add_argument("--approach", default="ns", choices=("ns", "ew", *APPROACHES))
+    query.add_argument("--weekdays", action="store_true", help="Monday-Friday only")
+    query.add_argument("--hours", type=_parse_hours, help="local hour window, e.g. 7-9")
+    sub.add_parser("info", help="rows and time span per tier")
+    bench_parser = sub.add_parser("bench", help="fill a scratch store and time queries")
+    bench_parser.add_argument("--days", type=int, default=30)
+    args = parser.parse_args()
+
+    if args.command == "bench":
+        bench(args.days, os.path.join(args.path, "bench"))
+        return
+    history = CountHistory(args.path)
+    if args.command == "info":
+        for name, tier in zip(history.names, history.tiers):
+            first, last = tier.first_ts(), tier.last_ts()
+            span = f"{time.ctime(first)} .. {time.ctime(last)}" if first is not None else "empty"
+            print(f"{name:>7}: {tier.rows:>9,} / {tier.capacity:,} rows  {span}")
+    else:
+        approaches = {"ns": ("north", "south"), "ew": ("east", "west")}.get(args.approach,
+                                                                           (args.approach,))
+        end = time.time()
+        t0 = time.perf_counter()
+        value, frames = history.demand(end - args.days * 86400, end, approaches,
+                                       range(5) if args.weekdays else None, args.hours)
+        elapsed = (time.perf_counter() - t0) * 1000
+        print(f"{'+'.join(approaches)}: {value:.2f} cars per frame over {frames:,} frames "
+              f"({elapsed:.1f} ms)")
+
+
+if __name__ == "__main__":
+    main()
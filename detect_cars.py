@@ -1,129 +1,147 @@
-from ultralytics import YOLO
 import cv2
 import serial
+import sys
 import time
 
-# Load the trained model
-model = YOLO('model/weights/best.pt')  # Path to the best trained model
+from count_history import CountHistory
+from event_log import EventLog
+from forecast import forecaster_from_env
+from green_wave import wave_from_env
+from incident_recorder import recorder_from_env
+from inference_server import client_from_env, draw_boxes
+from input_size import AdaptiveDetector
+from lamp_control import LampControl
+from latency import LatencyTracer, ReplyReader
+from metrics import ControllerMetrics, start_from_env
+from preemption import preemption_from_env
+from preprocess import FramePool
+from profiler import profiler_from_env
+from resources import resources_from_env
+from runtime_config import load_detector, watcher_from_env
+from serial_protocol import FramedPort
+from traffic_control import CycleController, calculate_green_time
+from web_dashboard import dashboard_from_env, frame_stats
+from zones import DIRECTIONS, box_centers, classify_directions, count_directions
 
-# ESP32 Serial Configuration
-SERIAL_PORT = "COM3"  # Change this to your ESP32's COM port (COM3, COM4, etc.)
-BAUD_RATE = 115200  # Standard ESP32 baud rate
+# torch/OpenCV thread pools, core pinning and thread priorities (TRAFFIC_TORCH_THREADS,
+# TRAFFIC_CV_THREADS, TRAFFIC_CORES, TRAFFIC_PRIORITY; see resources.py)
+resources = resources_from_env()
+resources.apply_libraries()
 
-# Initialize serial connection
-ser = None
+# Load the trained model, unless a shared inference server is configured
+# (TRAFFIC_INFERENCE_SERVER=host:port, see inference_server.py)
+inference_client = client_from_env()
+
+# COM port, camera, conf/iou/imgsz, zones and green times (traffic.yaml, reloaded while
+# running; write one with: python runtime_config.py init)
+config_watcher = watcher_from_env(local_model=inference_client is None)
+config = config_watcher.config
+
+# Local model: letterboxes into a reused input tensor (see preprocess.py); input size from
+# imgsz or TRAFFIC_IMGSZ (416, or auto to follow scene density, see input_size.py). With
+# TRAFFIC_LATENCY_BUDGET_MS the model and its input size come from the sweep (model_sweep.py)
+if inference_client is None:
+    detector = load_detector(config.detector)
+else:
+    detector = inference_client
+
+# Initialize serial connection (framed protocol if the firmware supports it, text otherwise)
+ser = FramedPort(config.serial.port, config.serial.baud_rate)
 try:
-    ser = serial.Serial(SERIAL_PORT, BAUD_RATE, timeout=1)
-    print(f"✓ Connected to ESP32 on {SERIAL_PORT} at {BAUD_RATE} baud")
-    time.sleep(2)  # Wait for ESP32 to initialize
+    ser.open()
+    print(f"✓ Connected to ESP32 on {ser.port} at {ser.baud_rate} baud ({ser.describe()})")
 
 except serial.SerialException as e:
-    print(f"✗ Failed to connect to ESP32 on {SERIAL_PORT}")
+    print(f"✗ Failed to connect to ESP32 on {ser.port}")
     print(f"  Error: {e}")
     print(f"  Available COM ports: Check Device Manager or use: python -m serial.tools.list_ports")
-    print("  Make sure ESP32 is connected and COM port is correct!")
+    print("  Make sure ESP32 is connected and the serial port in traffic.yaml is correct!")
     exit(1)  # Exit if we can't connect to ESP32
 
+# Structured event log (logs/events.jsonl), echoed to the console from its writer thread
+event_log = EventLog(echo=True)
+if isinstance(detector, AdaptiveDetector):
+    detector.event_log = event_log  # input size changes
+
+# Metrics endpoint (enable with TRAFFIC_METRICS_PORT=9100)
+metrics = ControllerMetrics()
+metrics_server = start_from_env(metrics.registry)
+if metrics_server:
+    print(f"✓ Metrics available on http://localhost:{metrics_server.server_port}/metrics")
+
+# Per-approach count history (history/), with phase switches and extensions
+history = CountHistory()
+history.watch(event_log)
+
+# Incident recorder: last 15 s of frames, dumped on SAFETY/serial errors or with 'i'
+recorder = recorder_from_env(event_log)
+
+# Web dashboard (enable with TRAFFIC_WEB_PORT=8080)
+dashboard = dashboard_from_env()
+if dashboard:
+    print(f"✓ Dashboard available on http://localhost:{dashboard.port}/")
+    if recorder:
+        dashboard.actions["/incident"] = lambda: recorder.trigger("api")
+
+# Latency tracing (enable with TRAFFIC_TRACE=1); the reader also drains ESP32 replies
+tracer = LatencyTracer()
+def on_reply(line):
+    # Called from the reply reader thread for every line the ESP32 sends
+    metrics.on_reply(line)
+    event_log.log("serial_rx", f"< {line}", line=line)
+
+reply_reader = ReplyReader(lambda: ser, tracer, on_line=on_reply)
+reply_reader.start()
+
+# Runtime profiler ('p', kill -USR1 <pid>, POST /profile) and slow frame trap (TRAFFIC_SLOW_FRAME_MS)
+profiler = profiler_from_env(event_log)
+profiler.install_signal()
+if dashboard:
+    dashboard.actions["/profile"] = lambda: profiler.start()
+
+def on_serial_error(e):
+    # A batched write (one frame per phase switch) failed after the cycle update
+    metrics.commands_failed.inc()
+    event_log.log("error", f"✗ Serial error: {e}")
+
+ser.on_error = on_serial_error
+
+# Direction threshold lines (calibrated with calibrate_zones.py)
+zones = config.zones
+
 # Traffic light timing configuration (in seconds)
-BASE_GREEN_TIME = 5  # Base green light duration
 BASE_RED_TIME = 5    # Base red light duration
 MAX_INCREMENT = 15   # Maximum additional seconds per car
 
-def calculate_green_time(north_count, south_count, east_count, west_count, direction):
-    """
-    Calculate dynamic green time based on individual car counts per direction.
-    Scaling: 10 seconds per car, max 20 seconds for first 2 cars, then 10 seconds per additional car.
-    - 0 cars: 5 seconds (base)
-    - 1 car: 10 seconds
-    - 2+ cars: 20 + (cars - 2) * 10 seconds (no cap)
-    
-    Gives priority to direction with highest car count.
-    direction: "NS" for North-South (S1/S4) or "EW" for East-West (S2/S3)
-    """
-    if direction == "NS":
-        # North-South: check which has more cars (North or South)
-        ns_max = max(north_count, south_count)
-        ew_max = max(east_count, west_count)
-        
-        if ns_max > ew_max:
-            # N-S direction has more cars - calculate duration
-            if ns_max == 0:
-                return 5
-            elif ns_max == 1:
-                return 10
-            else:
-                return 20 + (ns_max - 2) * 10
-        elif ns_max > 0:
-            # N-S has some cars but E-W has more
-            return 5
-        else:
-            # No cars in N-S
-            return 5
-    else:  # direction == "EW"
-        # East-West: check which has more cars (East or West)
-        ew_max = max(east_count, west_count)
-        ns_max = max(north_count, south_count)
-        
-        if ew_max > ns_max:
-            # E-W direction has more cars - calculate duration
-            if ew_max == 0:
-                return 5
-            elif ew_max == 1:
-                return 10
-            else:
-                return 20 + (ew_max - 2) * 10
-        elif ew_max > 0:
-            # E-W has some cars but N-S has more
-            return 5
-        else:
-            # No cars in E-W
-            return 5
-
 def send_command_to_esp32(lane, color, duration=None):
     """
     Send command to ESP32 via serial communication.
     lane: S1, S2, S3, or S4
     color: GREEN or RED
     """
-    if ser is None or not ser.is_open:
-        print(f"✗ Serial connection not available")
+    if not ser.is_open:
+        event_log.log("error", "✗ Serial connection not available", reconnect=True)
         return False
     
     try:
         # Format: "S1:GREEN\n" or "S2:RED\n"
         command = f"{lane}:{color}\n"
-        ser.write(command.encode())
-        print(f"✓ Sent: {lane} {color}")
+        write_start = time.perf_counter()
+        ser.send([((lane,), color)])
+        tracer.command_sent((lane,), color, write_start, time.perf_counter())
+        metrics.commands_sent.inc()
+        event_log.log("serial_tx", f"✓ Sent: {lane} {color}", command=command.strip())
         return True
     except serial.SerialException as e:
-        print(f"✗ Serial error: {e}")
+        metrics.commands_failed.inc()
+        event_log.log("error", f"✗ Serial error: {e}")
         return False
 
-def send_paired_command_to_esp32(lane1, lane2, color):
-    """
-    Send paired command to ESP32 via serial (e.g., S1 & S4 together or S2 & S3 together).
-    Uses a special command format to ensure both lights are controlled together.
-    """
-    global ser
-    if ser is None or not ser.is_open:
-        print(f"✗ Serial connection not available - attempting to reconnect...")
-        try:
-            ser = serial.Serial(SERIAL_PORT, BAUD_RATE, timeout=1)
-            time.sleep(1)
-            print(f"✓ Reconnected to ESP32 on {SERIAL_PORT}")
-        except serial.SerialException as e:
-            print(f"✗ Reconnection failed: {e}")
-            return False
-    
-    try:
-        # Format: "S1:S4:GREEN\n" for paired commands
-        command = f"{lane1}:{lane2}:{color}\n"
-        ser.write(command.encode())
-        print(f"✓ Sent: {lane1} & {lane2} {color}")
-        return True
-    except serial.SerialException as e:
-        print(f"✗ Serial error: {e}")
-        return False
+# Paired lamp commands, reconnects and the once-a-second resync; the same code runs in the GUI
+# and in the emulator check (see lamp_control.py)
+lamps = LampControl(lambda: ser, tracer=tracer, metrics=metrics, event_log=event_log)
+send_paired_command_to_esp32 = lamps.send_paired
+resync_lamps = lamps.resync
 
 def control_traffic_lights(north_count, south_count, west_count, east_count):
     """
@@ -162,120 +180,89 @@ def control_traffic_lights(north_count, south_count, west_count, east_count):
         # Sleep for dynamic duration
         time.sleep(green_time)
 
-# Initialize webcam
-cap = cv2.VideoCapture(0)  # Use 0 for default webcam
+# Initialize webcam (MJPG, 640x480, 1-frame buffer; camera section of traffic.yaml, see camera.py)
+# Captured and annotated frames live in preallocated pools instead of fresh arrays per frame
+frame_pool = FramePool()
+annotated_pool = FramePool()
+cap = config.camera.open(pool=frame_pool)
 
 if not cap.isOpened():
     print("Cannot open webcam")
     exit()
 
 print("✓ Webcam opened successfully")
-print("Press 'q' to quit")
-print(f"Connecting to ESP32 on {SERIAL_PORT} at {BAUD_RATE} baud")
+print(cap.describe())
+print("Press 'q' to quit, 'i' to save an incident, 'p' to profile")
+print(f"Connecting to ESP32 on {ser.port} at {ser.baud_rate} baud")
 
 frame_count = 0
 
-# Traffic light state tracking
-current_time_init = time.time()
-tl1_state = "GREEN"  # S1 (Traffic Light 1 - E-W)
-tl4_state = "GREEN"  # S4 (Traffic Light 4 - E-W)
-tl2_state = "RED"  # S2 (Traffic Light 2 - N-S) - Start with N-S red
-tl3_state = "RED"  # S3 (Traffic Light 3 - N-S) - Start with N-S red
-tl1_green_start = current_time_init
-tl4_green_start = current_time_init
-tl2_green_start = 0
-tl3_green_start = 0
-current_tl1_duration = BASE_GREEN_TIME  # Initial green duration for E-W
-current_tl4_duration = BASE_GREEN_TIME  # Initial green duration for E-W
-current_tl2_duration = BASE_GREEN_TIME
-current_tl3_duration = BASE_GREEN_TIME
-current_cycle_direction = "EW"  # Start with E-W (S1/S4) green
-last_ns_count = 0
-last_we_count = 0
-first_cycle_complete = False  # Track if initial cycle has completed
+# Demand forecaster that sizes each green when it starts (enable with TRAFFIC_FORECAST=1)
+forecaster = forecaster_from_env(history)
+
+# Green wave with the neighbouring controllers (enable with TRAFFIC_WAVE_NODE=<id>)
+wave = wave_from_env()
+
+# Traffic light state tracking (E-W S1/S4 starts green)
+cycle = CycleController(send_paired_command_to_esp32, log=None, event_log=event_log,
+                        green_time=config.timing.policy(),
+                        plan_green_time=forecaster.plan if forecaster else None, coordinator=wave)
+if forecaster:
+    forecaster.green_time = cycle.green_time
+
+# Emergency preemption: UDP triggers on TRAFFIC_PREEMPT_ADDR bypass the frame loop
+preemption, preempt_listener = preemption_from_env(cycle, event_log, zones)
+lamps.cycle, lamps.preemption = cycle, preemption
+resources.apply_control(reply_reader, preempt_listener, wave)
+print(f"✓ Resources: {resources.describe()}")
+
+# Config changes are prepared in the background and swapped into this module's globals
+# (zones, detector, cap, ser, ...) between frames
+config_watcher.event_log = event_log
+config_watcher.camera_pool = frame_pool
+config_watcher.start()
+this_module = sys.modules[__name__]
+
+# Every long-lived thread has started; set this thread's stage last so none of them inherit it
+resources.apply("inference")  # this thread runs the frame loop
 
 while True:
+    config_watcher.apply_pending(this_module)
+    trace = tracer.start_frame()
+    stages = profiler.start_frame()
     ret, frame = cap.read()
     if not ret:
         break
+    trace.mark("capture")
+    stages.mark("capture")
+    metrics.frames_captured.inc()
 
     # Get frame dimensions
     height, width = frame.shape[:2]
-    vertical_line_x = width // 2
-    horizontal_line_y = height // 2
-    
-    # Define thresholds for all directions
-    north_threshold_y = height // 2 - 100
-    south_threshold_y = height // 2 + 100
-    west_threshold_x = width // 2 - 120
-    east_threshold_x = width // 2 + 120
 
     # Perform detection with adjusted parameters (lower resolution for speed)
-    results = model(frame, conf=0.55, iou=0.3, imgsz=416)  # Consistent size for speed
-
-    # Reset counters for real-time counts per frame
-    from_west = 0
-    from_north = 0
-    from_east = 0
-    from_south = 0
-
-    # Process detections for directions
-    for i in range(len(results[0].boxes)):
-        bbox = results[0].boxes.xyxy[i]
-        center_x = (bbox[0] + bbox[2]) / 2
-        center_y = (bbox[1] + bbox[3]) / 2
-        
-        # Determine direction based on position with all four thresholds
-        if center_x < vertical_line_x and center_y < horizontal_line_y:
-            # Top-left quadrant: West or North
-            if center_y < north_threshold_y:
-                direction = "North"
-                from_north += 1
-            elif center_x < west_threshold_x:
-                direction = "West"
-                from_west += 1
-            else:
-                direction = "North"
-                from_north += 1
-        elif center_x > vertical_line_x and center_y < horizontal_line_y:
-            # Top-right quadrant: East or North
-            if center_y < north_threshold_y:
-                direction = "North"
-                from_north += 1
-            elif center_x > east_threshold_x:
-                direction = "East"
-                from_east += 1
-            else:
-                direction = "North"
-                from_north += 1
-        elif center_x < vertical_line_x and center_y > horizontal_line_y:
-            # Bottom-left quadrant: West or South
-            if center_y > south_threshold_y:
-                direction = "South"
-                from_south += 1
-            elif center_x < west_threshold_x:
-                direction = "West"
-                from_west += 1
-            else:
-                direction = "South"
-                from_south += 1
-        else:
-            # Bottom-right quadrant: East or South
-            if center_y > south_threshold_y:
-                direction = "South"
-                from_south += 1
-            elif center_x > east_threshold_x:
-                direction = "East"
-                from_east += 1
-            else:
-                direction = "South"
-                from_south += 1
-        
-        # Annotate direction on the frame
-        cv2.putText(frame, direction, (int(bbox[0]), int(bbox[1]) - 10), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (255, 0, 0), 2)
-
-    # Plot YOLO results on frame
-    annotated_frame = results[0].plot()
+    inference_start = time.perf_counter()
+    detections = detector.infer(frame)  # (N, 6): x1, y1, x2, y2, confidence, class
+    metrics.inference_seconds.observe(time.perf_counter() - inference_start)
+    metrics.frames_inferred.inc()
+    trace.mark("inference")
+    stages.mark("inference")
+
+    # Classify every detection into a direction in one pass
+    boxes = detections[:, :4]
+    center_x, center_y = box_centers(boxes)
+    directions = classify_directions(center_x, center_y, width, height, zones)
+    from_north, from_south, from_east, from_west = (int(c) for c in count_directions(directions))
+    trace.mark("zones")
+    preemption.observe_detections(detections, width, height)
+    stages.mark("zones")
+
+    # Plot YOLO results on a copy (frame stays raw for the incident recorder)
+    annotated_frame = draw_boxes(frame, detections, out=annotated_pool.acquire(frame.shape))
+
+    # Annotate direction on the copy
+    for bbox, direction in zip(boxes, directions):
+        cv2.putText(annotated_frame, DIRECTIONS[direction], (int(bbox[0]), int(bbox[1]) - 10), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (255, 0, 0), 2)
     
     # Threshold lines are defined but not drawn (invisible)
     # They are only used for detection logic, not for visualization
@@ -285,141 +272,104 @@ while True:
     cv2.putText(annotated_frame, f"North: {from_north}", (10, 60), cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 255, 0), 2)
     cv2.putText(annotated_frame, f"East: {from_east}", (10, 90), cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 255, 0), 2)
     cv2.putText(annotated_frame, f"South: {from_south}", (10, 120), cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 255, 0), 2)
+    stages.mark("annotate")
     
     # Calculate remaining time for each traffic light
     current_time = time.time()
     
-    # Update car counts for this frame
-    ns_count = from_north + from_south
-    we_count = from_west + from_east
-    
     # AUTO-CYCLE: Check if current green light has expired and switch if needed
-    if current_cycle_direction == "EW":
-        elapsed = current_time - tl1_green_start
-        # Only allow duration increases during a green cycle (never shorten remaining time)
-        new_duration = calculate_green_time(from_north, from_south, from_east, from_west, "EW")
-        if new_duration > current_tl1_duration:
-            current_tl1_duration = new_duration
-            current_tl4_duration = new_duration
-            print(f"Duration extended to {new_duration}s")
-        
-        # Only switch if elapsed time has TRULY exceeded the duration
-        if elapsed >= current_tl1_duration and tl1_state == "GREEN":
-            # E-W green has expired, switch to N-S green
-            green_duration = calculate_green_time(from_north, from_south, from_east, from_west, "NS")
-            
-            print(f"✓ SWITCHING: E-W was green for {elapsed:.1f}s (required: {current_tl1_duration}s)")
-            
-            tl2_state = "GREEN"
-            tl3_state = "GREEN"
-            tl2_green_start = current_time
-            tl3_green_start = current_time
-            current_tl2_duration = green_duration
-            current_tl3_duration = green_duration
-            current_cycle_direction = "NS"
-            first_cycle_complete = True
-            
-            send_paired_command_to_esp32("S2", "S3", "GREEN")
-            tl1_state = "RED"
-            tl4_state = "RED"
-            send_paired_command_to_esp32("S1", "S4", "RED")
-            print(f"✓ AUTO-CYCLE: E-W → N-S GREEN (Duration: {green_duration}s)")
-    else:
-        elapsed = current_time - tl2_green_start
-        # Only allow duration increases during a green cycle (never shorten remaining time)
-        new_duration = calculate_green_time(from_north, from_south, from_east, from_west, "NS")
-        if new_duration > current_tl2_duration:
-            current_tl2_duration = new_duration
-            current_tl3_duration = new_duration
-            print(f"Duration extended to {new_duration}s")
-        
-        # Only switch if elapsed time has TRULY exceeded the duration
-        if elapsed >= current_tl2_duration and tl2_state == "GREEN":
-            # N-S green has expired, switch to E-W green
-            green_duration = calculate_green_time(from_north, from_south, from_east, from_west, "EW")
-            
-            print(f"✓ SWITCHING: N-S was green for {elapsed:.1f}s (required: {current_tl2_duration}s)")
-            
-            tl1_state = "GREEN"
-            tl4_state = "GREEN"
-            tl1_green_start = current_time
-            tl4_green_start = current_time
-            current_tl1_duration = green_duration
-            current_tl4_duration = green_duration
-            current_cycle_direction = "EW"
-            first_cycle_complete = True
-            
-            send_paired_command_to_esp32("S1", "S4", "GREEN")
-            tl2_state = "RED"
-            tl3_state = "RED"
-            send_paired_command_to_esp32("S2", "S3", "RED")
-            print(f"✓ AUTO-CYCLE: N-S → E-W GREEN (Duration: {green_duration}s)")
+    if forecaster:
+        forecaster.observe(current_time, (from_north, from_south, from_east, from_west),
+                           cycle.current_cycle_direction)
+    # Commands of one update (e.g. both pairs of a phase switch) go out in one write, and under
+    # the preemption lock so a preempt can't send between the decision and the write
+    with preemption.batch(ser):
+        preemption.update(from_north, from_south, from_east, from_west, current_time)
+    trace.mark("decision")
+    stages.mark("decision")
+    metrics.observe_frame(from_north, from_south, from_east, from_west, cycle, current_time)
+    history.add(current_time, from_north, from_south, from_east, from_west, cycle.current_cycle_direction)
     
     # SAFETY CHECK: Ensure at least one direction is always green (only check once per second to avoid interference)
-    if frame_count % 30 == 0 and tl1_state == "RED" and tl2_state == "RED":
-        print("⚠ SAFETY: All lights were red, forcing E-W green")
-        tl1_state = "GREEN"
-        tl4_state = "GREEN"
-        tl2_state = "RED"
-        tl3_state = "RED"
-        tl1_green_start = current_time
-        tl4_green_start = current_time
-        current_tl1_duration = calculate_green_time(from_north, from_south, from_east, from_west, "EW")
-        current_tl4_duration = current_tl1_duration
-        current_cycle_direction = "EW"
-        send_paired_command_to_esp32("S1", "S4", "GREEN")
-        send_paired_command_to_esp32("S2", "S3", "RED")
+    if frame_count % 30 == 0:
+        with preemption.batch(ser):
+            preemption.safety_check(from_north, from_south, from_east, from_west, current_time)
+        resync_lamps()
+    
+    if recorder:
+        recorder.record(frame, detections, (from_north, from_south, from_east, from_west), cycle, current_time)
+    stages.mark("bookkeeping")
     
     # Traffic Light 1 (S1) - N-S
-    if tl1_state == "GREEN":
-        elapsed = current_time - tl1_green_start
-        remaining = max(0, current_tl1_duration - elapsed)
-    else:
-        remaining = 0
-    tl1_color = (0, 255, 0) if tl1_state == "GREEN" else (0, 0, 255)  # Green or Red
-    cv2.putText(annotated_frame, f"TL1: {tl1_state}", (width - 220, 30), cv2.FONT_HERSHEY_SIMPLEX, 0.7, tl1_color, 2)
+    remaining = cycle.remaining(1, current_time)
+    tl1_color = (0, 255, 0) if cycle.tl1_state == "GREEN" else (0, 0, 255)  # Green or Red
+    cv2.putText(annotated_frame, f"TL1: {cycle.tl1_state}", (width - 220, 30), cv2.FONT_HERSHEY_SIMPLEX, 0.7, tl1_color, 2)
     cv2.putText(annotated_frame, f"{remaining:.1f}s", (width - 220, 60), cv2.FONT_HERSHEY_SIMPLEX, 0.7, tl1_color, 2)
     
     # Traffic Light 4 (S4) - N-S
-    if tl4_state == "GREEN":
-        elapsed = current_time - tl4_green_start
-        remaining = max(0, current_tl4_duration - elapsed)
-    else:
-        remaining = 0
-    tl4_color = (0, 255, 0) if tl4_state == "GREEN" else (0, 0, 255)  # Green or Red
-    cv2.putText(annotated_frame, f"TL4: {tl4_state}", (width - 220, 90), cv2.FONT_HERSHEY_SIMPLEX, 0.7, tl4_color, 2)
+    remaining = cycle.remaining(4, current_time)
+    tl4_color = (0, 255, 0) if cycle.tl4_state == "GREEN" else (0, 0, 255)  # Green or Red
+    cv2.putText(annotated_frame, f"TL4: {cycle.tl4_state}", (width - 220, 90), cv2.FONT_HERSHEY_SIMPLEX, 0.7, tl4_color, 2)
     cv2.putText(annotated_frame, f"{remaining:.1f}s", (width - 220, 120), cv2.FONT_HERSHEY_SIMPLEX, 0.7, tl4_color, 2)
     
     # Traffic Light 2 (S2) - W-E
-    if tl2_state == "GREEN":
-        elapsed = current_time - tl2_green_start
-        remaining = max(0, current_tl2_duration - elapsed)
-    else:
-        remaining = 0
-    tl2_color = (0, 255, 0) if tl2_state == "GREEN" else (0, 0, 255)  # Green or Red
-    cv2.putText(annotated_frame, f"TL2: {tl2_state}", (width - 220, 150), cv2.FONT_HERSHEY_SIMPLEX, 0.7, tl2_color, 2)
+    remaining = cycle.remaining(2, current_time)
+    tl2_color = (0, 255, 0) if cycle.tl2_state == "GREEN" else (0, 0, 255)  # Green or Red
+    cv2.putText(annotated_frame, f"TL2: {cycle.tl2_state}", (width - 220, 150), cv2.FONT_HERSHEY_SIMPLEX, 0.7, tl2_color, 2)
     cv2.putText(annotated_frame, f"{remaining:.1f}s", (width - 220, 180), cv2.FONT_HERSHEY_SIMPLEX, 0.7, tl2_color, 2)
     
     # Traffic Light 3 (S3) - W-E
-    if tl3_state == "GREEN":
-        elapsed = current_time - tl3_green_start
-        remaining = max(0, current_tl3_duration - elapsed)
-    else:
-        remaining = 0
-    tl3_color = (0, 255, 0) if tl3_state == "GREEN" else (0, 0, 255)  # Green or Red
-    cv2.putText(annotated_frame, f"TL3: {tl3_state}", (width - 220, 210), cv2.FONT_HERSHEY_SIMPLEX, 0.7, tl3_color, 2)
+    remaining = cycle.remaining(3, current_time)
+    tl3_color = (0, 255, 0) if cycle.tl3_state == "GREEN" else (0, 0, 255)  # Green or Red
+    cv2.putText(annotated_frame, f"TL3: {cycle.tl3_state}", (width - 220, 210), cv2.FONT_HERSHEY_SIMPLEX, 0.7, tl3_color, 2)
     cv2.putText(annotated_frame, f"{remaining:.1f}s", (width - 220, 240), cv2.FONT_HERSHEY_SIMPLEX, 0.7, tl3_color, 2)
 
     # Display the frame
     cv2.imshow('Traffic Light System', annotated_frame)
+    if dashboard:
+        dashboard.publish_frame(annotated_frame)
+        dashboard.publish_stats(frame_stats(from_north, from_south, from_east, from_west, cycle, current_time))
+
+    tracer.finish_frame(trace)
 
     # Update frame counter
     frame_count += 1
 
-    # Exit on 'q' key
-    if cv2.waitKey(1) & 0xFF == ord('q'):
+    # Print latency percentiles every ~10 seconds when tracing
+    if tracer.enabled and frame_count % 300 == 0:
+        print(tracer.format_summary())
+
+    # Exit on 'q' key, save an incident recording on 'i', profile on 'p'
+    key = cv2.waitKey(1) & 0xFF
+    stages.mark("display")  # imshow is only drawn inside waitKey
+    profiler.finish_frame(stages)
+    if key == ord('q'):
         break
+    if key == ord('i') and recorder:
+        recorder.trigger("manual")
+    if key == ord('p'):
+        profiler.start()
 
 # Release resources
+if tracer.enabled:
+    print(tracer.format_summary())
+print(f"Capture: {cap.summary()}")
+if isinstance(detector, AdaptiveDetector):
+    print(detector.format_summary())
+config_watcher.close()
+reply_reader.stop()
+profiler.close()
+if preempt_listener:
+    preempt_listener.close()
+if wave:
+    wave.bus.close()
+if dashboard:
+    dashboard.close()
+if recorder:
+    recorder.close()
+history.close()
+if inference_client:
+    inference_client.close()
 cap.release()
 cv2.destroyAllWindows()
+event_log.close()  # last: everything above may still log
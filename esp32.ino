@@ -18,15 +18,34 @@
 // --- 3. Serial Configuration ---
 const int BAUD_RATE = 115200;
 
-// --- 4. Function to Control All Pins Off ---
+// --- 4. Lamp Pins ---
+const int GREEN_PINS[4] = {S1_GREEN, S2_GREEN, S3_GREEN, S4_GREEN};
+const int RED_PINS[4]   = {S1_RED, S2_RED, S3_RED, S4_RED};
+
+// Lamp state as reported in framed replies: green bits 0-3, red bits 4-7 (bit 0 = S1)
+uint8_t lampState = 0;
+
+void writeLamp(int pin, int level) {
+  digitalWrite(pin, level);
+  for (int i = 0; i < 4; i++) {
+    uint8_t bit = (pin == GREEN_PINS[i]) ? (1 << i) : (pin == RED_PINS[i]) ? (1 << (i + 4)) : 0;
+    if (bit) lampState = level ? (lampState | bit) : (lampState & ~bit);
+  }
+}
+
+// --- 4b. Function to Control All Pins Off ---
 void allLightsOff() {
-  digitalWrite(S1_GREEN, LOW); digitalWrite(S1_RED, LOW);
-  digitalWrite(S2_GREEN, LOW); digitalWrite(S2_RED, LOW);
-  digitalWrite(S3_GREEN, LOW); digitalWrite(S3_RED, LOW);
-  digitalWrite(S4_GREEN, LOW); digitalWrite(S4_RED, LOW);
+  writeLamp(S1_GREEN, LOW); writeLamp(S1_RED, LOW);
+  writeLamp(S2_GREEN, LOW); writeLamp(S2_RED, LOW);
+  writeLamp(S3_GREEN, LOW); writeLamp(S3_RED, LOW);
+  writeLamp(S4_GREEN, LOW); writeLamp(S4_RED, LOW);
 }
 
 // --- 5. Serial Command Handler ---
+bool isLane(const String &lane) {
+  return lane == "S1" || lane == "S2" || lane == "S3" || lane == "S4";
+}
+
 void handleSerialCommand(String command) {
   // Format: "S1:GREEN" or "S1:S4:GREEN" for paired commands
   // Parse the command
@@ -58,32 +77,38 @@ void handleSerialCommand(String command) {
     lane1.trim();
     lane2.trim();
     
+    // A corrupted lane name would otherwise switch S4 (the last case of the pin lookups below)
+    if (!isLane(lane1) || !isLane(lane2)) {
+      Serial.println("ERROR: Unknown lane");
+      return;
+    }
+    
     if (color == "GREEN") {
       // Set GREEN pins HIGH for the lanes
       int pin1 = (lane1 == "S1") ? S1_GREEN : (lane1 == "S2") ? S2_GREEN : (lane1 == "S3") ? S3_GREEN : S4_GREEN;
       int pin2 = (lane2 == "S1") ? S1_GREEN : (lane2 == "S2") ? S2_GREEN : (lane2 == "S3") ? S3_GREEN : S4_GREEN;
-      digitalWrite(pin1, HIGH);
-      digitalWrite(pin2, HIGH);
+      writeLamp(pin1, HIGH);
+      writeLamp(pin2, HIGH);
       
       // Turn off RED pins for these lanes
-      if (lane1 == "S1" || lane2 == "S1") digitalWrite(S1_RED, LOW);
-      if (lane1 == "S2" || lane2 == "S2") digitalWrite(S2_RED, LOW);
-      if (lane1 == "S3" || lane2 == "S3") digitalWrite(S3_RED, LOW);
-      if (lane1 == "S4" || lane2 == "S4") digitalWrite(S4_RED, LOW);
+      if (lane1 == "S1" || lane2 == "S1") writeLamp(S1_RED, LOW);
+      if (lane1 == "S2" || lane2 == "S2") writeLamp(S2_RED, LOW);
+      if (lane1 == "S3" || lane2 == "S3") writeLamp(S3_RED, LOW);
+      if (lane1 == "S4" || lane2 == "S4") writeLamp(S4_RED, LOW);
       
       // For opposite direction pair, turn on their RED and off GREEN
       if ((lane1 == "S1" && lane2 == "S4") || (lane1 == "S4" && lane2 == "S1")) {
         // S1/S4 are GREEN, so S2/S3 must be RED
-        digitalWrite(S2_GREEN, LOW);
-        digitalWrite(S3_GREEN, LOW);
-        digitalWrite(S2_RED, HIGH);
-        digitalWrite(S3_RED, HIGH);
+        writeLamp(S2_GREEN, LOW);
+        writeLamp(S3_GREEN, LOW);
+        writeLamp(S2_RED, HIGH);
+        writeLamp(S3_RED, HIGH);
       } else if ((lane1 == "S2" && lane2 == "S3") || (lane1 == "S3" && lane2 == "S2")) {
         // S2/S3 are GREEN, so S1/S4 must be RED
-        digitalWrite(S1_GREEN, LOW);
-        digitalWrite(S4_GREEN, LOW);
-        digitalWrite(S1_RED, HIGH);
-        digitalWrite(S4_RED, HIGH);
+        writeLamp(S1_GREEN, LOW);
+        writeLamp(S4_GREEN, LOW);
+        writeLamp(S1_RED, HIGH);
+        writeLamp(S4_RED, HIGH);
       }
       
       Serial.printf("OK: %s & %s GREEN\n", lane1.c_str(), lane2.c_str());
@@ -91,14 +116,14 @@ void handleSerialCommand(String command) {
       // Set RED pins HIGH for the lanes
       int pin1 = (lane1 == "S1") ? S1_RED : (lane1 == "S2") ? S2_RED : (lane1 == "S3") ? S3_RED : S4_RED;
       int pin2 = (lane2 == "S1") ? S1_RED : (lane2 == "S2") ? S2_RED : (lane2 == "S3") ? S3_RED : S4_RED;
-      digitalWrite(pin1, HIGH);
-      digitalWrite(pin2, HIGH);
+      writeLamp(pin1, HIGH);
+      writeLamp(pin2, HIGH);
       
       // Turn off GREEN pins for these lanes
-      if (lane1 == "S1" || lane2 == "S1") digitalWrite(S1_GREEN, LOW);
-      if (lane1 == "S2" || lane2 == "S2") digitalWrite(S2_GREEN, LOW);
-      if (lane1 == "S3" || lane2 == "S3") digitalWrite(S3_GREEN, LOW);
-      if (lane1 == "S4" || lane2 == "S4") digitalWrite(S4_GREEN, LOW);
+      if (lane1 == "S1" || lane2 == "S1") writeLamp(S1_GREEN, LOW);
+      if (lane1 == "S2" || lane2 == "S2") writeLamp(S2_GREEN, LOW);
+      if (lane1 == "S3" || lane2 == "S3") writeLamp(S3_GREEN, LOW);
+      if (lane1 == "S4" || lane2 == "S4") writeLamp(S4_GREEN, LOW);
       
       Serial.printf("OK: %s & %s RED\n", lane1.c_str(), lane2.c_str());
     }
@@ -110,32 +135,32 @@ void handleSerialCommand(String command) {
     
     if (color == "GREEN") {
       if (lane == "S1") {
-        digitalWrite(S1_GREEN, HIGH);
-        digitalWrite(S1_RED, LOW);
+        writeLamp(S1_GREEN, HIGH);
+        writeLamp(S1_RED, LOW);
       } else if (lane == "S2") {
-        digitalWrite(S2_GREEN, HIGH);
-        digitalWrite(S2_RED, LOW);
+        writeLamp(S2_GREEN, HIGH);
+        writeLamp(S2_RED, LOW);
       } else if (lane == "S3") {
-        digitalWrite(S3_GREEN, HIGH);
-        digitalWrite(S3_RED, LOW);
+        writeLamp(S3_GREEN, HIGH);
+        writeLamp(S3_RED, LOW);
       } else if (lane == "S4") {
-        digitalWrite(S4_GREEN, HIGH);
-        digitalWrite(S4_RED, LOW);
+        writeLamp(S4_GREEN, HIGH);
+        writeLamp(S4_RED, LOW);
       }
       Serial.printf("OK: %s GREEN\n", lane.c_str());
     } else if (color == "RED") {
       if (lane == "S1") {
-        digitalWrite(S1_RED, HIGH);
-        digitalWrite(S1_GREEN, LOW);
+        writeLamp(S1_RED, HIGH);
+        writeLamp(S1_GREEN, LOW);
       } else if (lane == "S2") {
-        digitalWrite(S2_RED, HIGH);
-        digitalWrite(S2_GREEN, LOW);
+        writeLamp(S2_RED, HIGH);
+        writeLamp(S2_GREEN, LOW);
       } else if (lane == "S3") {
-        digitalWrite(S3_RED, HIGH);
-        digitalWrite(S3_GREEN, LOW);
+        writeLamp(S3_RED, HIGH);
+        writeLamp(S3_GREEN, LOW);
       } else if (lane == "S4") {
-        digitalWrite(S4_RED, HIGH);
-        digitalWrite(S4_GREEN, LOW);
+        writeLamp(S4_RED, HIGH);
+        writeLamp(S4_GREEN, LOW);
       }
       Serial.printf("OK: %s RED\n", lane.c_str());
     }
@@ -143,6 +168,96 @@ void handleSerialCommand(String command) {
 }
   
 
+// --- 5b. Framed Binary Protocol ---
+// Command: 0xA5 | version | seq (2) | count | count x (heads, green) | CRC-16 (2)
+// Reply:   0xA5 | version | seq (2) | status | lampState | CRC-16 (2)
+// Multi-byte fields are little endian; the CRC (CRC-16/CCITT-FALSE) covers
+// everything between 0xA5 and the CRC. heads/green are bitmasks (bit 0 = S1):
+// every head in heads goes GREEN if its green bit is set, RED otherwise.
+// Text never contains 0xA5, so both protocols share the port; the Python
+// side switches to frames after "PROTO?" is answered.
+const uint8_t FRAME_SOF = 0xA5;
+const uint8_t PROTOCOL_VERSION = 1;
+const uint8_t MAX_BATCH = 8;
+const unsigned long FRAME_TIMEOUT_MS = 50;  // drop a partial frame (lost bytes)
+enum { STATUS_OK = 0, STATUS_BAD_CRC = 1, STATUS_BAD_VERSION = 2, STATUS_BAD_LENGTH = 3 };
+
+uint8_t frameBuffer[7 + 2 * MAX_BATCH];
+size_t frameLength = 0;
+unsigned long frameStarted = 0;
+char lineBuffer[64];
+size_t lineLength = 0;
+
+uint16_t crc16(const uint8_t *data, size_t length) {
+  uint16_t crc = 0xFFFF;
+  for (size_t i = 0; i < length; i++) {
+    crc ^= (uint16_t)data[i] << 8;
+    for (int bit = 0; bit < 8; bit++) {
+      crc = (crc & 0x8000) ? (crc << 1) ^ 0x1021 : crc << 1;
+    }
+  }
+  return crc;
+}
+
+void sendReply(uint8_t status) {
+  uint8_t reply[8] = {FRAME_SOF, PROTOCOL_VERSION, frameBuffer[2], frameBuffer[3], status, lampState, 0, 0};
+  uint16_t crc = crc16(reply + 1, 5);
+  reply[6] = crc & 0xFF;
+  reply[7] = crc >> 8;
+  Serial.write(reply, sizeof(reply));
+}
+
+void applyHeads(uint8_t heads, uint8_t green) {
+  for (int i = 0; i < 4; i++) {
+    if (heads & (1 << i)) {
+      bool on = green & (1 << i);
+      writeLamp(GREEN_PINS[i], on ? HIGH : LOW);
+      writeLamp(RED_PINS[i], on ? LOW : HIGH);
+    }
+  }
+}
+
+void handleFrame() {
+  uint16_t crc = frameBuffer[frameLength - 2] | (frameBuffer[frameLength - 1] << 8);
+  if (crc16(frameBuffer + 1, frameLength - 3) != crc) {
+    sendReply(STATUS_BAD_CRC);
+    return;
+  }
+  if (frameBuffer[1] != PROTOCOL_VERSION) {
+    sendReply(STATUS_BAD_VERSION);
+    return;
+  }
+  // All records of a batch are applied before the reply
+  for (uint8_t i = 0; i < frameBuffer[4]; i++) {
+    applyHeads(frameBuffer[5 + 2 * i], frameBuffer[6 + 2 * i]);
+  }
+  sendReply(STATUS_OK);
+}
+
+void readFrameByte(uint8_t b) {
+  frameBuffer[frameLength++] = b;
+  if (frameLength == 5 && (frameBuffer[4] == 0 || frameBuffer[4] > MAX_BATCH)) {
+    sendReply(STATUS_BAD_LENGTH);
+    frameLength = 0;
+  } else if (frameLength >= 5 && frameLength == 7 + 2 * (size_t)frameBuffer[4]) {
+    handleFrame();
+    frameLength = 0;
+  }
+}
+
+void handleLine() {
+  lineBuffer[lineLength] = '\0';
+  lineLength = 0;
+  String command(lineBuffer);
+  command.trim(); // Remove any whitespace
+  if (command == "PROTO?") {
+    Serial.printf("PROTO:%d BATCH:%d\n", PROTOCOL_VERSION, MAX_BATCH);
+  } else if (command.length() > 0) {
+    Serial.printf("< Received: %s\n", command.c_str());
+    handleSerialCommand(command);
+  }
+}
+
 // --- 6. Setup Function ---
 void setup() {
   // Initialize serial communication at 115200 baud
@@ -152,6 +267,7 @@ void setup() {
   Serial.println("\n\n=== ESP32 Traffic Light Controller (Serial Mode) ===");
   Serial.println("Waiting for commands via serial at 115200 baud");
   Serial.println("Command format: \"S1:GREEN\" or \"S1:S4:GREEN\"");
+  Serial.println("Framed protocol: send \"PROTO?\" to negotiate");
 
   // Initialize all defined pins as OUTPUT
   pinMode(S1_GREEN, OUTPUT); pinMode(S1_RED, OUTPUT);
@@ -166,17 +282,27 @@ void setup() {
 
 // --- 7. Loop Function ---
 void loop() {
-  // Read incoming serial data
-  if (Serial.available() > 0) {
-    String command = Serial.readStringUntil('\n');
-    command.trim(); // Remove any whitespace
-    
-    if (command.length() > 0) {
-      Serial.printf("< Received: %s\n", command.c_str());
-      handleSerialCommand(command);
+  if (frameLength > 0 && millis() - frameStarted > FRAME_TIMEOUT_MS) {
+    frameLength = 0;
+  }
+  // Read everything that has arrived: frames byte by byte, text up to each newline
+  while (Serial.available() > 0) {
+    uint8_t b = Serial.read();
+    if (frameLength > 0) {
+      readFrameByte(b);
+    } else if (b == FRAME_SOF) {
+      // Text never contains 0xA5, so a pending partial line is the tail of a
+      // frame that lost its start byte: drop it rather than swallow this frame too
+      lineLength = 0;
+      frameStarted = millis();
+      readFrameByte(b);
+    } else if (b == '\n') {
+      handleLine();
+    } else if (lineLength < sizeof(lineBuffer) - 1) {
+      lineBuffer[lineLength++] = b;
     }
   }
   
   // Python script handles all timing logic - no auto-timeout needed
   delay(10); // Small delay to prevent CPU thrashing
-}
\ No newline at end of file
+}
@@ -0,0 +1,632 @@
+"""
+esp32.ino on a pseudo-terminal, for exercising the serial path without the board.
+
+Esp32Emulator opens a pty and runs the firmware's loop() against it in a
+thread: the framed protocol and the text commands of handleSerialCommand,
+with the same replies, the same lamp pin updates and the delay(10) at the
+end of every loop. The serial line is modelled too. Bytes take 10 bits
+each at the configured baud rate in both directions, and bytes arriving
+while the 256-byte RX buffer is full are lost, like on the UART.
+
+firmware="text" emulates the firmware before the framed protocol: one
+readStringUntil('\\n') per loop and no PROTO? negotiation.
+
+Faults can be injected:
+
+    drop_rate     probability that an incoming byte is lost on the line
+    latency       extra handling time per command (+ uniform jitter); it
+                  stalls the loop like a slow handler would
+    disconnect()  the USB cable is pulled: the pty goes away for `down`
+                  seconds, then comes back at the same path and the board
+                  boots again with all lamps off
+    reboot()      the board resets (brown-out, watchdog) while the port stays open
+
+After every command the lamp pins are checked. Any moment with an S1/S4 head
+and an S2/S3 head green together is recorded in `conflicts`.
+
+    emulator = Esp32Emulator(drop_rate=0.001)
+    path = emulator.start()          # stable symlink to the pty, open it with pyserial
+    ...
+    emulator.green_heads()           # {"S1", "S4"}
+    emulator.conflicts               # [(time, green heads, command), ...]
+    emulator.stop()
+
+Run it standalone to point a controller at it, find the highest command
+rate the firmware keeps up with, or check the controller side (cycle and
+preemption commands, dropped bytes, a pulled cable, a reboot) for
+conflicting greens and lamps that disagree with the controller:
+
+    python esp32_emulator.py serve --disconnect-every 60
+    python esp32_emulator.py rate
+    python esp32_emulator.py check
+"""
+import argparse
+import os
+import random
+import select
+import shutil
+import struct
+import sys
+import tempfile
+import threading
+import time
+import tty
+from collections import deque
+
+import numpy as np
+
+from serial_protocol import HEADS, MAX_BATCH, SOF, VERSION, FramedPort, crc16, encode_reply
+
+PINS = [f"{head}_{color}" for head in HEADS for color in ("GREEN", "RED")]
+STATUS_OK, STATUS_BAD_CRC, STATUS_BAD_VERSION, STATUS_BAD_LENGTH = range(4)
+FRAME_TIMEOUT = 0.050  # FRAME_TIMEOUT_MS
+STREAM_TIMEOUT = 1.0   # Stream::setTimeout default, used by readStringUntil
+BANNER = ("\n\n=== ESP32 Traffic Light Controller (Serial Mode) ===\n"
+          "Waiting for commands via serial at 115200 baud\n"
+          "Command format: \"S1:GREEN\" or \"S1:S4:GREEN\"\n"
+          "Framed protocol: send \"PROTO?\" to negotiate\n"
+          "All pins initialized and set to OFF\n")
+
+
+class Esp32Emulator:
+    """
+    firmware: "framed" (current esp32.ino) or "text" (before the framed protocol)
+    baud_rate: serial line speed used for byte timing; None for an instant line
+    loop_delay: the delay() at the end of loop()
+    rx_buffer: UART receive buffer size; bytes arriving while it is full are dropped
+    drop_rate/latency/jitter/seed: injected faults, see the module docstring
+    """
+
+    def __init__(self, firmware="framed", baud_rate=115200, loop_delay=0.010, rx_buffer=256,
+                 drop_rate=0.0, latency=0.0, jitter=0.0, seed=None):
+        self.firmware = firmware
+        self.byte_time = 10 / baud_rate if baud_rate else 0.0
+        self.loop_delay = loop_delay
+        self.rx_buffer = rx_buffer
+        self.drop_rate = drop_rate
+        self.latency = latency
+        self.jitter = jitter
+        self.rng = random.Random(seed)
+        self.pins = dict.fromkeys(PINS, 0)
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.overflowed = 0
+        self.dropped = 0
+        self.commands = 0
+        self.boots = 0
+        self.conflicts = []
+        self.master = self.slave = None
+        self._rx = bytearray()       # bytes in the UART buffer, visible to loop()
+        self._wire = deque()         # (arrival time, bytes) still on the line
+        self._wire_free = 0.0
+        self._tx = deque()           # (send-complete time, bytes)
+        self._tx_free = 0.0
+        self._lock = threading.Condition()
+        self._frame = bytearray()
+        self._frame_started = 0.0
+        self._line = bytearray()
+        self.running = False
+
+    # --- pty and serial line ---
+
+    def start(self):
+        """Open the pty, start the firmware and return the (stable) device path to connect to."""
+        self._dir = tempfile.mkdtemp(prefix="esp32-")
+        self.path = os.path.join(self._dir, "ttyESP32")
+        self.running = True
+        self._threads = [threading.Thread(target=target, daemon=True)
+                         for target in (self._receive, self._transmit, self._loop)]
+        self._connect()
+        for thread in self._threads:
+            thread.start()
+        return self.path
+
+    def stop(self):
+        self.running = False
+        with self._lock:
+            self._lock.notify_all()
+        for thread in self._threads:
+            thread.join(timeout=1)
+        self._close_pty()
+        shutil.rmtree(self._dir, ignore_errors=True)
+
+    def _connect(self):
+        master, slave = os.openpty()
+        tty.setraw(slave)
+        link = self.path + ".new"
+        os.symlink(os.ttyname(slave), link)
+        os.replace(link, self.path)
+        with self._lock:
+            self.master, self.slave = master, slave
+        self._boot()
+
+    def _close_pty(self):
+        with self._lock:
+            fds, self.master, self.slave = (self.master, self.slave), None, None
+        for fd in fds:
+            if fd is not None:
+                os.close(fd)
+
+    def _boot(self):
+        """setup(): all lamps off, empty buffers, banner."""
+        with self._lock:
+            self._rx.clear()
+            self._wire.clear()
+            self._tx.clear()
+            self._frame.clear()
+            self._line.clear()
+            self.pins = dict.fromkeys(PINS, 0)
+            self.boots += 1
+        banner = BANNER if self.firmware == "framed" else BANNER.replace(
+            "Framed protocol: send \"PROTO?\" to negotiate\n", "")
+        self.println(banner.rstrip("\n"))
+
+    def disconnect(self, down=2.0):
+        """Pull the cable for `down` seconds; the board boots again when it is back."""
+        self._close_pty()
+        if os.path.lexists(self.path):
+            os.unlink(self.path)
+        timer = threading.Timer(down, lambda: self.running and self._connect())
+        timer.daemon = True
+        timer.start()
+
+    def reboot(self):
+        """Reset the board without closing the port."""
+        self._boot()
+
+    def _receive(self):
+        """Bytes written by the controller, stamped with the time their last bit arrives."""
+        while self.running:
+            master = self.master
+            if master is None:
+                time.sleep(0.01)
+                continue
+            try:
+                ready, _, _ = select.select([master], [], [], 0.05)
+                data = os.read(master, 4096) if ready else b""
+            except (OSError, ValueError):
+                continue  # disconnected while waiting
+            if not data:
+                continue
+            if self.drop_rate:
+                kept = bytes(b for b in data if self.rng.random() >= self.drop_rate)
+                self.dropped += len(data) - len(kept)
+                data = kept
+            now = time.perf_counter()
+            with self._lock:
+                self._wire_free = max(now, self._wire_free) + len(data) * self.byte_time
+                self._wire.append((self._wire_free, data))
+            self.bytes_in += len(data)
+
+    def _transmit(self):
+        while self.running:
+            with self._lock:
+                while self.running and not self._tx:
+                    self._lock.wait(0.05)
+                if not self._tx:
+                    return
+                due, data = self._tx[0]
+            delay = due - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            with self._lock:
+                if not self._tx or self._tx[0][1] is not data:
+                    continue  # rebooted meanwhile
+                self._tx.popleft()
+                master = self.master
+            if master is None:
+                continue  # disconnected: output is lost
+            try:
+                os.write(master, data)
+            except OSError:
+                continue
+            self.bytes_out += len(data)
+
+    def write(self, data):
+        """Serial.write: queued behind earlier output at the line rate."""
+        with self._lock:
+            self._tx_free = max(time.perf_counter(), self._tx_free) + len(data) * self.byte_time
+            self._tx.append((self._tx_free, bytes(data)))
+            self._lock.notify_all()
+
+    def println(self, text):
+        self.write(f"{text}\n".encode())
+
+    def available(self):
+        """Serial.available: move arrived bytes into the UART buffer first."""
+        now = time.perf_counter()
+        with self._lock:
+            while self._wire and self._wire[0][0] <= now:
+                _, data = self._wire.popleft()
+                room = self.rx_buffer - len(self._rx)
+                self._rx += data[:room]
+                self.overflowed += max(0, len(data) - room)
+        return len(self._rx)
+
+    def read(self):
+        byte = self._rx[0]
+        del self._rx[0]
+        return byte
+
+    def read_string_until(self, terminator=b"\n"):
+        """Serial.readStringUntil: waits up to the stream timeout for the terminator."""
+        deadline = time.perf_counter() + STREAM_TIMEOUT
+        line = bytearray()
+        while self.running:
+            if self.available():
+                byte = self.read()
+                if byte == terminator[0]:
+                    break
+                line.append(byte)
+                deadline = time.perf_counter() + STREAM_TIMEOUT
+            elif time.perf_counter() >= deadline:
+                break
+            else:
+                time.sleep(0.0005)
+        return line.decode(errors="replace")
+
+    # --- firmware ---
+
+    def digital_write(self, pin, level):
+        self.pins[pin] = level
+
+    def lamps(self):
+        """Lamp byte as in the framed reply: green bits 0-3, red bits 4-7."""
+        value = 0
+        for i, head in enumerate(HEADS):
+            value |= self.pins[f"{head}_GREEN"] << i
+            value |= self.pins[f"{head}_RED"] << (i + 4)
+        return value
+
+    def green_heads(self):
+        return {head for head in HEADS if self.pins[f"{head}_GREEN"]}
+
+    def _loop(self):
+        while self.running:
+            if self.firmware == "text":
+                if self.available() > 0:
+                    command = self.read_string_until().strip()
+                    if command:
+                        self.println(f"< Received: {command}")
+                        self._dispatch(command)
+            else:
+                self._loop_framed()
+            time.sleep(self.loop_delay)
+
+    def _loop_framed(self):
+        if self._frame and time.perf_counter() - self._frame_started > FRAME_TIMEOUT:
+            self._frame.clear()  # partial frame: bytes were lost
+        while self.available() > 0:
+            byte = self.read()
+            if self._frame:
+                self._read_frame_byte(byte)
+            elif byte == SOF:
+                self._line.clear()  # tail of a frame that lost its SOF (text never contains 0xA5)
+                self._frame_started = time.perf_counter()
+                self._read_frame_byte(byte)
+            elif byte == ord("\n"):
+                command = self._line.decode(errors="replace").strip()
+                self._line.clear()
+                if command == "PROTO?":
+                    self.println(f"PROTO:{VERSION} BATCH:{MAX_BATCH}")
+                elif command:
+                    self.println(f"< Received: {command}")
+                    self._dispatch(command)
+            elif len(self._line) < 63:
+                self._line.append(byte)
+
+    def _read_frame_byte(self, byte):
+        frame = self._frame
+        frame.append(byte)
+        if len(frame) == 5 and not 0 < frame[4] <= MAX_BATCH:
+            self._send_reply(STATUS_BAD_LENGTH)
+            frame.clear()
+        elif len(frame) >= 5 and len(frame) == 7 + 2 * frame[4]:
+            self._handle_frame()
+            frame.clear()
+
+    def _send_reply(self, status):
+        seq = struct.unpack_from("<H", self._frame, 2)[0]
+        self.write(encode_reply(seq, status, self.lamps()))
+
+    def _handle_frame(self):
+        frame = self._frame
+        if crc16(bytes(frame[1:-2])) != struct.unpack_from("<H", frame, len(frame) - 2)[0]:
+            self._send_reply(STATUS_BAD_CRC)
+            return
+        if frame[1] != VERSION:
+            self._send_reply(STATUS_BAD_VERSION)
+            return
+        self._stall()
+        records = [(frame[5 + 2 * i], frame[6 + 2 * i]) for i in range(frame[4])]
+        for heads, green in records:
+            self.apply_heads(heads, green)
+        self.commands += 1
+        self._check(f"frame {struct.unpack_from('<H', frame, 2)[0]} {records}")
+        self._send_reply(STATUS_OK)
+
+    def _stall(self):
+        if self.latency or self.jitter:
+            time.sleep(self.latency + self.rng.uniform(0, self.jitter))
+
+    def _dispatch(self, command):
+        self._stall()
+        self.handle_serial_command(command)
+        self._check(command)
+
+    def _check(self, command):
+        green = self.green_heads()
+        if green & {"S1", "S4"} and green & {"S2", "S3"}:
+            self.conflicts.append((time.perf_counter(), sorted(green), command))
+
+    def apply_heads(self, heads, green):
+        for i, head in enumerate(HEADS):
+            if heads & (1 << i):
+                on = 1 if green & (1 << i) else 0
+                self.digital_write(f"{head}_GREEN", on)
+                self.digital_write(f"{head}_RED", 1 - on)
+
+    def handle_serial_command(self, command):
+        """
+        handleSerialCommand, including what it does with unexpected lane names
+        (the old firmware switches S4 for an unknown lane in a paired command).
+        """
+        self.commands += 1
+        colons = [i for i, char in enumerate(command) if char == ":"][:2]
+        if not colons:
+            self.println("ERROR: Invalid command format")
+            return
+        color = command[colons[-1] + 1:].strip()
+
+        def pin(lane, kind):
+            # Unknown lanes fall through the ternary chain to S4
+            return f"{lane if lane in ('S1', 'S2', 'S3') else 'S4'}_{kind}"
+
+        if len(colons) == 2:
+            lane1 = command[:colons[0]].strip()
+            lane2 = command[colons[0] + 1:colons[1]].strip()
+            lanes = {lane1, lane2}
+            if self.firmware != "text" and not lanes <= set(HEADS):
+                self.println("ERROR: Unknown lane")
+                return
+            if color == "GREEN":
+                self.digital_write(pin(lane1, "GREEN"), 1)
+                self.digital_write(pin(lane2, "GREEN"), 1)
+                for head in HEADS:
+                    if head in lanes:
+                        self.digital_write(f"{head}_RED", 0)
+                if lanes == {"S1", "S4"}:
+                    for head in ("S2", "S3"):
+                        self.digital_write(f"{head}_GREEN", 0)
+                        self.digital_write(f"{head}_RED", 1)
+                elif lanes == {"S2", "S3"}:
+                    for head in ("S1", "S4"):
+                        self.digital_write(f"{head}_GREEN", 0)
+                        self.digital_write(f"{head}_RED", 1)
+                self.println(f"OK: {lane1} & {lane2} GREEN")
+            elif color == "RED":
+                self.digital_write(pin(lane1, "RED"), 1)
+                self.digital_write(pin(lane2, "RED"), 1)
+                for head in HEADS:
+                    if head in lanes:
+                        self.digital_write(f"{head}_GREEN", 0)
+                self.println(f"OK: {lane1} & {lane2} RED")
+        else:
+            lane = command[:colons[0]].strip()
+            if color in ("GREEN", "RED"):
+                if lane in HEADS:
+                    other = "RED" if color == "GREEN" else "GREEN"
+                    self.digital_write(f"{lane}_{color}", 1)
+                    self.digital_write(f"{lane}_{other}", 0)
+                self.println(f"OK: {lane} {color}")
+
+
+# One phase switch after another, as the cycle sends them
+SWITCH_COMMANDS = [(("S2", "S3"), "GREEN"), (("S1", "S4"), "RED"),
+                   (("S1", "S4"), "GREEN"), (("S2", "S3"), "RED")]
+
+
+def command_rate(rate, seconds, firmware="framed", mode="auto", **faults):
+    """
+    Send commands open loop at `rate` per second; returns (fraction acked,
+    ack latency p50 and p99 in ms, RX bytes overflowed).
+    """
+    emulator = Esp32Emulator(firmware=firmware, **faults)
+    port = FramedPort(emulator.start(), mode=mode, timeout=0.05)
+    port.open(settle=0.1)
+    acks = []
+    done = threading.Event()
+
+    def read():
+        while not done.is_set():
+            if port.readline().startswith(b"OK:"):
+                acks.append(time.perf_counter())
+
+    reader = threading.Thread(target=read, daemon=True)
+    reader.start()
+    count = int(rate * seconds)
+    sent = []
+    start = time.perf_counter()
+    for i in range(count):
+        time.sleep(max(0.0, start + i / rate - time.perf_counter()))
+        sent.append(time.perf_counter())
+        port.send([SWITCH_COMMANDS[i % 4]])
+    deadline = time.perf_counter() + 2.0
+    while len(acks) < count and time.perf_counter() < deadline:
+        time.sleep(0.01)
+    done.set()
+    reader.join()
+    port.close()
+    emulator.stop()
+    acked = min(len(acks), count)
+    ms = (np.array(acks[:acked]) - np.array(sent[:acked])) * 1000 if acked else np.zeros(1)
+    return acked / count, np.percentile(ms, 50), np.percentile(ms, 99), emulator.overflowed
+
+
+def max_rate(seconds, max_p99=50.0):
+    """Double the command rate until commands are lost or p99 ack latency passes max_p99 ms."""
+    setups = (("text firmware", "text", "text"), ("current firmware, text", "framed", "text"),
+              ("current firmware, framed", "framed", "auto"))
+    for name, firmware, mode in setups:
+        print(f"{name}:")
+        best, rate = None, 25
+        while rate <= 3200:
+            acked, p50, p99, overflowed = command_rate(rate, seconds, firmware, mode)
+            ok = acked == 1.0 and p99 <= max_p99
+            print(f"  {rate:5d} commands/s: {acked:6.1%} acked, p50 {p50:6.1f} / p99 {p99:7.1f} ms, "
+                  f"{overflowed} RX bytes overflowed{'' if ok else '  <- not sustained'}")
+            if not ok:
+                break
+            best, rate = rate, rate * 2
+        print(f"  max sustained: {best or '<25'} commands/s")
+
+
+def drive(emulator, seconds, mode="auto", speed=30.0, preempt_every=None, faults=(), settle=0.2, seed=0):
+    """
+    Run the cycle (and preemption) against the emulator as detect_cars does:
+    cycle updates batched per frame at 30 FPS, with detect_cars' LampControl
+    for sends, reconnects and the once-a-second lamp resync.
+    Timing runs `speed` times faster than real time. faults is a list of
+    (seconds, action(emulator)). Returns a dict of what happened.
+    """
+    from lamp_control import LampControl
+    from latency import LatencyTracer, ReplyReader
+    from preemption import PAIRS, Preemption
+    from traffic_control import CycleController
+
+    rng = random.Random(seed)
+    port = FramedPort(emulator.path, mode=mode, timeout=0.05)
+    port.open(settle=settle)
+    report = {"protocol": port.describe(), "errors": 0}
+    reader = ReplyReader(lambda: port, LatencyTracer(enabled=False),
+                         on_line=lambda line: line.startswith("ERROR") and report.update(
+                             errors=report["errors"] + 1))
+    reader.start()
+
+    lamps = LampControl(lambda: port, settle=settle)
+
+    start = time.perf_counter()
+    clock = lambda: start + (time.perf_counter() - start) * speed
+    cycle = CycleController(lamps.send_paired, log=None, now=clock())
+    preemption = Preemption(cycle, clearance=2.0 / speed, max_hold=20.0 / speed)
+    lamps.cycle, lamps.preemption = cycle, preemption
+    with port.batch():
+        cycle.reset(clock())
+    counts = [2, 2, 2, 2]
+    faults = sorted(faults, key=lambda fault: fault[0])
+    next_preempt = preempt_every
+    mismatch_since, longest_mismatch = None, 0.0
+    frame = 0
+    while time.perf_counter() - start < seconds:
+        elapsed = time.perf_counter() - start
+        while faults and faults[0][0] <= elapsed:
+            faults.pop(0)[1](emulator)
+        if next_preempt and elapsed >= next_preempt:
+            preemption.request("NS" if cycle.current_cycle_direction == "EW" else "EW", source="check")
+            next_preempt += preempt_every
+        counts = [max(0, min(2, c + rng.choice((-1, 0, 0, 1)))) for c in counts]
+        with preemption.batch(port):
+            preemption.update(*counts, clock())
+        frame += 1
+        if frame % 30 == 0:
+            lamps.resync()
+        # Lamps that disagree with the controller (preemption holds are skipped)
+        wanted = set(PAIRS[cycle.current_cycle_direction])
+        now = time.perf_counter()
+        if preemption.active is None and emulator.green_heads() != wanted:
+            mismatch_since = mismatch_since or now
+            longest_mismatch = max(longest_mismatch, now - mismatch_since)
+        else:
+            mismatch_since = None
+        time.sleep(max(0.0, start + frame / 30 - time.perf_counter()))
+    reader.stop()
+    preemption.release()
+    port.close()
+    report.update(sent=lamps.sent, failed=lamps.failed, reconnects=lamps.reconnects, resyncs=lamps.resyncs,
+                  conflicts=len(emulator.conflicts), longest_mismatch=longest_mismatch,
+                  commands=emulator.commands, dropped=emulator.dropped, boots=emulator.boots)
+    return report
+
+
+def check(seconds, max_mismatch, drop_rate=0.01):
+    """Scenarios with and without faults; returns True if none had a conflict or a stale lamp."""
+    drops = {"drop_rate": drop_rate, "seed": 1}
+    scenarios = (
+        ("text firmware (fallback)", {"firmware": "text"}, "auto", ()),
+        ("framed", {}, "auto", ()),
+        (f"framed, {drop_rate:.0%} bytes dropped", drops, "auto", ()),
+        (f"text commands, {drop_rate:.0%} bytes dropped", drops, "text", ()),
+        (f"text firmware, {drop_rate:.0%} bytes dropped", {**drops, "firmware": "text"}, "auto", ()),
+        ("framed, 20 +/- 10 ms handler latency", {"latency": 0.010, "jitter": 0.020}, "auto", ()),
+        ("cable pulled for 2 s", {}, "auto", [(seconds / 3, lambda emulator: emulator.disconnect(2.0))]),
+        ("board reset", {}, "auto", [(seconds / 3, Esp32Emulator.reboot)]),
+    )
+    passed = True
+    print(f"{'scenario':38s}{'protocol':>20s}{'cmds':>6s}{'conflicts':>10s}{'stale lamps':>12s}"
+          f"{'reconnects':>11s}{'resyncs':>8s}{'lost bytes':>11s}")
+    for name, options, mode, faults in scenarios:
+        emulator = Esp32Emulator(**options)
+        emulator.start()
+        try:
+            report = drive(emulator, seconds, mode, preempt_every=seconds / 4, faults=faults)
+        finally:
+            emulator.stop()
+        ok = report["conflicts"] == 0 and report["longest_mismatch"] <= max_mismatch
+        passed &= ok
+        print(f"{name:38s}{report['protocol']:>20s}{report['commands']:6d}{report['conflicts']:10d}"
+              f"{report['longest_mismatch']:11.2f}s{report['reconnects']:11d}{report['resyncs']:8d}"
+              f"{report['dropped']:11d}"
+              f"  {'ok' if ok else 'FAIL'}")
+        for when, green, command in emulator.conflicts[:3]:
+            print(f"    conflicting green {' '.join(green)} after {command}")
+    return passed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Emulated ESP32 traffic light controller on a pty")
+    sub = parser.add_subparsers(dest="command", required=True)
+    serve = sub.add_parser("serve", help="run the emulator for a controller to connect to")
+    serve.add_argument("--firmware", choices=("framed", "text"), default="framed")
+    serve.add_argument("--baud", type=int, default=115200)
+    serve.add_argument("--drop-rate", type=float, default=0.0, help="probability of losing each byte")
+    serve.add_argument("--latency-ms", type=float, default=0.0, help="extra handling time per command")
+    serve.add_argument("--jitter-ms", type=float, default=0.0)
+    serve.add_argument("--disconnect-every", type=float, help="pull the cable every N seconds")
+    serve.add_argument("--down", type=float, default=2.0, help="seconds the cable stays out")
+    rate = sub.add_parser("rate", help="highest command rate the firmware keeps up with")
+    rate.add_argument("--seconds", type=float, default=3.0, help="per rate step")
+    rate.add_argument("--max-p99-ms", type=float, default=50.0)
+    checks = sub.add_parser("check", help="conflicting greens, stale lamps and reconnects under faults")
+    checks.add_argument("--seconds", type=float, default=8.0, help="per scenario (cycle runs 30x faster)")
+    checks.add_argument("--max-stale", type=float, default=1.5,
+                        help="longest tolerated lamp/controller disagreement, seconds")
+    checks.add_argument("--drop-rate", type=float, default=0.01, help="for the dropped-bytes scenarios")
+    args = parser.parse_args()
+
+    if args.command == "rate":
+        max_rate(args.seconds, args.max_p99_ms)
+        return
+    if args.command == "check":
+        sys.exit(0 if check(args.seconds, args.max_stale, args.drop_rate) else 1)
+
+    emulator = Esp32Emulator(firmware=args.firmware, baud_rate=args.baud, drop_rate=args.drop_rate,
+                             latency=args.latency_ms / 1000, jitter=args.jitter_ms / 1000)
+    print(f"Emulated ESP32 ({args.firmware} firmware) on {emulator.start()}; Ctrl+C to stop")
+    next_disconnect = time.monotonic() + args.disconnect_every if args.disconnect_every else None
+    try:
+        while True:
+            time.sleep(1)
+            if next_disconnect and time.monotonic() >= next_disconnect:
+                print(f"  cable pulled for {args.down:.0f} s")
+                emulator.disconnect(args.down)
+                next_disconnect += args.disconnect_every
+            print(f"  green: {' '.join(sorted(emulator.green_heads())) or '-'}  "
+                  f"commands {emulator.commands}  rx overflow {emulator.overflowed} bytes  "
+                  f"conflicts {len(emulator.conflicts)}")
+    except KeyboardInterrupt:
+        pass
+    emulator.stop()
+
+
+if __name__ == "__main__":
+    main()
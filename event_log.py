@@ -0,0 +1,225 @@
+"""
+Structured, buffered event log (JSON lines) with size-based rotation.
+
+log() only appends the event to two in-memory deques: a write queue and a
+bounded ring of recent events. A background thread drains the queue every
+flush_interval seconds and writes the whole batch with one write call, so
+the detection thread never pays for a syscall per message. The GUI reads
+new events from the ring on a timer (see since()).
+
+Each line is one event:
+
+    {"ts": 1767500000.123, "kind": "phase", "msg": "[AUTO] E-W → N-S GREEN (Duration: 10s)",
+     "direction": "NS", "duration": 10, "elapsed": 5.03}
+
+Kinds used by the controllers: system, phase, extend, coordinate, safety,
+serial_tx, serial_rx, manual, error, incident, preempt.
+
+Replay a log (all rotated files, oldest first) for incident analysis:
+
+    python event_log.py logs/events.jsonl --kind phase --kind error
+    python event_log.py logs/events.jsonl --start 2026-10-19T07:00 --speed 10
+"""
+import argparse
+import itertools
+import json
+import os
+import sys
+import threading
+import time
+from collections import deque
+from datetime import datetime
+
+LOG_FILE = os.path.join("logs", "events.jsonl")
+
+
+class EventLog:
+    """
+    path: JSONL file (rotated to path.1 ... path.<backups>)
+    max_bytes: rotate once the file grows past this size
+    ring_size: number of recent events kept in memory for the GUI
+    flush_interval: seconds between background writes
+    echo: also print each event's message to stdout (batched, off-thread)
+    """
+
+    def __init__(self, path=LOG_FILE, max_bytes=5 * 1024 * 1024, backups=5,
+                 ring_size=500, flush_interval=0.5, echo=False):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self.flush_interval = flush_interval
+        self.echo = echo
+        self.ring = deque(maxlen=ring_size)
+        self._queue = deque()
+        self._seq = itertools.count(1)
+        self._ring_lock = threading.Lock()  # seq numbers enter the ring in order (see since())
+        self._flush_lock = threading.Lock()
+        self.write_errors = 0  # batches that could not be written (dropped)
+        self.unserializable = 0  # events whose fields were not JSON (written with repr() values)
+        self._stop = threading.Event()
+        self._file = None
+        self._hooks = {}
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def log(self, kind, msg="", **fields):
+        """Record an event. Cheap enough to call from the detection loop."""
+        event = {"ts": time.time(), "kind": kind, "msg": msg, **fields}
+        self._queue.append(event)
+        with self._ring_lock:
+            self.ring.append((next(self._seq), event))
+        for hook in self._hooks.get(kind, ()):
+            hook(event)
+        return event
+
+    def on(self, kind, hook):
+        """Call hook(event) from log() for every event of this kind. Keep hooks cheap."""
+        self._hooks.setdefault(kind, []).append(hook)
+
+    def since(self, seq):
+        """Return [(seq, event), ...] newer than seq from the in-memory ring."""
+        return [item for item in list(self.ring) if item[0] > seq]
+
+    def recent(self, n=None):
+        """Return the most recent events, oldest first."""
+        events = [event for _, event in list(self.ring)]
+        return events if n is None else events[-n:]
+
+    def _run(self):
+        while not self._stop.wait(self.flush_interval):
+            self.flush()
+        self.flush()
+
+    def flush(self):
+        """Write all queued events to disk in one batch."""
+        with self._flush_lock:
+            batch = []
+            while self._queue:
+                batch.append(self._queue.popleft())
+            if not batch:
+                return
+            if self.echo:
+                try:
+                    sys.stdout.write("".join(f"{event['msg']}\n" for event in batch if event["msg"]))
+                    sys.stdout.flush()
+                except (OSError, ValueError):
+                    pass  # no console (closed or detached stdout)
+            data = "".join(self._line(event) for event in batch).encode()
+            try:
+                if self._file is None:
+                    os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+                    self._file = open(self.path, "ab")
+                self._file.write(data)
+                self._file.flush()
+                if self._file.tell() >= self.max_bytes:
+                    self._rotate()
+            except OSError as e:
+                # Disk full, permissions...: drop this batch (the ring still has it) and retry on the
+                # next flush with a freshly opened file, so the writer thread keeps draining the queue
+                self.write_errors += 1
+                if self.write_errors == 1 or self.write_errors % 100 == 0:
+                    sys.stderr.write(f"Event log: could not write {self.path} ({e}); "
+                                     f"{self.write_errors} batches dropped\n")
+                if self._file is not None:
+                    try:
+                        self._file.close()
+                    except OSError:
+                        pass
+                    self._file = None
+
+    def _line(self, event):
+        try:
+            return json.dumps(event, ensure_ascii=False) + "\n"
+        except (TypeError, ValueError):
+            self.unserializable += 1
+            return json.dumps(event, ensure_ascii=False, default=repr) + "\n"
+
+    def _rotate(self):
+        self._file.close()
+        self._file = None
+        for i in range(self.backups - 1, 0, -1):
+            older = f"{self.path}.{i}"
+            if os.path.exists(older):
+                os.replace(older, f"{self.path}.{i + 1}")
+        if self.backups > 0:
+            os.replace(self.path, f"{self.path}.1")
+        else:
+            os.remove(self.path)
+
+    def close(self):
+        """Stop the writer thread after a final flush."""
+        self._stop.set()
+        self._thread.join()
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+def log_files(path):
+    """Return the log file and its rotated backups, oldest first."""
+    files = []
+    i = 1
+    while os.path.exists(f"{path}.{i}"):
+        files.append(f"{path}.{i}")
+        i += 1
+    files.reverse()
+    if os.path.exists(path):
+        files.append(path)
+    return files
+
+
+def read_events(path, kinds=None, start=None, end=None):
+    """Yield events from a log and its backups in time order."""
+    for name in log_files(path):
+        with open(name, encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    event = json.loads(line)
+                except json.JSONDecodeError:
+                    continue  # partial line from a crash
+                if kinds and event.get("kind") not in kinds:
+                    continue
+                if start is not None and event["ts"] < start:
+                    continue
+                if end is not None and event["ts"] > end:
+                    continue
+                yield event
+
+
+def format_event(event):
+    """One human-readable line for an event."""
+    stamp = datetime.fromtimestamp(event["ts"]).strftime("%Y-%m-%d %H:%M:%S.%f")[:-3]
+    extra = {k: v for k, v in event.items() if k not in ("ts", "kind", "msg")}
+    suffix = f"  {json.dumps(extra, ensure_ascii=False)}" if extra else ""
+    return f"[{stamp}] {event['kind']:<9} {event.get('msg', '')}{suffix}"
+
+
+def replay(events, speed=None):
+    """Print events, optionally paced at `speed` times the original rate."""
+    previous = None
+    for event in events:
+        if speed and previous is not None:
+            time.sleep(max(0.0, (event["ts"] - previous) / speed))
+        previous = event["ts"]
+        print(format_event(event))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay a structured event log")
+    parser.add_argument("path", nargs="?", default=LOG_FILE)
+    parser.add_argument("--kind", action="append", help="only show these kinds (repeatable)")
+    parser.add_argument("--start", help="ISO time, e.g. 2026-10-19T07:00")
+    parser.add_argument("--end", help="ISO time")
+    parser.add_argument("--speed", type=float, help="replay with original timing, sped up by this factor")
+    args = parser.parse_args()
+
+    start = datetime.fromisoformat(args.start).timestamp() if args.start else None
+    end = datetime.fromisoformat(args.end).timestamp() if args.end else None
+    replay(read_events(args.path, args.kind, start, end), args.speed)
+
+
+if __name__ == "__main__":
+    main()
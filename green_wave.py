@@ -0,0 +1,302 @@
+"""
+Coordinated green wave along a corridor of intersections.
+
+Every controller publishes a small binary message on a local bus whenever
+one of its greens starts or changes length; the controller downstream uses
+its upstream neighbour's corridor greens to predict when the platoon will
+arrive (green start + lost time + travel time) and bounds its own greens
+through CycleController's coordinator hook:
+
+    corridor green running  held until the platoon has passed (max_hold cap)
+    cross street green      cut so the corridor is green when it arrives
+                            (never below min_green)
+
+Message (25 bytes, little endian):
+
+    magic "GW" | version u8 | node u8 | seq u16 | green_start f64 (epoch s)
+    | direction u8 (0 EW, 1 NS) | duration u16 (0.1 s) | counts 4 x u16 (N, S, E, W)
+
+The bus is UDP multicast (one group for the whole corridor, loopback on so
+several controllers can share a host). Messages are received and decoded
+on the bus thread; the detection thread only reads the latest band.
+
+    TRAFFIC_WAVE_NODE=2 TRAFFIC_WAVE_UPSTREAM=1 TRAFFIC_WAVE_TRAVEL=30 python detect_cars.py
+
+Simulate a 5-intersection corridor with and without coordination:
+
+    python green_wave.py --intersections 5 --hours 1 --seeds 10
+"""
+import argparse
+import os
+import socket
+import struct
+import threading
+from collections import namedtuple
+from multiprocessing import Pool, cpu_count
+
+import numpy as np
+
+from traffic_control import BASE_GREEN_TIME
+
+MAGIC = b"GW"
+VERSION = 1
+MESSAGE = struct.Struct("<2sBBHdBH4H")
+DIRECTION_CODES = {"EW": 0, "NS": 1}
+DIRECTION_NAMES = ("EW", "NS")
+DEFAULT_GROUP = "239.255.60.1"
+DEFAULT_PORT = 6200
+
+PhaseMessage = namedtuple("PhaseMessage", "node seq green_start direction duration counts")
+
+
+def encode(node, seq, green_start, direction, duration, counts):
+    counts = [min(int(c), 0xFFFF) for c in counts]
+    return MESSAGE.pack(MAGIC, VERSION, node, seq & 0xFFFF, green_start, DIRECTION_CODES[direction],
+                        min(int(round(duration * 10)), 0xFFFF), *counts)
+
+
+def decode(data):
+    """PhaseMessage, or None for anything that is not a version-1 message."""
+    if len(data) != MESSAGE.size:
+        return None
+    magic, version, node, seq, green_start, direction, duration, *counts = MESSAGE.unpack(data)
+    if magic != MAGIC or version != VERSION or direction > 1:
+        return None
+    return PhaseMessage(node, seq, green_start, DIRECTION_NAMES[direction], duration / 10.0,
+                        tuple(counts))
+
+
+class MulticastBus:
+    """UDP multicast publish/subscribe for the controllers on one network segment."""
+
+    def __init__(self, group=DEFAULT_GROUP, port=DEFAULT_PORT, ttl=1):
+        self.address = (group, port)
+        self.send_sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.send_sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_TTL, ttl)
+        self.send_sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_LOOP, 1)
+        self.send_sock.setblocking(False)
+        self.recv_sock = None
+        self.thread = None
+
+    def publish(self, data):
+        try:
+            self.send_sock.sendto(data, self.address)
+        except OSError:
+            pass  # a full socket buffer drops one update; the next one supersedes it
+
+    def subscribe(self, handler):
+        """Call handler(data) on a background thread for every datagram received."""
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        sock.bind(("", self.address[1]))
+        membership = struct.pack("4s4s", socket.inet_aton(self.address[0]), socket.inet_aton("0.0.0.0"))
+        sock.setsockopt(socket.IPPROTO_IP, socket.IP_ADD_MEMBERSHIP, membership)
+        self.recv_sock = sock
+
+        def run():
+            while True:
+                try:
+                    data = sock.recv(256)
+                except OSError:
+                    return
+                handler(data)
+        self.thread = threading.Thread(target=run, daemon=True)
+        self.thread.start()
+
+    def close(self):
+        self.send_sock.close()
+        if self.recv_sock is not None:
+            self.recv_sock.close()
+
+
+class GreenWave:
+    """
+    Coordinator for one intersection (see CycleController).
+
+    node: this controller's id on the bus (0-255)
+    upstream: id of the neighbour whose corridor platoons arrive here (None = head of corridor)
+    travel_time: seconds from the upstream stop line to this one
+    corridor: phase serving the corridor ("EW" = S1/S4)
+    min_green: shortest cross-street green the coordinator may cut to
+    max_hold: longest the corridor green is held for a platoon
+    lost_time: start-up lost time at the start of a green (upstream and here)
+    """
+
+    def __init__(self, node, bus=None, upstream=None, travel_time=30.0, corridor="EW",
+                 min_green=BASE_GREEN_TIME, max_hold=45.0, lost_time=2.0):
+        self.node = node
+        self.bus = bus
+        self.upstream = upstream
+        self.travel_time = travel_time
+        self.corridor = corridor
+        self.min_green = min_green
+        self.max_hold = max_hold
+        self.lost_time = lost_time
+        self.band = None       # (start, end) of the next expected platoon, epoch seconds
+        self.sent = 0
+        self.received = 0
+        self._seq = 0
+        if bus is not None and upstream is not None:
+            bus.subscribe(self.receive)
+
+    def on_green(self, direction, green_start, duration, counts):
+        """CycleController hook: publish a green start or change."""
+        if self.bus is None:
+            return
+        self._seq += 1
+        self.bus.publish(encode(self.node, self._seq, green_start, direction, duration, counts))
+        self.sent += 1
+
+    def receive(self, data):
+        """Bus thread: turn the upstream neighbour's corridor greens into a platoon band."""
+        message = decode(data)
+        if message is None or message.node != self.upstream or message.direction != self.corridor:
+            return
+        self.received += 1
+        start = message.green_start + self.lost_time + self.travel_time
+        end = message.green_start + message.duration + self.travel_time
+        self.band = (start, end)
+
+    def bounds(self, direction, green_start, duration, now):
+        """(min, max or None) duration for a green that started at green_start."""
+        band = self.band
+        if band is None or band[1] <= now:
+            return 0, None
+        start, end = band
+        if direction == self.corridor:
+            # Hold only if the platoon arrives during (or just after) this green
+            if start <= green_start + duration + self.min_green:
+                return min(end - green_start, self.max_hold), None
+            return 0, None
+        # Corridor green (and its start-up lost time) should begin as the platoon arrives
+        return 0, max(self.min_green, start - self.lost_time - green_start)
+
+
+def wave_from_env():
+    """GreenWave on the multicast bus if TRAFFIC_WAVE_NODE is set, else None."""
+    node = os.environ.get("TRAFFIC_WAVE_NODE", "")
+    if node == "":
+        return None
+    upstream = os.environ.get("TRAFFIC_WAVE_UPSTREAM", "")
+    return GreenWave(int(node), MulticastBus(),
+                     upstream=int(upstream) if upstream != "" else None,
+                     travel_time=float(os.environ.get("TRAFFIC_WAVE_TRAVEL", "30")),
+                     corridor=os.environ.get("TRAFFIC_WAVE_CORRIDOR", "EW"))
+
+
+class ReplayBus:
+    """Simulation bus: keeps what one node published, stamped with its simulated send time."""
+
+    def __init__(self):
+        self.now = 0.0
+        self.messages = []   # (sent, data)
+        self.handler = None
+
+    def publish(self, data):
+        self.messages.append((self.now, data))
+
+    def subscribe(self, handler):
+        self.handler = handler
+
+
+def simulate_corridor(seed, coordinated, intersections=5, travel_time=30.0, corridor_rate=600.0,
+                      cross_rate=250.0, counter_rate=150.0, duration=3600.0, latency=0.05):
+    """
+    Eastbound corridor through `intersections` signals. Corridor traffic
+    enters at the first intersection's west approach and each
+    intersection's west-approach departures arrive at the next one
+    travel_time later; cross streets (north/south) and the westbound
+    counter-flow (east) are independent Poisson arrivals at every node.
+
+    Intersections are simulated upstream first, and each one replays the
+    messages its upstream neighbour published (latency seconds late), so
+    the run is the same as with the controllers running side by side.
+    """
+    from simulator import IntersectionSimulator, poisson_arrivals
+
+    rng = np.random.default_rng(seed)
+    entering = poisson_arrivals([corridor_rate], duration, rng)[0]
+    through = entering
+    upstream_bus = None
+    stops = delay = cross_delay = cross_stops = cross_cars = messages = 0
+    for node in range(intersections):
+        north, south, east = poisson_arrivals([cross_rate, cross_rate, counter_rate], duration, rng)
+        bus = ReplayBus()
+        wave = None
+        on_tick = None
+        if coordinated:
+            wave = GreenWave(node, bus, upstream=node - 1 if node else None, travel_time=travel_time)
+            inbox = list(upstream_bus.messages) if upstream_bus else []
+            position = [0]
+
+            def on_tick(now, wave=wave, bus=bus, inbox=inbox, position=position):
+                bus.now = now
+                while position[0] < len(inbox) and inbox[position[0]][0] + latency <= now:
+                    wave.receive(inbox[position[0]][1])
+                    position[0] += 1
+        sim = IntersectionSimulator([north, south, east, through], coordinator=wave, on_tick=on_tick,
+                                    record_departures=True)
+        result = sim.run(duration)
+        stops += result["stops_per_approach"]["west"]
+        delay += result["avg_delay_per_approach"]["west"]
+        for approach in ("north", "south"):
+            cross_stops += result["stops_per_approach"][approach]
+            cross_cars += len(sim.departures[("north", "south").index(approach)])
+            cross_delay += result["avg_delay_per_approach"][approach] / (2 * intersections)
+        messages += len(bus.messages)
+        departures = np.array(sim.departures[3])
+        through = departures[departures + travel_time < duration] + travel_time
+        upstream_bus = bus
+    return {
+        "stops_per_vehicle": stops / max(len(entering), 1),
+        "corridor_delay": delay,
+        "cross_delay": cross_delay,
+        "cross_stop_rate": cross_stops / max(cross_cars, 1),
+        "messages": messages,
+    }
+
+
+def _corridor_job(job):
+    seed, coordinated, kwargs = job
+    return simulate_corridor(seed, coordinated, **kwargs)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Simulate a coordinated corridor")
+    parser.add_argument("--intersections", type=int, default=5)
+    parser.add_argument("--hours", type=float, default=1.0)
+    parser.add_argument("--seeds", type=int, default=10)
+    parser.add_argument("--travel", type=float, default=30.0, help="travel time between signals (s)")
+    parser.add_argument("--corridor-rate", type=float, default=600.0, help="eastbound vehicles per hour")
+    parser.add_argument("--cross-rate", type=float, default=250.0,
+                        help="vehicles per hour on each cross-street approach")
+    parser.add_argument("--counter-rate", type=float, default=150.0, help="westbound vehicles per hour")
+    args = parser.parse_args()
+
+    kwargs = dict(intersections=args.intersections, travel_time=args.travel,
+                  corridor_rate=args.corridor_rate, cross_rate=args.cross_rate,
+                  counter_rate=args.counter_rate, duration=args.hours * 3600.0)
+    jobs = [(seed, coordinated, kwargs) for coordinated in (False, True) for seed in range(args.seeds)]
+    with Pool(cpu_count()) as pool:
+        results = pool.map(_corridor_job, jobs)
+    runs = {"isolated": results[:args.seeds], "green wave": results[args.seeds:]}
+
+    print(f"{args.intersections} intersections, {args.travel:.0f}s apart, {args.hours}h x {args.seeds} seeds "
+          f"({MESSAGE.size}-byte messages)\n")
+    metrics = ("stops_per_vehicle", "corridor_delay", "cross_delay", "cross_stop_rate", "messages")
+    print(f"{'':>10}  " + "  ".join(f"{m:>18}" for m in metrics))
+    for name, chunk in runs.items():
+        cells = []
+        for m in metrics:
+            values = np.array([r[m] for r in chunk], dtype=np.float64)
+            ci = 1.96 * values.std(ddof=1) / np.sqrt(len(values)) if len(values) > 1 else 0.0
+            cells.append(f"{values.mean():>10.2f} ± {ci:<5.2f}")
+        print(f"{name:>10}  " + "  ".join(cells))
+    base = np.array([r["stops_per_vehicle"] for r in runs["isolated"]])
+    wave = np.array([r["stops_per_vehicle"] for r in runs["green wave"]])
+    print(f"\nStops per corridor vehicle: {(wave.mean() / base.mean() - 1) * 100:+.0f}% "
+          f"(fewer on {int((wave < base).sum())}/{len(base)} seeds)")
+
+
+if __name__ == "__main__":
+    main()
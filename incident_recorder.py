@@ -0,0 +1,339 @@
+"""
+Incident recorder: the last N seconds of raw frames and detections.
+
+Every processed frame is JPEG-compressed into a preallocated ring together
+with its boxes, per-approach counts and the cycle's phase state, so memory
+is fixed at start-up (seconds * fps * max_frame_bytes plus a little for the
+detections). trigger() is cheap and never blocks: a writer thread waits for
+post_seconds of extra frames, copies the frames out of the ring and writes
+
+    incidents/<time>_<reason>/video.avi         the raw frames (MJPG)
+    incidents/<time>_<reason>/detections.jsonl  header + one line per frame
+
+Triggers wired in by the controllers: the GUI's SAVE INCIDENT button (or
+'i' in detect_cars.py), SAFETY all-red events, serial errors, and
+POST /incident on the web dashboard. Event triggers are rate limited per
+kind (one dump per `cooldown` seconds), errors logged by the reconnect path
+(marked reconnect=True) never trigger, and the oldest recordings are
+deleted once incidents/ holds more than `max_dumps` of them or `max_bytes`.
+
+Replay a recording through the controller and compare its decisions with
+the ones recorded (optionally showing the video with the boxes). The
+green-time table saved with the recording is used, or else the one in
+traffic.yaml (see runtime_config.py):
+
+    python incident_recorder.py incidents/20261019-071502_safety --show
+"""
+import argparse
+import json
+import os
+import queue
+import shutil
+import threading
+import time
+from datetime import datetime
+
+import numpy as np
+
+from traffic_control import CycleController, GreenTimeTable
+
+INCIDENT_DIR = "incidents"
+PHASES = ("EW", "NS")
+
+
+class IncidentRecorder:
+    """
+    seconds/fps: ring length (slots = seconds * fps)
+    post_seconds: frames kept recording after a trigger before the dump
+    max_frame_bytes: largest JPEG a slot can hold (bigger frames are skipped)
+    max_boxes: detections kept per frame
+    cooldown: seconds between dumps triggered by the same event kind
+    max_dumps / max_bytes: recordings kept in out_dir (oldest deleted first)
+    """
+
+    def __init__(self, seconds=15, fps=30, post_seconds=3, max_frame_bytes=100_000,
+                 max_boxes=100, quality=60, out_dir=INCIDENT_DIR, event_log=None, cooldown=300,
+                 max_dumps=20, max_bytes=500_000_000):
+        import cv2
+
+        self.slots = int(seconds * fps)
+        self.post_frames = int(post_seconds * fps)
+        self.post_seconds = post_seconds
+        self.max_frame_bytes = max_frame_bytes
+        self.max_boxes = max_boxes
+        self.out_dir = out_dir
+        self.event_log = event_log
+        self.cooldown = cooldown
+        self.max_dumps = max_dumps
+        self.max_bytes = max_bytes
+        self.params = [int(cv2.IMWRITE_JPEG_QUALITY), quality]
+
+        self.jpeg = np.zeros((self.slots, max_frame_bytes), np.uint8)
+        self.jpeg_len = np.zeros(self.slots, np.int32)
+        self.frame_no = np.full(self.slots, -1, np.int64)  # -1 while a slot is being written
+        self.ts = np.zeros(self.slots, np.float64)
+        self.counts = np.zeros((self.slots, 4), np.int16)
+        self.phase = np.zeros(self.slots, np.uint8)
+        self.duration = np.zeros(self.slots, np.float32)
+        self.green_start = np.zeros(self.slots, np.float64)
+        self.lights = np.zeros((self.slots, 4), np.bool_)  # True = green
+        self.boxes = np.zeros((self.slots, max_boxes, 6), np.float32)
+        self.box_count = np.zeros(self.slots, np.int16)
+        self.size = (0, 0)
+        self.green_time = None  # the cycle's green-time policy, saved with each recording
+        self.frames = 0       # frames recorded so far
+        self.oversize = 0     # frames too large for a slot
+        self.dumps = 0
+        self._last_trigger = -self.post_frames - 1
+        self._last_event_trigger = {}  # kind -> monotonic time of its last dump
+        self._requests = queue.Queue()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def record(self, frame, boxes, counts, cycle, now):
+        """Add one processed frame. boxes: (N, 6) or (N, 4) array in frame pixels."""
+        import cv2
+
+        n = self.frames
+        slot = n % self.slots
+        self.frame_no[slot] = -1
+        ok, buf = cv2.imencode(".jpg", frame, self.params)
+        length = len(buf) if ok else 0
+        if length > self.max_frame_bytes:
+            self.oversize += 1
+            length = 0
+        self.jpeg[slot, :length] = buf.ravel()[:length]
+        self.jpeg_len[slot] = length
+
+        boxes = np.asarray(boxes, np.float32)[:self.max_boxes]
+        if len(boxes):
+            cols = min(boxes.shape[1], 6)
+            self.boxes[slot, :len(boxes), :cols] = boxes[:, :cols]
+        self.box_count[slot] = len(boxes)
+
+        light = 1 if cycle.current_cycle_direction == "EW" else 2
+        self.ts[slot] = now
+        self.counts[slot] = counts
+        self.phase[slot] = PHASES.index(cycle.current_cycle_direction)
+        self.duration[slot] = getattr(cycle, f"current_tl{light}_duration")
+        self.green_start[slot] = getattr(cycle, f"tl{light}_green_start")
+        self.lights[slot] = [getattr(cycle, f"tl{i}_state") == "GREEN" for i in (1, 2, 3, 4)]
+        self.size = frame.shape[1], frame.shape[0]
+        self.green_time = cycle.green_time
+        self.frame_no[slot] = n
+        self.frames = n + 1
+
+    def trigger(self, reason="manual", **details):
+        """
+        Schedule a dump of the ring. Returns the output directory, or None if
+        an earlier trigger's dump already covers this moment.
+        """
+        if self.frames - self._last_trigger <= self.post_frames:
+            return None
+        self._last_trigger = self.frames
+        stamp = datetime.now().strftime("%Y%m%d-%H%M%S")
+        path = os.path.join(self.out_dir, f"{stamp}_{reason}")
+        self._requests.put((path, reason, self.frames, time.time(), details))
+        if self.event_log is not None:
+            self.event_log.log("incident", f"[INCIDENT] Recording '{reason}' to {path}",
+                               reason=reason, path=path)
+        return path
+
+    def watch(self, event_log, kinds=("safety", "error")):
+        """Trigger a dump when event_log records one of these kinds (at most once per cooldown per kind)."""
+        for kind in kinds:
+            event_log.on(kind, lambda event, kind=kind: self._on_event(kind, event))
+
+    def _on_event(self, kind, event):
+        if event.get("reconnect"):
+            return  # repeats every send while the ESP32 is unplugged; the first serial error already dumped
+        now = time.monotonic()
+        last = self._last_event_trigger.get(kind)
+        if last is not None and now - last < self.cooldown:
+            return
+        if self.trigger(kind, msg=event["msg"]) is not None:
+            self._last_event_trigger[kind] = now
+
+    def _run(self):
+        while True:
+            request = self._requests.get()
+            if request is None:
+                return
+            path, reason, trigger_frame, trigger_ts, details = request
+            # Keep recording for a few seconds so the dump shows what happened next
+            deadline = time.time() + self.post_seconds * 2
+            while self.frames < trigger_frame + self.post_frames and time.time() < deadline:
+                time.sleep(0.05)
+            try:
+                self._dump(path, reason, trigger_frame, trigger_ts, details)
+            except Exception as e:
+                if self.event_log is not None:
+                    # Not "error": that kind is watched and would trigger another dump
+                    self.event_log.log("incident", f"[ERROR] Incident dump failed: {e}", path=path)
+
+    def _snapshot(self):
+        """Copy every still-valid slot out of the ring, oldest first."""
+        end = self.frames
+        records = []
+        for n in range(max(0, end - self.slots), end):
+            slot = n % self.slots
+            if self.frame_no[slot] != n:
+                continue
+            jpeg = self.jpeg[slot, :self.jpeg_len[slot]].copy()
+            record = {
+                "frame": n,
+                "ts": float(self.ts[slot]),
+                "counts": self.counts[slot].tolist(),
+                "phase": PHASES[self.phase[slot]],
+                "duration": float(self.duration[slot]),
+                "green_start": float(self.green_start[slot]),
+                "lights": ["GREEN" if on else "RED" for on in self.lights[slot]],
+                "boxes": np.round(self.boxes[slot, :self.box_count[slot]], 2).tolist(),
+            }
+            # The detection thread may have overwritten the slot while we copied it
+            if self.frame_no[slot] == n:
+                records.append((jpeg, record))
+        return records
+
+    def _dump(self, path, reason, trigger_frame, trigger_ts, details):
+        import cv2
+
+        records = self._snapshot()
+        if not records:
+            return
+        os.makedirs(path, exist_ok=True)
+        span = records[-1][1]["ts"] - records[0][1]["ts"]
+        fps = (len(records) - 1) / span if span > 0 else 30.0
+        writer = cv2.VideoWriter(os.path.join(path, "video.avi"), cv2.VideoWriter_fourcc(*"MJPG"),
+                                 fps, self.size)
+        header = {"reason": reason, "trigger_ts": trigger_ts, "trigger_frame": trigger_frame,
+                  "video": "video.avi", "width": self.size[0], "height": self.size[1],
+                  "fps": round(fps, 2), "frames": len(records), **details}
+        if isinstance(self.green_time, GreenTimeTable):
+            header["green_table"] = list(self.green_time.table)
+            header["per_extra_car"] = self.green_time.per_extra_car
+        with open(os.path.join(path, "detections.jsonl"), "w", encoding="utf-8") as f:
+            f.write(json.dumps(header) + "\n")
+            for index, (jpeg, record) in enumerate(records):
+                image = cv2.imdecode(jpeg, cv2.IMREAD_COLOR) if len(jpeg) else None
+                if image is None:
+                    image = np.zeros((self.size[1], self.size[0], 3), np.uint8)
+                writer.write(image)
+                f.write(json.dumps({"index": index, **record}) + "\n")
+        writer.release()
+        self.dumps += 1
+        if self.event_log is not None:
+            self.event_log.log("incident", f"[INCIDENT] Saved {len(records)} frames to {path}",
+                               reason=reason, path=path, frames=len(records))
+        self._prune()
+
+    def _prune(self):
+        """Delete the oldest recordings beyond max_dumps / max_bytes."""
+        recordings = []
+        for name in sorted(os.listdir(self.out_dir)):
+            path = os.path.join(self.out_dir, name)
+            if os.path.isfile(os.path.join(path, "detections.jsonl")):
+                size = sum(entry.stat().st_size for entry in os.scandir(path) if entry.is_file())
+                recordings.append((path, size))
+        total = sum(size for _, size in recordings)
+        while recordings and (len(recordings) > self.max_dumps or total > self.max_bytes):
+            path, size = recordings.pop(0)
+            shutil.rmtree(path, ignore_errors=True)
+            total -= size
+            if self.event_log is not None:
+                self.event_log.log("incident", f"[INCIDENT] Deleted old recording {path}", path=path)
+
+    def close(self):
+        self._requests.put(None)
+        self._thread.join(timeout=10)
+
+
+def load_incident(path):
+    """Read a recording's sidecar: returns (header, [frame records])."""
+    with open(os.path.join(path, "detections.jsonl"), encoding="utf-8") as f:
+        header = json.loads(f.readline())
+        records = [json.loads(line) for line in f if line.strip()]
+    return header, records
+
+
+def replay_policy(header):
+    """Green-time policy for a replay: the recording's table, else the one configured in traffic.yaml."""
+    if "green_table" in header:
+        return GreenTimeTable(header["green_table"], header["per_extra_car"])
+    from runtime_config import CONFIG_FILE, load_config
+
+    return load_config(os.environ.get("TRAFFIC_CONFIG", CONFIG_FILE)).timing.policy()
+
+
+def replay_incident(path, show=False, speed=1.0):
+    """
+    Feed the recorded counts through a fresh CycleController with the
+    recording's green-time policy, starting from the recorded phase, and
+    report every frame where its phase differs from the recording. Returns
+    the number of mismatching frames.
+    """
+    header, records = load_incident(path)
+    first = records[0]
+    cycle = CycleController(lambda *args: True, log=print, green_time=replay_policy(header),
+                            now=first["ts"])
+    cycle.restore(first["phase"], first["duration"], first["green_start"])
+    print(f"Replaying {len(records)} frames of '{header['reason']}' "
+          f"({header['width']}x{header['height']} @ {header['fps']} fps)")
+
+    capture = None
+    if show:
+        import cv2
+        capture = cv2.VideoCapture(os.path.join(path, header["video"]))
+
+    mismatches = 0
+    previous = None
+    for record in records:
+        cycle.update(*record["counts"], record["ts"])
+        if cycle.current_cycle_direction != record["phase"]:
+            mismatches += 1
+            print(f"  frame {record['index']:>5} t+{record['ts'] - first['ts']:7.2f}s "
+                  f"counts {record['counts']}: recorded {record['phase']}, "
+                  f"replay {cycle.current_cycle_direction}")
+        if capture is not None:
+            import cv2
+            ret, image = capture.read()
+            if not ret:
+                break
+            for x1, y1, x2, y2, *_ in record["boxes"]:
+                cv2.rectangle(image, (int(x1), int(y1)), (int(x2), int(y2)), (0, 255, 0), 2)
+            cv2.putText(image, f"{record['phase']} {record['counts']}", (10, 30),
+                        cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 255, 0), 2)
+            cv2.imshow("Incident replay", image)
+            delay = (record["ts"] - previous) / speed if previous is not None else 0
+            previous = record["ts"]
+            if cv2.waitKey(max(1, int(delay * 1000))) & 0xFF == ord('q'):
+                break
+    if capture is not None:
+        capture.release()
+        cv2.destroyAllWindows()
+    print(f"{mismatches} of {len(records)} frames differ from the recorded phase")
+    return mismatches
+
+
+def recorder_from_env(event_log=None):
+    """IncidentRecorder sized by TRAFFIC_INCIDENT_SECONDS (default 15, 0 disables)."""
+    seconds = float(os.environ.get("TRAFFIC_INCIDENT_SECONDS", "15"))
+    if seconds <= 0:
+        return None
+    recorder = IncidentRecorder(seconds=seconds, event_log=event_log)
+    if event_log is not None:
+        recorder.watch(event_log)
+    return recorder
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay an incident recording through the controller")
+    parser.add_argument("path", help="incident directory")
+    parser.add_argument("--show", action="store_true", help="play the video with recorded boxes")
+    parser.add_argument("--speed", type=float, default=1.0, help="playback speed for --show")
+    args = parser.parse_args()
+    replay_incident(args.path, args.show, args.speed)
+
+
+if __name__ == "__main__":
+    main()
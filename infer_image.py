@@ -2,6 +2,8 @@ from ultralytics import YOLO
 import cv2
 import os
 
+from zones import DIRECTIONS, IMAGE_ZONES, box_centers, classify_directions, count_directions, load_zone_config
+
 # Load the trained model
 model = YOLO('model/weights/best.pt')
 
@@ -21,17 +23,9 @@ height, width = image.shape[:2]
 vertical_line_x = width // 2
 horizontal_line_y = height // 2
 
-# Define additional south threshold line (below center)
-south_threshold_y = height // 2 + 380  # Adjust this value if needed
-
-# Define additional north threshold line (above center)
-north_threshold_y = height // 2 - 600  # Adjust this value if needed
-
-# Define additional east threshold line (right of center)
-east_threshold_x = width // 2 + 420  # Adjust this value if needed
-
-# Define additional west threshold line (left of center)
-west_threshold_x = width // 2 - 420  # Adjust this value if needed
+# Threshold lines (calibrated with calibrate_zones.py, defaults tuned for the test images)
+zones = load_zone_config(default=IMAGE_ZONES)
+north_threshold_y, south_threshold_y, west_threshold_x, east_threshold_x = zones.thresholds(width, height)
 
 # Draw center lines first
 cv2.line(image, (vertical_line_x, 0), (vertical_line_x, height), (255, 255, 255), 2)  # White vertical
@@ -69,66 +63,15 @@ cv2.putText(image, "EAST", (width - 100, height // 2), cv2.FONT_HERSHEY_SIMPLEX,
 # Perform detection with adjusted parameters
 results = model(image, conf=0.5, iou=0.5)  # Lower confidence for more detections
 
-# Initialize counters
-west_count = 0
-north_count = 0
-south_count = 0
-east_count = 0
-
-# Process each detection
-for i in range(len(results[0].boxes)):
-    bbox = results[0].boxes.xyxy[i]
-    center_x = int((bbox[0] + bbox[2]) / 2)
-    center_y = int((bbox[1] + bbox[3]) / 2)
-    
-    # Determine direction based on position with all four thresholds
-    if center_x < vertical_line_x and center_y < horizontal_line_y:
-        # Top-left quadrant: West or North (apply north and west thresholds)
-        if center_y < north_threshold_y:
-            direction = "North"
-            north_count += 1
-        elif center_x < west_threshold_x:
-            direction = "West"
-            west_count += 1
-        else:
-            direction = "North"
-            north_count += 1
-    elif center_x > vertical_line_x and center_y < horizontal_line_y:
-        # Top-right quadrant: East or North (apply north and east thresholds)
-        if center_y < north_threshold_y:
-            direction = "North"
-            north_count += 1
-        elif center_x > east_threshold_x:
-            direction = "East"
-            east_count += 1
-        else:
-            direction = "North"
-            north_count += 1
-    elif center_x < vertical_line_x and center_y > horizontal_line_y:
-        # Bottom-left quadrant: West or South (apply south and west thresholds)
-        if center_y > south_threshold_y:
-            direction = "South"
-            south_count += 1
-        elif center_x < west_threshold_x:
-            direction = "West"
-            west_count += 1
-        else:
-            direction = "South"
-            south_count += 1
-    else:
-        # Bottom-right quadrant: East or South (apply south and east thresholds)
-        if center_y > south_threshold_y:
-            direction = "South"
-            south_count += 1
-        elif center_x > east_threshold_x:
-            direction = "East"
-            east_count += 1
-        else:
-            direction = "South"
-            south_count += 1
-    
-    # Anotate thne direction on the image
-    cv2.putText(image, direction, (int(bbox[0]), int(bbox[1]) - 10), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (255, 0, 0), 2)
+# Classify every detection into a direction
+boxes = results[0].boxes.xyxy.cpu().numpy()
+center_x, center_y = box_centers(boxes)
+directions = classify_directions(center_x, center_y, width, height, zones)
+north_count, south_count, east_count, west_count = (int(c) for c in count_directions(directions))
+
+for bbox, direction in zip(boxes, directions):
+    # Annotate the direction on the image
+    cv2.putText(image, DIRECTIONS[direction], (int(bbox[0]), int(bbox[1]) - 10), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (255, 0, 0), 2)
 
 # Plot results on image (this will add bounding boxes)
 annotated_image = results[0].plot()
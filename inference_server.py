@@ -0,0 +1,320 @@
+"""
+Local inference service shared by several intersection controllers.
+
+One server process owns the single YOLO model instance. Each controller
+(client) creates a shared-memory ring of frame slots and registers it with
+the server over a local connection. To run a frame the client copies it
+into a free slot and sends the 4-byte slot number; the server reads the
+frame straight out of shared memory, writes the boxes back into the same
+slot and answers with the slot number and box count. Frames and results are
+never pickled: only raw bytes go over the connection.
+
+The server batches requests from all clients: once the first request
+arrives it waits up to max_wait_ms for more (or until max_batch frames are
+queued) and runs them through the model in one call.
+
+Start the server, then point the controllers at it:
+
+    python inference_server.py --max-batch 8 --max-wait-ms 5
+    TRAFFIC_INFERENCE_SERVER=127.0.0.1:6001 python detect_cars.py
+
+bench_inference_server.py load-tests it with 1 to 8 clients.
+"""
+import argparse
+import json
+import os
+import struct
+import threading
+import time
+import uuid
+from multiprocessing import shared_memory
+from multiprocessing.connection import Client, Listener, wait
+
+import numpy as np
+
+MODEL_PATH = "model/weights/best.pt"
+DEFAULT_ADDRESS = ("127.0.0.1", 6001)
+AUTHKEY = b"traffic-infer"
+
+# Per-slot layout: header (height, width, box count, unused) + frame + boxes
+HEADER = struct.Struct("<4i")
+BOX_FIELDS = 6  # x1, y1, x2, y2, confidence, class
+SLOT = struct.Struct("<I")
+REPLY = struct.Struct("<II")
+
+
+def parse_address(text):
+    """'host:port' -> (host, port); anything else is used as a socket path."""
+    if text and ":" in text:
+        host, port = text.rsplit(":", 1)
+        return host, int(port)
+    return text or DEFAULT_ADDRESS
+
+
+def _untrack(shm):
+    """Stop this process's resource tracker from unlinking a segment it only attached to."""
+    try:
+        from multiprocessing import resource_tracker
+        resource_tracker.unregister(shm._name, "shared_memory")
+    except Exception:
+        pass
+
+
+class FrameRing:
+    """Fixed-size shared-memory slots, laid out identically in client and server."""
+
+    def __init__(self, name, slots, max_height, max_width, max_boxes, create=False):
+        self.slots = slots
+        self.max_height = max_height
+        self.max_width = max_width
+        self.max_boxes = max_boxes
+        self.frame_bytes = max_height * max_width * 3
+        self.box_bytes = max_boxes * BOX_FIELDS * 4
+        self.slot_bytes = HEADER.size + self.frame_bytes + self.box_bytes
+        self.shm = shared_memory.SharedMemory(name=name, create=create, size=slots * self.slot_bytes)
+        if not create:
+            _untrack(self.shm)
+        self.name = self.shm.name
+        buf = self.shm.buf
+        self.frames = []
+        self.boxes = []
+        for i in range(slots):
+            base = i * self.slot_bytes
+            self.frames.append(np.ndarray((max_height, max_width, 3), np.uint8, buf, base + HEADER.size))
+            self.boxes.append(np.ndarray((max_boxes, BOX_FIELDS), np.float32, buf,
+                                         base + HEADER.size + self.frame_bytes))
+
+    def write_header(self, slot, height, width, count=0):
+        HEADER.pack_into(self.shm.buf, slot * self.slot_bytes, height, width, count, 0)
+
+    def read_header(self, slot):
+        return HEADER.unpack_from(self.shm.buf, slot * self.slot_bytes)
+
+    def frame(self, slot):
+        height, width, _, _ = self.read_header(slot)
+        return self.frames[slot][:height, :width]
+
+    def describe(self):
+        return {"shm": self.name, "slots": self.slots, "max_height": self.max_height,
+                "max_width": self.max_width, "max_boxes": self.max_boxes}
+
+    def close(self, unlink=False):
+        self.frames.clear()
+        self.boxes.clear()
+        self.shm.close()
+        if unlink:
+            self.shm.unlink()
+
+
+class InferenceClient:
+    """
+    Client side used by a controller.
+
+    infer(frame) blocks until the boxes come back and returns an (N, 6)
+    float32 array of x1, y1, x2, y2, confidence, class. submit()/collect()
+    split that in two so a caller can keep `slots` frames in flight.
+    """
+
+    def __init__(self, address=DEFAULT_ADDRESS, max_height=1080, max_width=1920,
+                 slots=2, max_boxes=300):
+        self.ring = FrameRing(f"traffic_{uuid.uuid4().hex[:12]}", slots, max_height, max_width,
+                              max_boxes, create=True)
+        self.conn = Client(address, authkey=AUTHKEY)
+        self.conn.send_bytes(json.dumps(self.ring.describe()).encode())
+        self.free = list(range(slots))
+
+    def submit(self, frame):
+        """Copy a BGR frame into a free slot and queue it; returns the slot."""
+        height, width = frame.shape[:2]
+        if height > self.ring.max_height or width > self.ring.max_width:
+            raise ValueError(f"frame {width}x{height} exceeds ring size "
+                             f"{self.ring.max_width}x{self.ring.max_height}")
+        slot = self.free.pop()
+        self.ring.frames[slot][:height, :width] = frame
+        self.ring.write_header(slot, height, width)
+        self.conn.send_bytes(SLOT.pack(slot))
+        return slot
+
+    def collect(self):
+        """Wait for the next finished slot; returns (slot, boxes)."""
+        slot, count = REPLY.unpack(self.conn.recv_bytes())
+        boxes = self.ring.boxes[slot][:count].copy()
+        self.free.append(slot)
+        return slot, boxes
+
+    def infer(self, frame):
+        self.submit(frame)
+        return self.collect()[1]
+
+    def close(self):
+        self.conn.close()
+        self.ring.close(unlink=True)
+
+
+class InferenceServer:
+    """Owns the model and serves batched requests from all registered clients."""
+
+    def __init__(self, address=DEFAULT_ADDRESS, model_path=MODEL_PATH, conf=0.55, iou=0.3,
+                 imgsz=416, max_batch=8, max_wait_ms=5.0, model=None):
+        if model is None:
+            from ultralytics import YOLO
+            model = YOLO(model_path)
+        self.model = model
+        self.conf = conf
+        self.iou = iou
+        self.imgsz = imgsz
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1000.0
+        self.listener = Listener(address, authkey=AUTHKEY)
+        self.address = self.listener.address
+        self.clients = {}  # connection -> FrameRing
+        self._new = []
+        self._lock = threading.Lock()
+        self.running = True
+        self.batches = 0
+        self.frames = 0
+
+    def _accept_loop(self):
+        while self.running:
+            try:
+                conn = self.listener.accept()
+                ring = FrameRing(**_ring_args(json.loads(conn.recv_bytes())))
+            except Exception:
+                continue
+            with self._lock:
+                self._new.append((conn, ring))
+
+    def warmup(self):
+        """Run one dummy frame so the first real batch is not slow."""
+        self.model(np.zeros((self.imgsz, self.imgsz, 3), np.uint8), imgsz=self.imgsz, verbose=False)
+
+    def serve_forever(self):
+        threading.Thread(target=self._accept_loop, daemon=True).start()
+        pending = []  # (connection, slot, arrival time)
+        while self.running:
+            with self._lock:
+                for conn, ring in self._new:
+                    self.clients[conn] = ring
+                self._new.clear()
+
+            # Sleep until a request arrives or the oldest pending one is due
+            if pending:
+                timeout = max(0.0, pending[0][2] + self.max_wait - time.perf_counter())
+            else:
+                timeout = 0.05
+            if not self.clients:
+                time.sleep(timeout)
+                continue
+            for conn in wait(list(self.clients), timeout):
+                try:
+                    while conn.poll():
+                        (slot,) = SLOT.unpack(conn.recv_bytes())
+                        pending.append((conn, slot, time.perf_counter()))
+                except (EOFError, OSError):
+                    self._drop(conn)
+                    pending = [p for p in pending if p[0] is not conn]
+
+            if pending and (len(pending) >= self.max_batch
+                            or time.perf_counter() - pending[0][2] >= self.max_wait):
+                batch, pending = pending[:self.max_batch], pending[self.max_batch:]
+                dropped = self._run_batch([(conn, slot) for conn, slot, _ in batch])
+                if dropped:
+                    pending = [p for p in pending if p[0] not in dropped]
+
+    def _run_batch(self, batch):
+        """Infer one batch and reply to each slot; returns the clients dropped on send errors."""
+        frames = [self.clients[conn].frame(slot) for conn, slot in batch]
+        results = self.model(frames, conf=self.conf, iou=self.iou, imgsz=self.imgsz, verbose=False)
+        self.batches += 1
+        self.frames += len(batch)
+        failed = set()
+        for (conn, slot), result in zip(batch, results):
+            if conn in failed:
+                continue  # a client can have several slots in one batch
+            ring = self.clients[conn]
+            boxes = result.boxes.data.cpu().numpy()[:ring.max_boxes]
+            ring.boxes[slot][:len(boxes)] = boxes[:, :BOX_FIELDS]
+            try:
+                conn.send_bytes(REPLY.pack(slot, len(boxes)))
+            except (EOFError, OSError):
+                failed.add(conn)
+        # The frames (and results, via orig_img) are views into the clients' shared
+        # memory, which can't be closed while they exist
+        frames = results = result = None
+        for conn in failed:
+            self._drop(conn)
+        return failed
+
+    def _drop(self, conn):
+        ring = self.clients.pop(conn, None)
+        if ring is not None:
+            ring.close()
+        conn.close()
+
+    def close(self):
+        self.running = False
+        for conn in list(self.clients):
+            self._drop(conn)
+        self.listener.close()
+
+
+def _ring_args(description):
+    return {"name": description["shm"], "slots": description["slots"],
+            "max_height": description["max_height"], "max_width": description["max_width"],
+            "max_boxes": description["max_boxes"]}
+
+
+def client_from_env():
+    """Connect to the server named by TRAFFIC_INFERENCE_SERVER, or return None."""
+    address = os.environ.get("TRAFFIC_INFERENCE_SERVER")
+    if not address:
+        return None
+    return InferenceClient(parse_address(address))
+
+
+def draw_boxes(frame, boxes, color=(0, 255, 0), out=None):
+    """
+    Draw (N, 6) boxes on a copy of the frame (stand-in for results[0].plot()).
+    The copy goes into `out` when given (e.g. a FramePool buffer).
+    """
+    import cv2
+
+    if out is None:
+        annotated = frame.copy()
+    else:
+        annotated = out
+        np.copyto(annotated, frame)
+    for x1, y1, x2, y2, conf, _ in boxes:
+        cv2.rectangle(annotated, (int(x1), int(y1)), (int(x2), int(y2)), color, 2)
+        cv2.putText(annotated, f"car {conf:.2f}", (int(x1), int(y1) - 4),
+                    cv2.FONT_HERSHEY_SIMPLEX, 0.5, color, 1)
+    return annotated
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Shared-memory YOLO inference server")
+    parser.add_argument("--address", default="127.0.0.1:6001", help="host:port or socket path")
+    parser.add_argument("--model", default=MODEL_PATH)
+    parser.add_argument("--conf", type=float, default=0.55)
+    parser.add_argument("--iou", type=float, default=0.3)
+    parser.add_argument("--imgsz", type=int, default=416)
+    parser.add_argument("--max-batch", type=int, default=8)
+    parser.add_argument("--max-wait-ms", type=float, default=5.0)
+    args = parser.parse_args()
+
+    server = InferenceServer(parse_address(args.address), args.model, args.conf, args.iou,
+                             args.imgsz, args.max_batch, args.max_wait_ms)
+    server.warmup()
+    print(f"✓ Inference server listening on {args.address} "
+          f"(batch ≤ {args.max_batch}, wait ≤ {args.max_wait_ms} ms)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        print(f"Served {server.frames} frames in {server.batches} batches")
+        server.close()
+
+
+if __name__ == "__main__":
+    main()
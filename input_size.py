@@ -0,0 +1,327 @@
+"""
+Model input size chosen from scene density.
+
+The controllers ran YOLO at a fixed imgsz=416. An empty street does not
+need that, and a jam of touching cars needs more to separate them.
+AdaptiveDetector keeps one LocalDetector per size (default 320, 416, 640).
+Each has its own preallocated letterbox and is warmed up at start-up, so
+switching sizes costs nothing. Over a sliding window of frames
+InputSizePolicy looks at:
+
+    count     cars per frame (mean over the window)
+    smallest  10th percentile of the box short side, in model input pixels
+              at the current size
+    touching  share of boxes overlapping another box
+
+and steps one size up when the scene is dense (count >= dense_count,
+touching >= dense_touching) or boxes get too small to detect reliably
+(smallest < min_box_px). It steps down when the scene is sparse (down to
+the smallest size only at sparse_count cars or fewer) and the boxes would
+still be large enough at the smaller size. After a change it
+holds the new size for `hold` frames.
+
+Fewer cars at a small size could also mean cars are being missed, so the
+detector probes: every probe_every frames it also runs the largest size on
+the same frame. The count ratio (current / largest) estimates the recall
+it is giving up. A ratio below min_recall forces a step up, and the size
+is not tried again for `retry` frames. summary()
+reports the trade-off per size: frames used, latency and probe recall.
+
+Enable it with TRAFFIC_IMGSZ=auto (or a list such as 320,416,640); a
+single number fixes the size (default 416, as before).
+
+Benchmark fixed sizes against auto on a sparse and a dense clip (video
+files or incident recordings), using the largest size as the reference
+count:
+
+    python input_size.py --clip sparse.avi --clip dense.avi
+"""
+import argparse
+import os
+import time
+from collections import deque
+
+import numpy as np
+
+from inference_server import MODEL_PATH
+from preprocess import LocalDetector
+
+SIZES = (320, 416, 640)
+
+
+def box_stats(detections, ratio):
+    """(count, 10th percentile box short side in model pixels, share of boxes touching another)."""
+    count = len(detections)
+    if count == 0:
+        return 0, np.inf, 0.0
+    boxes = detections[:, :4]
+    sides = np.minimum(boxes[:, 2] - boxes[:, 0], boxes[:, 3] - boxes[:, 1]) * ratio
+    smallest = float(np.percentile(sides, 10))
+    if count == 1:
+        return count, smallest, 0.0
+    # Pairwise intersection widths/heights; a box touches another if both are positive
+    overlap_w = np.minimum(boxes[:, None, 2], boxes[None, :, 2]) - np.maximum(boxes[:, None, 0], boxes[None, :, 0])
+    overlap_h = np.minimum(boxes[:, None, 3], boxes[None, :, 3]) - np.maximum(boxes[:, None, 1], boxes[None, :, 1])
+    touching = (overlap_w > 0) & (overlap_h > 0)
+    np.fill_diagonal(touching, False)
+    return count, smallest, float(touching.any(axis=1).mean())
+
+
+class InputSizePolicy:
+    """
+    sizes: candidate input sizes, ascending
+    window: frames of detection statistics a decision looks at
+    hold: frames to stay at a size after switching
+    dense_count / dense_touching: step up at or above these
+    sparse_count: step down to the smallest size at or below this mean count (to
+        the other sizes at half of dense_count)...
+    min_box_px: ...if boxes stay at least twice this size at the smaller input
+    min_recall: step up when a probe finds the current size sees fewer cars than this share
+    retry: frames before stepping down again to a size that failed a probe
+    """
+
+    def __init__(self, sizes=SIZES, start=416, window=15, hold=30, dense_count=12, dense_touching=0.3,
+                 sparse_count=3, min_box_px=12, min_recall=0.9, retry=1800):
+        self.sizes = tuple(sorted(sizes))
+        self.index = self.sizes.index(start) if start in self.sizes else len(self.sizes) // 2
+        self.window = window
+        self.hold = hold
+        self.dense_count = dense_count
+        self.dense_touching = dense_touching
+        self.sparse_count = sparse_count
+        self.min_box_px = min_box_px
+        self.min_recall = min_recall
+        self.retry = retry
+        self.failed = {}  # size -> frame its last probe fell below min_recall
+        self.frames = 0
+        self.stats = deque(maxlen=window)
+        self.since_change = 0
+        self.recall = None  # last probe's count ratio at the current size
+        self.reason = "start"
+
+    @property
+    def size(self):
+        return self.sizes[self.index]
+
+    def observe(self, count, smallest, touching):
+        """Add one frame's box_stats(); returns the size for the next frame."""
+        self.stats.append((count, smallest, touching))
+        self.frames += 1
+        self.since_change += 1
+        if self.since_change < self.hold or len(self.stats) < self.window:
+            return self.size
+        counts, smallest, touching = (np.array(column, float) for column in zip(*self.stats))
+        mean_count = counts.mean()
+        smallest = smallest.min()
+        touching = touching.mean()
+        top = self.index == len(self.sizes) - 1
+        if not top and self.recall is not None and self.recall < self.min_recall:
+            self.failed[self.size] = self.frames
+            return self._step(+1, f"probe recall {self.recall:.0%}")
+        if not top and mean_count >= self.dense_count:
+            return self._step(+1, f"dense: {mean_count:.1f} cars")
+        if not top and touching >= self.dense_touching:
+            return self._step(+1, f"dense: {touching:.0%} of boxes touching")
+        if not top and smallest < self.min_box_px:
+            return self._step(+1, f"small boxes: {smallest:.0f} px")
+        # The smallest size is for sparse scenes; the ones between need half the dense count
+        limit = self.sparse_count if self.index == 1 else self.dense_count / 2
+        if self.index > 0 and mean_count <= limit and touching < self.dense_touching / 2:
+            lower = self.sizes[self.index - 1]
+            failed = self.failed.get(lower)
+            if smallest * lower / self.size >= 2 * self.min_box_px and (
+                    failed is None or self.frames - failed >= self.retry):
+                return self._step(-1, f"sparse: {mean_count:.1f} cars, smallest box {smallest:.0f} px")
+        return self.size
+
+    def probed(self, count, reference):
+        """Record a probe: `count` cars at the current size, `reference` at the largest."""
+        self.recall = min(count, reference) / reference if reference else 1.0
+
+    def _step(self, direction, reason):
+        self.index += direction
+        self.since_change = 0
+        self.stats.clear()
+        self.recall = None
+        self.reason = reason
+        return self.size
+
+
+class AdaptiveDetector:
+    """
+    LocalDetector per input size with an InputSizePolicy choosing between
+    them; same infer(frame) as LocalDetector.
+
+    probe_every: frames between probes at the largest size (0 disables)
+    event_log: optional EventLog for size changes
+    """
+
+    def __init__(self, model, sizes=SIZES, start=416, conf=0.55, iou=0.3, probe_every=150,
+                 event_log=None, warmup=2, **policy):
+        self.policy = InputSizePolicy(sizes, start, **policy)
+        self.detectors = {size: LocalDetector(model, imgsz=size, conf=conf, iou=iou)
+                          for size in self.policy.sizes}
+        self.probe_every = probe_every
+        self.event_log = event_log
+        self.frames = 0
+        # Per size: frames, inference seconds, probe counts (current size, largest size)
+        self.usage = {size: [0, 0.0, 0, 0] for size in self.policy.sizes}
+        self.warm_up(warmup)
+
+    def warm_up(self, frames=2, shape=(480, 640, 3)):
+        """Run every size on a blank frame so buffers and model caches exist before the first switch."""
+        blank = np.zeros(shape, np.uint8)
+        for detector in self.detectors.values():
+            for _ in range(frames):
+                detector.infer(blank)
+
+    @property
+    def imgsz(self):
+        return self.policy.size
+
+    def set_thresholds(self, conf, iou):
+        for detector in self.detectors.values():
+            detector.set_thresholds(conf, iou)
+
+    def infer(self, frame):
+        size = self.policy.size
+        detector = self.detectors[size]
+        start = time.perf_counter()
+        detections = detector.infer(frame)
+        usage = self.usage[size]
+        usage[0] += 1
+        usage[1] += time.perf_counter() - start
+        self.frames += 1
+        largest = self.policy.sizes[-1]
+        if self.probe_every and size != largest and self.frames % self.probe_every == 0:
+            reference = len(self.detectors[largest].infer(frame))
+            self.policy.probed(len(detections), reference)
+            usage[2] += len(detections)
+            usage[3] += reference
+        new_size = self.policy.observe(*box_stats(detections, detector.letterbox.ratio))
+        if new_size != size and self.event_log is not None:
+            self.event_log.log("detector", f"[DETECT] Input size {size} -> {new_size} ({self.policy.reason})",
+                               imgsz=new_size, reason=self.policy.reason)
+        return detections
+
+    def summary(self):
+        """{size: (share of frames, mean inference ms, probe recall or None)}."""
+        result = {}
+        for size, (frames, seconds, count, reference) in self.usage.items():
+            recall = count / reference if reference else None
+            result[size] = (frames / max(self.frames, 1), seconds / frames * 1000 if frames else None, recall)
+        return result
+
+    def format_summary(self):
+        parts = []
+        for size, (share, ms, recall) in self.summary().items():
+            if share:
+                recall_text = f", recall {recall:.0%} vs {self.policy.sizes[-1]}" if recall is not None else ""
+                parts.append(f"{size}: {share:.0%} of frames, {ms:.1f} ms{recall_text}")
+        return f"Input size {self.imgsz} ({self.policy.reason}); " + "; ".join(parts)
+
+
+def parse_imgsz(setting):
+    """Normalized input size setting: '416', 'auto' or an ascending list like '320,416,640'."""
+    if isinstance(setting, (list, tuple)):
+        setting = ",".join(str(size) for size in setting)
+    setting = str(setting).strip().lower()
+    if setting == "auto":
+        return setting
+    try:
+        sizes = [int(size) for size in setting.split(",")]
+    except ValueError:
+        raise ValueError(f"input size {setting!r} is not a number, a list of numbers or 'auto'") from None
+    if any(size % 32 or not 128 <= size <= 1280 for size in sizes):
+        raise ValueError(f"input sizes must be multiples of 32 between 128 and 1280, got {setting}")
+    if sizes != sorted(set(sizes)):
+        raise ValueError(f"input sizes must be listed smallest first without repeats, got {setting}")
+    return ",".join(str(size) for size in sizes)
+
+
+def build_detector(model, setting, conf=0.55, iou=0.3, event_log=None):
+    """LocalDetector for one size ('416'), or AdaptiveDetector for 'auto' or a list of sizes."""
+    setting = parse_imgsz(setting)
+    if setting == "auto":
+        return AdaptiveDetector(model, conf=conf, iou=iou, event_log=event_log)
+    sizes = [int(size) for size in setting.split(",")]
+    if len(sizes) == 1:
+        return LocalDetector(model, imgsz=sizes[0], conf=conf, iou=iou)
+    return AdaptiveDetector(model, sizes=sizes, start=sizes[len(sizes) // 2], conf=conf, iou=iou,
+                            event_log=event_log)
+
+
+def detector_from_env(model, conf=0.55, iou=0.3, event_log=None, imgsz=None):
+    """build_detector at TRAFFIC_IMGSZ (default imgsz or 416): a size, 'auto' or a list of sizes."""
+    return build_detector(model, os.environ.get("TRAFFIC_IMGSZ", str(imgsz or 416)), conf, iou, event_log)
+
+
+def read_clip(path, width=640, height=480, limit=None):
+    """Frames of a video file or an incident recording directory, resized to webcam resolution."""
+    import cv2
+
+    if os.path.isdir(path):
+        path = os.path.join(path, "video.avi")
+    cap = cv2.VideoCapture(path)
+    frames = []
+    while limit is None or len(frames) < limit:
+        ret, frame = cap.read()
+        if not ret:
+            break
+        frames.append(cv2.resize(frame, (width, height)))
+    cap.release()
+    if not frames:
+        raise SystemExit(f"Could not read frames from {path}")
+    return frames
+
+
+def bench_clip(model, frames, sizes, probe_every):
+    """Fixed sizes and auto on one clip: mean/p95 ms and count error against the largest size."""
+    fixed = {}
+    for size in sizes:
+        detector = LocalDetector(model, imgsz=size)
+        detector.infer(frames[0])
+        times, counts = [], []
+        for frame in frames:
+            start = time.perf_counter()
+            counts.append(len(detector.infer(frame)))
+            times.append(time.perf_counter() - start)
+        fixed[size] = (np.array(times) * 1000, np.array(counts))
+    reference = fixed[max(sizes)][1]
+    adaptive = AdaptiveDetector(model, sizes=sizes, probe_every=probe_every)
+    times, counts = [], []
+    for frame in frames:
+        start = time.perf_counter()
+        counts.append(len(adaptive.infer(frame)))
+        times.append(time.perf_counter() - start)
+    rows = [(str(size), ms, counts) for size, (ms, counts) in fixed.items()]
+    rows.append(("auto", np.array(times) * 1000, np.array(counts)))
+    for name, ms, counts in rows:
+        error = np.abs(counts - reference).mean()
+        recall = np.minimum(counts, reference).sum() / max(reference.sum(), 1)
+        print(f"  {name:>5}: {ms.mean():7.1f} ms mean, {np.percentile(ms, 95):7.1f} ms p95, "
+              f"{counts.mean():5.1f} cars/frame, count error {error:4.2f}, recall vs {max(sizes)} {recall:.0%}")
+    print(f"  {adaptive.format_summary()}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fixed vs density-adaptive model input size")
+    parser.add_argument("--clip", action="append", required=True,
+                        help="video file or incident directory (repeatable, e.g. a sparse and a dense clip)")
+    parser.add_argument("--sizes", default=",".join(str(size) for size in SIZES))
+    parser.add_argument("--frames", type=int, default=600, help="frames per clip")
+    parser.add_argument("--probe-every", type=int, default=150)
+    args = parser.parse_args()
+
+    from ultralytics import YOLO
+
+    model = YOLO(MODEL_PATH)
+    sizes = sorted(int(size) for size in args.sizes.split(","))
+    for clip in args.clip:
+        frames = read_clip(clip, limit=args.frames)
+        print(f"{clip}: {len(frames)} frames")
+        bench_clip(model, frames, sizes, args.probe_every)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,140 @@
+"""
+The controllers' lamp command path to the ESP32.
+
+detect_cars.py, traffic_light_gui.py and the emulator check
+(esp32_emulator.py check) all send through LampControl, so the check
+exercises the same send, reconnect and resync code the controllers run:
+
+    send_paired(lane1, lane2, color)   the send_paired function handed to
+                                       CycleController and Preemption
+    resync()                           called about once a second from the
+                                       frame loop: sends the current phase
+                                       again if the ESP32 may not be showing
+                                       it (port reopened, board reset, or the
+                                       lamps in its last framed reply disagree)
+
+send_paired() never reopens the port: it runs under the preemption lock,
+and open() waits `settle` seconds for the board to boot, which would hold
+up a preempt request by as long. A closed port is reopened by resync()
+before it takes the lock. resync() checks and sends under the preemption
+lock, so a preempt request arriving on another thread can't be overwritten
+by the normal phase.
+"""
+import time
+
+from preemption import PAIRS
+
+MESSAGES = {
+    "console": {
+        "sent": "✓ Sent: {lanes} {color}",
+        "error": "✗ Serial error: {error}",
+        "closed": "✗ Serial connection not available - attempting to reconnect...",
+        "reconnected": "✓ Reconnected to ESP32 on {port} ({protocol})",
+        "reconnect_failed": "✗ Reconnection failed: {error}",
+        "resync": "↻ Resending {direction} phase to the ESP32",
+    },
+    "gui": {
+        "sent": "[SENT] >>> {lanes} {color}",
+        "error": "[ERROR] Serial error: {error}",
+        "closed": "[ERROR] Serial connection not available - attempting to reconnect...",
+        "reconnected": "[SYSTEM] ✓ Reconnected to ESP32 on {port} ({protocol})",
+        "reconnect_failed": "[ERROR] ✗ Reconnection failed: {error}",
+        "resync": "[SYSTEM] Resending {direction} phase to the ESP32",
+    },
+}
+
+
+class LampControl:
+    """
+    port: callable returning the current FramedPort (runtime_config.py can swap it)
+    cycle / preemption: set once they exist (they take send_paired, so they come later)
+    reconnect: resync() reopens a closed port (detect_cars.py); False leaves it closed (GUI)
+    tracer / metrics / event_log: optional, as in the controllers
+    messages: "console" or "gui" wording for the event log
+    """
+
+    def __init__(self, port, reconnect=True, settle=1.0, tracer=None, metrics=None, event_log=None,
+                 messages="console"):
+        self.port = port
+        self.reconnect = reconnect
+        self.settle = settle
+        self.tracer = tracer
+        self.metrics = metrics
+        self.event_log = event_log
+        self.messages = MESSAGES[messages]
+        self.cycle = None
+        self.preemption = None
+        self.sent = 0
+        self.failed = 0
+        self.reconnects = 0
+        self.resyncs = 0
+
+    def send_paired(self, lane1, lane2, color):
+        """Send "S1:S4:GREEN"-style paired commands; returns False if they could not be written."""
+        ser = self.port()
+        if not ser.is_open:
+            return False  # resync() reopens it and sends the current phase
+        try:
+            write_start = time.perf_counter()
+            ser.send([((lane1, lane2), color)])
+            if self.tracer is not None:
+                self.tracer.command_sent((lane1, lane2), color, write_start, time.perf_counter())
+            self.sent += 1
+            if self.metrics is not None:
+                self.metrics.commands_sent.inc()
+            self._log("serial_tx", "sent", lanes=f"{lane1} & {lane2}", color=color,
+                      command=f"{lane1}:{lane2}:{color}")
+            return True
+        except OSError as e:  # serial.SerialException is an OSError
+            self.failed += 1
+            if self.metrics is not None:
+                self.metrics.commands_failed.inc()
+            self._log("error", "error", error=e)
+            return False
+
+    def reopen(self, ser):
+        """Reopen a closed port (not under any lock: open() blocks for `settle` seconds)."""
+        if ser.is_open or not self.reconnect:
+            return False
+        self._log("error", "closed", reconnect=True)
+        if self.metrics is not None:
+            self.metrics.reconnects.inc()
+        try:
+            ser.open(settle=self.settle)
+        except OSError as e:  # serial.SerialException is an OSError
+            self._log("error", "reconnect_failed", port=ser.port, error=e, reconnect=True)
+            return False
+        self.reconnects += 1
+        self._log("system", "reconnected", port=ser.port, protocol=ser.describe())
+        return True
+
+    def resync(self):
+        """
+        Send the current phase again if the ESP32 may not be showing it (not
+        during preemption or a manual FORCE RED ALL).
+        """
+        ser = self.port()
+        reopened = self.reopen(ser)
+        with self.preemption.batch(ser):
+            if self.preemption.active is not None or self.preemption.holding_all_red():
+                return False
+            direction = self.cycle.current_cycle_direction
+            on, off = (PAIRS["EW"], PAIRS["NS"]) if direction == "EW" else (PAIRS["NS"], PAIRS["EW"])
+            if not ser.is_open:
+                return False
+            if not reopened and not ser.rebooted and ser.shows(on) is not False:
+                return False
+            self.resyncs += 1
+            self._log("system", "resync", direction=direction)
+            ser.rebooted = False
+            self.send_paired(*on, "GREEN")
+            self.send_paired(*off, "RED")
+            return True
+
+    def _log(self, kind, message, **fields):
+        if self.event_log is None:
+            return
+        text = self.messages[message].format(**fields)
+        fields = {key: value for key, value in fields.items()
+                  if key not in ("lanes", "color", "protocol", "error")}
+        self.event_log.log(kind, text, **fields)
@@ -0,0 +1,202 @@
+"""
+End-to-end latency tracing from camera frame to ESP32 lamp switch.
+
+Each frame gets a FrameTrace that is stamped as it moves through the
+pipeline (capture, inference, zone counting, timing decision). Serial
+writes made while a frame is current are tied to that frame, and the
+ESP32's replies close the loop:
+
+    "< Received: S1:S4:GREEN"   the firmware loop picked the line up
+    "OK: S1 & S4 GREEN"         handleSerialCommand has set the pins
+
+so every switch yields capture -> lamp latency, split into stages. Stage
+samples are kept in bounded windows and reported as p50/p95/p99.
+
+Tracing is off unless TRAFFIC_TRACE=1 is set (or enabled=True is passed);
+when off, start_frame() hands out a shared no-op trace and the serial hooks
+return immediately.
+"""
+import os
+import threading
+import time
+from collections import deque
+
+import numpy as np
+
+# Per-frame stages, in pipeline order
+FRAME_STAGES = ("capture", "inference", "zones", "decision")
+# Per-command stages, measured from the serial write
+SWITCH_STAGES = ("serial_write", "firmware_rx", "firmware_ack", "end_to_end")
+STAGES = FRAME_STAGES + ("frame_total",) + SWITCH_STAGES
+
+
+class FrameTrace:
+    """Timestamps (perf_counter seconds) for one frame."""
+    __slots__ = ("start", "stamps")
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.stamps = []
+
+    def mark(self, stage):
+        self.stamps.append((stage, time.perf_counter()))
+
+
+class _NullTrace:
+    """Shared trace used when tracing is off; marking it does nothing."""
+    __slots__ = ()
+    start = 0.0
+    stamps = ()
+
+    def mark(self, stage):
+        pass
+
+
+NULL_TRACE = _NullTrace()
+
+
+def command_key(lanes, color):
+    """Key used to match a sent command with its reply, e.g. 'S1:S4:GREEN'."""
+    return ":".join([*lanes, color])
+
+
+def parse_reply(line):
+    """
+    Map an ESP32 reply line to ('rx' | 'ack', key), or None.
+
+    '< Received: S1:S4:GREEN' -> ('rx', 'S1:S4:GREEN')
+    'OK: S1 & S4 GREEN'       -> ('ack', 'S1:S4:GREEN')
+    """
+    if line.startswith("< Received:"):
+        return "rx", line.split(":", 1)[1].strip()
+    if line.startswith("OK:"):
+        words = line[3:].replace("&", " ").split()
+        if len(words) >= 2:
+            return "ack", command_key(words[:-1], words[-1])
+    return None
+
+
+class LatencyTracer:
+    """Collects stage latencies and correlates serial commands with replies."""
+
+    def __init__(self, enabled=None, window=1000):
+        if enabled is None:
+            enabled = os.environ.get("TRAFFIC_TRACE") == "1"
+        self.enabled = enabled
+        self.samples = {stage: deque(maxlen=window) for stage in STAGES}
+        self.current = NULL_TRACE
+        # key -> FIFO of [frame trace, write start, write end, rx time]
+        self._pending = {}
+        self._lock = threading.Lock()
+
+    def start_frame(self):
+        """Begin tracing a new frame; it becomes the current frame."""
+        self.current = FrameTrace() if self.enabled else NULL_TRACE
+        return self.current
+
+    def finish_frame(self, trace):
+        """Record the stage durations of a finished frame."""
+        if trace is NULL_TRACE:
+            return
+        previous = trace.start
+        for stage, stamp in trace.stamps:
+            if stage in self.samples:
+                self.samples[stage].append(stamp - previous)
+            previous = stamp
+        self.samples["frame_total"].append(previous - trace.start)
+
+    def command_sent(self, lanes, color, write_start, write_end):
+        """Called after a serial write; ties the command to the current frame."""
+        if not self.enabled:
+            return
+        self.samples["serial_write"].append(write_end - write_start)
+        entry = [self.current, write_start, write_end, None]
+        with self._lock:
+            self._pending.setdefault(command_key(lanes, color), deque(maxlen=16)).append(entry)
+
+    def on_reply(self, line, now=None):
+        """Feed one line read from the ESP32."""
+        if not self.enabled:
+            return
+        reply = parse_reply(line)
+        if reply is None:
+            return
+        now = time.perf_counter() if now is None else now
+        kind, key = reply
+        with self._lock:
+            queue = self._pending.get(key)
+            if not queue:
+                return
+            if kind == "rx":
+                # Oldest command of this kind still waiting for its echo
+                for entry in queue:
+                    if entry[3] is None:
+                        entry[3] = now
+                        break
+                return
+            trace, write_start, write_end, rx = queue.popleft()
+        if rx is not None:
+            self.samples["firmware_rx"].append(rx - write_end)
+            self.samples["firmware_ack"].append(now - rx)
+        if trace is not NULL_TRACE:
+            self.samples["end_to_end"].append(now - trace.start)
+
+    def percentiles(self):
+        """Return {stage: (p50, p95, p99, count)} in milliseconds."""
+        summary = {}
+        for stage, values in self.samples.items():
+            if values:
+                p50, p95, p99 = np.percentile(np.fromiter(values, float), (50, 95, 99)) * 1000
+                summary[stage] = (p50, p95, p99, len(values))
+        return summary
+
+    def format_summary(self):
+        """Multi-line p50/p95/p99 table for the log or the GUI."""
+        if not self.enabled:
+            return "Latency tracing off (set TRAFFIC_TRACE=1)"
+        summary = self.percentiles()
+        if not summary:
+            return "Latency: no samples yet"
+        lines = [f"{'stage':<13}{'p50':>7}{'p95':>7}{'p99':>7}  ms"]
+        for stage in STAGES:
+            if stage in summary:
+                p50, p95, p99, _ = summary[stage]
+                lines.append(f"{stage:<13}{p50:>7.1f}{p95:>7.1f}{p99:>7.1f}")
+        return "\n".join(lines)
+
+
+class ReplyReader(threading.Thread):
+    """
+    Background thread that reads ESP32 reply lines and hands them to the
+    tracer (and an optional callback). get_serial returns the current port,
+    so it keeps working across reconnects.
+    """
+
+    def __init__(self, get_serial, tracer, on_line=None):
+        super().__init__(daemon=True)
+        self.get_serial = get_serial
+        self.tracer = tracer
+        self.on_line = on_line
+        self.running = True
+
+    def run(self):
+        while self.running:
+            ser = self.get_serial()
+            if ser is None or not ser.is_open:
+                time.sleep(0.1)
+                continue
+            try:
+                raw = ser.readline()
+            except Exception:
+                time.sleep(0.1)
+                continue
+            if not raw:
+                continue
+            now = time.perf_counter()
+            line = raw.decode(errors="replace").strip()
+            self.tracer.on_reply(line, now)
+            if self.on_line is not None:
+                self.on_line(line)
+
+    def stop(self):
+        self.running = False
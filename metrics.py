@@ -0,0 +1,216 @@
+"""
+Prometheus-style metrics for the controller process.
+
+Counters, gauges and histograms are plain Python objects updated from the
+detection loop without locks:
+
+- Counter keeps one cell per updating thread and sums them when scraped,
+  so increments from the detection, serial-reply and GUI threads never race.
+- Gauge.set is a single attribute assignment.
+- Histogram is written only by the detection thread.
+
+The optional HTTP endpoint runs in its own daemon thread and only reads
+those values, so a scrape never blocks inference. It is started when
+TRAFFIC_METRICS_PORT is set:
+
+    TRAFFIC_METRICS_PORT=9100 python traffic_light_gui.py
+    curl http://localhost:9100/metrics
+"""
+import bisect
+import os
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Inference latency buckets (seconds)
+INFERENCE_BUCKETS = (0.01, 0.025, 0.05, 0.075, 0.1, 0.15, 0.2, 0.3, 0.5, 1.0)
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{k}="{v}"' for k, v in labels.items()) + "}"
+
+
+class Counter:
+    """Monotonic counter with one lock-free cell per updating thread."""
+
+    def __init__(self, name, help_text):
+        self.name = name
+        self.help = help_text
+        self._local = threading.local()
+        self._cells = []
+
+    def inc(self, amount=1):
+        try:
+            cell = self._local.cell
+        except AttributeError:
+            cell = self._local.cell = [0]
+            self._cells.append(cell)
+        cell[0] += amount
+
+    @property
+    def value(self):
+        return sum(cell[0] for cell in list(self._cells))
+
+    def render(self):
+        return [f"# HELP {self.name} {self.help}",
+                f"# TYPE {self.name} counter",
+                f"{self.name} {self.value}"]
+
+
+class Gauge:
+    """Gauge with optional labels, e.g. Gauge(..., label="direction")."""
+
+    def __init__(self, name, help_text, label=None):
+        self.name = name
+        self.help = help_text
+        self.label = label
+        self.value = 0
+        self._children = {}
+
+    def set(self, value):
+        self.value = value
+
+    def labels(self, value):
+        child = self._children.get(value)
+        if child is None:
+            child = self._children[value] = Gauge(self.name, self.help)
+        return child
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} gauge"]
+        if self.label is None:
+            lines.append(f"{self.name} {self.value}")
+        for key, child in list(self._children.items()):
+            lines.append(f"{self.name}{_format_labels({self.label: key})} {child.value}")
+        return lines
+
+
+class Histogram:
+    """Cumulative-bucket histogram; observe() from a single thread only."""
+
+    def __init__(self, name, help_text, buckets):
+        self.name = name
+        self.help = help_text
+        self.buckets = tuple(buckets)
+        self._counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self._counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        counts = list(self._counts)
+        cumulative = 0
+        for bound, n in zip(self.buckets, counts):
+            cumulative += n
+            lines.append(f'{self.name}_bucket{{le="{bound}"}} {cumulative}')
+        lines.append(f'{self.name}_bucket{{le="+Inf"}} {cumulative + counts[-1]}')
+        lines.append(f"{self.name}_sum {self.sum}")
+        lines.append(f"{self.name}_count {self.count}")
+        return lines
+
+
+class Registry:
+    """Ordered set of metrics rendered in the Prometheus text format."""
+
+    def __init__(self):
+        self.metrics = []
+
+    def add(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def counter(self, name, help_text):
+        return self.add(Counter(name, help_text))
+
+    def gauge(self, name, help_text, label=None):
+        return self.add(Gauge(name, help_text, label))
+
+    def histogram(self, name, help_text, buckets):
+        return self.add(Histogram(name, help_text, buckets))
+
+    def render(self):
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+class ControllerMetrics:
+    """The metrics exported by detect_cars.py and traffic_light_gui.py."""
+
+    def __init__(self):
+        r = self.registry = Registry()
+        self.frames_captured = r.counter("traffic_frames_captured_total", "Frames read from the camera")
+        self.frames_inferred = r.counter("traffic_frames_inferred_total", "Frames run through the detector")
+        self.frames_dropped = r.counter("traffic_frames_dropped_total", "Frames captured but not inferred")
+        self.inference_seconds = r.histogram("traffic_inference_seconds", "Detector latency per frame",
+                                             INFERENCE_BUCKETS)
+        self.approach_cars = r.gauge("traffic_approach_cars", "Cars detected per approach in the last frame",
+                                     label="direction")
+        self.phase_green = r.gauge("traffic_phase_green", "1 if the direction pair currently has green",
+                                   label="direction")
+        self.phase_remaining = r.gauge("traffic_phase_remaining_seconds", "Seconds left on the current green")
+        self.commands_sent = r.counter("traffic_serial_commands_sent_total", "Commands written to the ESP32")
+        self.commands_acked = r.counter("traffic_serial_commands_acked_total", "OK: replies from the ESP32")
+        self.commands_failed = r.counter("traffic_serial_commands_failed_total",
+                                         "Serial write errors and ERROR: replies")
+        self.reconnects = r.counter("traffic_serial_reconnects_total", "Serial reconnect attempts")
+
+    def observe_frame(self, north, south, east, west, cycle, now):
+        """Update the per-frame gauges after the timing decision."""
+        self.approach_cars.labels("north").set(north)
+        self.approach_cars.labels("south").set(south)
+        self.approach_cars.labels("east").set(east)
+        self.approach_cars.labels("west").set(west)
+        direction = cycle.current_cycle_direction
+        self.phase_green.labels("EW").set(1 if direction == "EW" else 0)
+        self.phase_green.labels("NS").set(1 if direction == "NS" else 0)
+        self.phase_remaining.set(round(cycle.remaining(1 if direction == "EW" else 2, now), 2))
+
+    def on_reply(self, line):
+        """Count ESP32 replies (used as a ReplyReader callback)."""
+        if line.startswith("OK:"):
+            self.commands_acked.inc()
+        elif line.startswith("ERROR"):
+            self.commands_failed.inc()
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    registry = None
+
+    def do_GET(self):
+        if self.path.split("?")[0] not in ("/", "/metrics"):
+            self.send_error(404)
+            return
+        body = self.registry.render().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass  # keep scrapes out of the console
+
+
+def start_metrics_server(registry, port, host="0.0.0.0"):
+    """Serve registry on http://host:port/metrics from a daemon thread."""
+    handler = type("MetricsHandler", (_MetricsHandler,), {"registry": registry})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def start_from_env(registry):
+    """Start the endpoint if TRAFFIC_METRICS_PORT is set; returns the server or None."""
+    port = os.environ.get("TRAFFIC_METRICS_PORT")
+    if not port:
+        return None
+    return start_metrics_server(registry, int(port))
@@ -0,0 +1,308 @@
+"""
+Model size / input resolution sweep with a latency-accuracy Pareto report.
+
+model/ holds a single training run (yolov8n at 416). This trains every
+combination of --models and --imgsz on the same data.yaml, with the same
+seed and hyperparameters as model/args.yaml. Each variant is validated
+(mAP50, mAP50-95 on --split) and timed on the CPU through the controller's
+own LocalDetector path. Runs are resumable: a variant whose weights
+already exist is not trained again.
+
+The dataset is decoded once and reused by every run. Training uses
+ultralytics' dataset cache (--cache disk keeps decoded .npy files next to
+the images between runs; --cache ram holds them for one run). The latency
+frames (the split's images resized to 640x480) are kept in a memory-mapped
+array, sweeps/frames_640x480.npy. sweeps/frames_640x480.json records the
+images it holds, and the array is rebuilt when --data, --split or --frames
+select different ones.
+
+    sweeps/results.json   one entry per variant, plus the machine fingerprint
+    sweeps/pareto.txt     table sorted by latency; * marks the Pareto front
+    sweeps/pareto.png     mAP50-95 vs CPU p50 (needs matplotlib)
+
+Latency depends on the machine, so time the trained variants again on the
+controller box before relying on a budget there:
+
+    python model_sweep.py train --models yolov8n.pt,yolov8s.pt --imgsz 320,416,640 --epochs 50
+    python model_sweep.py latency          # re-time sweeps/results.json on this machine
+    python model_sweep.py pick --budget-ms 40
+
+The controllers pick a variant automatically with
+TRAFFIC_LATENCY_BUDGET_MS=40: the most accurate Pareto variant with a CPU p50
+within the budget, run at its own input size (unless TRAFFIC_IMGSZ is set).
+"""
+import argparse
+import json
+import os
+import time
+
+import numpy as np
+import yaml
+
+from bench_suite import fingerprint
+from inference_server import MODEL_PATH
+
+SWEEP_DIR = "sweeps"
+RESULTS_FILE = os.path.join(SWEEP_DIR, "results.json")
+BASE_ARGS = "model/args.yaml"
+# Hyperparameters carried over from the original run (model/args.yaml)
+TRAIN_KEYS = ("epochs", "batch", "seed", "deterministic", "optimizer", "patience", "close_mosaic", "lr0",
+              "lrf", "momentum", "weight_decay", "warmup_epochs", "box", "cls", "dfl", "hsv_h", "hsv_s",
+              "hsv_v", "translate", "scale", "fliplr", "mosaic", "mixup", "erasing")
+
+
+def base_train_args(path=BASE_ARGS):
+    with open(path) as f:
+        args = yaml.safe_load(f)
+    return {key: args[key] for key in TRAIN_KEYS if key in args}
+
+
+def split_images(data_yaml, split):
+    """Image paths of one split of a data.yaml (directory, list file or list of either)."""
+    with open(data_yaml) as f:
+        data = yaml.safe_load(f)
+    root = data.get("path") or os.path.dirname(os.path.abspath(data_yaml))
+    entries = data[split] if isinstance(data[split], list) else [data[split]]
+    images = []
+    for entry in entries:
+        entry = entry if os.path.isabs(entry) else os.path.join(root, entry)
+        if os.path.isdir(os.path.join(entry, "images")):
+            entry = os.path.join(entry, "images")
+        if os.path.isdir(entry):
+            images += sorted(os.path.join(entry, name) for name in os.listdir(entry)
+                             if name.lower().endswith((".jpg", ".jpeg", ".png", ".bmp")))
+        elif os.path.isfile(entry):
+            with open(entry) as f:
+                images += [line.strip() for line in f if line.strip()]
+    return images
+
+
+def cached_frames(data_yaml, split, limit=100, width=640, height=480, sweep_dir=SWEEP_DIR):
+    """
+    The split's first `limit` images at webcam resolution, as a memory-mapped
+    (N, H, W, 3) array. The cache is reused only if its metadata lists the
+    same images.
+    """
+    path = os.path.join(sweep_dir, f"frames_{width}x{height}.npy")
+    meta_path = os.path.join(sweep_dir, f"frames_{width}x{height}.json")
+    images = [os.path.abspath(image) for image in split_images(data_yaml, split)[:limit]]
+    if not images:
+        raise SystemExit(f"No {split} images found for {data_yaml}")
+    meta = {"data": os.path.abspath(data_yaml), "split": split, "images": images}
+    if os.path.exists(path) and os.path.exists(meta_path):
+        with open(meta_path) as f:
+            if json.load(f) == meta:
+                return np.load(path, mmap_mode="r")
+    import cv2
+
+    os.makedirs(sweep_dir, exist_ok=True)
+    frames = np.lib.format.open_memmap(path + ".tmp", mode="w+", dtype=np.uint8,
+                                       shape=(len(images), height, width, 3))
+    for i, image_path in enumerate(images):
+        image = cv2.imread(image_path)
+        if image is None:
+            raise SystemExit(f"Could not read {image_path}")
+        cv2.resize(image, (width, height), dst=frames[i])
+    frames.flush()
+    del frames
+    os.replace(path + ".tmp", path)
+    with open(meta_path, "w") as f:
+        json.dump(meta, f, indent=1)
+    return np.load(path, mmap_mode="r")
+
+
+def cpu_latency(weights, imgsz, frames, warmup=5, repeat=2):
+    """p50/p95 CPU milliseconds per frame through LocalDetector (letterbox + model + box scaling)."""
+    from ultralytics import YOLO
+
+    from preprocess import LocalDetector
+
+    model = YOLO(weights)
+    model.to("cpu")
+    detector = LocalDetector(model, imgsz=imgsz)
+    for i in range(warmup):
+        detector.infer(np.ascontiguousarray(frames[i % len(frames)]))
+    times = []
+    for _ in range(repeat):
+        for frame in frames:
+            frame = np.ascontiguousarray(frame)
+            start = time.perf_counter()
+            detector.infer(frame)
+            times.append(time.perf_counter() - start)
+    p50, p95 = np.percentile(np.array(times) * 1000, (50, 95))
+    return float(p50), float(p95)
+
+
+def train_variant(model_name, imgsz, data_yaml, split, cache, epochs, sweep_dir=SWEEP_DIR):
+    """Train (or reuse) one variant and validate it; returns its result entry without latency."""
+    from ultralytics import YOLO
+
+    name = f"{os.path.splitext(os.path.basename(model_name))[0]}_{imgsz}"
+    weights = os.path.join(sweep_dir, name, "weights", "best.pt")
+    if not os.path.exists(weights):
+        args = base_train_args()
+        if epochs:
+            args["epochs"] = epochs
+        YOLO(model_name).train(data=data_yaml, imgsz=imgsz, cache=cache, project=sweep_dir, name=name,
+                               exist_ok=True, plots=False, **args)
+    model = YOLO(weights)
+    metrics = model.val(data=data_yaml, imgsz=imgsz, split=split, plots=False, verbose=False)
+    return {"name": name, "model": model_name, "imgsz": imgsz, "weights": weights,
+            "params": sum(p.numel() for p in model.model.parameters()),
+            "map50": float(metrics.box.map50), "map50_95": float(metrics.box.map)}
+
+
+def pareto_front(entries):
+    """Entries not dominated on (lower latency p50, higher mAP50-95)."""
+    front = []
+    for entry in entries:
+        dominated = any(other["latency_p50_ms"] <= entry["latency_p50_ms"] and other["map50_95"] >= entry["map50_95"]
+                        and (other["latency_p50_ms"], other["map50_95"]) != (entry["latency_p50_ms"], entry["map50_95"])
+                        for other in entries)
+        if not dominated:
+            front.append(entry)
+    return front
+
+
+def load_results(path=RESULTS_FILE):
+    with open(path) as f:
+        return json.load(f)
+
+
+def save_results(results, path=RESULTS_FILE):
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(path + ".tmp", "w") as f:
+        json.dump(results, f, indent=2)
+    os.replace(path + ".tmp", path)
+
+
+def format_table(entries):
+    front = {entry["name"] for entry in pareto_front(entries)}
+    lines = [f"  {'variant':<16}{'imgsz':>6}{'params':>9}{'mAP50':>8}{'mAP50-95':>10}{'p50 ms':>9}{'p95 ms':>9}"]
+    for entry in sorted(entries, key=lambda entry: entry["latency_p50_ms"]):
+        mark = "*" if entry["name"] in front else " "
+        lines.append(f"{mark} {entry['name']:<16}{entry['imgsz']:>6}{entry['params'] / 1e6:>8.1f}M"
+                     f"{entry['map50']:>8.3f}{entry['map50_95']:>10.3f}{entry['latency_p50_ms']:>9.1f}"
+                     f"{entry['latency_p95_ms']:>9.1f}")
+    return "\n".join(lines)
+
+
+def write_report(results, sweep_dir=SWEEP_DIR):
+    entries = results["variants"]
+    table = format_table(entries)
+    with open(os.path.join(sweep_dir, "pareto.txt"), "w") as f:
+        f.write(f"CPU latency on {results['machine']['cpu']} ({results['machine']['cores']} cores), "
+                f"* = Pareto front\n{table}\n")
+    print(table)
+    try:
+        import matplotlib
+        matplotlib.use("Agg")
+        import matplotlib.pyplot as plt
+    except ImportError:
+        print("matplotlib not installed, skipping pareto.png")
+        return
+    front = sorted(pareto_front(entries), key=lambda entry: entry["latency_p50_ms"])
+    fig, ax = plt.subplots(figsize=(7, 5))
+    ax.scatter([e["latency_p50_ms"] for e in entries], [e["map50_95"] for e in entries], color="#999")
+    ax.plot([e["latency_p50_ms"] for e in front], [e["map50_95"] for e in front], "o-", color="#c00")
+    for entry in entries:
+        ax.annotate(entry["name"], (entry["latency_p50_ms"], entry["map50_95"]), fontsize=8,
+                    xytext=(4, 4), textcoords="offset points")
+    ax.set_xlabel("CPU latency p50 (ms)")
+    ax.set_ylabel("mAP50-95")
+    ax.set_title("Model size / input size sweep")
+    ax.grid(alpha=0.3)
+    fig.tight_layout()
+    fig.savefig(os.path.join(sweep_dir, "pareto.png"), dpi=120)
+    print(f"Plot written to {os.path.join(sweep_dir, 'pareto.png')}")
+
+
+def pick_model(budget_ms, results=None):
+    """Most accurate Pareto variant with CPU p50 <= budget_ms, or None."""
+    results = results or load_results()
+    within = [entry for entry in pareto_front(results["variants"]) if entry["latency_p50_ms"] <= budget_ms]
+    return max(within, key=lambda entry: entry["map50_95"]) if within else None
+
+
+def model_from_env(default=MODEL_PATH, log=print):
+    """
+    (weights, imgsz) for the controllers. With TRAFFIC_LATENCY_BUDGET_MS set
+    and a sweep on disk, the variant pick_model() chooses; otherwise the
+    default model and None (the detector's own input size).
+    """
+    budget = os.environ.get("TRAFFIC_LATENCY_BUDGET_MS")
+    if not budget:
+        return default, None
+    try:
+        results = load_results()
+    except (OSError, ValueError) as e:
+        log(f"[MODEL] No usable sweep results ({e}), using {default}")
+        return default, None
+    if results["machine"]["id"] != fingerprint()["id"]:
+        log(f"[MODEL] Sweep latencies were measured on {results['machine']['cpu']}; "
+            f"run 'python model_sweep.py latency' on this machine")
+    entry = pick_model(float(budget), results)
+    if entry is None:
+        log(f"[MODEL] No variant within {budget} ms, using {default}")
+        return default, None
+    if not os.path.exists(entry["weights"]):
+        log(f"[MODEL] {entry['weights']} missing, using {default}")
+        return default, None
+    log(f"[MODEL] {entry['name']} (p50 {entry['latency_p50_ms']:.1f} ms, mAP50-95 {entry['map50_95']:.3f}) "
+        f"within the {budget} ms budget")
+    return entry["weights"], entry["imgsz"]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Model size / input size sweep and Pareto report")
+    sub = parser.add_subparsers(dest="command", required=True)
+    train = sub.add_parser("train", help="train, validate and time every variant")
+    train.add_argument("--models", default="yolov8n.pt,yolov8s.pt", help="comma-separated base models")
+    train.add_argument("--imgsz", default="320,416,640", help="comma-separated input sizes")
+    train.add_argument("--data", default="data.yaml")
+    train.add_argument("--split", default="val", help="split used for mAP and latency frames")
+    train.add_argument("--epochs", type=int, help="override the epochs from model/args.yaml")
+    train.add_argument("--cache", choices=("disk", "ram", "none"), default="disk")
+    train.add_argument("--frames", type=int, default=100, help="frames timed per variant")
+    latency = sub.add_parser("latency", help="re-time the variants in sweeps/results.json on this machine")
+    latency.add_argument("--data", default="data.yaml")
+    latency.add_argument("--split", default="val")
+    latency.add_argument("--frames", type=int, default=100)
+    pick = sub.add_parser("pick", help="variant for a latency budget")
+    pick.add_argument("--budget-ms", type=float, required=True)
+    args = parser.parse_args()
+
+    if args.command == "pick":
+        results = load_results()
+        print(format_table(results["variants"]))
+        entry = pick_model(args.budget_ms, results)
+        print(f"Budget {args.budget_ms:.0f} ms: " + (f"{entry['name']} ({entry['weights']}, imgsz {entry['imgsz']})"
+                                                    if entry else "no variant fits"))
+        return
+
+    frames = cached_frames(args.data, args.split, limit=args.frames)
+    if args.command == "train":
+        import torch
+
+        torch.set_num_threads(os.cpu_count())
+        cache = False if args.cache == "none" else args.cache
+        variants = []
+        for model_name in args.models.split(","):
+            for imgsz in (int(size) for size in args.imgsz.split(",")):
+                entry = train_variant(model_name, imgsz, args.data, args.split, cache, args.epochs)
+                entry["latency_p50_ms"], entry["latency_p95_ms"] = cpu_latency(entry["weights"], imgsz, frames)
+                print(f"{entry['name']}: mAP50-95 {entry['map50_95']:.3f}, CPU p50 {entry['latency_p50_ms']:.1f} ms")
+                variants.append(entry)
+        results = {"data": args.data, "split": args.split, "base_args": base_train_args(), "variants": variants}
+    else:
+        results = load_results()
+        for entry in results["variants"]:
+            entry["latency_p50_ms"], entry["latency_p95_ms"] = cpu_latency(entry["weights"], entry["imgsz"], frames)
+    results["machine"] = fingerprint()
+    results["time"] = time.strftime("%Y-%m-%dT%H:%M:%S")
+    save_results(results)
+    write_report(results)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,417 @@
+"""
+Emergency-vehicle preemption fast path.
+
+A preempt request (from the UDP trigger socket, a detector hook or a direct
+call) does not wait for the next frame: the requesting thread takes the
+cycle lock and writes the lamp commands itself, through the same
+send_paired function the cycle uses.
+
+    requested pair already green  hold it green
+    otherwise                     conflicting pair RED now, all-red for
+                                  `clearance` seconds, then requested pair GREEN
+
+While preempted the normal cycle is frozen (update() and safety_check() are
+skipped). On release, or after max_hold seconds, the interrupted phase comes
+back with the green time it had left, again with an all-red clearance if
+the pairs differ.
+
+Trigger socket (UDP, one datagram per request; a GPIO/button script or a
+siren receiver can send these):
+
+    PREEMPT NS | PREEMPT EW | PREEMPT north|south|east|west | CLEAR
+
+    python preemption.py trigger NS
+    python preemption.py trigger CLEAR
+
+Measure trigger-to-command latency while a busy "inference" thread runs:
+
+    python preemption.py bench --triggers 200
+"""
+import argparse
+import os
+import socket
+import sys
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+import numpy as np
+
+from traffic_control import BASE_GREEN_TIME
+
+DEFAULT_ADDRESS = ("127.0.0.1", 6100)
+PAIRS = {"EW": ("S1", "S4"), "NS": ("S2", "S3")}
+APPROACH_PHASE = {"north": "NS", "south": "NS", "east": "EW", "west": "EW"}
+
+
+def parse_direction(text):
+    """'NS', 'EW' or an approach name -> phase direction."""
+    text = text.strip()
+    if text.upper() in PAIRS:
+        return text.upper()
+    return APPROACH_PHASE[text.lower()]
+
+
+class Preemption:
+    """
+    Wraps a CycleController. The detection loop calls update() and
+    safety_check() on this object instead of on the cycle.
+
+    clearance: all-red seconds between conflicting greens
+    max_hold: preemption ends by itself after this many seconds
+    detector: optional hook(detections, width, height) -> direction or None,
+              fed through observe_detections() every frame
+    """
+
+    def __init__(self, cycle, clearance=2.0, max_hold=60.0, event_log=None, detector=None,
+                 release_frames=30):
+        self.cycle = cycle
+        self.clearance = clearance
+        self.max_hold = max_hold
+        self.event_log = event_log
+        self.detector = detector
+        self.release_frames = release_frames
+        self.lock = threading.RLock()
+        self.active = None          # direction being held (also during its clearance)
+        self.source = None
+        self.latencies = deque(maxlen=1000)  # trigger -> first command written (s)
+        self._interrupted = None    # (direction, remaining green) to restore
+        self._generation = 0        # invalidates timers from older requests
+        self._missed = 0
+        self._manual_hold = None    # phase FORCE RED ALL interrupted: (direction, green start)
+
+    # --- normal pipeline (detection thread) ---
+
+    @contextmanager
+    def batch(self, port):
+        """
+        port.batch() under the preemption lock: the cycle's batched commands
+        are written before a preempt request on another thread can send its own.
+        """
+        with self.lock, port.batch():
+            yield
+
+    def update(self, north, south, east, west, now=None):
+        with self.lock:
+            if self.active is not None:
+                return None
+            return self.cycle.update(north, south, east, west, now)
+
+    def safety_check(self, north, south, east, west, now=None):
+        with self.lock:
+            if self.active is not None:
+                return False  # all-red during clearance is intended
+            return self.cycle.safety_check(north, south, east, west, now)
+
+    def observe_detections(self, detections, width, height):
+        """Run the detector hook; preempt on a hit, release after release_frames misses."""
+        if self.detector is None:
+            return
+        direction = self.detector(detections, width, height)
+        if direction is not None:
+            self._missed = 0
+            if self.active != direction:
+                self.request(direction, source="detector")
+        elif self.active is not None and self.source == "detector":
+            self._missed += 1
+            if self._missed >= self.release_frames:
+                self.release()
+
+    # --- fast path (any thread) ---
+
+    def request(self, direction, source="api", received=None):
+        """Preempt for `direction` ("NS"/"EW"). received: perf_counter() of the trigger."""
+        received = time.perf_counter() if received is None else received
+        now = time.time()
+        with self.lock:
+            cycle = self.cycle
+            if self.active is None:
+                light = 1 if cycle.current_cycle_direction == "EW" else 2
+                self._interrupted = (cycle.current_cycle_direction, cycle.remaining(light, now))
+            self._generation += 1
+            generation = self._generation
+            self.active = direction
+            self.source = source
+            self._missed = 0
+
+            green_now = cycle.current_cycle_direction == direction and \
+                getattr(cycle, f"tl{PAIRS[direction][0][1]}_state") == "GREEN"
+            if green_now:
+                # Already green: just hold it
+                cycle.restore(direction, self.max_hold, now)
+                self.latencies.append(time.perf_counter() - received)
+            else:
+                # Conflicting green goes red first; the requested green follows after clearance
+                other = "NS" if direction == "EW" else "EW"
+                cycle.send_paired(*PAIRS[other], "RED")
+                self.latencies.append(time.perf_counter() - received)
+                self._all_red()
+                self._after(self.clearance, generation, self._green, direction)
+            self._after(self.max_hold, generation, self.release)
+        self._event(f"[PREEMPT] {direction} requested by {source}", direction=direction,
+                    source=source, latency_ms=round(self.latencies[-1] * 1000, 3))
+
+    def release(self, generation=None):
+        """End preemption and bring back the interrupted phase."""
+        with self.lock:
+            if self.active is None or (generation is not None and generation != self._generation):
+                return
+            self._generation += 1
+            generation = self._generation
+            held, (direction, remaining) = self.active, self._interrupted
+            if held == direction:
+                self._resume(generation, direction, remaining)
+            else:
+                self.cycle.send_paired(*PAIRS[held], "RED")
+                self._all_red()
+                self._after(self.clearance, generation, self._resume, direction, remaining)
+        self._event(f"[PREEMPT] Released, restoring {direction}", direction=direction)
+
+    def _green(self, generation, direction):
+        with self.lock:
+            if generation != self._generation:
+                return
+            self.cycle.restore(direction, self.max_hold, time.time())
+            self.cycle.send_paired(*PAIRS[direction], "GREEN")
+
+    def _resume(self, generation, direction, remaining):
+        with self.lock:
+            if generation != self._generation:
+                return
+            now = time.time()
+            if self.cycle.current_cycle_direction != direction or self.cycle.tl1_state == self.cycle.tl2_state:
+                self.cycle.send_paired(*PAIRS[direction], "GREEN")
+            self.cycle.restore(direction, max(remaining, BASE_GREEN_TIME), now)
+            self.active = None
+            self.source = None
+
+    # --- manual all-red (GUI) ---
+
+    def force_all_red(self):
+        """
+        FORCE RED ALL: every head RED until the interrupted green would have
+        ended (the cycle then switches as usual) or clear_all_red().
+        """
+        with self.lock:
+            self.cycle.send_paired("S1", "S4", "RED")
+            self.cycle.send_paired("S2", "S3", "RED")
+            self._manual_hold = self._phase()
+
+    def clear_all_red(self):
+        with self.lock:
+            self._manual_hold = None
+
+    def holding_all_red(self):
+        """Whether FORCE RED ALL is in effect, so the lamps are meant to differ from the cycle."""
+        with self.lock:
+            if self._manual_hold is not None and self._manual_hold != self._phase():
+                self._manual_hold = None  # the cycle has moved on
+            return self._manual_hold is not None
+
+    def _phase(self):
+        cycle = self.cycle
+        start = cycle.tl1_green_start if cycle.current_cycle_direction == "EW" else cycle.tl2_green_start
+        return cycle.current_cycle_direction, start
+
+    def _all_red(self):
+        for light in (1, 2, 3, 4):
+            setattr(self.cycle, f"tl{light}_state", "RED")
+
+    def _after(self, delay, generation, action, *args):
+        timer = threading.Timer(delay, action, (generation, *args))
+        timer.daemon = True
+        timer.start()
+
+    def _event(self, message, **fields):
+        if self.event_log is not None:
+            self.event_log.log("preempt", message, **fields)
+
+    def latency_summary(self):
+        if not self.latencies:
+            return "no preemptions yet"
+        ms = np.array(self.latencies) * 1000
+        return (f"trigger->command p50 {np.percentile(ms, 50):.2f} ms  "
+                f"p99 {np.percentile(ms, 99):.2f} ms  max {ms.max():.2f} ms  (n={len(ms)})")
+
+
+class TriggerListener:
+    """
+    UDP trigger input. Runs its own thread, so a preempt is handled while
+    the detection thread is still inside inference.
+
+    switch_interval: if given, the interpreter's GIL switch interval is set
+    to this (seconds), bounding how long Python-heavy work on other threads
+    can keep the listener waiting; None leaves the default (5 ms).
+    """
+
+    def __init__(self, preemption, address=DEFAULT_ADDRESS, switch_interval=None):
+        self.preemption = preemption
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.bind(address)
+        self.address = self.sock.getsockname()
+        if switch_interval is not None:
+            sys.setswitchinterval(switch_interval)
+        self.running = True
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def _run(self):
+        while self.running:
+            try:
+                data, _ = self.sock.recvfrom(256)
+            except OSError:
+                return
+            received = time.perf_counter()
+            words = data.decode(errors="replace").split()
+            try:
+                if words and words[0].upper() == "CLEAR":
+                    self.preemption.release()
+                elif len(words) >= 2 and words[0].upper() == "PREEMPT":
+                    self.preemption.request(parse_direction(words[1]), source="socket",
+                                            received=received)
+            except KeyError:
+                pass  # unknown approach name
+
+    def close(self):
+        self.running = False
+        self.sock.close()
+
+
+def send_trigger(message, address=DEFAULT_ADDRESS):
+    """Send one trigger datagram, e.g. 'PREEMPT NS' or 'CLEAR'."""
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+        sock.sendto(message.encode(), address)
+
+
+def class_detector(class_id, zones, min_conf=0.5):
+    """
+    Detector hook for a model with an emergency-vehicle class: returns the
+    phase serving the approach where a box of class_id is seen. Its `zones`
+    attribute can be replaced while running.
+    """
+    from zones import DIRECTIONS, box_centers, classify_directions
+
+    def detect(detections, width, height):
+        hits = detections[(detections[:, 5] == class_id) & (detections[:, 4] >= min_conf)]
+        if not len(hits):
+            return None
+        center_x, center_y = box_centers(hits[:, :4])
+        direction = classify_directions(center_x, center_y, width, height, detect.zones)[0]
+        return APPROACH_PHASE[DIRECTIONS[direction].lower()]
+    detect.zones = zones
+    return detect
+
+
+def preemption_from_env(cycle, event_log=None, zones=None):
+    """
+    Preemption with a UDP trigger listener if TRAFFIC_PREEMPT_ADDR is set
+    (host:port, or just a port on 127.0.0.1) and the class_detector hook if
+    TRAFFIC_PREEMPT_CLASS names a model class id.
+    Returns (preemption, listener or None).
+    """
+    from zones import DEFAULT_ZONES
+
+    class_id = os.environ.get("TRAFFIC_PREEMPT_CLASS", "")
+    detector = class_detector(int(class_id), zones or DEFAULT_ZONES) if class_id else None
+    preemption = Preemption(cycle, event_log=event_log, detector=detector)
+    address = os.environ.get("TRAFFIC_PREEMPT_ADDR", "")
+    if address in ("", "0"):
+        return preemption, None
+    host, _, port = address.rpartition(":")
+    return preemption, TriggerListener(preemption, (host or DEFAULT_ADDRESS[0], int(port)))
+
+
+def bench(triggers, clearance, busy, switch_interval=None):
+    """Trigger repeatedly while a busy thread mimics inference; print latencies."""
+    from traffic_control import CycleController
+
+    written = []
+
+    class Port:
+        """Serial stand-in: a pty when available, so each write is a real syscall."""
+        def __init__(self):
+            self.fd = None
+            if hasattr(os, "openpty"):
+                self.fd, self.peer = os.openpty()
+                threading.Thread(target=self._drain, daemon=True).start()
+
+        def _drain(self):
+            while True:
+                os.read(self.peer, 4096)
+
+        def send_paired(self, lane1, lane2, color):
+            if self.fd is not None:
+                os.write(self.fd, f"{lane1}:{lane2}:{color}\n".encode())
+            written.append(time.perf_counter())
+            return True
+
+    port = Port()
+    cycle = CycleController(port.send_paired, log=None)
+    preemption = Preemption(cycle, clearance=clearance, max_hold=clearance * 4)
+    listener = TriggerListener(preemption, ("127.0.0.1", 0), switch_interval)
+
+    stop = threading.Event()
+
+    def inference():
+        a = np.random.rand(256, 256).astype(np.float32)
+        while not stop.is_set():
+            a @ a                        # native work, releases the GIL
+            sum(i * i for i in range(20000))  # Python work, holds the GIL
+            preemption.update(1, 2, 3, 1)
+
+    workers = [threading.Thread(target=inference, daemon=True) for _ in range(busy)]
+    for w in workers:
+        w.start()
+
+    latencies = []
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+        for i in range(triggers):
+            direction = "NS" if cycle.current_cycle_direction == "EW" else "EW"
+            count = len(written)
+            sent = time.perf_counter()
+            sock.sendto(f"PREEMPT {direction}".encode(), listener.address)
+            deadline = sent + 1.0
+            while len(written) == count and time.perf_counter() < deadline:
+                time.sleep(0.0002)
+            if len(written) > count:
+                latencies.append(written[count] - sent)
+            time.sleep(clearance * 1.5)
+            sock.sendto(b"CLEAR", listener.address)
+            time.sleep(clearance * 1.5)
+    stop.set()
+    listener.close()
+
+    ms = np.array(latencies) * 1000
+    print(f"{len(ms)} preemptions with {busy} busy inference thread(s), "
+          f"switch interval {sys.getswitchinterval() * 1000:.1f} ms")
+    print(f"  socket send -> serial write: p50 {np.percentile(ms, 50):.2f} ms  "
+          f"p99 {np.percentile(ms, 99):.2f} ms  max {ms.max():.2f} ms")
+    print(f"  {preemption.latency_summary()} (measured inside the process)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Emergency preemption trigger and benchmark")
+    sub = parser.add_subparsers(dest="command", required=True)
+    trigger = sub.add_parser("trigger", help="send a trigger to a running controller")
+    trigger.add_argument("what", help="NS, EW, north/south/east/west, or CLEAR")
+    trigger.add_argument("--address", default="127.0.0.1:6100")
+    bench_parser = sub.add_parser("bench", help="measure trigger-to-command latency")
+    bench_parser.add_argument("--triggers", type=int, default=100)
+    bench_parser.add_argument("--clearance", type=float, default=0.05,
+                              help="all-red seconds (short so the bench runs quickly)")
+    bench_parser.add_argument("--busy", type=int, default=1, help="busy inference threads")
+    bench_parser.add_argument("--switch-interval", type=float, default=5.0,
+                              help="GIL switch interval in ms (Python's default is 5)")
+    args = parser.parse_args()
+
+    if args.command == "trigger":
+        host, port = args.address.rsplit(":", 1)
+        message = "CLEAR" if args.what.upper() == "CLEAR" else f"PREEMPT {parse_direction(args.what)}"
+        send_trigger(message, (host, int(port)))
+    else:
+        bench(args.triggers, args.clearance, args.busy, args.switch_interval / 1000)
+
+
+if __name__ == "__main__":
+    main()
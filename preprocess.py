@@ -0,0 +1,221 @@
+"""
+Allocation-free frame path: a frame buffer pool and an in-place letterbox.
+
+At 30 FPS the detection loop used to allocate several full-size arrays per
+frame: the captured frame, ultralytics' letterboxed copy, its CHW and
+float32 conversions, the plot() output and the GUI's RGB copy. Here each of
+those is a buffer allocated once and reused:
+
+    FramePool     a few preallocated frames handed out round robin (capture
+                  with Camera(pool=...), annotation with draw_boxes(out=...))
+    Letterbox     resizes into a fixed buffer, pastes it into a padded
+                  canvas and writes RGB/CHW/0-1 floats straight into a
+                  preallocated input tensor (rectangular, stride-aligned,
+                  like ultralytics' own letterbox)
+    LocalDetector runs the YOLO model on that tensor (shared with torch
+                  through torch.from_numpy, no copy) and maps the boxes
+                  back to frame pixels; same infer() as InferenceClient
+
+Count the bytes allocated per frame (tracemalloc) by the old and the
+pooled pipeline on synthetic frames:
+
+    python preprocess.py --frames 300 --size 640x480
+"""
+import argparse
+import math
+import time
+import tracemalloc
+
+import numpy as np
+
+
+class FramePool:
+    """
+    `count` preallocated frames of one shape, handed out round robin.
+
+    A buffer is reused `count` acquisitions later, so anything that keeps a
+    frame around longer (e.g. a queued GUI signal) needs count large enough
+    to cover it.
+    """
+
+    def __init__(self, count=4):
+        self.count = count
+        self.shape = None
+        self.buffers = []
+        self.index = 0
+
+    def acquire(self, shape, dtype=np.uint8):
+        if shape != self.shape:
+            self.shape = shape
+            self.buffers = [np.empty(shape, dtype) for _ in range(self.count)]
+        buffer = self.buffers[self.index]
+        self.index = (self.index + 1) % self.count
+        return buffer
+
+
+class Letterbox:
+    """
+    BGR frame -> (1, 3, H, W) float32 RGB model input, in preallocated buffers.
+
+    The long side is scaled to imgsz and the short side padded (pad_value)
+    up to a multiple of stride, centred. Buffers are reallocated only when
+    the frame size changes.
+    """
+
+    def __init__(self, imgsz=416, stride=32, pad_value=114):
+        self.imgsz = imgsz
+        self.stride = stride
+        self.pad_value = pad_value
+        self.source_shape = None
+
+    def _setup(self, height, width):
+        ratio = self.imgsz / max(height, width)
+        new_w, new_h = round(width * ratio), round(height * ratio)
+        pad_w = math.ceil(new_w / self.stride) * self.stride
+        pad_h = math.ceil(new_h / self.stride) * self.stride
+        self.ratio = ratio
+        self.left = (pad_w - new_w) // 2
+        self.top = (pad_h - new_h) // 2
+        self.resized = np.empty((new_h, new_w, 3), np.uint8)
+        self.canvas = np.full((pad_h, pad_w, 3), self.pad_value, np.uint8)
+        self.inner = self.canvas[self.top:self.top + new_h, self.left:self.left + new_w]
+        self.tensor = np.empty((1, 3, pad_h, pad_w), np.float32)
+        # BGR HWC view of the canvas as RGB CHW, so one ufunc call fills the tensor
+        self.planes = self.canvas.transpose(2, 0, 1)[::-1]
+        self.source_shape = (height, width)
+
+    def __call__(self, frame):
+        import cv2
+
+        if frame.shape[:2] != self.source_shape:
+            self._setup(*frame.shape[:2])
+        cv2.resize(frame, self.resized.shape[1::-1], dst=self.resized, interpolation=cv2.INTER_LINEAR)
+        self.inner[...] = self.resized
+        np.multiply(self.planes, np.float32(1 / 255), out=self.tensor[0], dtype=np.float32,
+                    casting="unsafe")
+        return self.tensor
+
+    def scale_boxes(self, boxes):
+        """Map (N, 4+) boxes from model input to frame pixels, in place."""
+        boxes[:, 0:4:2] -= self.left
+        boxes[:, 1:4:2] -= self.top
+        boxes[:, :4] /= self.ratio
+        height, width = self.source_shape
+        np.clip(boxes[:, 0:4:2], 0, width, out=boxes[:, 0:4:2])
+        np.clip(boxes[:, 1:4:2], 0, height, out=boxes[:, 1:4:2])
+        return boxes
+
+
+class LocalDetector:
+    """
+    In-process YOLO with the preallocated letterbox. infer(frame) returns an
+    (N, 6) float32 array of x1, y1, x2, y2, confidence, class in frame
+    pixels, like InferenceClient.infer.
+    """
+
+    def __init__(self, model, imgsz=416, conf=0.55, iou=0.3):
+        self.model = model
+        self.conf = conf
+        self.iou = iou
+        self.letterbox = Letterbox(imgsz)
+        self._array = None
+        self._tensor = None
+
+    def set_thresholds(self, conf, iou):
+        self.conf = conf
+        self.iou = iou
+
+    def infer(self, frame):
+        import torch
+
+        array = self.letterbox(frame)
+        if array is not self._array:
+            # Wraps the numpy buffer; refilled in place on every frame
+            self._array = array
+            self._tensor = torch.from_numpy(array)
+        results = self.model(self._tensor, conf=self.conf, iou=self.iou, imgsz=array.shape[2:],
+                             verbose=False)
+        boxes = results[0].boxes.data.cpu().numpy()
+        return self.letterbox.scale_boxes(boxes)
+
+
+def _baseline_step(frame_source, imgsz):
+    """The allocations the old pipeline made per frame (capture, letterbox, plot, GUI)."""
+    import cv2
+
+    frame = frame_source.copy()                               # VideoCapture.read()
+    h, w = frame.shape[:2]
+    ratio = imgsz / max(h, w)
+    new_w, new_h = round(w * ratio), round(h * ratio)
+    resized = cv2.resize(frame, (new_w, new_h))               # ultralytics LetterBox
+    pad_w, pad_h = math.ceil(new_w / 32) * 32 - new_w, math.ceil(new_h / 32) * 32 - new_h
+    padded = cv2.copyMakeBorder(resized, pad_h // 2, pad_h - pad_h // 2, pad_w // 2, pad_w - pad_w // 2,
+                                cv2.BORDER_CONSTANT, value=(114, 114, 114))
+    chw = np.ascontiguousarray(padded[..., ::-1].transpose(2, 0, 1)[None])
+    tensor = chw.astype(np.float32) / 255                     # im.float() / 255
+    annotated = frame.copy()                                  # results[0].plot()
+    cv2.rectangle(annotated, (10, 10), (100, 100), (0, 255, 0), 2)
+    rgb = cv2.cvtColor(annotated, cv2.COLOR_BGR2RGB)          # GUI update_frame
+    return tensor, rgb
+
+
+BENCH_BOXES = np.array([[10, 10, 100, 100, 0.9, 0]], np.float32)
+
+
+def _pooled_step(frame_source, letterbox, frames, annotated, rgb):
+    import cv2
+
+    from inference_server import draw_boxes
+
+    frame = frames.acquire(frame_source.shape)
+    np.copyto(frame, frame_source)                            # Camera(pool=...).read()
+    tensor = letterbox(frame)
+    out = annotated.acquire(frame.shape)
+    draw_boxes(frame, BENCH_BOXES, out=out)
+    cv2.cvtColor(out, cv2.COLOR_BGR2RGB, dst=rgb)
+    return tensor, rgb
+
+
+def measure(step, frames):
+    """Mean bytes allocated per frame (tracemalloc peak above steady state) and ms per frame."""
+    step()  # first frame sets up the buffers
+    start = time.perf_counter()
+    for _ in range(frames):
+        step()
+    elapsed = (time.perf_counter() - start) / frames
+
+    tracemalloc.start()
+    peaks = []
+    for _ in range(frames):
+        before = tracemalloc.get_traced_memory()[0]
+        tracemalloc.reset_peak()
+        step()
+        peaks.append(tracemalloc.get_traced_memory()[1] - before)
+    tracemalloc.stop()
+    return float(np.mean(peaks)), elapsed * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Per-frame allocations: old vs pooled pipeline")
+    parser.add_argument("--frames", type=int, default=300)
+    parser.add_argument("--size", default="640x480", help="frame size")
+    parser.add_argument("--imgsz", type=int, default=416)
+    args = parser.parse_args()
+
+    width, height = (int(v) for v in args.size.lower().split("x"))
+    source = np.random.default_rng(0).integers(0, 255, (height, width, 3), np.uint8)
+    letterbox = Letterbox(args.imgsz)
+    frames, annotated = FramePool(), FramePool()
+    rgb = np.empty_like(source)
+
+    old_bytes, old_ms = measure(lambda: _baseline_step(source, args.imgsz), args.frames)
+    new_bytes, new_ms = measure(lambda: _pooled_step(source, letterbox, frames, annotated, rgb),
+                                args.frames)
+    print(f"{args.frames} frames of {width}x{height}, model input {letterbox.tensor.shape[3]}x"
+          f"{letterbox.tensor.shape[2]}")
+    print(f"  old pipeline:    {old_bytes / 1024:9.1f} KiB allocated per frame, {old_ms:.2f} ms")
+    print(f"  pooled pipeline: {new_bytes / 1024:9.1f} KiB allocated per frame, {new_ms:.2f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,346 @@
+"""
+Runtime profiling that can be switched on while the controller is running.
+
+    start(seconds)   samples the stacks of every thread (sys._current_frames)
+                     for `seconds` and times each stage of the frame loop;
+                     when it ends, two files are written:
+
+        profiles/<time>_stacks.folded   collapsed stacks, one line per stack
+                                        with its sample count (flamegraph.pl,
+                                        speedscope, inferno)
+        profiles/<time>_stages.txt      p50/p95/p99/max per loop stage and
+                                        its share of the frame time
+
+    slow frame trap  with a budget set (TRAFFIC_SLOW_FRAME_MS), a watchdog
+                     thread snapshots the loop thread's stack while an
+                     iteration is still running past the budget, so the
+                     capture shows where the time went, not where the frame
+                     ended. Snapshots are appended to profiles/slow_frames.log.
+
+Triggers: the GUI's PROFILE button, 'p' in detect_cars.py, SIGUSR1 (POSIX)
+and POST /profile on the web dashboard. TRAFFIC_PROFILE_SECONDS sets the
+session length (default 30).
+
+The loop marks stages the same way it marks latency traces:
+
+    stages = profiler.start_frame()
+    ...
+    stages.mark("inference")
+    ...
+    profiler.finish_frame(stages)
+
+With no session running, start_frame() hands out a shared no-op recorder,
+so the cost is a few attribute lookups per frame. Measure it with
+
+    python profiler.py overhead
+"""
+import argparse
+import os
+import signal
+import sys
+import threading
+import time
+import traceback
+from collections import Counter
+from datetime import datetime
+
+import numpy as np
+
+PROFILE_DIR = "profiles"
+
+
+class FrameStages:
+    """Stage durations (seconds) of one loop iteration."""
+    __slots__ = ("start", "last", "durations")
+
+    def __init__(self, start):
+        self.start = start
+        self.last = start
+        self.durations = []
+
+    def mark(self, stage):
+        now = time.perf_counter()
+        self.durations.append((stage, now - self.last))
+        self.last = now
+
+
+class _NullStages:
+    """Shared recorder used outside a session; marking it does nothing."""
+    __slots__ = ()
+
+    def mark(self, stage):
+        pass
+
+
+NULL_STAGES = _NullStages()
+
+
+class RuntimeProfiler:
+    """
+    interval: sampling period of the stack sampler (seconds)
+    slow_frame_ms: budget for the slow frame trap (None/0 disables it)
+    event_log: optional EventLog for 'profile' events
+    """
+
+    def __init__(self, interval=0.01, slow_frame_ms=None, out_dir=PROFILE_DIR, event_log=None,
+                 default_seconds=30):
+        self.interval = interval
+        self.slow_frame = slow_frame_ms / 1000 if slow_frame_ms else None
+        self.out_dir = out_dir
+        self.event_log = event_log
+        self.default_seconds = default_seconds
+        self.sampling = False
+        self.slow_frames = 0
+        self.last_report = None
+        self._stages = {}
+        self._stacks = Counter()
+        self._labels = {}
+        self._session = None
+        self._lock = threading.Lock()
+        self._start_requested = False  # set by the signal handler, acted on by start_frame()
+        # Slow frame trap state: the loop thread and the start of its current iteration
+        self._loop_thread = None
+        self._frame_start = None
+        self._frame_id = 0
+        self._closed = threading.Event()
+        self._watchdog = None
+        if self.slow_frame:
+            self._watchdog = threading.Thread(target=self._watch, name="slow-frame-trap", daemon=True)
+            self._watchdog.start()
+
+    # -- frame loop hooks ------------------------------------------------
+
+    def start_frame(self):
+        """Begin one loop iteration; returns the stage recorder to mark."""
+        if self._start_requested:
+            self._start_requested = False
+            self.start()
+        if self.slow_frame:
+            if self._loop_thread is None:
+                self._loop_thread = threading.get_ident()
+            self._frame_id += 1
+            self._frame_start = time.perf_counter()
+        if not self.sampling:
+            return NULL_STAGES
+        return FrameStages(time.perf_counter())
+
+    def finish_frame(self, stages):
+        """End the iteration started by start_frame()."""
+        self._frame_start = None
+        if stages is NULL_STAGES or not self.sampling:
+            return
+        samples = self._stages
+        for stage, duration in stages.durations:
+            samples.setdefault(stage, []).append(duration)
+        samples.setdefault("frame_total", []).append(stages.last - stages.start)
+
+    # -- sessions --------------------------------------------------------
+
+    def start(self, seconds=None):
+        """Profile for `seconds` in the background; returns a status message. Safe to call from any thread."""
+        seconds = seconds or self.default_seconds
+        with self._lock:
+            if self.sampling:
+                return "profiling already running"
+            self._stages = {}
+            self._stacks = Counter()
+            self.sampling = True
+            self._session = threading.Thread(target=self._sample, args=(seconds,), name="profiler",
+                                             daemon=True)
+            self._session.start()
+        self._log(f"[PROFILE] Sampling all threads for {seconds:.0f} s", seconds=seconds)
+        return f"profiling for {seconds:.0f} s"
+
+    def stop(self):
+        """End a running session early (its files are still written)."""
+        self.sampling = False
+        if self._session is not None:
+            self._session.join()
+
+    def close(self):
+        """Stop the session and the slow frame trap."""
+        self.stop()
+        self._closed.set()
+        if self._watchdog is not None:
+            self._watchdog.join()
+
+    def install_signal(self, signum=getattr(signal, "SIGUSR1", None)):
+        """
+        Start a session on SIGUSR1 (POSIX only; call from the main thread).
+        The handler only sets a flag and the next start_frame() starts the
+        session: the handler can interrupt the main thread inside start(),
+        and taking self._lock again there would deadlock.
+        """
+        if signum is None:
+            return False
+        signal.signal(signum, self._request_start)
+        return True
+
+    def _request_start(self, signum, frame):
+        self._start_requested = True
+
+    def _sample(self, seconds):
+        own = threading.get_ident()
+        names = {}
+        started = time.perf_counter()
+        end = started + seconds
+        count = 0
+        while self.sampling and time.perf_counter() < end:
+            frames = sys._current_frames()
+            if len(names) != len(frames):
+                names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for ident, frame in frames.items():
+                if ident != own:
+                    self._stacks[self._collapse(frame, names.get(ident, ident))] += 1
+            del frames, frame
+            count += 1
+            time.sleep(self.interval)
+        elapsed = time.perf_counter() - started
+        self.sampling = False
+        try:
+            self.last_report = self._write(count, elapsed)
+            self._log(f"[PROFILE] {count} samples in {elapsed:.1f} s written to {self.last_report[0]}",
+                      stacks=self.last_report[0], stages=self.last_report[1])
+        except OSError as e:
+            self._log(f"[ERROR] Could not write profile: {e}")
+
+    def _label(self, code):
+        label = self._labels.get(code)
+        if label is None:
+            label = f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+            self._labels[code] = label
+        return label
+
+    def _collapse(self, frame, thread_name):
+        labels = []
+        while frame is not None:
+            labels.append(self._label(frame.f_code))
+            frame = frame.f_back
+        labels.append(f"thread {thread_name}")
+        return ";".join(reversed(labels))
+
+    def _write(self, samples, elapsed):
+        os.makedirs(self.out_dir, exist_ok=True)
+        prefix = os.path.join(self.out_dir, datetime.now().strftime("%Y%m%d-%H%M%S"))
+        stacks_path, stages_path = f"{prefix}_stacks.folded", f"{prefix}_stages.txt"
+        with open(stacks_path, "w") as f:
+            for stack, count in self._stacks.most_common():
+                f.write(f"{stack} {count}\n")
+        with open(stages_path, "w") as f:
+            f.write(f"{samples} stack samples over {elapsed:.1f} s "
+                    f"(every {self.interval * 1000:.0f} ms)\n\n")
+            f.write(self.format_stages() + "\n")
+        return stacks_path, stages_path
+
+    def format_stages(self):
+        """p50/p95/p99/max per stage of the last (or running) session, in milliseconds."""
+        stages = dict(self._stages)
+        total = stages.get("frame_total")
+        if not total:
+            return "No frames timed"
+        frame_time = float(np.sum(total))
+        lines = [f"{'stage':<13}{'p50':>8}{'p95':>8}{'p99':>8}{'max':>8}{'share':>8}  ms ({len(total)} frames)"]
+        for stage, values in stages.items():
+            values = np.asarray(values) * 1000
+            p50, p95, p99 = np.percentile(values, (50, 95, 99))
+            share = values.sum() / 1000 / frame_time * 100
+            lines.append(f"{stage:<13}{p50:>8.2f}{p95:>8.2f}{p99:>8.2f}{values.max():>8.2f}{share:>7.1f}%")
+        return "\n".join(lines)
+
+    # -- slow frame trap -------------------------------------------------
+
+    def _watch(self):
+        poll = max(self.slow_frame / 4, 0.002)
+        trapped = 0
+        while not self._closed.wait(poll):
+            start, frame_id = self._frame_start, self._frame_id
+            if start is None or frame_id == trapped:
+                continue
+            elapsed = time.perf_counter() - start
+            if elapsed < self.slow_frame:
+                continue
+            frame = sys._current_frames().get(self._loop_thread)
+            if frame is None or self._frame_id != frame_id:
+                continue
+            trapped = frame_id
+            self.slow_frames += 1
+            stack = "".join(traceback.format_stack(frame))
+            del frame
+            try:
+                os.makedirs(self.out_dir, exist_ok=True)
+                with open(os.path.join(self.out_dir, "slow_frames.log"), "a") as f:
+                    f.write(f"--- {datetime.now():%Y-%m-%d %H:%M:%S.%f} frame {frame_id} still running "
+                            f"after {elapsed * 1000:.0f} ms (budget {self.slow_frame * 1000:.0f} ms)\n{stack}")
+            except OSError:
+                pass
+            self._log(f"[PROFILE] Slow frame: {elapsed * 1000:.0f} ms, stack in {self.out_dir}/slow_frames.log",
+                      elapsed_ms=round(elapsed * 1000, 1))
+
+    def _log(self, msg, **fields):
+        if self.event_log is not None:
+            self.event_log.log("profile", msg, **fields)
+        else:
+            print(msg)
+
+
+def profiler_from_env(event_log=None):
+    """RuntimeProfiler configured by TRAFFIC_PROFILE_SECONDS and TRAFFIC_SLOW_FRAME_MS (0/unset = no trap)."""
+    return RuntimeProfiler(slow_frame_ms=float(os.environ.get("TRAFFIC_SLOW_FRAME_MS", "0")),
+                           default_seconds=float(os.environ.get("TRAFFIC_PROFILE_SECONDS", "30")),
+                           event_log=event_log)
+
+
+def _synthetic_frame(image, boxes, stages):
+    """A loop iteration with small numpy steps standing in for the pipeline stages."""
+    image.sum()
+    stages.mark("capture")
+    image.max()
+    stages.mark("inference")
+    np.sort(boxes)
+    stages.mark("zones")
+
+
+def measure_overhead(frames, mode, slow_frame_ms=50):
+    """Mean microseconds per iteration of the synthetic loop with the profiler in `mode`."""
+    rng = np.random.default_rng(0)
+    image, boxes = rng.integers(0, 255, (60, 80), np.uint8), rng.random(50)
+    if mode == "none":
+        stages = NULL_STAGES
+        start = time.perf_counter()
+        for _ in range(frames):
+            _synthetic_frame(image, boxes, stages)
+        return (time.perf_counter() - start) / frames * 1e6
+    profiler = RuntimeProfiler(slow_frame_ms=slow_frame_ms if mode == "trap" else None,
+                               out_dir=os.path.join(PROFILE_DIR, "overhead"), event_log=None)
+    if mode == "sampling":
+        profiler._log = lambda *args, **fields: None
+        profiler.start(seconds=3600)
+    start = time.perf_counter()
+    for _ in range(frames):
+        stages = profiler.start_frame()
+        _synthetic_frame(image, boxes, stages)
+        profiler.finish_frame(stages)
+    elapsed = time.perf_counter() - start
+    profiler.close()
+    return elapsed / frames * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Runtime profiler overhead check")
+    sub = parser.add_subparsers(dest="command", required=True)
+    overhead = sub.add_parser("overhead", help="time a synthetic loop with the profiler off, trapping and sampling")
+    overhead.add_argument("--frames", type=int, default=20000)
+    args = parser.parse_args()
+
+    modes = ("none", "off", "trap", "sampling")
+    # Interleaved, best of five, to keep scheduler noise out of a sub-microsecond difference
+    best = dict.fromkeys(modes, float("inf"))
+    for _ in range(5):
+        for mode in modes:
+            best[mode] = min(best[mode], measure_overhead(args.frames, mode))
+    for mode in modes:
+        print(f"  {mode:9s} {best[mode]:8.2f} us/frame ({best[mode] - best['none']:+.2f} us)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,396 @@
+"""
+CPU budget for the pipeline: library thread pools, core pinning and thread priorities.
+
+On a quad-core box, PyTorch's intra-op pool, OpenCV's pool, the Qt GUI
+thread and the control threads all compete for the same cores, so a
+repaint can stretch a frame. ResourceConfig sets, from the environment:
+
+    TRAFFIC_TORCH_THREADS=3        torch.set_num_threads (intra-op pool)
+    TRAFFIC_CV_THREADS=1           cv2.setNumThreads (0 = no OpenCV pool)
+    TRAFFIC_CORES=inference=1-3,gui=0,control=0
+                                   CPUs each stage's threads may run on
+    TRAFFIC_PRIORITY=control=high,gui=low
+                                   thread priority per stage (high, normal, low)
+
+Stages are the threads of the controllers:
+
+    inference   the frame loop (capture, YOLO, zones, cycle decisions)
+    gui         the Qt main thread
+    control     the ESP32 reply reader, the preemption trigger listener and
+                the green wave bus
+
+Pinning and priorities are per thread. On Linux that is sched_setaffinity
+and setpriority on the thread id; on Windows it is SetThreadAffinityMask
+and SetThreadPriority. Raising a priority usually needs privileges on
+Linux (CAP_SYS_NICE). When the OS refuses, the setting is reported and
+skipped, so lowering the others (gui=low) is the portable way to favour
+the control path. Unset variables leave the defaults alone.
+
+New threads inherit the mask and priority of the thread that starts them,
+and an unprivileged process can't raise a lowered priority again. So the
+controllers start all their long-lived threads first and only then apply
+each stage: the frame loop and the Qt main thread configure themselves,
+and the control threads are configured by thread id. A stage missing from
+TRAFFIC_CORES gets every CPU; a stage missing from TRAFFIC_PRIORITY keeps
+the priority it started with (an inherited boost is dropped, since that
+needs no privilege). Threads started later, such as torch's pool threads,
+a profiling session or a preemption timer, inherit from whichever thread
+starts them and are not managed per stage.
+
+Benchmark matrix: each configuration runs in a fresh process, with an
+inference loop (YOLO on the sample image if available, else a matrix
+multiply), a 30 Hz GUI-like repaint thread and a control thread. The
+control thread sleeps to a deadline every 50 ms and then sends a phase
+switch to an in-memory FramedPort. The report gives inference p50/p99 and
+how late the switches ran (p50/p99/max):
+
+    python resources.py bench --seconds 10
+    python resources.py bench --matrix "TRAFFIC_TORCH_THREADS=1;TRAFFIC_TORCH_THREADS=4,TRAFFIC_CORES=inference=1-3,gui=0,control=0"
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+
+import numpy as np
+
+STAGES = ("inference", "gui", "control")
+# Linux nice values and Windows thread priorities per level
+NICE = {"high": -5, "normal": 0, "low": 5}
+WINDOWS_PRIORITY = {"high": 1, "normal": 0, "low": -1}  # THREAD_PRIORITY_ABOVE_NORMAL / NORMAL / BELOW_NORMAL
+
+
+def parse_cpus(text):
+    """'0,2-3' -> {0, 2, 3}"""
+    cpus = set()
+    for part in text.split(","):
+        if "-" in part:
+            first, last = part.split("-")
+            cpus.update(range(int(first), int(last) + 1))
+        elif part.strip():
+            cpus.add(int(part))
+    return cpus
+
+
+def parse_stages(text, parse_value):
+    """'inference=1-3,gui=0' -> {stage: value}; a stage's value may contain commas."""
+    result = {}
+    stage = None
+    for part in text.split(","):
+        if "=" in part:
+            stage, value = part.split("=", 1)
+            stage = stage.strip()
+            if stage not in STAGES:
+                raise ValueError(f"unknown stage {stage!r} (expected one of {', '.join(STAGES)})")
+            result[stage] = value.strip()
+        elif stage is not None:
+            result[stage] += "," + part.strip()
+    return {stage: parse_value(value) for stage, value in result.items()}
+
+
+def _priority_level(value):
+    if value not in NICE:
+        raise ValueError(f"unknown priority {value!r} (expected high, normal or low)")
+    return value
+
+
+class ResourceConfig:
+    """
+    torch_threads / cv_threads: pool sizes (None leaves the library default)
+    cores: {stage: set of CPUs}
+    priority: {stage: 'high' | 'normal' | 'low'}
+    log: callable for what was applied or refused
+    """
+
+    def __init__(self, torch_threads=None, cv_threads=None, cores=None, priority=None, log=print):
+        self.torch_threads = torch_threads
+        self.cv_threads = cv_threads
+        self.cores = cores or {}
+        self.priority = priority or {}
+        self.log = log
+
+    def describe(self):
+        parts = []
+        if self.torch_threads is not None:
+            parts.append(f"torch {self.torch_threads} threads")
+        if self.cv_threads is not None:
+            parts.append(f"OpenCV {self.cv_threads} threads")
+        parts += [f"{stage} on CPU {','.join(map(str, sorted(cpus)))}" for stage, cpus in self.cores.items()]
+        parts += [f"{stage} {level} priority" for stage, level in self.priority.items()]
+        return ", ".join(parts) or "default threads, no pinning"
+
+    def apply_libraries(self):
+        """Size the torch and OpenCV pools; call before the model runs."""
+        if self.torch_threads is not None:
+            try:
+                import torch
+                torch.set_num_threads(self.torch_threads)
+            except ImportError:
+                pass
+        if self.cv_threads is not None:
+            try:
+                import cv2
+                cv2.setNumThreads(self.cv_threads)
+            except ImportError:
+                pass
+
+    def apply(self, stage, thread=None):
+        """
+        Pin and prioritise a thread (default: the calling one) as `stage`.
+        Call once every long-lived thread has been started (see above).
+        """
+        native_id = threading.get_native_id() if thread is None else thread.native_id
+        if native_id is None:
+            return
+        # A stage left out of TRAFFIC_CORES may have inherited a pinned mask; widening it is allowed
+        cpus = self.cores.get(stage) or (set(range(os.cpu_count() or 1)) if self.cores else None)
+        if cpus:
+            try:
+                _set_affinity(native_id, cpus)
+            except (OSError, AttributeError, ValueError) as e:
+                self.log(f"[RESOURCES] Could not pin {stage} thread to CPU {sorted(cpus)}: {e}")
+        level = self.priority.get(stage)
+        if level is None and self.priority and _inherited_boost(native_id):
+            level = "normal"  # lowering an inherited boost needs no privilege; undoing a lowering would
+        if level:
+            try:
+                _set_priority(native_id, level)
+            except (OSError, AttributeError) as e:
+                self.log(f"[RESOURCES] Could not set {stage} thread to {level} priority: {e}")
+
+    def apply_control(self, reply_reader=None, preempt_listener=None, wave=None):
+        """Apply the control stage to the controllers' control threads that exist."""
+        for thread in (reply_reader, preempt_listener and preempt_listener.thread, wave and wave.bus.thread):
+            if thread is not None:
+                self.apply("control", thread)
+
+
+def _set_affinity(native_id, cpus):
+    if sys.platform == "win32":
+        import ctypes
+
+        kernel32 = ctypes.windll.kernel32
+        handle = kernel32.OpenThread(0x0060, False, native_id)  # THREAD_SET_INFORMATION | QUERY_INFORMATION
+        if not handle:
+            raise ctypes.WinError()
+        try:
+            if not kernel32.SetThreadAffinityMask(handle, sum(1 << cpu for cpu in cpus)):
+                raise ctypes.WinError()
+        finally:
+            kernel32.CloseHandle(handle)
+    else:
+        os.sched_setaffinity(native_id, cpus)  # a thread id on Linux
+
+
+def _inherited_boost(native_id):
+    """True if a Linux thread runs above normal priority (Windows threads start at normal)."""
+    if sys.platform == "win32":
+        return False
+    try:
+        return os.getpriority(os.PRIO_PROCESS, native_id) < NICE["normal"]
+    except (OSError, AttributeError):
+        return False
+
+
+def _set_priority(native_id, level):
+    if sys.platform == "win32":
+        import ctypes
+
+        kernel32 = ctypes.windll.kernel32
+        handle = kernel32.OpenThread(0x0060, False, native_id)
+        if not handle:
+            raise ctypes.WinError()
+        try:
+            if not kernel32.SetThreadPriority(handle, WINDOWS_PRIORITY[level]):
+                raise ctypes.WinError()
+        finally:
+            kernel32.CloseHandle(handle)
+    else:
+        os.setpriority(os.PRIO_PROCESS, native_id, NICE[level])  # per thread on Linux
+
+
+def resources_from_env(log=print):
+    """ResourceConfig from TRAFFIC_TORCH_THREADS, TRAFFIC_CV_THREADS, TRAFFIC_CORES and TRAFFIC_PRIORITY."""
+    torch_threads = os.environ.get("TRAFFIC_TORCH_THREADS")
+    cv_threads = os.environ.get("TRAFFIC_CV_THREADS")
+    return ResourceConfig(torch_threads=int(torch_threads) if torch_threads else None,
+                          cv_threads=int(cv_threads) if cv_threads else None,
+                          cores=parse_stages(os.environ.get("TRAFFIC_CORES", ""), parse_cpus),
+                          priority=parse_stages(os.environ.get("TRAFFIC_PRIORITY", ""), _priority_level),
+                          log=log)
+
+
+def _inference_workload():
+    """(name, callable) standing in for one frame of inference."""
+    try:
+        from ultralytics import YOLO
+
+        from bench_suite import SAMPLE_IMAGES
+        from inference_server import MODEL_PATH
+        from preprocess import LocalDetector
+        import cv2
+
+        if os.path.exists(MODEL_PATH):
+            frame = cv2.resize(cv2.imread(SAMPLE_IMAGES[0]), (640, 480))
+            detector = LocalDetector(YOLO(MODEL_PATH), imgsz=416)
+            return "yolo", lambda: detector.infer(frame)
+    except (ImportError, TypeError, AttributeError):
+        pass
+    try:
+        import torch
+
+        weights = torch.randn(512, 512)
+        inputs = torch.randn(256, 512)
+        return "torch matmul", lambda: [inputs @ weights for _ in range(20)]
+    except ImportError:
+        pass
+    weights = np.random.default_rng(0).random((512, 512), np.float32)
+    inputs = np.random.default_rng(1).random((256, 512), np.float32)
+    return "numpy matmul", lambda: [inputs @ weights for _ in range(20)]
+
+
+def _worker(seconds, period=0.05):
+    """One matrix cell: runs in a child process configured by its environment; prints JSON."""
+    from serial_protocol import FramedPort
+
+    config = resources_from_env(log=lambda msg: print(msg, file=sys.stderr))
+    config.apply_libraries()
+    name, infer = _inference_workload()
+    running = True
+    inference_ms, lateness_ms = [], []
+
+    def gui():
+        config.apply("gui")
+        frame = np.random.default_rng(2).integers(0, 255, (480, 640, 3), np.uint8)
+        rgb = np.empty_like(frame)
+        while running:
+            # Repaint stand-in: BGR->RGB conversion and a scaled copy, 30 times a second
+            np.copyto(rgb, frame[..., ::-1])
+            rgb[::2, ::2].copy()
+            time.sleep(1 / 30)
+
+    class MemoryPort:
+        is_open = True
+
+        def write(self, data):
+            pass
+
+    def control():
+        config.apply("control")
+        port = FramedPort("memory", mode="text")
+        port.ser, port.binary = MemoryPort(), True
+        deadline = time.perf_counter() + period
+        green = ("S1", "S4")
+        while running:
+            time.sleep(max(0.0, deadline - time.perf_counter()))
+            lateness_ms.append((time.perf_counter() - deadline) * 1000)
+            with port.batch():
+                port.send([(green, "GREEN")])
+            green = ("S2", "S3") if green == ("S1", "S4") else ("S1", "S4")
+            deadline += period
+
+    threads = [threading.Thread(target=gui, daemon=True), threading.Thread(target=control, daemon=True)]
+    for thread in threads:
+        thread.start()
+    config.apply("inference")  # after the other threads start, so they don't inherit it
+    for _ in range(3):
+        infer()
+    lateness_ms.clear()
+    end = time.perf_counter() + seconds
+    while time.perf_counter() < end:
+        start = time.perf_counter()
+        infer()
+        inference_ms.append((time.perf_counter() - start) * 1000)
+    running = False
+    for thread in threads:
+        thread.join()
+    inference, lateness = np.array(inference_ms), np.array(lateness_ms)
+    print(json.dumps({
+        "workload": name, "config": config.describe(), "frames": len(inference),
+        "inference_p50_ms": float(np.percentile(inference, 50)),
+        "inference_p99_ms": float(np.percentile(inference, 99)),
+        "switch_late_p50_ms": float(np.percentile(lateness, 50)),
+        "switch_late_p99_ms": float(np.percentile(lateness, 99)),
+        "switch_late_max_ms": float(lateness.max()),
+    }))
+
+
+def default_matrix(cores=None):
+    """Thread counts, pinning and priority settings worth comparing on this machine."""
+    cores = cores or os.cpu_count() or 1
+    matrix = [{}]
+    for threads in sorted({1, max(1, cores // 2), cores, max(1, cores - 1)}):
+        matrix.append({"TRAFFIC_TORCH_THREADS": str(threads), "TRAFFIC_CV_THREADS": "1"})
+    if cores >= 2:
+        rest = f"1-{cores - 1}" if cores > 2 else "1"
+        pinned = {"TRAFFIC_TORCH_THREADS": str(cores - 1), "TRAFFIC_CV_THREADS": "1",
+                  "TRAFFIC_CORES": f"inference={rest},gui=0,control=0"}
+        matrix.append(pinned)
+        matrix.append({**pinned, "TRAFFIC_PRIORITY": "gui=low"})
+    matrix.append({"TRAFFIC_PRIORITY": "inference=low,gui=low"})
+    return matrix
+
+
+def parse_matrix(text):
+    """'A=1,B=x;C=2' -> [{'A': '1', 'B': 'x'}, {'C': '2'}]; values may contain commas (stage lists)."""
+    matrix = []
+    for cell in text.split(";"):
+        env = {}
+        key = None
+        for part in cell.split(","):
+            name, sep, value = part.partition("=")
+            if sep and name.strip().startswith("TRAFFIC_"):
+                key = name.strip()
+                env[key] = value
+            elif key is not None:
+                env[key] += "," + part
+        matrix.append(env)
+    return matrix
+
+
+def bench(seconds, matrix):
+    keys = ("TRAFFIC_TORCH_THREADS", "TRAFFIC_CV_THREADS", "TRAFFIC_CORES", "TRAFFIC_PRIORITY")
+    workload = None
+    base_env = {key: value for key, value in os.environ.items() if key not in keys}
+    print(f"{os.cpu_count()} CPUs, {seconds:.0f} s per configuration")
+    print(f"  {'configuration':<62}{'infer p50':>10}{'p99':>8}{'switch late p50':>17}{'p99':>8}{'max':>8}")
+    for env in matrix:
+        result = subprocess.run([sys.executable, __file__, "worker", "--seconds", str(seconds)],
+                                env={**base_env, **env}, capture_output=True, text=True)
+        label = " ".join(f"{key[8:].lower()}={value}" for key, value in env.items()) or "defaults"
+        if result.returncode != 0:
+            print(f"  {label:<62} failed: {result.stderr.strip().splitlines()[-1:]}")
+            continue
+        for line in result.stderr.strip().splitlines():
+            print(f"  {'':<4}{line}")
+        row = json.loads(result.stdout.strip().splitlines()[-1])
+        workload = row["workload"]
+        print(f"  {label:<62}{row['inference_p50_ms']:>8.1f}ms{row['inference_p99_ms']:>6.1f}ms"
+              f"{row['switch_late_p50_ms']:>15.2f}ms{row['switch_late_p99_ms']:>6.2f}ms"
+              f"{row['switch_late_max_ms']:>6.1f}ms")
+    if workload:
+        print(f"(inference workload: {workload})")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Thread, core and priority settings for the pipeline")
+    sub = parser.add_subparsers(dest="command", required=True)
+    bench_parser = sub.add_parser("bench", help="benchmark matrix: inference p99 and phase switch jitter")
+    bench_parser.add_argument("--seconds", type=float, default=10)
+    bench_parser.add_argument("--matrix", help="';'-separated configurations of TRAFFIC_* settings "
+                                               "(default: a matrix sized to this machine)")
+    worker = sub.add_parser("worker", help=argparse.SUPPRESS)
+    worker.add_argument("--seconds", type=float, default=10)
+    args = parser.parse_args()
+
+    if args.command == "worker":
+        _worker(args.seconds)
+    else:
+        bench(args.seconds, parse_matrix(args.matrix) if args.matrix else default_matrix())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,523 @@
+"""
+Runtime settings that can be changed while the controller is running.
+
+One file, traffic.yaml (TRAFFIC_CONFIG overrides the path), holds what used
+to be constants in detect_cars.py, traffic_light_gui.py and
+traffic_control.py:
+
+    serial:    port, baud_rate
+    camera:    source (index or file/URL), width, height, fps, fourcc
+    detector:  model (weights path), imgsz (416, auto or [320, 416, 640]),
+               conf, iou
+    zones:     north, south, west, east (threshold offsets, as in zones.yaml)
+    timing:    green_table (seconds for 0, 1, 2... cars on the busier phase),
+               per_extra_car (seconds added per car beyond the table)
+
+Keys left out keep their defaults: the TRAFFIC_CAMERA* and TRAFFIC_IMGSZ
+variables, zones.yaml, the sweep's model (model_sweep.py) and the built-in
+green times, so a missing file changes nothing. Write one with every value
+filled in, or check one before copying it into place, with
+
+    python runtime_config.py init [FILE]
+    python runtime_config.py check [FILE]
+
+ConfigWatcher polls the file (and zones.yaml, which calibrate_zones.py
+writes) once a second. A changed file is validated as a whole: an unknown
+key or a bad value rejects the change, which is logged, and the running
+settings stay. Everything slow is prepared on the watcher thread while the
+frame loop keeps running: a new model is loaded and warmed up, a new serial
+port is opened (including the ESP32's 2 s boot wait) and a new camera is
+opened. The loop calls apply_pending() between frames, which swaps it all
+in at once:
+
+    zones      the next frame is classified with the new threshold lines
+    timing     the CycleController (and forecaster) size greens with the new table
+    conf/iou   set on the running detector
+    model      the warmed-up detector replaces the old one
+    serial     the new port replaces the old one and the current phase is resent
+    camera     the new capture replaces the old one
+
+Each change is logged as a 'config' event with its prepare and apply times.
+A serial or camera change that keeps the same port or device can't be
+opened next to the old one, so it is reopened inside apply (the serial boot
+wait then lands on that frame); if the reopen fails, the old settings are
+restored and nothing else is applied.
+"""
+import argparse
+import os
+import sys
+import threading
+import time
+from dataclasses import asdict, dataclass, fields, replace
+
+import numpy as np
+import yaml
+
+from zones import ZONES_FILE, ZoneConfig, load_zone_config
+
+CONFIG_FILE = "traffic.yaml"
+SECTIONS = ("serial", "camera", "detector", "zones", "timing")
+
+
+@dataclass(frozen=True)
+class SerialSettings:
+    port: str = "COM3"  # the ESP32's COM port (COM3, COM4, ... or /dev/ttyUSB0)
+    baud_rate: int = 115200
+
+
+@dataclass(frozen=True)
+class CameraSettings:
+    source: object = 0  # device index or file/URL
+    width: int = 640
+    height: int = 480
+    fps: float = 30.0
+    fourcc: str = "MJPG"
+
+    def open(self, pool=None):
+        from camera import Camera
+
+        return Camera(self.source, self.width, self.height, self.fps, self.fourcc or None, pool=pool)
+
+
+@dataclass(frozen=True)
+class DetectorSettings:
+    model: str = None  # None = the sweep's pick (TRAFFIC_LATENCY_BUDGET_MS) or the trained model
+    imgsz: str = None  # None = TRAFFIC_IMGSZ, the sweep's size or 416
+    conf: float = 0.55
+    iou: float = 0.3
+
+
+@dataclass(frozen=True)
+class TimingSettings:
+    green_table: tuple = (5, 10, 20)
+    per_extra_car: int = 10
+
+    def policy(self):
+        """green_time callable for CycleController."""
+        from traffic_control import GreenTimeTable
+
+        return GreenTimeTable(self.green_table, self.per_extra_car)
+
+
+@dataclass(frozen=True)
+class RuntimeConfig:
+    serial: SerialSettings = SerialSettings()
+    camera: CameraSettings = CameraSettings()
+    detector: DetectorSettings = DetectorSettings()
+    zones: ZoneConfig = ZoneConfig()
+    timing: TimingSettings = TimingSettings()
+
+    def to_dict(self):
+        data = {section: asdict(getattr(self, section)) for section in SECTIONS}
+        data["timing"]["green_table"] = list(self.timing.green_table)
+        return data
+
+
+# -- validation ----------------------------------------------------------
+
+def _integer(low, high):
+    def check(value):
+        if isinstance(value, bool) or not isinstance(value, int) or not low <= value <= high:
+            raise ValueError(f"expected a whole number from {low} to {high}, got {value!r}")
+        return value
+    return check
+
+
+def _number(low, high):
+    def check(value):
+        if isinstance(value, bool) or not isinstance(value, (int, float)) or not low <= value <= high:
+            raise ValueError(f"expected a number from {low} to {high}, got {value!r}")
+        return float(value)
+    return check
+
+
+def _text(value):
+    if not isinstance(value, str) or not value.strip():
+        raise ValueError(f"expected a name, got {value!r}")
+    return value.strip()
+
+
+def _optional(check):
+    return lambda value: None if value is None else check(value)
+
+
+def _source(value):
+    if isinstance(value, str) and value.strip().isdigit():
+        value = int(value)
+    if isinstance(value, int) and not isinstance(value, bool):
+        return _integer(0, 99)(value)
+    return _text(value)
+
+
+def _fourcc(value):
+    if value in (None, ""):
+        return ""
+    if not isinstance(value, str) or len(value) != 4:
+        raise ValueError(f"expected a four character code like MJPG, got {value!r}")
+    return value
+
+
+def _weights(value):
+    value = _text(value)
+    if not os.path.exists(value):
+        raise ValueError(f"{value} does not exist")
+    return value
+
+
+def _imgsz(value):
+    from input_size import parse_imgsz
+
+    return parse_imgsz(value)
+
+
+def _green_table(value):
+    if not isinstance(value, (list, tuple)) or not value:
+        raise ValueError(f"expected a list of seconds like [5, 10, 20], got {value!r}")
+    table = tuple(_integer(1, 600)(seconds) for seconds in value)
+    if list(table) != sorted(table):
+        raise ValueError(f"green times must not decrease with more cars, got {list(table)}")
+    return table
+
+
+CHECKS = {
+    "serial": {"port": _text, "baud_rate": _integer(1200, 4000000)},
+    "camera": {"source": _source, "width": _integer(160, 4096), "height": _integer(120, 4096),
+               "fps": _number(1, 240), "fourcc": _fourcc},
+    "detector": {"model": _optional(_weights), "imgsz": _optional(_imgsz), "conf": _number(0.01, 1),
+                 "iou": _number(0.01, 1)},
+    "zones": {name: _integer(0, 4096) for name in ("north", "south", "west", "east")},
+    "timing": {"green_table": _green_table, "per_extra_car": _integer(0, 600)},
+}
+
+
+def parse_config(data, defaults=RuntimeConfig()):
+    """RuntimeConfig from parsed YAML over `defaults`; raises ValueError naming the first bad key."""
+    if data is None:
+        data = {}
+    if not isinstance(data, dict):
+        raise ValueError("expected sections (serial, camera, detector, zones, timing) at the top level")
+    unknown = sorted(set(data) - set(SECTIONS))
+    if unknown:
+        raise ValueError(f"unknown section {unknown[0]!r} (expected one of {', '.join(SECTIONS)})")
+    sections = {}
+    for section in SECTIONS:
+        values = data.get(section) or {}
+        if not isinstance(values, dict):
+            raise ValueError(f"{section}: expected keys, got {values!r}")
+        checks = CHECKS[section]
+        current = getattr(defaults, section)
+        updates = {}
+        for key, value in values.items():
+            if key not in checks:
+                raise ValueError(f"{section}: unknown key {key!r} (expected one of {', '.join(checks)})")
+            try:
+                updates[key] = checks[key](value)
+            except ValueError as e:
+                raise ValueError(f"{section}.{key}: {e}") from None
+        sections[section] = replace(current, **updates)
+    return RuntimeConfig(**sections)
+
+
+def load_config(path=CONFIG_FILE, defaults=None):
+    """Validated settings from `path` over `defaults` (config_from_env()); a missing file gives the defaults."""
+    defaults = defaults or config_from_env()
+    if not os.path.exists(path):
+        return defaults
+    with open(path) as f:
+        try:
+            data = yaml.safe_load(f)
+        except yaml.YAMLError as e:
+            raise ValueError(f"not valid YAML: {e}") from None
+    return parse_config(data, defaults)
+
+
+def config_from_env(zones_file=ZONES_FILE):
+    """Settings used for keys the file leaves out: TRAFFIC_CAMERA*, zones.yaml and built-in values."""
+    from camera import camera_settings_from_env
+
+    camera = camera_settings_from_env()
+    return RuntimeConfig(camera=CameraSettings(**camera), zones=load_zone_config(zones_file))
+
+
+def describe_changes(old, new):
+    """'section.key old -> new' for every value that differs."""
+    changes = []
+    for section in SECTIONS:
+        before, after = getattr(old, section), getattr(new, section)
+        for field in fields(before):
+            a, b = getattr(before, field.name), getattr(after, field.name)
+            if a != b:
+                changes.append(f"{section}.{field.name} {a} -> {b}")
+    return changes
+
+
+# -- building and swapping -----------------------------------------------
+
+def load_detector(settings, event_log=None, log=print):
+    """LocalDetector/AdaptiveDetector for DetectorSettings (model and size defaults as in model_sweep.py)."""
+    from ultralytics import YOLO
+
+    from input_size import build_detector
+    from model_sweep import model_from_env
+
+    weights, imgsz = (settings.model, None) if settings.model else model_from_env(log=log)
+    setting = settings.imgsz or os.environ.get("TRAFFIC_IMGSZ", str(imgsz or 416))
+    return build_detector(YOLO(weights), setting, conf=settings.conf, iou=settings.iou, event_log=event_log)
+
+
+class ConfigChange:
+    """
+    A validated change from `old` to `new` plus what the watcher prepared
+    for it (detector, port, camera); apply() swaps it into the running loop.
+    """
+
+    def __init__(self, old, new):
+        self.old = old
+        self.new = new
+        self.detector = None
+        self.port = None
+        self.camera = None
+        self.prepare_ms = 0.0
+        self.apply_ms = None
+
+    def changed(self, section):
+        return getattr(self.old, section) != getattr(self.new, section)
+
+    def discard(self):
+        """Close what was prepared for a change that will not be applied."""
+        if self.port is not None:
+            self.port.close()
+        if self.camera is not None:
+            self.camera.release()
+
+    def apply(self, target):
+        """
+        Swap the change into `target`, which has the loop's zones, detector,
+        cap, ser, cycle, forecaster and preemption attributes and a
+        resync_lamps() method (the VideoThread, or detect_cars' module).
+        Returns None, or the reason the change was abandoned.
+        """
+        start = time.perf_counter()
+        new = self.new
+        # Same device or port: reopen in place first, since these are the steps that can fail
+        reopened_camera = False
+        if self.changed("camera") and self.camera is None:
+            cap = target.cap
+            cap.release()
+            target.cap = new.camera.open(pool=cap.pool)
+            if not target.cap.isOpened():
+                target.cap = self.old.camera.open(pool=cap.pool)
+                return f"could not reopen camera {new.camera.source}"
+            reopened_camera = True
+        if self.changed("serial") and self.port is None:
+            ser = target.ser
+            ser.baud_rate = new.serial.baud_rate
+            try:
+                ser.open()
+            except OSError as e:
+                ser.baud_rate = self.old.serial.baud_rate
+                if reopened_camera:
+                    target.cap.release()
+                    target.cap = self.old.camera.open(pool=target.cap.pool)
+                try:
+                    ser.open()
+                except OSError:
+                    pass  # the controller's reconnect path keeps trying
+                return f"could not reopen {ser.port} at {new.serial.baud_rate} baud: {e}"
+            ser.rebooted = True
+        if self.changed("zones"):
+            target.zones = new.zones
+            detect = getattr(target.preemption, "detector", None)
+            if hasattr(detect, "zones"):
+                detect.zones = new.zones
+        if self.changed("timing"):
+            policy = new.timing.policy()
+            target.cycle.green_time = policy
+            if target.forecaster:
+                target.forecaster.green_time = policy
+        if self.detector is not None:
+            target.detector = self.detector
+        elif self.changed("detector") and target.detector is not None:
+            target.detector.set_thresholds(new.detector.conf, new.detector.iou)
+        if self.camera is not None:
+            old, target.cap = target.cap, self.camera
+            old.release()
+        if self.port is not None:
+            old, target.ser = target.ser, self.port
+            self.port.on_error = old.on_error
+            self.port.rebooted = True
+            old.close()
+        if self.changed("serial"):
+            target.resync_lamps()
+        self.apply_ms = (time.perf_counter() - start) * 1000
+        return None
+
+
+class ConfigWatcher:
+    """
+    Polls the config file and prepares changes in the background.
+
+    local_model: False when frames go to a shared inference server
+                 (detector changes are then ignored)
+    event_log: optional EventLog for 'config' events
+    camera_pool: FramePool handed to a newly opened camera
+    """
+
+    def __init__(self, path=CONFIG_FILE, zones_file=ZONES_FILE, interval=1.0, local_model=True,
+                 event_log=None, camera_pool=None):
+        self.path = path
+        self.zones_file = zones_file
+        self.interval = interval
+        self.local_model = local_model
+        self.event_log = event_log
+        self.camera_pool = camera_pool
+        self.changes = 0
+        self.rejected = 0
+        self.pending = None
+        self._seen = self._stamp()
+        self.config = load_config(path, config_from_env(zones_file))
+        self._closed = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="config-watcher", daemon=True)
+        self._thread.start()
+        return self
+
+    def close(self):
+        self._closed.set()
+        if self._thread is not None:
+            self._thread.join()
+        change, self.pending = self.pending, None
+        if change is not None:
+            change.discard()
+
+    def apply_pending(self, target):
+        """Apply a prepared change to the loop's objects; call between frames. Returns it (or None)."""
+        change = self.pending
+        if change is None:
+            return None
+        self.pending = None
+        error = change.apply(target)
+        if error:
+            self.rejected += 1
+            change.discard()
+            self._log(f"[CONFIG] Rejected {self.path}: {error}; keeping the running settings", error=error)
+            return change
+        self.config = change.new
+        self.changes += 1
+        self._log(f"[CONFIG] Applied {', '.join(describe_changes(change.old, change.new))} "
+                  f"(prepared in {change.prepare_ms:.0f} ms, applied in {change.apply_ms:.1f} ms)",
+                  prepare_ms=round(change.prepare_ms, 1), apply_ms=round(change.apply_ms, 2))
+        return change
+
+    def _stamp(self):
+        stamps = []
+        for path in (self.path, self.zones_file):
+            try:
+                stamps.append(os.stat(path).st_mtime_ns)
+            except OSError:
+                stamps.append(None)
+        return tuple(stamps)
+
+    def _run(self):
+        while not self._closed.wait(self.interval):
+            if self.pending is not None:
+                continue  # the loop has not taken the last change yet
+            stamp = self._stamp()
+            if stamp != self._seen:
+                self._seen = stamp
+                self.check()
+
+    def check(self):
+        """Reload the file now; a valid change is prepared and left for apply_pending()."""
+        try:
+            new = load_config(self.path, config_from_env(self.zones_file))
+        except (OSError, ValueError) as e:
+            self._reject(e)
+            return None
+        if new == self.config:
+            return None
+        change = ConfigChange(self.config, new)
+        start = time.perf_counter()
+        try:
+            self._prepare(change)
+        except Exception as e:  # model, port and camera errors alike; the running settings stay
+            change.discard()
+            self._reject(e)
+            return None
+        change.prepare_ms = (time.perf_counter() - start) * 1000
+        self.pending = change
+        return change
+
+    def _prepare(self, change):
+        old, new = change.old, change.new
+        if new.detector != old.detector and not self.local_model:
+            self._log("[CONFIG] detector settings ignored: frames go to the shared inference server")
+            change.new = new = replace(new, detector=old.detector)
+        elif (new.detector.model, new.detector.imgsz) != (old.detector.model, old.detector.imgsz):
+            detector = load_detector(new.detector, self.event_log, log=self._log)
+            # Build the model's buffers and caches before it sees a live frame
+            blank = np.zeros((new.camera.height, new.camera.width, 3), np.uint8)
+            for _ in range(2):
+                detector.infer(blank)
+            change.detector = detector
+        if new.serial.port != old.serial.port:
+            from serial_protocol import FramedPort
+
+            change.port = FramedPort(new.serial.port, new.serial.baud_rate).open()
+        if new.camera.source != old.camera.source:
+            change.camera = new.camera.open(pool=self.camera_pool)
+            if not change.camera.isOpened():
+                raise OSError(f"could not open camera {new.camera.source}")
+
+    def _reject(self, error):
+        self.rejected += 1
+        self._log(f"[CONFIG] Rejected {self.path}: {error}; keeping the running settings", error=str(error))
+
+    def _log(self, msg, **fields):
+        if self.event_log is not None:
+            self.event_log.log("config", msg, **fields)
+        else:
+            print(msg)
+
+
+def watcher_from_env(**kwargs):
+    """ConfigWatcher for TRAFFIC_CONFIG (default traffic.yaml); raises ValueError for an invalid file."""
+    path = os.environ.get("TRAFFIC_CONFIG", CONFIG_FILE)
+    try:
+        return ConfigWatcher(path, **kwargs)
+    except ValueError as e:
+        raise ValueError(f"{path}: {e}") from None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Write or check the runtime configuration file")
+    sub = parser.add_subparsers(dest="command", required=True)
+    init = sub.add_parser("init", help="write the current defaults to a config file")
+    init.add_argument("path", nargs="?", default=os.environ.get("TRAFFIC_CONFIG", CONFIG_FILE))
+    init.add_argument("--force", action="store_true", help="overwrite an existing file")
+    check = sub.add_parser("check", help="validate a config file and show what it changes")
+    check.add_argument("path", nargs="?", default=os.environ.get("TRAFFIC_CONFIG", CONFIG_FILE))
+    args = parser.parse_args()
+
+    defaults = config_from_env()
+    if args.command == "init":
+        if os.path.exists(args.path) and not args.force:
+            sys.exit(f"{args.path} exists (use --force to overwrite)")
+        with open(args.path, "w") as f:
+            yaml.safe_dump(defaults.to_dict(), f, sort_keys=False)
+        print(f"Wrote {args.path}")
+        return
+    try:
+        config = load_config(args.path, defaults)
+    except ValueError as e:
+        sys.exit(f"{args.path}: {e}")
+    changes = describe_changes(defaults, config)
+    print(f"{args.path} is valid" + (":" if changes else ", same as the defaults"))
+    for line in changes:
+        print(f"  {line}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,410 @@
+"""
+Framed binary protocol for the ESP32 link, with a fallback to text.
+
+The text protocol sends one free-form line per command ("S1:S4:GREEN\\n").
+The firmware echoes every line and replies with another one
+("< Received: ...", "OK: S1 & S4 GREEN"). Nothing detects a corrupted
+byte, and a phase switch takes two lines. The framed protocol sends:
+
+    command  A5 | version | seq (u16) | count | count x (heads, green) | CRC-16
+    reply    A5 | version | seq (u16) | status | lamps | CRC-16
+
+heads and green are bitmasks of the signal heads (bit 0 = S1 ... bit 3 =
+S4). Every head in heads goes GREEN if its green bit is set and RED
+otherwise, so one record can set all four lamps. Up to MAX_BATCH records
+go in one frame and are applied together. The CRC is CRC-16/CCITT-FALSE
+over everything between A5 and the CRC, little endian like the other
+fields. The reply carries the resulting lamp state (green bits 0-3, red
+bits 4-7). The firmware has no "< Received" echo in framed mode. With the
+text protocol the lamp state is worked out from the "OK: ..." replies, so a
+command lost on the wire shows up there too.
+
+At connect time FramedPort sends "PROTO?". Firmware that speaks the framed
+protocol answers "PROTO:1 BATCH:8". Older firmware answers "ERROR: Invalid
+command format" and the port keeps sending text. TRAFFIC_SERIAL_PROTOCOL
+=text skips the negotiation. Replies to frames are handed to readers as
+the same "OK: ..." lines the text firmware prints, so ReplyReader, the
+latency tracer and the metrics work unchanged.
+
+Throughput and latency of both protocols against the ESP32 emulator on a pty:
+
+    python serial_protocol.py bench --switches 200
+"""
+import argparse
+import binascii
+import os
+import struct
+import threading
+import time
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+
+import numpy as np
+
+from latency import command_key, parse_reply
+
+SOF = 0xA5
+VERSION = 1
+MAX_BATCH = 8
+HEADS = ("S1", "S2", "S3", "S4")
+# A paired GREEN also turns the opposite pair RED in handleSerialCommand
+OPPOSITE = {frozenset(("S1", "S4")): ("S2", "S3"), frozenset(("S2", "S3")): ("S1", "S4")}
+STATUS = {0: "ok", 1: "bad CRC", 2: "bad version", 3: "bad length"}
+REPLY_SIZE = 8
+
+
+def crc16(data):
+    """CRC-16/CCITT-FALSE (poly 0x1021, init 0xFFFF), as computed by the firmware."""
+    return binascii.crc_hqx(data, 0xFFFF)
+
+
+def head_mask(lanes):
+    return sum(1 << HEADS.index(lane) for lane in lanes)
+
+
+def encode_command(lanes, color):
+    """(heads, green) record with the same effect as the text command for lanes/color."""
+    heads = head_mask(lanes)
+    green = heads if color == "GREEN" else 0
+    opposite = OPPOSITE.get(frozenset(lanes))
+    if color == "GREEN" and opposite:
+        heads |= head_mask(opposite)
+    return heads, green
+
+
+def apply_record(lamps, heads, green):
+    """Lamp state (green bits 0-3, red bits 4-7) after the firmware applies one record."""
+    for i in range(len(HEADS)):
+        if heads & 1 << i:
+            lamps &= ~(1 << i | 1 << (i + 4))
+            lamps |= 1 << i if green & 1 << i else 1 << (i + 4)
+    return lamps
+
+
+def text_ack_record(line):
+    """(heads, green) acknowledged by a text 'OK: S1 & S4 GREEN' line, or None if it is garbled."""
+    reply = parse_reply(line.decode(errors="replace"))
+    if reply is None or reply[0] != "ack":
+        return None
+    *lanes, color = reply[1].split(":")
+    if not lanes or not set(lanes) <= set(HEADS) or color not in ("GREEN", "RED"):
+        return None
+    return encode_command(lanes, color)
+
+
+def encode_frame(seq, records):
+    body = struct.pack("<BHB", VERSION, seq & 0xFFFF, len(records)) + bytes(
+        value for record in records for value in record)
+    return bytes((SOF,)) + body + struct.pack("<H", crc16(body))
+
+
+def decode_frame(data):
+    """Command frame -> (seq, [(heads, green), ...]); ValueError if it is malformed."""
+    if len(data) < 7 or data[0] != SOF:
+        raise ValueError("not a frame")
+    version, seq, count = struct.unpack_from("<BHB", data, 1)
+    if len(data) != 7 + 2 * count:
+        raise ValueError("bad length")
+    if crc16(data[1:-2]) != struct.unpack_from("<H", data, len(data) - 2)[0]:
+        raise ValueError("bad CRC")
+    if version != VERSION:
+        raise ValueError("bad version")
+    return seq, [(data[5 + 2 * i], data[6 + 2 * i]) for i in range(count)]
+
+
+def encode_reply(seq, status, lamps):
+    body = struct.pack("<BHBB", VERSION, seq & 0xFFFF, status, lamps)
+    return bytes((SOF,)) + body + struct.pack("<H", crc16(body))
+
+
+def decode_reply(data):
+    """Reply frame -> (seq, status, lamps); ValueError if the CRC does not match."""
+    if crc16(data[1:6]) != struct.unpack_from("<H", data, 6)[0]:
+        raise ValueError("bad CRC")
+    _, seq, status, lamps = struct.unpack_from("<BHBB", data, 1)
+    return seq, status, lamps
+
+
+def text_command(lanes, color):
+    return (":".join([*lanes, color]) + "\n").encode()
+
+
+def ok_line(key):
+    """The firmware's text reply for a command key: 'S1:S4:GREEN' -> 'OK: S1 & S4 GREEN'."""
+    *lanes, color = key.split(":")
+    return f"OK: {' & '.join(lanes)} {color}\n".encode()
+
+
+class FramedPort:
+    """
+    ESP32 serial port speaking the framed protocol when the firmware does, text otherwise.
+
+    Keeps the pyserial calls the controllers and ReplyReader use (is_open,
+    readline, close) and replaces write with send(commands), where commands
+    is a list of (lanes, color) tuples sent in one write. Sends made inside
+    `with port.batch():` on the same thread are coalesced into one write
+    when the block exits. A failed deferred write goes to on_error(exc).
+
+    A read or write error (e.g. the USB cable was pulled) closes the port,
+    so is_open turns False and the controller's reconnect path runs;
+    open() reopens it. `rebooted` is set when the firmware's boot banner
+    shows up on an open port (reset, brown-out): its lamps are all off and
+    the controller should send the current phase again.
+    """
+
+    def __init__(self, port, baud_rate=115200, mode=None, timeout=1, on_error=None):
+        self.port = port
+        self.baud_rate = baud_rate
+        self.mode = mode or os.environ.get("TRAFFIC_SERIAL_PROTOCOL", "auto")
+        self.timeout = timeout
+        self.on_error = on_error
+        self.ser = None
+        self.binary = False
+        self.seq = 0
+        self.pending = OrderedDict()  # seq -> (send time, command keys) awaiting a reply
+        self.lamps = None             # last lamp state reported by the firmware
+        self.text_sent = 0.0          # monotonic time of the last text command
+        self.bytes_sent = 0
+        self.rebooted = False
+        self._buffer = bytearray()
+        self._lines = deque()
+        self._write_lock = threading.Lock()
+        self._read_lock = threading.Lock()
+        self._batch = threading.local()
+
+    def open(self, settle=2.0):
+        """Open (or reopen) the port, wait for the ESP32 to boot and negotiate the protocol."""
+        import serial
+
+        if self.ser is not None:
+            self.ser.close()
+        self.ser = serial.Serial(self.port, self.baud_rate, timeout=self.timeout)
+        time.sleep(settle)  # Wait for ESP32 to initialize
+        self.pending.clear()
+        self.lamps = None
+        self.negotiate()
+        self.rebooted = False
+        return self
+
+    @property
+    def is_open(self):
+        return self.ser is not None and self.ser.is_open
+
+    def close(self):
+        if self.ser is not None:
+            self.ser.close()
+
+    def describe(self):
+        return f"framed protocol v{VERSION}" if self.binary else "text protocol"
+
+    def negotiate(self, timeout=1.0):
+        """Ask the firmware for the framed protocol; returns True if it is used."""
+        self.binary = False
+        if self.mode == "text":
+            return False
+        with self._read_lock:
+            self._buffer.clear()
+            self._lines.clear()
+            self.ser.reset_input_buffer()
+            self._write(b"PROTO?\n")
+            deadline = time.monotonic() + timeout
+            while time.monotonic() < deadline:
+                line = self._readline()
+                if line.startswith(b"PROTO:"):
+                    self.binary = int(line.split()[0][6:]) == VERSION
+                    break
+                if line.startswith(b"ERROR"):
+                    break
+        return self.binary
+
+    def _write(self, data):
+        try:
+            self.ser.write(data)
+        except OSError:  # serial.SerialException is an OSError
+            self.ser.close()
+            raise
+        self.bytes_sent += len(data)
+
+    def send(self, commands):
+        queue = getattr(self._batch, "queue", None)
+        if queue is not None:
+            queue.extend(commands)
+        else:
+            self._send(commands)
+
+    def _send(self, commands):
+        with self._write_lock:
+            if not self.binary:
+                self._write(b"".join(text_command(lanes, color) for lanes, color in commands))
+                self.text_sent = time.monotonic()
+                return
+            data = bytearray()
+            for i in range(0, len(commands), MAX_BATCH):
+                chunk = commands[i:i + MAX_BATCH]
+                self.seq = (self.seq + 1) & 0xFFFF
+                self.pending[self.seq] = (time.monotonic(),
+                                          [command_key(lanes, color) for lanes, color in chunk])
+                while len(self.pending) > 256:  # replies lost with a dropped connection
+                    self.pending.popitem(last=False)
+                data += encode_frame(self.seq, [encode_command(lanes, color) for lanes, color in chunk])
+            self._write(bytes(data))
+
+    @contextmanager
+    def batch(self):
+        """Coalesce this thread's sends inside the block into one write."""
+        if getattr(self._batch, "queue", None) is not None:
+            yield
+            return
+        self._batch.queue = queue = []
+        try:
+            yield
+        finally:
+            self._batch.queue = None
+            if queue:
+                try:
+                    self._send(queue)
+                except Exception as e:
+                    if self.on_error is None:
+                        raise
+                    self.on_error(e)
+
+    def readline(self):
+        """Next reply line (bytes), b'' on timeout. Frame replies come back as 'OK: ...' lines."""
+        with self._read_lock:
+            return self._readline()
+
+    def _readline(self):
+        while not self._lines:
+            self._parse()
+            if self._lines:
+                break
+            try:
+                chunk = self.ser.read(self.ser.in_waiting or 1)
+            except OSError:
+                self.ser.close()
+                raise
+            if not chunk:
+                return b""
+            self._buffer += chunk
+        return self._lines.popleft()
+
+    def _parse(self):
+        buffer = self._buffer
+        while buffer:
+            if buffer[0] == SOF:
+                if len(buffer) < REPLY_SIZE:
+                    return
+                try:
+                    seq, status, lamps = decode_reply(bytes(buffer[:REPLY_SIZE]))
+                except ValueError:
+                    del buffer[0]  # resynchronise on the next A5 or newline
+                    continue
+                del buffer[:REPLY_SIZE]
+                self._lines.extend(self._on_reply(seq, status, lamps))
+                continue
+            # Text never contains A5, so a text line also ends where a frame starts
+            ends = [i for i in (buffer.find(b"\n") + 1, buffer.find(SOF)) if i > 0]
+            if not ends:
+                return
+            end = min(ends)
+            line = bytes(buffer[:end]).strip()
+            del buffer[:end]
+            if line.startswith(b"All pins initialized"):
+                self.rebooted = True
+            elif not self.binary and line.startswith(b"OK:"):
+                record = text_ack_record(line)
+                if record is not None:
+                    self.lamps = apply_record(self.lamps or 0, *record)
+            if line:
+                self._lines.append(line + b"\n")
+
+    def _on_reply(self, seq, status, lamps):
+        with self._write_lock:
+            _, keys = self.pending.pop(seq, (None, ()))
+        self.lamps = lamps
+        if status != 0:
+            return [f"ERROR: frame {seq} rejected ({STATUS.get(status, status)})\n".encode()]
+        return [ok_line(key) for key in keys]
+
+    def shows(self, green_lanes, settle=0.5):
+        """
+        Whether the firmware last reported exactly green_lanes green (and the
+        other heads red). None when unknown: no reply yet, or a command sent
+        less than `settle` seconds ago may still be unanswered.
+        """
+        if self.lamps is None:
+            return None
+        if not self.binary:
+            if time.monotonic() - self.text_sent < settle:
+                return None
+        else:
+            with self._write_lock:
+                recent = [sent for sent, _ in self.pending.values() if time.monotonic() - sent < settle]
+            if recent:
+                return None
+        green = head_mask(green_lanes)
+        return self.lamps == green | (0xF & ~green) << 4
+
+
+def _measure(port, switches, batched):
+    """Stop-and-wait phase switches; returns per-switch write -> last ack latencies (s) and bytes."""
+    latencies = []
+    sent = port.bytes_sent
+    for i in range(switches):
+        on, off = (("S2", "S3"), ("S1", "S4")) if i % 2 else (("S1", "S4"), ("S2", "S3"))
+        commands = [(on, "GREEN"), (off, "RED")]
+        start = time.perf_counter()
+        if batched:
+            port.send(commands)
+        else:
+            for command in commands:
+                port.send([command])
+        acked = 0
+        while acked < len(commands):
+            line = port.readline()
+            if not line:
+                raise TimeoutError(f"no reply to switch {i}")
+            acked += line.startswith(b"OK:")
+        latencies.append(time.perf_counter() - start)
+    return np.array(latencies), (port.bytes_sent - sent) / switches
+
+
+def bench(switches, baud_rate):
+    from esp32_emulator import Esp32Emulator
+
+    print(f"{switches} phase switches (2 commands each), stop-and-wait, {baud_rate} baud emulated")
+    runs = (("text firmware", "text", "text", False),
+            ("current firmware, text commands", "framed", "text", False),
+            ("framed, one frame per command", "framed", "auto", False),
+            ("framed, batched switch", "framed", "auto", True))
+    for name, firmware, mode, batched in runs:
+        emulator = Esp32Emulator(firmware=firmware, baud_rate=baud_rate)
+        path = emulator.start()
+        port = FramedPort(path, baud_rate, mode=mode)
+        try:
+            port.open(settle=0.1)
+            replied = emulator.bytes_out
+            ms, per_switch = _measure(port, switches, batched)
+            replied = (emulator.bytes_out - replied) / switches
+        finally:
+            port.close()
+            emulator.stop()
+        ms *= 1000
+        print(f"  {name:32s} {port.describe():20s} {2 * switches / (ms.sum() / 1000):6.1f} commands/s, "
+              f"switch p50 {np.percentile(ms, 50):5.1f} / p99 {np.percentile(ms, 99):5.1f} ms, "
+              f"{per_switch:.0f} bytes sent / {replied:.0f} replied per switch")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Framed ESP32 serial protocol")
+    sub = parser.add_subparsers(dest="command", required=True)
+    bench_parser = sub.add_parser("bench", help="text vs framed protocol against the emulator")
+    bench_parser.add_argument("--switches", type=int, default=200)
+    bench_parser.add_argument("--baud", type=int, default=115200)
+    args = parser.parse_args()
+    if args.command == "bench":
+        bench(args.switches, args.baud)
+
+
+if __name__ == "__main__":
+    main()
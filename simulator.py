@@ -0,0 +1,358 @@
+"""
+Deterministic intersection traffic simulator.
+
+Replaces the camera with simulated queues so timing policies can be compared
+without a real intersection. The project's own CycleController (the EW/NS
+auto-cycle from detect_cars.py / traffic_light_gui.py) drives the lights, and
+its paired serial commands set the S1-S4 signal heads exactly as they would
+on the ESP32:
+
+    S1/S4 green -> East and West approaches discharge
+    S2/S3 green -> North and South approaches discharge
+
+Vehicles arrive per approach (Poisson or from a trace file), queue at the
+stop line and leave one saturation headway apart once their head turns
+green, after a start-up lost time. The controller is polled every
+frame_interval seconds with the queue lengths it would see on camera.
+
+Usage:
+    python simulator.py --hours 2 --rates 300,300,200,200 --seeds 50
+    python simulator.py --trace arrivals.csv --policy dynamic --policy fixed20
+
+The same seeds are used for every policy (common random numbers), so the
+per-seed differences can be compared directly.
+"""
+import argparse
+import csv
+import heapq
+from collections import deque
+from multiprocessing import Pool, cpu_count
+
+import numpy as np
+
+from traffic_control import CycleController, calculate_green_time
+
+APPROACHES = ("north", "south", "east", "west")
+# Signal head that controls each approach (see CycleController)
+APPROACH_HEADS = {"north": "S2", "south": "S3", "east": "S1", "west": "S4"}
+
+# Event kinds, ordered so departures at a tick time are processed before the tick
+DEPART, ARRIVAL, TICK = 0, 1, 2
+
+
+def fixed_green_time(seconds):
+    """Fixed-time policy with the same signature as calculate_green_time."""
+    def green_time(north_count, south_count, east_count, west_count, direction):
+        return seconds
+    return green_time
+
+
+POLICIES = {
+    "dynamic": calculate_green_time,
+    "forecast": calculate_green_time,  # plus forecast-planned splits, see forecast.py
+    "fixed10": fixed_green_time(10),
+    "fixed20": fixed_green_time(20),
+    "fixed30": fixed_green_time(30),
+}
+
+
+def poisson_arrivals(rates_per_hour, duration, rng, swing=0.0, period=3600.0):
+    """
+    Return one sorted array of arrival times per approach.
+
+    With swing > 0 the rates follow a slow wave, rate * (1 + swing * sin(2 pi t / period)),
+    so demand builds and fades the way it does around rush hour.
+    """
+    arrivals = []
+    for rate in rates_per_hour:
+        if rate <= 0:
+            arrivals.append(np.zeros(0))
+            continue
+        # Draw a few extra gaps in one call, then trim to the horizon
+        peak = rate * (1.0 + swing)
+        mean_gap = 3600.0 / peak
+        n = int(duration / mean_gap * 1.2) + 20
+        times = np.cumsum(rng.exponential(mean_gap, n))
+        while times[-1] < duration:
+            times = np.concatenate([times, times[-1] + np.cumsum(rng.exponential(mean_gap, n))])
+        times = times[times < duration]
+        if swing > 0:
+            # Thin the peak-rate process down to the time-varying rate
+            keep = rng.random(len(times)) * peak < rate * (1.0 + swing * np.sin(2 * np.pi * times / period))
+            times = times[keep]
+        arrivals.append(times)
+    return arrivals
+
+
+def trace_arrivals(path):
+    """Read arrivals from a CSV with time (seconds) and approach columns."""
+    times = {a: [] for a in APPROACHES}
+    with open(path, newline="") as f:
+        for row in csv.DictReader(f):
+            times[row["approach"].strip().lower()].append(float(row["time"]))
+    return [np.sort(np.array(times[a], dtype=np.float64)) for a in APPROACHES]
+
+
+class IntersectionSimulator:
+    """
+    Discrete-event simulation of one intersection under CycleController.
+
+    arrivals: one array of arrival times per approach (APPROACHES order)
+    green_time: timing policy, same signature as calculate_green_time
+    headway: saturation discharge headway (s)
+    lost_time: start-up lost time at the beginning of each green (s)
+    frame_interval: how often the controller sees a new "frame" (s)
+    visible: max cars per approach the camera can see (None = unlimited)
+    forecaster: DemandForecaster that sees every frame and plans each green
+    record_counts: keep every frame's counts and phase in self.counts / self.phases
+    coordinator: CycleController coordinator (see green_wave.py)
+    on_tick: called with the simulated time before every controller update
+    record_departures: keep every departure time per approach in self.departures
+    stop_delay: a car delayed longer than this (s) counts as having stopped
+    """
+
+    def __init__(self, arrivals, green_time=calculate_green_time, headway=2.0,
+                 lost_time=2.0, frame_interval=0.1, visible=None, forecaster=None,
+                 record_counts=False, coordinator=None, on_tick=None, record_departures=False,
+                 stop_delay=1.0):
+        self.arrivals = arrivals
+        self.headway = headway
+        self.lost_time = lost_time
+        self.frame_interval = frame_interval
+        self.visible = visible
+        self.forecaster = forecaster
+        self.on_tick = on_tick
+        self.stop_delay = stop_delay
+        self.departures = [[] for _ in APPROACHES] if record_departures else None
+        self.counts = [] if record_counts else None
+        self.phases = [] if record_counts else None
+        self.extensions = 0
+        self.heads = {"S1": "RED", "S2": "RED", "S3": "RED", "S4": "RED"}
+        self.changed = []
+        self.controller = CycleController(self.send_paired, log=self._on_message,
+                                          green_time=green_time, now=0.0,
+                                          plan_green_time=forecaster.plan if forecaster else None,
+                                          coordinator=coordinator)
+        # The controller starts with S1/S4 green without sending a command
+        self.heads["S1"] = self.heads["S4"] = "GREEN"
+
+    def _on_message(self, message):
+        if "extended" in message:
+            self.extensions += 1
+
+    def send_paired(self, lane1, lane2, color):
+        """Stand-in for the ESP32: set the two heads and remember the change."""
+        for lane in (lane1, lane2):
+            if self.heads[lane] != color:
+                self.heads[lane] = color
+                self.changed.append(lane)
+        return True
+
+    def run(self, duration):
+        """Simulate `duration` seconds and return a dict of results."""
+        n = len(APPROACHES)
+        queues = [deque() for _ in range(n)]   # arrival times of waiting cars
+        head_of = [APPROACH_HEADS[a] for a in APPROACHES]
+        next_free = [0.0] * n                  # earliest next departure per approach
+        pending = [False] * n                  # departure event scheduled
+        token = [0] * n                        # bumped when a head turns red
+        max_queue = [0] * n
+        departed = [0] * n
+        delays = []
+        stops = [0] * n
+        delay_sum = [0.0] * n
+        switches = 0
+        green_total = {"EW": 0.0, "NS": 0.0}
+        phase_start = 0.0
+
+        events = []
+        seq = 0
+        for i, times in enumerate(self.arrivals):
+            for t in times:
+                events.append((float(t), ARRIVAL, seq, i, 0))
+                seq += 1
+        events.append((0.0, TICK, seq, -1, 0))
+        seq += 1
+        heapq.heapify(events)
+
+        def schedule_departure(i, now):
+            nonlocal seq
+            if pending[i] or not queues[i] or self.heads[head_of[i]] != "GREEN":
+                return
+            t = max(now, next_free[i])
+            heapq.heappush(events, (t, DEPART, seq, i, token[i]))
+            seq += 1
+            pending[i] = True
+
+        for i in range(n):
+            if self.heads[head_of[i]] == "GREEN":
+                next_free[i] = self.lost_time
+
+        while events:
+            now, kind, _, i, tok = heapq.heappop(events)
+            if now >= duration:
+                break
+            if kind == ARRIVAL:
+                queues[i].append(now)
+                max_queue[i] = max(max_queue[i], len(queues[i]))
+                schedule_departure(i, now)
+            elif kind == DEPART:
+                if tok != token[i]:
+                    continue  # head turned red before this car could leave
+                pending[i] = False
+                arrived = queues[i].popleft()
+                delays.append(now - arrived)
+                delay_sum[i] += now - arrived
+                if now - arrived > self.stop_delay:
+                    stops[i] += 1
+                if self.departures is not None:
+                    self.departures[i].append(now)
+                departed[i] += 1
+                next_free[i] = now + self.headway
+                schedule_departure(i, now)
+            else:
+                counts = [len(q) if self.visible is None else min(len(q), self.visible) for q in queues]
+                if self.counts is not None:
+                    self.counts.append(counts)
+                    self.phases.append(self.controller.current_cycle_direction)
+                if self.on_tick is not None:
+                    self.on_tick(now)
+                if self.forecaster is not None:
+                    self.forecaster.observe(now, counts, self.controller.current_cycle_direction)
+                direction = self.controller.update(counts[0], counts[1], counts[2], counts[3], now)
+                if direction is not None:
+                    switches += 1
+                    green_total["NS" if direction == "EW" else "EW"] += now - phase_start
+                    phase_start = now
+                for lane in self.changed:
+                    for j in range(n):
+                        if head_of[j] != lane:
+                            continue
+                        if self.heads[lane] == "GREEN":
+                            next_free[j] = now + self.lost_time
+                            schedule_departure(j, now)
+                        else:
+                            token[j] += 1
+                            pending[j] = False
+                self.changed.clear()
+                heapq.heappush(events, (now + self.frame_interval, TICK, seq, -1, 0))
+                seq += 1
+
+        green_total[self.controller.current_cycle_direction] += duration - phase_start
+        delays = np.array(delays)
+        arrived_total = sum(len(times) for times in self.arrivals)
+        return {
+            "avg_delay": float(delays.mean()) if len(delays) else 0.0,
+            "p95_delay": float(np.percentile(delays, 95)) if len(delays) else 0.0,
+            "max_queue": max(max_queue),
+            "max_queue_per_approach": dict(zip(APPROACHES, max_queue)),
+            "avg_delay_per_approach": {a: delay_sum[i] / departed[i] if departed[i] else 0.0
+                                       for i, a in enumerate(APPROACHES)},
+            "throughput": sum(departed) * 3600.0 / duration,
+            "departed": sum(departed),
+            "arrived": arrived_total,
+            "left_in_queue": sum(len(q) for q in queues),
+            "stops": sum(stops),
+            "stops_per_approach": dict(zip(APPROACHES, stops)),
+            "switches": switches,
+            "extensions": self.extensions,
+            "ew_green_share": green_total["EW"] / duration,
+        }
+
+
+def simulate(seed, policy="dynamic", rates=(300, 300, 200, 200), duration=3600.0,
+             trace=None, swing=0.0, forecast_horizon=20, **options):
+    """Run one seed of one policy and return its result dict."""
+    if trace is not None:
+        arrivals = trace_arrivals(trace)
+    else:
+        arrivals = poisson_arrivals(rates, duration, np.random.default_rng(seed), swing=swing)
+    if policy == "forecast":
+        from forecast import DemandForecaster
+        options["forecaster"] = DemandForecaster(horizon=forecast_horizon)
+    sim = IntersectionSimulator(arrivals, green_time=POLICIES[policy], **options)
+    return sim.run(duration)
+
+
+def _simulate_job(job):
+    seed, policy, kwargs = job
+    return simulate(seed, policy, **kwargs)
+
+
+# Scalar results gathered into arrays by run_many
+METRICS = ("avg_delay", "p95_delay", "max_queue", "throughput", "stops", "switches", "extensions",
+           "left_in_queue")
+
+
+def run_many(seeds, policies=("dynamic",), workers=None, **kwargs):
+    """
+    Run every policy over every seed (in parallel) and return
+    {policy: {metric: array of shape (len(seeds),)}}.
+    """
+    jobs = [(seed, policy, kwargs) for policy in policies for seed in seeds]
+    workers = workers or cpu_count()
+    if workers > 1 and len(jobs) > 1:
+        with Pool(workers) as pool:
+            results = pool.map(_simulate_job, jobs)
+    else:
+        results = [_simulate_job(job) for job in jobs]
+    out = {}
+    for p, policy in enumerate(policies):
+        chunk = results[p * len(seeds):(p + 1) * len(seeds)]
+        out[policy] = {m: np.array([r[m] for r in chunk], dtype=np.float64) for m in METRICS}
+    return out
+
+
+def summarize(results, baseline=None):
+    """Print mean ± 95% CI per policy, and paired deltas against `baseline`."""
+    print(f"{'policy':>10}  " + "  ".join(f"{m:>18}" for m in METRICS))
+    for policy, metrics in results.items():
+        cells = []
+        for m in METRICS:
+            values = metrics[m]
+            ci = 1.96 * values.std(ddof=1) / np.sqrt(len(values)) if len(values) > 1 else 0.0
+            cells.append(f"{values.mean():>10.2f} ± {ci:<5.2f}")
+        print(f"{policy:>10}  " + "  ".join(cells))
+    if baseline is None or baseline not in results or len(results) < 2:
+        return
+    print(f"\nPaired difference in avg_delay vs {baseline} (negative = better):")
+    for policy, metrics in results.items():
+        if policy == baseline:
+            continue
+        diff = metrics["avg_delay"] - results[baseline]["avg_delay"]
+        ci = 1.96 * diff.std(ddof=1) / np.sqrt(len(diff)) if len(diff) > 1 else 0.0
+        wins = int((diff < 0).sum())
+        print(f"{policy:>10}  {diff.mean():+.2f}s ± {ci:.2f}  (better on {wins}/{len(diff)} seeds)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Simulate the intersection under a timing policy")
+    parser.add_argument("--hours", type=float, default=1.0, help="simulated duration")
+    parser.add_argument("--rates", default="300,300,200,200",
+                        help="arrivals per hour for north,south,east,west")
+    parser.add_argument("--swing", type=float, default=0.0,
+                        help="relative amplitude of an hourly demand wave (0 = constant rates)")
+    parser.add_argument("--trace", help="CSV of arrivals (time,approach) instead of Poisson")
+    parser.add_argument("--seeds", type=int, default=20, help="number of random seeds")
+    parser.add_argument("--policy", action="append", choices=sorted(POLICIES),
+                        help="timing policy (repeat to compare; default: dynamic)")
+    parser.add_argument("--headway", type=float, default=2.0, help="saturation headway (s)")
+    parser.add_argument("--lost-time", type=float, default=2.0, help="start-up lost time (s)")
+    parser.add_argument("--frame-interval", type=float, default=0.1, help="controller poll period (s)")
+    parser.add_argument("--visible", type=int, default=None, help="max cars visible per approach")
+    parser.add_argument("--workers", type=int, default=cpu_count())
+    args = parser.parse_args()
+
+    policies = args.policy or ["dynamic"]
+    seeds = list(range(1 if args.trace else args.seeds))
+    results = run_many(seeds, policies, workers=args.workers,
+                       rates=[float(r) for r in args.rates.split(",")],
+                       duration=args.hours * 3600.0, trace=args.trace, swing=args.swing,
+                       headway=args.headway, lost_time=args.lost_time,
+                       frame_interval=args.frame_interval, visible=args.visible)
+    print(f"Simulated {args.hours}h x {len(seeds)} seeds per policy\n")
+    summarize(results, baseline=policies[0])
+
+
+if __name__ == "__main__":
+    main()
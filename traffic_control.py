@@ -0,0 +1,280 @@
+"""
+Traffic light timing and the EW/NS auto-cycle.
+
+Shared by detect_cars.py, traffic_light_gui.py and simulator.py so the same
+cycle logic runs against the camera and against simulated traffic.
+"""
+import time
+
+BASE_GREEN_TIME = 5  # Base green light duration (seconds)
+
+
+def calculate_green_time(north_count, south_count, east_count, west_count, direction):
+    """
+    Calculate dynamic green time based on individual car counts per direction.
+    Scaling: 10 seconds per car, max 20 seconds for first 2 cars, then 10 seconds per additional car.
+    - 0 cars: 5 seconds (base)
+    - 1 car: 10 seconds
+    - 2+ cars: 20 + (cars - 2) * 10 seconds (no cap)
+
+    Gives priority to direction with highest car count.
+    direction: "NS" for North-South (S2/S3) or "EW" for East-West (S1/S4)
+    """
+    if direction == "NS":
+        # North-South: check which has more cars (North or South)
+        ns_max = max(north_count, south_count)
+        ew_max = max(east_count, west_count)
+
+        if ns_max > ew_max:
+            # N-S direction has more cars - calculate duration
+            if ns_max == 0:
+                return 5
+            elif ns_max == 1:
+                return 10
+            else:
+                return 20 + (ns_max - 2) * 10
+        elif ns_max > 0:
+            # N-S has some cars but E-W has more
+            return 5
+        else:
+            # No cars in N-S
+            return 5
+    else:  # direction == "EW"
+        # East-West: check which has more cars (East or West)
+        ew_max = max(east_count, west_count)
+        ns_max = max(north_count, south_count)
+
+        if ew_max > ns_max:
+            # E-W direction has more cars - calculate duration
+            if ew_max == 0:
+                return 5
+            elif ew_max == 1:
+                return 10
+            else:
+                return 20 + (ew_max - 2) * 10
+        elif ew_max > 0:
+            # E-W has some cars but N-S has more
+            return 5
+        else:
+            # No cars in E-W
+            return 5
+
+
+class GreenTimeTable:
+    """
+    calculate_green_time with its durations as data, so they can be changed
+    without a restart (see runtime_config.py).
+
+    table[n] seconds for n cars on the busier phase, table[-1] plus
+    per_extra_car for each car beyond the table, and table[0] when the other
+    phase has as many cars or more. The default reproduces calculate_green_time.
+    """
+
+    def __init__(self, table=(5, 10, 20), per_extra_car=10):
+        self.table = tuple(table)
+        self.per_extra_car = per_extra_car
+
+    def __call__(self, north_count, south_count, east_count, west_count, direction):
+        ns_max = max(north_count, south_count)
+        ew_max = max(east_count, west_count)
+        own, other = (ns_max, ew_max) if direction == "NS" else (ew_max, ns_max)
+        if own <= other:
+            return self.table[0]
+        if own < len(self.table):
+            return self.table[own]
+        return self.table[-1] + (own - len(self.table) + 1) * self.per_extra_car
+
+
+class CycleController:
+    """
+    EW/NS auto-cycle state machine.
+
+    S1/S4 are green during the "EW" phase and S2/S3 during "NS". The running
+    green is only ever extended (never shortened) by new counts; when it
+    expires the other pair gets green with a duration computed from the
+    latest counts, by plan_green_time (e.g. a forecast) when one is given.
+    Lamp changes go out through send_paired(lane1, lane2, color), status
+    messages through log(message) and, when an EventLog is given,
+    structured phase/extend/safety events through event_log.log().
+
+    A coordinator (e.g. green_wave.GreenWave) can bound each green:
+    coordinator.bounds(direction, green_start, duration, now) returns
+    (min_duration, max_duration or None), and coordinator.on_green(direction,
+    green_start, duration, counts) is told about every green start and change.
+    """
+
+    def __init__(self, send_paired, log=print, green_time=calculate_green_time, now=None,
+                 event_log=None, plan_green_time=None, coordinator=None):
+        self.send_paired = send_paired
+        self.log = log
+        self.event_log = event_log
+        self.green_time = green_time
+        self.plan_green_time = plan_green_time
+        self.coordinator = coordinator
+        self.tl2_green_start = 0
+        self.tl3_green_start = 0
+        self.current_tl2_duration = BASE_GREEN_TIME
+        self.current_tl3_duration = BASE_GREEN_TIME
+        self.reset(now, send=False)
+
+    def reset(self, now=None, send=True):
+        """Restart the cycle with E-W (S1/S4) green for the base duration."""
+        now = time.time() if now is None else now
+        self.tl1_state = "GREEN"  # S1 (E-W)
+        self.tl4_state = "GREEN"  # S4 (E-W)
+        self.tl2_state = "RED"    # S2 (N-S)
+        self.tl3_state = "RED"    # S3 (N-S)
+        self.tl1_green_start = now
+        self.tl4_green_start = now
+        self.current_tl1_duration = BASE_GREEN_TIME
+        self.current_tl4_duration = BASE_GREEN_TIME
+        self.current_cycle_direction = "EW"
+        if send:
+            self.send_paired("S1", "S4", "GREEN")
+            self.send_paired("S2", "S3", "RED")
+
+    def restore(self, direction, duration, green_start, send=False):
+        """Put the cycle into a given phase, e.g. one captured by an incident recording."""
+        on, off = ((1, 4), (2, 3)) if direction == "EW" else ((2, 3), (1, 4))
+        for light in on:
+            setattr(self, f"tl{light}_state", "GREEN")
+            setattr(self, f"tl{light}_green_start", green_start)
+            setattr(self, f"current_tl{light}_duration", duration)
+        for light in off:
+            setattr(self, f"tl{light}_state", "RED")
+        self.current_cycle_direction = direction
+        if send:
+            self.send_paired(f"S{on[0]}", f"S{on[1]}", "GREEN")
+            self.send_paired(f"S{off[0]}", f"S{off[1]}", "RED")
+
+    def _event(self, kind, message, **fields):
+        if self.log is not None:
+            self.log(message)
+        if self.event_log is not None:
+            self.event_log.log(kind, message, **fields)
+
+    def _plan(self, north, south, east, west, direction, now):
+        """Duration for a green that is starting now."""
+        plan = self.plan_green_time or self.green_time
+        duration = plan(north, south, east, west, direction)
+        if self.coordinator is not None:
+            low, high = self.coordinator.bounds(direction, now, duration, now)
+            duration = max(duration, low) if high is None else min(max(duration, low), high)
+            self.coordinator.on_green(direction, now, duration, (north, south, east, west))
+        return duration
+
+    def _extend(self, direction, lights, north, south, east, west, now):
+        """
+        Only allow duration increases during a green cycle (never shorten
+        remaining time), except where the coordinator's bounds say otherwise.
+        """
+        new_duration = self.green_time(north, south, east, west, direction)
+        duration = getattr(self, f"current_tl{lights[0]}_duration")
+        low, high = 0, None
+        if self.coordinator is not None:
+            green_start = getattr(self, f"tl{lights[0]}_green_start")
+            low, high = self.coordinator.bounds(direction, green_start, duration, now)
+            if high is not None:
+                new_duration = min(new_duration, high)
+        target = duration
+        if new_duration > duration:
+            target = new_duration
+            self._event("extend", f"[AUTO] Duration extended to {new_duration}s",
+                        direction=direction, duration=new_duration, counts=[north, south, east, west])
+        coordinated = max(target, low) if high is None else min(max(target, low), high)
+        if coordinated != target:
+            self._event("coordinate", f"[WAVE] {direction} green {'held' if coordinated > target else 'cut'} "
+                        f"to {coordinated:.0f}s", direction=direction, duration=round(coordinated, 2),
+                        previous=target)
+            target = coordinated
+        if target != duration:
+            for light in lights:
+                setattr(self, f"current_tl{light}_duration", target)
+            if self.coordinator is not None:
+                self.coordinator.on_green(direction, green_start, target, (north, south, east, west))
+
+    def update(self, north, south, east, west, now=None):
+        """
+        Feed one frame's counts into the cycle.
+
+        Returns the new direction ("EW" or "NS") if the lights switched,
+        otherwise None.
+        """
+        now = time.time() if now is None else now
+
+        if self.current_cycle_direction == "EW":
+            elapsed = now - self.tl1_green_start
+            self._extend("EW", (1, 4), north, south, east, west, now)
+
+            if elapsed >= self.current_tl1_duration and self.tl1_state == "GREEN":
+                # E-W green has expired, switch to N-S green
+                green_duration = self._plan(north, south, east, west, "NS", now)
+
+                self.tl2_state = "GREEN"
+                self.tl3_state = "GREEN"
+                self.tl2_green_start = now
+                self.tl3_green_start = now
+                self.current_tl2_duration = green_duration
+                self.current_tl3_duration = green_duration
+                self.current_cycle_direction = "NS"
+
+                self.send_paired("S2", "S3", "GREEN")
+                self.tl1_state = "RED"
+                self.tl4_state = "RED"
+                self.send_paired("S1", "S4", "RED")
+                self._event("phase", f"[AUTO] E-W → N-S GREEN (Duration: {green_duration}s)",
+                            direction="NS", duration=green_duration, elapsed=round(elapsed, 3),
+                            counts=[north, south, east, west])
+                return "NS"
+        else:
+            elapsed = now - self.tl2_green_start
+            self._extend("NS", (2, 3), north, south, east, west, now)
+
+            if elapsed >= self.current_tl2_duration and self.tl2_state == "GREEN":
+                # N-S green has expired, switch to E-W green
+                green_duration = self._plan(north, south, east, west, "EW", now)
+
+                self.tl1_state = "GREEN"
+                self.tl4_state = "GREEN"
+                self.tl1_green_start = now
+                self.tl4_green_start = now
+                self.current_tl1_duration = green_duration
+                self.current_tl4_duration = green_duration
+                self.current_cycle_direction = "EW"
+
+                self.send_paired("S1", "S4", "GREEN")
+                self.tl2_state = "RED"
+                self.tl3_state = "RED"
+                self.send_paired("S2", "S3", "RED")
+                self._event("phase", f"[AUTO] N-S → E-W GREEN (Duration: {green_duration}s)",
+                            direction="EW", duration=green_duration, elapsed=round(elapsed, 3),
+                            counts=[north, south, east, west])
+                return "EW"
+        return None
+
+    def safety_check(self, north, south, east, west, now=None):
+        """Force E-W green if both pairs ended up red. Returns True if it fired."""
+        if self.tl1_state != "RED" or self.tl2_state != "RED":
+            return False
+        now = time.time() if now is None else now
+        self._event("safety", "⚠ SAFETY: All lights were red, forcing E-W green")
+        self.tl1_state = "GREEN"
+        self.tl4_state = "GREEN"
+        self.tl2_state = "RED"
+        self.tl3_state = "RED"
+        self.tl1_green_start = now
+        self.tl4_green_start = now
+        self.current_tl1_duration = self.green_time(north, south, east, west, "EW")
+        self.current_tl4_duration = self.current_tl1_duration
+        self.current_cycle_direction = "EW"
+        self.send_paired("S1", "S4", "GREEN")
+        self.send_paired("S2", "S3", "RED")
+        return True
+
+    def remaining(self, light, now=None):
+        """Seconds of green left for traffic light 1-4 (0 while red)."""
+        if getattr(self, f"tl{light}_state") != "GREEN":
+            return 0
+        now = time.time() if now is None else now
+        duration = getattr(self, f"current_tl{light}_duration")
+        return max(0, duration - (now - getattr(self, f"tl{light}_green_start")))
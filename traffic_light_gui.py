@@ -2,279 +2,329 @@ import sys
 import cv2
 import numpy as np
 from PyQt5.QtWidgets import (QApplication, QMainWindow, QWidget, QVBoxLayout, QHBoxLayout, 
-                             QLabel, QPushButton, QFrame, QGridLayout)
-from PyQt5.QtGui import QImage, QPixmap, QFont, QColor, QPalette
-from PyQt5.QtCore import Qt, QTimer, QThread, pyqtSignal
+                             QLabel, QPushButton, QFrame, QGridLayout, QListView)
+from PyQt5.QtGui import QImage, QPixmap, QFont, QColor, QPalette, QPainter
+from PyQt5.QtCore import Qt, QTimer, QThread, QAbstractListModel, QModelIndex
 import time
 import serial
+from datetime import datetime
+
+from count_history import CountHistory
+from event_log import EventLog
+from forecast import forecaster_from_env
+from green_wave import wave_from_env
+from incident_recorder import recorder_from_env
+from inference_server import client_from_env, draw_boxes
+from input_size import AdaptiveDetector
+from lamp_control import LampControl
+from latency import LatencyTracer, ReplyReader
+from metrics import ControllerMetrics, start_from_env
+from preemption import preemption_from_env
+from preprocess import FramePool
+from profiler import profiler_from_env
+from resources import resources_from_env
+from runtime_config import load_detector, watcher_from_env
+from serial_protocol import FramedPort
+from traffic_control import CycleController
+from web_dashboard import dashboard_from_env, frame_stats
+from zones import box_centers, classify_directions, count_directions
+
+# Lamp colours (blue for GREEN, red for RED to match design)
+LAMP_COLORS = {"GREEN": "#00aaff", "RED": "#d32f2f"}
+
+
+def lamp_pixmap(color, size=22):
+    """Round lamp drawn once, so state changes are a setPixmap instead of a style re-polish."""
+    pixmap = QPixmap(size, size)
+    pixmap.fill(Qt.transparent)
+    painter = QPainter(pixmap)
+    painter.setRenderHint(QPainter.Antialiasing)
+    painter.setPen(Qt.NoPen)
+    painter.setBrush(QColor(color))
+    painter.drawEllipse(0, 0, size, size)
+    painter.end()
+    return pixmap
+
+
+class EventListModel(QAbstractListModel):
+    """Log lines for a QListView, which only lays out the rows that are visible."""
+
+    def __init__(self, max_rows=2000):
+        super().__init__()
+        self.max_rows = max_rows
+        self.rows = []
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.rows)
+
+    def data(self, index, role=Qt.DisplayRole):
+        if role == Qt.DisplayRole and index.isValid():
+            return self.rows[index.row()]
+        return None
+
+    def append(self, lines):
+        start = len(self.rows)
+        self.beginInsertRows(QModelIndex(), start, start + len(lines) - 1)
+        self.rows.extend(lines)
+        self.endInsertRows()
+        # Trim in chunks; older lines stay in logs/events.jsonl
+        excess = len(self.rows) - self.max_rows
+        if excess > self.max_rows // 4:
+            self.beginRemoveRows(QModelIndex(), 0, excess - 1)
+            del self.rows[:excess]
+            self.endRemoveRows()
+
 
 class VideoThread(QThread):
-    frame_signal = pyqtSignal(np.ndarray)
-    stats_signal = pyqtSignal(dict)
-    log_signal = pyqtSignal(str)
-    
     def __init__(self):
         super().__init__()
-        # Model will be loaded in main thread
-        self.model = None
-        self.cap = cv2.VideoCapture(0)
+        # Latest annotated frame and stats; the GUI picks them up on its refresh timer
+        self.latest_frame = None
+        self.frame_seq = 0
+        self.latest_stats = None
+        # COM port, camera, conf/iou/imgsz, zones and green times (traffic.yaml, reloaded while
+        # running; write one with: python runtime_config.py init)
+        self.config_watcher = watcher_from_env()
+        config = self.config_watcher.config
+        # Model will be loaded in main thread (wrapped in a LocalDetector or AdaptiveDetector)
+        self.detector = None
+        # Captured and annotated frames live in preallocated pools instead of fresh arrays per frame
+        self.frame_pool = FramePool()
+        self.annotated_pool = FramePool(count=6)  # also covers the frame the GUI is converting
+        self.cap = config.camera.open(pool=self.frame_pool)
         self.running = True
         
-        # Serial connection
-        self.ser = None
+        # Direction threshold lines (calibrated with calibrate_zones.py)
+        self.zones = config.zones
+        
+        # Structured event log (logs/events.jsonl); the GUI reads its in-memory ring
+        self.event_log = EventLog()
+        self.event_log.log("system", f"[SYSTEM] {self.cap.describe()}")
+        
+        # torch/OpenCV thread pools, core pinning and thread priorities (see resources.py);
+        # the pools are sized before the model is loaded
+        self.resources = resources_from_env(log=lambda msg: self.event_log.log("system", msg))
+        self.resources.apply_libraries()
+        
+        # Serial connection (framed protocol if the firmware supports it, text otherwise)
+        self.ser = FramedPort(config.serial.port, config.serial.baud_rate, on_error=self.on_serial_error)
         self.connect_to_esp32()
         
-        # Traffic light state
-        self.tl1_state = "GREEN"  # S1 (E-W)
-        self.tl4_state = "GREEN"  # S4 (E-W)
-        self.tl2_state = "RED"    # S2 (N-S)
-        self.tl3_state = "RED"    # S3 (N-S)
-        self.tl1_green_start = time.time()
-        self.tl4_green_start = time.time()
-        self.tl2_green_start = 0
-        self.tl3_green_start = 0
-        self.current_tl1_duration = 5
-        self.current_tl4_duration = 5
-        self.current_tl2_duration = 5
-        self.current_tl3_duration = 5
-        self.current_cycle_direction = "EW"
+        # Shared inference server (TRAFFIC_INFERENCE_SERVER=host:port); None = local model
+        try:
+            self.inference_client = client_from_env()
+        except (OSError, ValueError) as e:
+            self.inference_client = None
+            self.event_log.log("error", f"[ERROR] Inference server unavailable: {e}")
+        
+        # Metrics endpoint (enable with TRAFFIC_METRICS_PORT=9100)
+        self.metrics = ControllerMetrics()
+        self.metrics_server = start_from_env(self.metrics.registry)
+        
+        # Per-approach count history (history/), with phase switches and extensions
+        self.history = CountHistory()
+        self.history.watch(self.event_log)
+        
+        # Incident recorder: last 15 s of frames, dumped on SAFETY/serial errors or on request
+        self.recorder = recorder_from_env(self.event_log)
+        
+        # Web dashboard (enable with TRAFFIC_WEB_PORT=8080)
+        self.dashboard = dashboard_from_env()
+        if self.dashboard and self.recorder:
+            self.dashboard.actions["/incident"] = lambda: self.recorder.trigger("api")
+        
+        # Latency tracing (enable with TRAFFIC_TRACE=1); the reader also drains ESP32 replies
+        self.tracer = LatencyTracer()
+        self.reply_reader = ReplyReader(lambda: self.ser, self.tracer, on_line=self.on_reply)
+        self.reply_reader.start()
+        
+        # Paired lamp commands and the resync, shared with detect_cars.py and the emulator check
+        # (see lamp_control.py); the GUI doesn't reopen a closed port by itself
+        self.lamps = LampControl(lambda: self.ser, reconnect=False, tracer=self.tracer, metrics=self.metrics,
+                                 event_log=self.event_log, messages="gui")
+        
+        # Runtime profiler (PROFILE button, SIGUSR1, POST /profile) and slow frame trap (TRAFFIC_SLOW_FRAME_MS)
+        self.profiler = profiler_from_env(self.event_log)
+        self.profiler.install_signal()
+        if self.dashboard:
+            self.dashboard.actions["/profile"] = lambda: self.profiler.start()
+        
+        # Demand forecaster that sizes each green when it starts (enable with TRAFFIC_FORECAST=1)
+        self.forecaster = forecaster_from_env(self.history)
+        
+        # Green wave with the neighbouring controllers (enable with TRAFFIC_WAVE_NODE=<id>)
+        self.wave = wave_from_env()
+        
+        # Traffic light state (E-W S1/S4 starts green)
+        self.cycle = CycleController(self.send_paired_command, log=None, event_log=self.event_log,
+                                     green_time=config.timing.policy(),
+                                     plan_green_time=self.forecaster.plan if self.forecaster else None,
+                                     coordinator=self.wave)
+        if self.forecaster:
+            self.forecaster.green_time = self.cycle.green_time
+        
+        # Emergency preemption: UDP triggers on TRAFFIC_PREEMPT_ADDR bypass the frame loop
+        self.preemption, self.preempt_listener = preemption_from_env(self.cycle, self.event_log, self.zones)
+        self.lamps.cycle, self.lamps.preemption = self.cycle, self.preemption
+        self.resources.apply_control(self.reply_reader, self.preempt_listener, self.wave)
+        self.event_log.log("system", f"[SYSTEM] Resources: {self.resources.describe()}")
         self.frame_count = 0
         
+        # Config changes are prepared on the watcher thread and swapped in between frames
+        self.config_watcher.local_model = self.inference_client is None
+        self.config_watcher.event_log = self.event_log
+        self.config_watcher.camera_pool = self.frame_pool
+        self.config_watcher.start()
+        
     def connect_to_esp32(self):
         try:
-            self.ser = serial.Serial("COM3", 115200, timeout=1)
-            time.sleep(2)
-            self.log_signal.emit("[SYSTEM] ✓ Connected to ESP32 on COM3")
+            self.ser.open()
+            self.event_log.log("system", f"[SYSTEM] ✓ Connected to ESP32 on {self.ser.port} ({self.ser.describe()})",
+                               port=self.ser.port)
         except serial.SerialException as e:
-            self.log_signal.emit(f"[ERROR] ✗ Failed to connect: {e}")
+            self.event_log.log("error", f"[ERROR] ✗ Failed to connect: {e}", port=self.ser.port)
+    
+    def on_reply(self, line):
+        # Called from the reply reader thread for every line the ESP32 sends
+        self.metrics.on_reply(line)
+        self.event_log.log("serial_rx", f"[ESP32] <<< {line}", line=line)
+    
+    def on_serial_error(self, e):
+        # A batched write (one frame per phase switch) failed after the cycle update
+        self.metrics.commands_failed.inc()
+        self.event_log.log("error", f"[ERROR] Serial error: {e}")
             
     def send_command(self, lane, color):
-        if self.ser is None or not self.ser.is_open:
+        if not self.ser.is_open:
             return False
         try:
             command = f"{lane}:{color}\n"
-            self.ser.write(command.encode())
-            self.log_signal.emit(f"[SENT] >>> {lane} {color}")
+            write_start = time.perf_counter()
+            self.ser.send([((lane,), color)])
+            self.tracer.command_sent((lane,), color, write_start, time.perf_counter())
+            self.metrics.commands_sent.inc()
+            self.event_log.log("serial_tx", f"[SENT] >>> {lane} {color}", command=command.strip())
             return True
         except serial.SerialException as e:
-            self.log_signal.emit(f"[ERROR] Serial error: {e}")
+            self.metrics.commands_failed.inc()
+            self.event_log.log("error", f"[ERROR] Serial error: {e}")
             return False
     
     def send_paired_command(self, lane1, lane2, color):
-        if self.ser is None or not self.ser.is_open:
-            return False
-        try:
-            command = f"{lane1}:{lane2}:{color}\n"
-            self.ser.write(command.encode())
-            self.log_signal.emit(f"[SENT] >>> {lane1} & {lane2} {color}")
-            return True
-        except serial.SerialException as e:
-            self.log_signal.emit(f"[ERROR] Serial error: {e}")
-            return False
-    
-    def calculate_green_time(self, north_count, south_count, east_count, west_count, direction):
-        """Calculate dynamic green time based on individual car counts"""
-        if direction == "NS":
-            ns_max = max(north_count, south_count)
-            ew_max = max(east_count, west_count)
-            
-            if ns_max > ew_max:
-                if ns_max == 0:
-                    return 5
-                elif ns_max == 1:
-                    return 10
-                else:
-                    return 20 + (ns_max - 2) * 10
-            elif ns_max > 0:
-                return 5
-            else:
-                return 5
-        else:  # EW
-            ew_max = max(east_count, west_count)
-            ns_max = max(north_count, south_count)
-            
-            if ew_max > ns_max:
-                if ew_max == 0:
-                    return 5
-                elif ew_max == 1:
-                    return 10
-                else:
-                    return 20 + (ew_max - 2) * 10
-            elif ew_max > 0:
-                return 5
-            else:
-                return 5
+        return self.lamps.send_paired(lane1, lane2, color)
     
     def run(self):
+        self.resources.apply("inference")
         while self.running:
+            self.config_watcher.apply_pending(self)
+            trace = self.tracer.start_frame()
+            stages = self.profiler.start_frame()
             ret, frame = self.cap.read()
             if not ret:
                 break
+            trace.mark("capture")
+            stages.mark("capture")
+            self.metrics.frames_captured.inc()
             
             # Get frame dimensions
             height, width = frame.shape[:2]
             
-            # Define thresholds for all directions
-            north_threshold_y = height // 2 - 100
-            south_threshold_y = height // 2 + 100
-            west_threshold_x = width // 2 - 120
-            east_threshold_x = width // 2 + 120
-            
             # Check if model is loaded
-            if self.model is None:
+            detector = self.inference_client or self.detector
+            if detector is None:
                 # Skip detection if model failed to load
+                self.metrics.frames_dropped.inc()
                 annotated_frame = frame
-                self.frame_signal.emit(annotated_frame)
+                self.latest_frame = annotated_frame
+                self.frame_seq += 1
+                self.profiler.finish_frame(stages)
                 time.sleep(0.03)
                 continue
 
             # Detection
-            results = self.model(frame, conf=0.55, iou=0.3, imgsz=416)
-            
-            # Reset counters
-            from_west = 0
-            from_north = 0
-            from_east = 0
-            from_south = 0
+            inference_start = time.perf_counter()
+            detections = detector.infer(frame)  # (N, 6): x1, y1, x2, y2, confidence, class
+            self.metrics.inference_seconds.observe(time.perf_counter() - inference_start)
+            self.metrics.frames_inferred.inc()
+            trace.mark("inference")
+            stages.mark("inference")
             
-            # Process detections
-            for i in range(len(results[0].boxes)):
-                bbox = results[0].boxes.xyxy[i]
-                center_x = (bbox[0] + bbox[2]) / 2
-                center_y = (bbox[1] + bbox[3]) / 2
-                
-                # Determine direction
-                if center_x < width // 2 and center_y < height // 2:
-                    if center_y < north_threshold_y:
-                        from_north += 1
-                    elif center_x < width // 2 - 120:
-                        from_west += 1
-                    else:
-                        from_north += 1
-                elif center_x > width // 2 and center_y < height // 2:
-                    if center_y < north_threshold_y:
-                        from_north += 1
-                    elif center_x > east_threshold_x:
-                        from_east += 1
-                    else:
-                        from_north += 1
-                elif center_x < width // 2 and center_y > height // 2:
-                    if center_y > south_threshold_y:
-                        from_south += 1
-                    elif center_x < west_threshold_x:
-                        from_west += 1
-                    else:
-                        from_south += 1
-                else:
-                    if center_y > south_threshold_y:
-                        from_south += 1
-                    elif center_x > east_threshold_x:
-                        from_east += 1
-                    else:
-                        from_south += 1
+            # Determine direction of every detection in one pass
+            boxes = detections[:, :4]
+            center_x, center_y = box_centers(boxes)
+            directions = classify_directions(center_x, center_y, width, height, self.zones)
+            from_north, from_south, from_east, from_west = (int(c) for c in count_directions(directions))
+            trace.mark("zones")
+            self.preemption.observe_detections(detections, width, height)
+            stages.mark("zones")
             
             # AUTO-CYCLE logic
             current_time = time.time()
+            if self.forecaster:
+                self.forecaster.observe(current_time, (from_north, from_south, from_east, from_west),
+                                        self.cycle.current_cycle_direction)
+            # Commands of one update (e.g. both pairs of a phase switch) go out in one write, and under
+            # the preemption lock so a preempt can't send between the decision and the write
+            with self.preemption.batch(self.ser):
+                self.preemption.update(from_north, from_south, from_east, from_west, current_time)
+            trace.mark("decision")
+            stages.mark("decision")
+            self.metrics.observe_frame(from_north, from_south, from_east, from_west, self.cycle, current_time)
+            self.history.add(current_time, from_north, from_south, from_east, from_west,
+                             self.cycle.current_cycle_direction)
             
-            if self.current_cycle_direction == "EW":
-                elapsed = current_time - self.tl1_green_start
-                new_duration = self.calculate_green_time(from_north, from_south, from_east, from_west, "EW")
-                if new_duration > self.current_tl1_duration:
-                    self.current_tl1_duration = new_duration
-                    self.current_tl4_duration = new_duration
-                    self.log_signal.emit(f"[AUTO] Duration extended to {new_duration}s")
-                
-                if elapsed >= self.current_tl1_duration and self.tl1_state == "GREEN":
-                    green_duration = self.calculate_green_time(from_north, from_south, from_east, from_west, "NS")
-                    
-                    self.tl2_state = "GREEN"
-                    self.tl3_state = "GREEN"
-                    self.tl2_green_start = current_time
-                    self.tl3_green_start = current_time
-                    self.current_tl2_duration = green_duration
-                    self.current_tl3_duration = green_duration
-                    self.current_cycle_direction = "NS"
-                    
-                    self.send_paired_command("S2", "S3", "GREEN")
-                    self.tl1_state = "RED"
-                    self.tl4_state = "RED"
-                    self.send_paired_command("S1", "S4", "RED")
-                    self.log_signal.emit(f"[AUTO] E-W → N-S GREEN (Duration: {green_duration}s)")
-            else:
-                elapsed = current_time - self.tl2_green_start
-                new_duration = self.calculate_green_time(from_north, from_south, from_east, from_west, "NS")
-                if new_duration > self.current_tl2_duration:
-                    self.current_tl2_duration = new_duration
-                    self.current_tl3_duration = new_duration
-                    self.log_signal.emit(f"[AUTO] Duration extended to {new_duration}s")
-                
-                if elapsed >= self.current_tl2_duration and self.tl2_state == "GREEN":
-                    green_duration = self.calculate_green_time(from_north, from_south, from_east, from_west, "EW")
-                    
-                    self.tl1_state = "GREEN"
-                    self.tl4_state = "GREEN"
-                    self.tl1_green_start = current_time
-                    self.tl4_green_start = current_time
-                    self.current_tl1_duration = green_duration
-                    self.current_tl4_duration = green_duration
-                    self.current_cycle_direction = "EW"
-                    
-                    self.send_paired_command("S1", "S4", "GREEN")
-                    self.tl2_state = "RED"
-                    self.tl3_state = "RED"
-                    self.send_paired_command("S2", "S3", "RED")
-                    self.log_signal.emit(f"[AUTO] N-S → E-W GREEN (Duration: {green_duration}s)")
+            if self.recorder:
+                self.recorder.record(frame, detections, (from_north, from_south, from_east, from_west), self.cycle, current_time)
+            stages.mark("bookkeeping")
             
             # Annotate frame
-            annotated_frame = results[0].plot()
+            annotated_frame = draw_boxes(frame, detections, out=self.annotated_pool.acquire(frame.shape))
+            stages.mark("annotate")
             
-            # Emit signals
-            self.frame_signal.emit(annotated_frame)
+            # Publish the latest frame and stats (the GUI refreshes at its own rate)
+            self.latest_frame = annotated_frame
+            self.frame_seq += 1
             
-            # Calculate remaining time for each traffic light
-            if self.tl1_state == "GREEN":
-                tl1_remaining = max(0, self.current_tl1_duration - (current_time - self.tl1_green_start))
-            else:
-                tl1_remaining = 0
-            if self.tl4_state == "GREEN":
-                tl4_remaining = max(0, self.current_tl4_duration - (current_time - self.tl4_green_start))
-            else:
-                tl4_remaining = 0
-            if self.tl2_state == "GREEN":
-                tl2_remaining = max(0, self.current_tl2_duration - (current_time - self.tl2_green_start))
-            else:
-                tl2_remaining = 0
-            if self.tl3_state == "GREEN":
-                tl3_remaining = max(0, self.current_tl3_duration - (current_time - self.tl3_green_start))
-            else:
-                tl3_remaining = 0
-
-            stats = {
-                'north': from_north,
-                'south': from_south,
-                'east': from_east,
-                'west': from_west,
-                'ns_total': from_north + from_south,
-                'we_total': from_west + from_east,
-                'tl1_state': self.tl1_state,
-                'tl1_remaining': int(tl1_remaining),
-                'tl2_state': self.tl2_state,
-                'tl2_remaining': int(tl2_remaining),
-                'tl3_state': self.tl3_state,
-                'tl3_remaining': int(tl3_remaining),
-                'tl4_state': self.tl4_state,
-                'tl4_remaining': int(tl4_remaining)
-            }
-            self.stats_signal.emit(stats)
+            stats = frame_stats(from_north, from_south, from_east, from_west, self.cycle, current_time)
+            self.latest_stats = stats
+            if self.dashboard:
+                self.dashboard.publish_frame(annotated_frame)
+                self.dashboard.publish_stats(stats)
+            self.tracer.finish_frame(trace)
+            stages.mark("publish")
             
             self.frame_count += 1
+            if self.frame_count % 30 == 0:
+                self.resync_lamps()
+                stages.mark("resync")
+            self.profiler.finish_frame(stages)
             time.sleep(0.03)  # ~30 FPS
     
+    def resync_lamps(self):
+        """Send the current phase again after an ESP32 reset or a lost frame (not during preemption)."""
+        self.lamps.resync()
+    
     def stop(self):
         self.running = False
-        if self.ser:
-            self.ser.close()
+        self.config_watcher.close()
+        self.reply_reader.stop()
+        self.profiler.close()
+        if self.preempt_listener:
+            self.preempt_listener.close()
+        if self.wave:
+            self.wave.bus.close()
+        if self.metrics_server:
+            self.metrics_server.shutdown()
+        if self.dashboard:
+            self.dashboard.close()
+        if self.recorder:
+            self.recorder.close()
+        self.history.close()
+        self.ser.close()
         self.cap.release()
+        if self.inference_client:
+            self.inference_client.close()
+        self.event_log.close()
 
 class TrafficLightGUI(QMainWindow):
     def __init__(self):
@@ -282,6 +332,7 @@ class TrafficLightGUI(QMainWindow):
         self.setWindowTitle("LIVE TRAFFIC FEED - INTERSECTION A4")
         self.setGeometry(100, 100, 1400, 900)
         self.setStyleSheet("background-color: #0a0e27;")
+        self._rgb = None  # reused RGB buffer for update_frame
         
         # Central widget (vertical: header, content, footer)
         central_widget = QWidget()
@@ -317,10 +368,10 @@ class TrafficLightGUI(QMainWindow):
         left_layout.addWidget(self.video_label)
         
         # System status
-        status_label = QLabel("SYSTEM STATUS: ACTIVE  |  SERIAL PORT: COM3  |  AI MODEL: YOLOv8 - READY")
-        status_label.setFont(QFont("Courier New", 9))
-        status_label.setStyleSheet("color: #00ffff; background-color: #0a0e27;")
-        left_layout.addWidget(status_label)
+        self.status_label = QLabel("SYSTEM STATUS: ACTIVE  |  SERIAL PORT: COM3  |  AI MODEL: YOLOv8 - READY")
+        self.status_label.setFont(QFont("Courier New", 9))
+        self.status_label.setStyleSheet("color: #00ffff; background-color: #0a0e27;")
+        left_layout.addWidget(self.status_label)
         
         main_layout.addLayout(left_layout, 2)
         
@@ -332,6 +383,10 @@ class TrafficLightGUI(QMainWindow):
         counts_frame = self.create_stats_frame()
         right_layout.addWidget(counts_frame)
         
+        # Latency section
+        latency_frame = self.create_latency_frame()
+        right_layout.addWidget(latency_frame)
+        
         # System log section
         log_frame = self.create_log_frame()
         right_layout.addWidget(log_frame)
@@ -356,18 +411,53 @@ class TrafficLightGUI(QMainWindow):
         
         # Start video thread
         self.video_thread = VideoThread()
+        self.status_label.setText(f"SYSTEM STATUS: ACTIVE  |  SERIAL PORT: {self.video_thread.ser.port}  |  "
+                                  "AI MODEL: YOLOv8 - READY")
         # Load model in main thread to avoid DLL issues in QThread
-        try:
-            from ultralytics import YOLO
-            self.video_thread.model = YOLO('model/weights/best.pt')
-            self.video_thread.log_signal.emit("[SYSTEM] ✓ Loaded YOLO model in main thread")
-        except Exception as e:
-            self.video_thread.log_signal.emit(f"[ERROR] Failed to load YOLO model: {e}")
-            self.video_thread.model = None
-        self.video_thread.frame_signal.connect(self.update_frame)
-        self.video_thread.stats_signal.connect(self.update_stats)
-        self.video_thread.log_signal.connect(self.update_log)
+        # (not needed when frames go to the shared inference server)
+        if self.video_thread.inference_client is not None:
+            self.video_thread.event_log.log("system", "[SYSTEM] ✓ Using shared inference server")
+        else:
+            try:
+                # Model, imgsz, conf and iou from traffic.yaml; input size otherwise from TRAFFIC_IMGSZ
+                # (416, or auto to follow scene density), model and size from the sweep with
+                # TRAFFIC_LATENCY_BUDGET_MS (see model_sweep.py). Later model changes load on the
+                # config watcher thread, once torch is already initialized here.
+                event_log = self.video_thread.event_log
+                self.video_thread.detector = load_detector(self.video_thread.config_watcher.config.detector,
+                                                           event_log=event_log,
+                                                           log=lambda msg: event_log.log("system", msg))
+                self.video_thread.event_log.log("system", "[SYSTEM] ✓ Loaded YOLO model in main thread")
+            except Exception as e:
+                self.video_thread.event_log.log("error", f"[ERROR] Failed to load YOLO model: {e}")
+                self.video_thread.detector = None
+        self.incident_btn.setEnabled(self.video_thread.recorder is not None)
         self.video_thread.start()
+        # After the VideoThread starts, so it doesn't inherit the GUI's priority (it sets its own)
+        self.video_thread.resources.apply("gui")  # this is the Qt main thread
+        
+        # Coalesced refresh: video and panel are redrawn from the latest snapshot at a fixed
+        # rate, and widgets are only touched when their value changes
+        self.shown_seq = 0
+        self.shown = {}
+        self.refresh_timer = QTimer(self)
+        self.refresh_timer.timeout.connect(self.refresh)
+        self.refresh_timer.start(33)
+        
+        # GUI-thread CPU use, shown under the latency table
+        self.cpu_mark = (time.thread_time(), time.perf_counter())
+        self.gui_cpu = 0.0
+        
+        # Pull new log events from the in-memory ring a few times per second
+        self.log_seq = 0
+        self.log_timer = QTimer(self)
+        self.log_timer.timeout.connect(self.update_log)
+        self.log_timer.start(250)
+        
+        # Refresh the latency percentiles once per second
+        self.latency_timer = QTimer(self)
+        self.latency_timer.timeout.connect(self.update_latency)
+        self.latency_timer.start(1000)
     
     def create_stats_frame(self):
         frame = QFrame()
@@ -382,6 +472,7 @@ class TrafficLightGUI(QMainWindow):
         
         layout = QGridLayout(frame)
         layout.setSpacing(12)
+        self.lamps = {state: lamp_pixmap(color) for state, color in LAMP_COLORS.items()}
 
         # Title
         title = QLabel("CARS DETECTED")
@@ -420,7 +511,8 @@ class TrafficLightGUI(QMainWindow):
         tl1_label.setStyleSheet("color: #ddd;")
         self.tl1_status = QLabel()
         self.tl1_status.setFixedSize(22, 22)
-        self.tl1_status.setStyleSheet("border-radius:11px; background-color: #00aaff;")
+        self.tl1_status.setStyleSheet("border: none; padding: 0; background: transparent;")
+        self.tl1_status.setPixmap(self.lamps["GREEN"])
         self.tl1_countdown = QLabel("0s")
         self.tl1_countdown.setFont(QFont("Courier New", 12, QFont.Bold))
         self.tl1_countdown.setStyleSheet("color: #00ffff;")
@@ -433,7 +525,8 @@ class TrafficLightGUI(QMainWindow):
         tl2_label.setStyleSheet("color: #ddd;")
         self.tl2_status = QLabel()
         self.tl2_status.setFixedSize(22, 22)
-        self.tl2_status.setStyleSheet("border-radius:11px; background-color: #d32f2f;")
+        self.tl2_status.setStyleSheet("border: none; padding: 0; background: transparent;")
+        self.tl2_status.setPixmap(self.lamps["RED"])
         self.tl2_countdown = QLabel("0s")
         self.tl2_countdown.setFont(QFont("Courier New", 12, QFont.Bold))
         self.tl2_countdown.setStyleSheet("color: #00ffff;")
@@ -446,7 +539,8 @@ class TrafficLightGUI(QMainWindow):
         tl3_label.setStyleSheet("color: #ddd;")
         self.tl3_status = QLabel()
         self.tl3_status.setFixedSize(22, 22)
-        self.tl3_status.setStyleSheet("border-radius:11px; background-color: #d32f2f;")
+        self.tl3_status.setStyleSheet("border: none; padding: 0; background: transparent;")
+        self.tl3_status.setPixmap(self.lamps["RED"])
         self.tl3_countdown = QLabel("0s")
         self.tl3_countdown.setFont(QFont("Courier New", 12, QFont.Bold))
         self.tl3_countdown.setStyleSheet("color: #00ffff;")
@@ -459,7 +553,8 @@ class TrafficLightGUI(QMainWindow):
         tl4_label.setStyleSheet("color: #ddd;")
         self.tl4_status = QLabel()
         self.tl4_status.setFixedSize(22, 22)
-        self.tl4_status.setStyleSheet("border-radius:11px; background-color: #00aaff;")
+        self.tl4_status.setStyleSheet("border: none; padding: 0; background: transparent;")
+        self.tl4_status.setPixmap(self.lamps["GREEN"])
         self.tl4_countdown = QLabel("0s")
         self.tl4_countdown.setFont(QFont("Courier New", 12, QFont.Bold))
         self.tl4_countdown.setStyleSheet("color: #00ffff;")
@@ -489,14 +584,44 @@ class TrafficLightGUI(QMainWindow):
         title.setStyleSheet("color: #00ffff;")
         layout.addWidget(title)
         
-        # Log text area
-        self.log_text = QLabel()
-        self.log_text.setFont(QFont("Courier New", 8))
-        self.log_text.setStyleSheet("color: #00ff00; background-color: #000; padding: 5px;")
-        self.log_text.setAlignment(Qt.AlignTop | Qt.AlignLeft)
-        self.log_text.setWordWrap(True)
-        self.log_text.setText("[09:45:22] >>> SENT: S2_GREEN\n[09:45:15] AI: North-South Priority Set\n[09:45:15] AI: North-South Priority Set")
-        layout.addWidget(self.log_text)
+        # Log view (virtualized: only the visible rows are laid out and painted)
+        self.log_model = EventListModel()
+        self.log_view = QListView()
+        self.log_view.setModel(self.log_model)
+        self.log_view.setUniformItemSizes(True)
+        self.log_view.setFont(QFont("Courier New", 8))
+        self.log_view.setStyleSheet("color: #00ff00; background-color: #000; padding: 5px;")
+        self.log_view.setMinimumHeight(120)
+        layout.addWidget(self.log_view)
+        
+        return frame
+    
+    def create_latency_frame(self):
+        frame = QFrame()
+        frame.setStyleSheet("""
+            QFrame {
+                border: 2px solid #00ffff;
+                border-radius: 8px;
+                background-color: #0f1435;
+                padding: 10px;
+            }
+        """)
+        
+        layout = QVBoxLayout(frame)
+        layout.setContentsMargins(10, 10, 10, 10)
+        
+        # Title
+        title = QLabel("LATENCY (p50 / p95 / p99)")
+        title.setFont(QFont("Arial", 11, QFont.Bold))
+        title.setStyleSheet("color: #00ffff;")
+        layout.addWidget(title)
+        
+        # Percentile table
+        self.latency_text = QLabel()
+        self.latency_text.setFont(QFont("Courier New", 8))
+        self.latency_text.setStyleSheet("color: #00ff00; background-color: #000; padding: 5px;")
+        self.latency_text.setAlignment(Qt.AlignTop | Qt.AlignLeft)
+        layout.addWidget(self.latency_text)
         
         return frame
     
@@ -567,19 +692,70 @@ class TrafficLightGUI(QMainWindow):
         self.auto_mode_btn.clicked.connect(self.auto_mode)
         buttons_layout.addWidget(self.auto_mode_btn)
         
+        # Save incident button (dumps the recorder's last seconds of footage)
+        self.incident_btn = QPushButton("SAVE INCIDENT")
+        self.incident_btn.setFont(QFont("Arial", 10, QFont.Bold))
+        self.incident_btn.setStyleSheet("""
+            QPushButton {
+                background-color: #4d3800;
+                color: #ffcc00;
+                border: 2px solid #ffcc00;
+                border-radius: 5px;
+                padding: 8px;
+                font-weight: bold;
+            }
+            QPushButton:hover {
+                background-color: #5e4500;
+            }
+            QPushButton:pressed {
+                background-color: #3d2c00;
+            }
+        """)
+        self.incident_btn.clicked.connect(self.save_incident)
+        buttons_layout.addWidget(self.incident_btn)
+        
+        # Profile button (samples every thread and times the loop stages; files go to profiles/)
+        self.profile_btn = QPushButton("PROFILE")
+        self.profile_btn.setFont(QFont("Arial", 10, QFont.Bold))
+        self.profile_btn.setStyleSheet("""
+            QPushButton {
+                background-color: #2d004d;
+                color: #cc99ff;
+                border: 2px solid #cc99ff;
+                border-radius: 5px;
+                padding: 8px;
+                font-weight: bold;
+            }
+            QPushButton:hover {
+                background-color: #3d0066;
+            }
+            QPushButton:pressed {
+                background-color: #22003a;
+            }
+            QPushButton:disabled {
+                color: #7a5c99;
+                border-color: #7a5c99;
+            }
+        """)
+        self.profile_btn.clicked.connect(self.start_profile)
+        buttons_layout.addWidget(self.profile_btn)
+        
         layout.addLayout(buttons_layout)
         
         return frame
     
     def update_frame(self, frame):
-        # Convert frame to RGB
-        rgb_frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+        # Convert frame to RGB (into a reused buffer; QPixmap.fromImage copies it)
+        if self._rgb is None or self._rgb.shape != frame.shape:
+            self._rgb = np.empty_like(frame)
+        rgb_frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB, dst=self._rgb)
         
-        # Resize to fit label
+        # Resize to fit label (a no-op at the default 640x480 capture)
         h, w = rgb_frame.shape[:2]
         target_w = 640
-        target_h = int(h * (target_w / w))
-        rgb_frame = cv2.resize(rgb_frame, (target_w, target_h))
+        if w != target_w:
+            target_h = int(h * (target_w / w))
+            rgb_frame = cv2.resize(rgb_frame, (target_w, target_h))
         
         # Convert to QImage
         h, w, ch = rgb_frame.shape
@@ -590,60 +766,82 @@ class TrafficLightGUI(QMainWindow):
         pixmap = QPixmap.fromImage(qt_image)
         self.video_label.setPixmap(pixmap)
     
+    def refresh(self):
+        """Fixed-rate redraw from the video thread's latest frame and stats."""
+        thread = self.video_thread
+        if thread.frame_seq != self.shown_seq and thread.latest_frame is not None:
+            self.shown_seq = thread.frame_seq
+            self.update_frame(thread.latest_frame)
+        if thread.latest_stats is not None:
+            self.update_stats(thread.latest_stats)
+    
+    def _set_text(self, label, text):
+        if self.shown.get(label) != text:
+            self.shown[label] = text
+            label.setText(text)
+    
+    def _set_lamp(self, label, state):
+        if self.shown.get(label) != state:
+            self.shown[label] = state
+            label.setPixmap(self.lamps["GREEN" if state == "GREEN" else "RED"])
+    
     def update_stats(self, stats):
-        self.ns_count.setText(str(stats['ns_total']))
-        self.we_count.setText(str(stats['we_total']))
-
-        # Update traffic light statuses (use blue for GREEN, red for RED to match design)
-        def color_for_state(state):
-            return '#00aaff' if state == 'GREEN' else '#d32f2f'
-
-        # TL1
-        if 'tl1_state' in stats:
-            self.tl1_status.setStyleSheet(f"border-radius:11px; background-color: {color_for_state(stats['tl1_state'])};")
-            self.tl1_countdown.setText(f"{stats.get('tl1_remaining', 0)}s")
-        # TL2
-        if 'tl2_state' in stats:
-            self.tl2_status.setStyleSheet(f"border-radius:11px; background-color: {color_for_state(stats['tl2_state'])};")
-            self.tl2_countdown.setText(f"{stats.get('tl2_remaining', 0)}s")
-        # TL3
-        if 'tl3_state' in stats:
-            self.tl3_status.setStyleSheet(f"border-radius:11px; background-color: {color_for_state(stats['tl3_state'])};")
-            self.tl3_countdown.setText(f"{stats.get('tl3_remaining', 0)}s")
-        # TL4
-        if 'tl4_state' in stats:
-            self.tl4_status.setStyleSheet(f"border-radius:11px; background-color: {color_for_state(stats['tl4_state'])};")
-            self.tl4_countdown.setText(f"{stats.get('tl4_remaining', 0)}s")
+        self._set_text(self.ns_count, str(stats['ns_total']))
+        self._set_text(self.we_count, str(stats['we_total']))
+        
+        lamps = ((self.tl1_status, self.tl1_countdown), (self.tl2_status, self.tl2_countdown),
+                 (self.tl3_status, self.tl3_countdown), (self.tl4_status, self.tl4_countdown))
+        for light, (status, countdown) in enumerate(lamps, start=1):
+            if f'tl{light}_state' in stats:
+                self._set_lamp(status, stats[f'tl{light}_state'])
+                self._set_text(countdown, f"{stats.get(f'tl{light}_remaining', 0)}s")
     
-    def update_log(self, message):
-        current_text = self.log_text.text()
-        lines = current_text.split('\n')
-        lines.insert(0, message)
-        # Keep only last 5 messages
-        if len(lines) > 5:
-            lines = lines[:5]
-        self.log_text.setText('\n'.join(lines))
+    def update_latency(self):
+        cpu, wall = time.thread_time(), time.perf_counter()
+        self.gui_cpu = (cpu - self.cpu_mark[0]) / max(wall - self.cpu_mark[1], 1e-9) * 100
+        self.cpu_mark = (cpu, wall)
+        detector = self.video_thread.detector
+        input_size = (f"\nModel input: {detector.imgsz} ({detector.policy.reason})"
+                      if isinstance(detector, AdaptiveDetector) else "")
+        self._set_text(self.latency_text, f"{self.video_thread.tracer.format_summary()}\n"
+                                          f"GUI thread CPU: {self.gui_cpu:.1f}%{input_size}")
+        # The button is greyed out while a session runs, whoever started it
+        profiling = self.video_thread.profiler.sampling
+        if self.shown.get(self.profile_btn) != profiling:
+            self.shown[self.profile_btn] = profiling
+            self.profile_btn.setEnabled(not profiling)
+            self.profile_btn.setText("PROFILING..." if profiling else "PROFILE")
+    
+    def update_log(self):
+        events = self.video_thread.event_log.since(self.log_seq)
+        if not events:
+            return
+        self.log_seq = events[-1][0]
+        scrollbar = self.log_view.verticalScrollBar()
+        at_bottom = scrollbar.value() == scrollbar.maximum()
+        self.log_model.append([f"[{datetime.fromtimestamp(event['ts']):%H:%M:%S}] {event['msg']}"
+                               for _, event in events])
+        if at_bottom:
+            self.log_view.scrollToBottom()
     
     def force_red_all(self):
-        self.video_thread.send_paired_command("S1", "S4", "RED")
-        self.video_thread.send_paired_command("S2", "S3", "RED")
-        self.update_log("[MANUAL] >>> FORCE RED ALL")
+        # Through the preemption wrapper, so the lamp resync leaves the all-red in place
+        self.video_thread.preemption.force_all_red()
+        self.video_thread.event_log.log("manual", "[MANUAL] >>> FORCE RED ALL")
     
     def auto_mode(self):
-        # Reset to auto-cycle
-        current_time = time.time()
-        self.video_thread.tl1_state = "GREEN"
-        self.video_thread.tl4_state = "GREEN"
-        self.video_thread.tl2_state = "RED"
-        self.video_thread.tl3_state = "RED"
-        self.video_thread.tl1_green_start = current_time
-        self.video_thread.tl4_green_start = current_time
-        self.video_thread.current_tl1_duration = 5
-        self.video_thread.current_tl4_duration = 5
-        self.video_thread.current_cycle_direction = "EW"
-        self.video_thread.send_paired_command("S1", "S4", "GREEN")
-        self.video_thread.send_paired_command("S2", "S3", "RED")
-        self.update_log("[MANUAL] >>> AUTO MODE ACTIVATED")
+        # Reset to auto-cycle (under the preemption lock: the frame loop and triggers share the cycle)
+        preemption = self.video_thread.preemption
+        with preemption.lock:
+            preemption.clear_all_red()
+            self.video_thread.cycle.reset()
+        self.video_thread.event_log.log("manual", "[MANUAL] >>> AUTO MODE ACTIVATED")
+    
+    def save_incident(self):
+        self.video_thread.recorder.trigger("manual")
+    
+    def start_profile(self):
+        self.video_thread.profiler.start()
     
     def closeEvent(self, event):
         self.video_thread.stop()
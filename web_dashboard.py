@@ -0,0 +1,324 @@
+"""
+Optional web monitoring dashboard.
+
+Serves the annotated feed as MJPEG and pushes the stats dict (the GUI's
+stats_signal payload) over a WebSocket:
+
+    http://host:8080/             dashboard page
+    http://host:8080/stream.mjpg  MJPEG stream
+    http://host:8080/snapshot.jpg latest frame
+    http://host:8080/stats        latest stats as JSON
+    ws://host:8080/ws             stats pushed as JSON text messages
+    POST http://host:8080/<action> runs a registered action (see actions)
+
+The detection loop only hands over references (publish_frame /
+publish_stats). A single encoder thread JPEG-encodes the newest frame at
+most max_fps times per second, and only while someone is watching; every
+viewer is then sent that same buffer. Each viewer has its own thread that
+always jumps to the newest frame, so a slow viewer just skips frames and
+never holds up the pipeline or other viewers.
+
+Enable it with TRAFFIC_WEB_PORT=8080 for detect_cars.py or the GUI. It
+listens on 127.0.0.1 unless TRAFFIC_WEB_HOST says otherwise (0.0.0.0 for
+every interface). The POST actions need "Authorization: Bearer <token>"
+when TRAFFIC_WEB_TOKEN is set. Without a token they only answer on a
+loopback address.
+"""
+import base64
+import hashlib
+import hmac
+import json
+import os
+import struct
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+WS_GUID = "258EAFA5-E914-47DA-95CA-C5AB0DC11B85"
+LOOPBACK = ("127.0.0.1", "localhost", "::1")
+
+PAGE = """<!DOCTYPE html>
+<html>
+<head>
+<meta charset="utf-8">
+<title>LIVE TRAFFIC FEED - INTERSECTION A4</title>
+<style>
+  body { background: #0a0e27; color: #00ffff; font-family: Arial, sans-serif; margin: 12px; }
+  h1 { font-size: 18px; text-align: center; }
+  .row { display: flex; gap: 16px; }
+  img { border: 2px solid #00ffff; border-radius: 10px; max-width: 70vw; background: #000; }
+  .panel { border: 2px solid #00ffff; border-radius: 8px; background: #0f1435; padding: 10px; min-width: 220px; }
+  .count { color: #00ff00; font: bold 24px "Courier New", monospace; }
+  .lamp { display: inline-block; width: 16px; height: 16px; border-radius: 8px; vertical-align: middle; }
+  td { color: #ddd; padding: 4px 8px; }
+</style>
+</head>
+<body>
+<h1>ECE 110 - Feedback and Control Systems Project</h1>
+<div class="row">
+  <img src="/stream.mjpg" alt="live feed">
+  <div class="panel">
+    <div>CARS DETECTED</div>
+    <table>
+      <tr><td>N-S:</td><td class="count" id="ns_total">0</td></tr>
+      <tr><td>W-E:</td><td class="count" id="we_total">0</td></tr>
+    </table>
+    <div>TRAFFIC LIGHTS</div>
+    <table id="lights"></table>
+    <div id="status" style="color:#888">connecting...</div>
+  </div>
+</div>
+<script>
+function connect() {
+  const ws = new WebSocket(`ws://${location.host}/ws`);
+  ws.onopen = () => document.getElementById("status").textContent = "live";
+  ws.onclose = () => { document.getElementById("status").textContent = "reconnecting..."; setTimeout(connect, 1000); };
+  ws.onmessage = (msg) => {
+    const s = JSON.parse(msg.data);
+    document.getElementById("ns_total").textContent = s.ns_total;
+    document.getElementById("we_total").textContent = s.we_total;
+    let rows = "";
+    for (const n of [1, 2, 3, 4]) {
+      const color = s[`tl${n}_state`] === "GREEN" ? "#00aaff" : "#d32f2f";
+      rows += `<tr><td>TL${n} (S${n})</td><td><span class="lamp" style="background:${color}"></span></td>` +
+              `<td>${s[`tl${n}_remaining`]}s</td></tr>`;
+    }
+    document.getElementById("lights").innerHTML = rows;
+  };
+}
+connect();
+</script>
+</body>
+</html>
+"""
+
+
+class WebDashboard:
+    """Encode-once MJPEG / WebSocket fan-out of the controller's output."""
+
+    def __init__(self, port=8080, host="127.0.0.1", max_fps=10.0, quality=80, stats_hz=5.0,
+                 token=None):
+        self.max_fps = max_fps
+        self.quality = quality
+        self.stats_period = 1.0 / stats_hz
+        self.actions = {}  # POST path -> callable returning a JSON-able result
+        self.token = token
+        self.actions_open = token is None and host in LOOPBACK
+        self.viewers = 0
+        self._viewers_lock = threading.Lock()
+        self.frames_encoded = 0
+        self._frame = None
+        self._frame_seq = 0
+        self._jpeg = None
+        self._jpeg_seq = 0
+        self._stats = None
+        self._stats_seq = 0
+        self._cond = threading.Condition()
+        self._running = True
+
+        handler = type("DashboardHandler", (_DashboardHandler,), {"dashboard": self})
+        self.server = ThreadingHTTPServer((host, port), handler)
+        self.server.daemon_threads = True
+        self.port = self.server.server_port
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        threading.Thread(target=self._encode_loop, daemon=True).start()
+
+    # --- called from the detection thread (never blocks) ---
+
+    def publish_frame(self, frame):
+        self._frame = frame
+        self._frame_seq += 1
+
+    def publish_stats(self, stats):
+        self._stats = stats
+        self._stats_seq += 1
+
+    # --- encoder ---
+
+    def _encode_loop(self):
+        import cv2
+
+        params = [int(cv2.IMWRITE_JPEG_QUALITY), self.quality]
+        period = 1.0 / self.max_fps
+        encoded_seq = 0
+        next_encode = time.perf_counter()
+        while self._running:
+            now = time.perf_counter()
+            if now < next_encode:
+                time.sleep(next_encode - now)
+                continue
+            next_encode = max(next_encode + period, now)
+            frame, seq = self._frame, self._frame_seq
+            if self.viewers == 0 or frame is None or seq == encoded_seq:
+                continue
+            ok, buf = cv2.imencode(".jpg", frame, params)
+            if not ok:
+                continue
+            encoded_seq = seq
+            with self._cond:
+                self._jpeg = buf.tobytes()
+                self._jpeg_seq += 1
+                self.frames_encoded += 1
+                self._cond.notify_all()
+
+    def wait_jpeg(self, last_seq, timeout=1.0):
+        """Block a viewer thread until a JPEG newer than last_seq exists."""
+        with self._cond:
+            self._cond.wait_for(lambda: self._jpeg_seq != last_seq or not self._running, timeout)
+            return self._jpeg, self._jpeg_seq
+
+    def add_viewer(self, delta):
+        # Handler threads come and go concurrently; += on an int is not atomic
+        with self._viewers_lock:
+            self.viewers += delta
+
+    def authorized(self, header):
+        """Whether a request with this Authorization header may run actions."""
+        if self.token is None:
+            return self.actions_open
+        return hmac.compare_digest(header.encode(), f"Bearer {self.token}".encode())
+
+    def latest_stats(self):
+        return self._stats, self._stats_seq
+
+    def close(self):
+        self._running = False
+        with self._cond:
+            self._cond.notify_all()
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class _DashboardHandler(BaseHTTPRequestHandler):
+    dashboard = None
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        path = self.path.split("?")[0]
+        if path == "/":
+            self._send_body(PAGE.encode(), "text/html; charset=utf-8")
+        elif path == "/stats":
+            stats, _ = self.dashboard.latest_stats()
+            self._send_body(json.dumps(stats or {}).encode(), "application/json")
+        elif path == "/snapshot.jpg":
+            self._viewer(self._snapshot)
+        elif path == "/stream.mjpg":
+            self._viewer(self._stream)
+        elif path == "/ws" and self.headers.get("Upgrade", "").lower() == "websocket":
+            self._websocket()
+        else:
+            self.send_error(404)
+
+    def do_POST(self):
+        action = self.dashboard.actions.get(self.path.split("?")[0])
+        if action is None:
+            self.send_error(404)
+            return
+        if not self.dashboard.authorized(self.headers.get("Authorization", "")):
+            self.send_error(403, "Set TRAFFIC_WEB_TOKEN and send it as a Bearer token")
+            return
+        self._send_body(json.dumps({"result": action()}).encode(), "application/json")
+
+    def _send_body(self, body, content_type):
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("Cache-Control", "no-cache")
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _viewer(self, serve):
+        # Count viewers so the encoder idles when nobody is watching
+        self.dashboard.add_viewer(1)
+        try:
+            serve()
+        except (BrokenPipeError, ConnectionResetError, TimeoutError):
+            pass
+        finally:
+            self.dashboard.add_viewer(-1)
+
+    def _snapshot(self):
+        jpeg, _ = self.dashboard.wait_jpeg(0, timeout=2.0)
+        if jpeg is None:
+            self.send_error(503, "No frame yet")
+            return
+        self._send_body(jpeg, "image/jpeg")
+
+    def _stream(self):
+        self.close_connection = True
+        self.send_response(200)
+        self.send_header("Content-Type", "multipart/x-mixed-replace; boundary=frame")
+        self.send_header("Cache-Control", "no-cache")
+        self.end_headers()
+        seq = 0
+        while self.dashboard._running:
+            jpeg, new_seq = self.dashboard.wait_jpeg(seq)
+            if jpeg is None or new_seq == seq:
+                continue
+            seq = new_seq  # intermediate frames are skipped, never queued
+            self.wfile.write(b"--frame\r\nContent-Type: image/jpeg\r\nContent-Length: "
+                             + str(len(jpeg)).encode() + b"\r\n\r\n" + jpeg + b"\r\n")
+
+    def _websocket(self):
+        self.close_connection = True
+        key = self.headers.get("Sec-WebSocket-Key", "")
+        accept = base64.b64encode(hashlib.sha1((key + WS_GUID).encode()).digest()).decode()
+        self.send_response(101, "Switching Protocols")
+        self.send_header("Upgrade", "websocket")
+        self.send_header("Connection", "Upgrade")
+        self.send_header("Sec-WebSocket-Accept", accept)
+        self.end_headers()
+        seq = 0
+        try:
+            while self.dashboard._running:
+                stats, new_seq = self.dashboard.latest_stats()
+                if stats is not None and new_seq != seq:
+                    seq = new_seq
+                    self.wfile.write(ws_text_frame(json.dumps(stats)))
+                time.sleep(self.dashboard.stats_period)
+        except (BrokenPipeError, ConnectionResetError, TimeoutError):
+            pass
+
+
+def ws_text_frame(text):
+    """Encode an unmasked server-to-client WebSocket text frame."""
+    payload = text.encode()
+    n = len(payload)
+    if n < 126:
+        header = struct.pack("!BB", 0x81, n)
+    elif n < 65536:
+        header = struct.pack("!BBH", 0x81, 126, n)
+    else:
+        header = struct.pack("!BBQ", 0x81, 127, n)
+    return header + payload
+
+
+def frame_stats(north, south, east, west, cycle, now):
+    """The per-frame stats dict shown by the GUI and the dashboard."""
+    stats = {
+        'north': north,
+        'south': south,
+        'east': east,
+        'west': west,
+        'ns_total': north + south,
+        'we_total': west + east,
+    }
+    for light in (1, 2, 3, 4):
+        stats[f'tl{light}_state'] = getattr(cycle, f'tl{light}_state')
+        stats[f'tl{light}_remaining'] = int(cycle.remaining(light, now))
+    return stats
+
+
+def dashboard_from_env():
+    """
+    Start the dashboard if TRAFFIC_WEB_PORT is set; returns it or None.
+    TRAFFIC_WEB_HOST (default 127.0.0.1) and TRAFFIC_WEB_TOKEN are optional.
+    """
+    port = os.environ.get("TRAFFIC_WEB_PORT")
+    if not port:
+        return None
+    host = os.environ.get("TRAFFIC_WEB_HOST", "127.0.0.1")
+    return WebDashboard(int(port), host=host, token=os.environ.get("TRAFFIC_WEB_TOKEN") or None)
@@ -0,0 +1,113 @@
+"""
+Direction zones for the intersection camera.
+
+A detection is assigned to North, South, East or West from the position of
+its box center relative to the image center and four threshold lines. The
+thresholds are pixel offsets from the center and are loaded from zones.yaml
+(written by calibrate_zones.py) so they no longer have to be edited in code.
+"""
+import os
+from dataclasses import dataclass, asdict
+
+import numpy as np
+import yaml
+
+# Direction indices used by classify_directions / count_directions
+NORTH, SOUTH, EAST, WEST = 0, 1, 2, 3
+DIRECTIONS = ("North", "South", "East", "West")
+
+ZONES_FILE = "zones.yaml"
+
+
+@dataclass(frozen=True)
+class ZoneConfig:
+    """Threshold line offsets (in pixels) from the image center."""
+    north: int = 100  # north line is height // 2 - north
+    south: int = 100  # south line is height // 2 + south
+    west: int = 120   # west line is width // 2 - west
+    east: int = 120   # east line is width // 2 + east
+
+    def thresholds(self, width, height):
+        """Return (north_y, south_y, west_x, east_x) for a frame size."""
+        return (height // 2 - self.north, height // 2 + self.south,
+                width // 2 - self.west, width // 2 + self.east)
+
+
+# Webcam defaults used by detect_cars.py and traffic_light_gui.py
+DEFAULT_ZONES = ZoneConfig()
+# Phone-camera test images used by infer_image.py
+IMAGE_ZONES = ZoneConfig(north=600, south=380, west=420, east=420)
+
+
+def load_zone_config(path=ZONES_FILE, default=DEFAULT_ZONES):
+    """Load thresholds from a zones.yaml file, falling back to `default`."""
+    if not os.path.exists(path):
+        return default
+    with open(path) as f:
+        data = yaml.safe_load(f) or {}
+    # calibrate_zones.py writes the thresholds under a 'zones' key
+    data = data.get("zones", data)
+    fields = {k: int(data[k]) for k in ("north", "south", "west", "east") if k in data}
+    return ZoneConfig(**{**asdict(default), **fields})
+
+
+def save_zone_config(zones, path=ZONES_FILE, extra=None):
+    """Write thresholds (and optional metadata) to a zones.yaml file."""
+    data = {"zones": asdict(zones)}
+    if extra:
+        data.update(extra)
+    with open(path, "w") as f:
+        yaml.safe_dump(data, f, sort_keys=False)
+
+
+def box_centers(xyxy):
+    """Return (center_x, center_y) arrays for an (N, 4) xyxy box array."""
+    xyxy = np.asarray(xyxy, dtype=np.float32).reshape(-1, 4)
+    return (xyxy[:, 0] + xyxy[:, 2]) / 2, (xyxy[:, 1] + xyxy[:, 3]) / 2
+
+
+def classify_directions(center_x, center_y, width, height, zones=DEFAULT_ZONES):
+    """
+    Vectorized direction classifier.
+
+    Reproduces the per-box quadrant logic of the original loop: boxes in the
+    top quadrants are North unless they sit between the center and north line
+    and past the west/east line; the bottom quadrants work the same way for
+    South. Boxes exactly on a center line fall into the bottom-right branch.
+
+    `center_x`/`center_y` may have any matching shape, and the threshold
+    values returned by zones.thresholds() may be arrays that broadcast
+    against them (calibrate_zones.py uses this to score many configs at once).
+    Returns an int array of NORTH/SOUTH/EAST/WEST indices.
+    """
+    center_x = np.asarray(center_x)
+    center_y = np.asarray(center_y)
+    vertical_line_x = width // 2
+    horizontal_line_y = height // 2
+    north_y, south_y, west_x, east_x = zones.thresholds(width, height)
+
+    left = center_x < vertical_line_x
+    right = center_x > vertical_line_x
+    top = center_y < horizontal_line_y
+    bottom = center_y > horizontal_line_y
+
+    top_left = left & top
+    top_right = right & top
+    bottom_left = left & bottom
+    bottom_right = ~(top_left | top_right | bottom_left)
+
+    past_north = center_y >= north_y
+    past_south = center_y <= south_y
+    west = ((top_left & past_north) | (bottom_left & past_south)) & (center_x < west_x)
+    east = ((top_right & past_north) | (bottom_right & past_south)) & (center_x > east_x)
+
+    direction = np.where(top_left | top_right, NORTH, SOUTH)
+    direction = np.where(west, WEST, direction)
+    direction = np.where(east, EAST, direction)
+    return direction
+
+
+def count_directions(direction):
+    """Return per-direction counts [north, south, east, west] along the last axis."""
+    direction = np.asarray(direction)
+    return np.stack([(direction == d).sum(axis=-1) for d in range(len(DIRECTIONS))], axis=-1)